@@ -9,10 +9,13 @@ import json
 import math
 import os
 import re
-from typing import Dict, List, TypedDict, Optional
+from typing import AsyncIterator, Dict, List, Tuple, TypedDict, Optional, Union
 from urllib.parse import urljoin, urlparse, parse_qsl, urlencode, urlunparse
 
 from loguru import logger as log
+from lxml import etree
+from parsel import Selector, SelectorList
+from parsel.csstranslator import HTMLTranslator
 from scrapfly import ScrapeApiResponse, ScrapeConfig, ScrapflyClient
 
 SCRAPFLY = ScrapflyClient(key=os.environ["SCRAPFLY_KEY"])
@@ -26,6 +29,65 @@ BASE_CONFIG = {
 }
 
 
+class CompiledSelectors:
+    """
+    Registry of compiled selectors for hot parse loops: CSS queries are translated to XPath once and every
+    XPath is compiled once, rather than on every .css()/.xpath() call. get()/getall() also return
+    string results directly instead of wrapping every match in a Selector.
+    """
+
+    namespaces = {"re": "http://exslt.org/regular-expressions"}
+
+    def __init__(self):
+        self.compiled: Dict[Tuple[str, bool], etree.XPath] = {}
+        self.translator = HTMLTranslator()
+
+    def compile(self, query: str, css: bool = False) -> etree.XPath:
+        compiled = self.compiled.get((query, css))
+        if compiled is None:
+            xpath = self.translator.css_to_xpath(query) if css else query
+            compiled = etree.XPath(xpath, namespaces=self.namespaces, smart_strings=False)
+            self.compiled[(query, css)] = compiled
+        return compiled
+
+    def _evaluate(self, selector: Union[Selector, SelectorList], query: str, css: bool) -> list:
+        compiled = self.compile(query, css)
+        nodes = []
+        for item in selector if isinstance(selector, SelectorList) else [selector]:
+            result = compiled(item.root)
+            nodes.extend(result if isinstance(result, list) else [result])
+        return nodes
+
+    @staticmethod
+    def _wrap(node) -> Selector:
+        return Selector(root=node, type="html")
+
+    def select(self, selector: Union[Selector, SelectorList], query: str, css: bool = False) -> SelectorList:
+        """same as selector.xpath(query) or selector.css(query)"""
+        return SelectorList(self._wrap(node) for node in self._evaluate(selector, query, css))
+
+    def get(
+        self, selector: Union[Selector, SelectorList], query: str, default: Optional[str] = None, css: bool = False
+    ) -> Optional[str]:
+        """same as selector.xpath(query).get(default) or selector.css(query).get(default)"""
+        for node in self._evaluate(selector, query, css):
+            return node if isinstance(node, str) else self._wrap(node).get()
+        return default
+
+    def getall(self, selector: Union[Selector, SelectorList], query: str, css: bool = False) -> List[str]:
+        """same as selector.xpath(query).getall() or selector.css(query).getall()"""
+        nodes = self._evaluate(selector, query, css)
+        return [node if isinstance(node, str) else self._wrap(node).get() for node in nodes]
+
+
+SELECTORS = CompiledSelectors()
+# the small price text of a search result box is the "real" price
+REAL_PRICE_XPATH = (
+    ".//div[@data-cy='secondary-offer-recipe']//span[contains(@class, 'a-color-base') and contains(text(), '$')]/text()"
+)
+CUSTOMER_REVIEWS_XPATH = "//div[@id='averageCustomerReviews']//span[@class='a-icon-alt']/text()"
+
+
 def _add_or_replace_url_parameters(url: str, **params):
     """adds url parameters or replaces them with new values"""
     parsed_url = urlparse(url)
@@ -49,36 +111,42 @@ class ProductPreview(TypedDict):
 def parse_search(result: ScrapeApiResponse) -> List[ProductPreview]:
     """Parse search result page for product previews"""
     previews = []
-    product_boxes = result.selector.css("div.s-result-item[data-component-type=s-search-result]")
+    product_boxes = SELECTORS.select(
+        result.selector, "div.s-result-item[data-component-type=s-search-result]", css=True
+    )
     for box in product_boxes:
-        url = urljoin(result.context["url"], box.css("div>a::attr(href)").get()).split("?")[0]
+        url = urljoin(result.context["url"], SELECTORS.get(box, "div>a::attr(href)", css=True)).split("?")[0]
         if "/slredirect/" in url:  # skip ads etc.
             continue
-        rating = box.xpath("//div[@data-cy='reviews-block']//a[contains(@aria-label, 'out of')]/@aria-label").re_first(r"(\d+\.*\d*) out")
-        rating_count = box.xpath("//div[@data-cy='reviews-block']//a[contains(@aria-label, 'ratings')]/@aria-label").get()
+        # note: paths must be relative to the box (.//) - absolute paths (//) would scan the whole document
+        # for every box and return the first product's values for every row
+        review_labels = SELECTORS.select(box, ".//div[@data-cy='reviews-block']//a/@aria-label")
+        rating = review_labels.re_first(r"(\d+\.*\d*) out")
+        rating_count = review_labels.re_first(r"([\d,]+) ratings")
         previews.append(
             {
                 "url": url,
-                "title": box.css("div>a>h2::attr(aria-label)").get(),
+                "title": SELECTORS.get(box, "div>a>h2::attr(aria-label)", css=True),
                 # big price text is discounted price
-                "price": box.css(".a-price[data-a-size=xl] .a-offscreen::text").get(),
+                "price": SELECTORS.get(box, ".a-price[data-a-size=xl] .a-offscreen::text", css=True),
                 # small price text is "real" price
-                "real_price": box.xpath("//div[@data-cy='secondary-offer-recipe']//span[contains(@class, 'a-color-base') and contains(text(), '$')]/text()").get(),
+                "real_price": SELECTORS.get(box, REAL_PRICE_XPATH),
                 "rating": float(rating) if rating else None,
-                "rating_count": int(rating_count.replace(',','').replace(" ratings", "")) if rating_count else None,
+                "rating_count": int(rating_count.replace(",", "")) if rating_count else None,
             }
         )
     log.info(f"parsed {len(previews)} product previews from search page {result.context['url']}")
     return previews
 
 
-async def scrape_search(url: str, max_pages: Optional[int] = None) -> List[ProductPreview]:
-    """Scrape amazon search pages product previews"""
+async def iter_search(url: str, max_pages: Optional[int] = None) -> AsyncIterator[ProductPreview]:
+    """Scrape amazon search pages and yield product previews as soon as each page is parsed"""
     log.info(f"{url}: scraping first page")
 
     # first, scrape the first page and find total pages:
     first_result = await SCRAPFLY.async_scrape(ScrapeConfig(url, **BASE_CONFIG))
-    results = parse_search(first_result)
+    for preview in parse_search(first_result):
+        yield preview
     _paging_meta = first_result.selector.xpath("//*[@cel_widget_id='UPPER-RESULT_INFO_BAR-0']//span/text()").get()
     _total_results = int(re.findall(r"(?:over\s+)?([\d,]+)\s+results", _paging_meta)[0].replace(',', ''))
     _results_per_page = int(re.findall(r"\d+-(\d+)", _paging_meta)[0])
@@ -96,8 +164,13 @@ async def scrape_search(url: str, max_pages: Optional[int] = None) -> List[Produ
         for page in range(2, total_pages + 1)
     ]
     async for result in SCRAPFLY.concurrent_scrape(other_pages):
-        results.extend(parse_search(result))
+        for preview in parse_search(result):
+            yield preview
+
 
+async def scrape_search(url: str, max_pages: Optional[int] = None) -> List[ProductPreview]:
+    """Scrape amazon search pages product previews"""
+    results = [preview async for preview in iter_search(url, max_pages=max_pages)]
     log.info(f"{url}: found total of {len(results)} product previews")
     return results
 
@@ -131,7 +204,9 @@ async def scrape_reviews(url: str) -> List[Review]:
     """scrape product reviews of a given URL of an amazon product"""
     # pagination is not publically available, so we can't scrape more than one page
     log.info(f"scraping review page: {url}")
-    api_response = await SCRAPFLY.async_scrape(ScrapeConfig(url, render_js=True, auto_scroll=True, rendering_wait=8000, **BASE_CONFIG))
+    api_response = await SCRAPFLY.async_scrape(
+        ScrapeConfig(url, render_js=True, auto_scroll=True, rendering_wait=8000, **BASE_CONFIG)
+    )
     reviews = parse_reviews(api_response)
     log.info(f"scraped {len(reviews)} reviews")
     return reviews
@@ -164,24 +239,26 @@ def parse_product(result) -> Product:
     # we can define our helper functions to keep our code clean
     sel = result.selector
     parsed = {
-        "name": sel.css("#productTitle::text").get("").strip(),
-        "asin": sel.css("input[name=ASIN]::attr(value)").get("").strip(),
-        "style": ''.join(sel.css("[id^=inline-twister-expanded-dimension-text] ::text").getall()).strip(),
-        "description": '\n'.join(sel.css("#productDescription p span ::text").getall()).strip(),
-        "stars": sel.css("i[data-hook=average-star-rating] ::text").get("").strip(),
-        "rating_count": sel.css("span[data-hook=total-review-count] ::text").get("").strip(),
-        "features": [value.strip() for value in sel.css("#feature-bullets li ::text").getall()],
+        "name": SELECTORS.get(sel, "#productTitle::text", "", css=True).strip(),
+        "asin": SELECTORS.get(sel, "input[name=ASIN]::attr(value)", "", css=True).strip(),
+        "style": ''.join(
+            SELECTORS.getall(sel, "[id^=inline-twister-expanded-dimension-text] ::text", css=True)
+        ).strip(),
+        "description": '\n'.join(SELECTORS.getall(sel, "#productDescription p span ::text", css=True)).strip(),
+        "stars": SELECTORS.get(sel, "i[data-hook=average-star-rating] ::text", "", css=True).strip(),
+        "rating_count": SELECTORS.get(sel, "span[data-hook=total-review-count] ::text", "", css=True).strip(),
+        "features": [value.strip() for value in SELECTORS.getall(sel, "#feature-bullets li ::text", css=True)],
         "images": images,
     }
     # extract details from "Product Information" table:
     info_table = {}
-    for row in sel.css('table.prodDetTable tr'):
-        label = row.css("th::text").get("").strip()
-        value = " ".join(v.strip() for v in row.css("td ::text").getall() if v.strip())
+    for row in SELECTORS.select(sel, 'table.prodDetTable tr', css=True):
+        label = SELECTORS.get(row, "th::text", "", css=True).strip()
+        value = " ".join(v.strip() for v in SELECTORS.getall(row, "td ::text", css=True) if v.strip())
         if label:
             info_table[label] = value
-    info_table['Customer Reviews'] = sel.xpath("//div[@id='averageCustomerReviews']//span[@class='a-icon-alt']/text()").get()
-    rank = sel.xpath("//tr[th[text()=' Best Sellers Rank ']]//td//text()").getall()
+    info_table['Customer Reviews'] = SELECTORS.get(sel, CUSTOMER_REVIEWS_XPATH)
+    rank = SELECTORS.getall(sel, "//tr[th[text()=' Best Sellers Rank ']]//td//text()")
     info_table['Best Sellers Rank'] = ' '.join([text.strip() for text in rank if text.strip()])
     parsed['info_table'] = info_table
     return parsed
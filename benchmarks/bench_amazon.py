@@ -0,0 +1,49 @@
+"""Amazon search parser benchmarks on generated search pages"""
+import pytest
+
+from measure import timed
+from replay import load_scraper, make_response
+
+amazon = load_scraper("amazon")
+
+BOX = """
+<div class="s-result-item" data-component-type="s-search-result">
+  <div><a href="/product-{i}/dp/B0{i:08d}?ref=sr_1"><h2 aria-label="Product {i}"></h2></a></div>
+  <div data-cy="reviews-block">
+    <a aria-label="{rating} out of 5 stars"></a>
+    <a aria-label="{count:,} ratings"></a>
+  </div>
+  <span class="a-price" data-a-size="xl"><span class="a-offscreen">${i}.99</span></span>
+  <div data-cy="secondary-offer-recipe"><span class="a-color-base">${i}.49</span></div>
+</div>
+"""
+
+
+def search_page(boxes: int):
+    body = "".join(BOX.format(i=i, rating=1 + i % 40 / 10, count=1000 + i) for i in range(boxes))
+    return make_response("https://www.amazon.com/s?k=kindle", f"<html><body>{body}</body></html>")
+
+
+def test_search_fields_are_resolved_per_box():
+    previews = amazon.parse_search(search_page(5))
+    assert [p["rating"] for p in previews] == [1.0, 1.1, 1.2, 1.3, 1.4]
+    assert [p["rating_count"] for p in previews] == [1000, 1001, 1002, 1003, 1004]
+    assert [p["real_price"] for p in previews] == ["$0.49", "$1.49", "$2.49", "$3.49", "$4.49"]
+
+
+def test_search_scales_linearly():
+    def parse(boxes):
+        page = search_page(boxes)
+        return lambda: amazon.parse_search(page)
+
+    small, large = 25, 200
+    small_time = timed(parse(small))
+    large_time = timed(parse(large))
+    per_box_ratio = (large_time / large) / (small_time / small)
+    # quadratic per-box document scans made large pages ~8x slower per box
+    assert per_box_ratio < 3, f"per box cost grew {per_box_ratio:.1f}x from {small} to {large} boxes"
+
+
+@pytest.mark.parametrize("boxes", [20, 60, 180])
+def test_search_parser(boxes, bench_pages):
+    bench_pages(amazon.parse_search, lambda: [search_page(boxes) for _ in range(5)])
@@ -0,0 +1,139 @@
+"""Apollo GraphQL cache resolver benchmarks for glassdoor and wellfound on generated caches"""
+import inspect
+
+import pytest
+
+from measure import measure_allocations, timed
+from replay import load_scraper
+
+glassdoor = load_scraper("glassdoor")
+wellfound = load_scraper("wellfound")
+
+
+def naive_resolve(data, root):
+    """the previous glassdoor resolver: every reference is expanded again with no caching"""
+    if isinstance(data, dict):
+        if "__ref" in data:
+            return naive_resolve(root[data["__ref"]], root)
+        return {k: naive_resolve(v, root) for k, v in data.items()}
+    if isinstance(data, list):
+        return [naive_resolve(i, root) for i in data]
+    return data
+
+
+def apollo_cache(jobs: int = 2000, employers: int = 20, ratings: int = 50):
+    """glassdoor-like cache where many job listings share a few heavy employer nodes"""
+    cache = {}
+    for r in range(ratings):
+        cache[f"Rating:{r}"] = {"__typename": "Rating", "id": r, "value": r / 10, "label": f"rating {r}"}
+    for e in range(employers):
+        cache[f"Employer:{e}"] = {
+            "__typename": "Employer",
+            "id": e,
+            "name": f"employer {e}",
+            "ratings": [{"__ref": f"Rating:{r}"} for r in range(ratings)],
+        }
+    for j in range(jobs):
+        cache[f"JobListing:{j}"] = {
+            "__typename": "JobListing",
+            "id": j,
+            "title": f"job {j}",
+            "employer": {"__ref": f"Employer:{j % employers}"},
+        }
+    cache["ROOT_QUERY"] = {
+        "jobListings": [{"__ref": f"JobListing:{j}"} for j in range(jobs)],
+        "employerReviewsRG({})": {"__ref": "Employer:0"},
+    }
+    return cache
+
+
+def wellfound_state(startups: int = 500, jobs: int = 20):
+    """wellfound-like apollo state where startup results share job listing nodes through edges"""
+    state = {}
+    for j in range(jobs):
+        state[f"JobListing:{j}"] = {"id": j, "title": f"job {j}", "description": "lorem ipsum " * 50}
+        state[f"Edge:{j}"] = {"node": {"type": "id", "id": f"JobListing:{j}"}}
+    for s in range(startups):
+        state[f"StartupResult:{s}"] = {
+            "id": s,
+            "name": f"startup {s}",
+            "highlightedJobListings": [{"type": "id", "id": f"Edge:{j}"} for j in range(jobs)],
+        }
+    return state
+
+
+def _resolve_glassdoor(cache):
+    graph = glassdoor.ApolloGraph(cache, reference=glassdoor._apollo_reference)
+    return graph.resolve(cache["ROOT_QUERY"])
+
+
+@pytest.mark.parametrize("name", ["ApolloGraph", "LazyApolloNode", "LazyApolloList"])
+def test_resolver_copies_are_identical(name):
+    assert inspect.getsource(getattr(wellfound, name)) == inspect.getsource(getattr(glassdoor, name))
+
+
+def test_resolver_matches_naive_output():
+    cache = apollo_cache(jobs=50, employers=5, ratings=5)
+    assert _resolve_glassdoor(cache) == naive_resolve(cache["ROOT_QUERY"], cache)
+
+
+def test_resolver_uses_less_time_and_memory_than_naive():
+    cache = apollo_cache()
+    naive_time = timed(naive_resolve, cache["ROOT_QUERY"], cache)
+    memoized_time = timed(_resolve_glassdoor, cache)
+    naive_peak, _ = measure_allocations(naive_resolve, cache["ROOT_QUERY"], cache)
+    memoized_peak, _ = measure_allocations(_resolve_glassdoor, cache)
+    assert memoized_time < naive_time / 2, f"memoized {memoized_time:.4f}s vs naive {naive_time:.4f}s"
+    assert memoized_peak < naive_peak / 2, f"memoized {memoized_peak} bytes vs naive {naive_peak} bytes"
+
+
+def test_resolver_handles_cycles():
+    cache = {
+        "ROOT_QUERY": {"employer": {"__ref": "Employer:1"}},
+        "Employer:1": {"name": "a", "jobs": [{"__ref": "Job:1"}]},
+        "Job:1": {"title": "b", "employer": {"__ref": "Employer:1"}},
+    }
+    resolved = _resolve_glassdoor(cache)
+    assert resolved["employer"]["jobs"][0]["title"] == "b"
+    # the cycle is closed with the unresolved reference
+    assert resolved["employer"]["jobs"][0]["employer"] == {"__ref": "Employer:1"}
+
+
+def test_lazy_access_only_expands_visited_nodes():
+    cache = apollo_cache()
+    graph = glassdoor.ApolloGraph(cache, reference=glassdoor._apollo_reference)
+    root = graph.lazy(cache["ROOT_QUERY"])
+    assert root["employerReviewsRG({})"]["ratings"][3]["value"] == 0.3
+    assert len(graph._lazy) == 2  # Employer:0 and Rating:3
+
+
+def test_wellfound_unpacks_edges_once():
+    state = wellfound_state(startups=3, jobs=2)
+    resolver = wellfound.apollo_graph(state)
+    first, second = [resolver.resolve(state[f"StartupResult:{s}"]) for s in range(2)]
+    assert first["highlightedJobListings"][0]["title"] == "job 0"
+    assert first["highlightedJobListings"][0] is second["highlightedJobListings"][0]
+    # references in the items of a list are resolved at any depth, the previous resolver flattened one level
+    state["JobListing:0"]["company"] = {"type": "id", "id": "StartupResult:2"}
+    third = wellfound.unpack_node_references(state["StartupResult:1"], state)
+    assert third["highlightedJobListings"][0]["company"]["name"] == "startup 2"
+
+
+@pytest.mark.parametrize("jobs", [500, 5000])
+def test_glassdoor_resolver(jobs, benchmark):
+    cache = apollo_cache(jobs=jobs)
+    peak, blocks = measure_allocations(_resolve_glassdoor, cache)
+    benchmark(_resolve_glassdoor, cache)
+    benchmark.extra_info.update({"peak_alloc_kib": round(peak / 1024, 1), "allocated_blocks": blocks})
+
+
+def test_wellfound_resolver(benchmark):
+    state = wellfound_state()
+
+    def resolve():
+        resolver = wellfound.apollo_graph(state)
+        return [resolver.resolve(state[key]) for key in state if key.startswith("StartupResult")]
+
+    peak, blocks = measure_allocations(resolve)
+    benchmark(resolve)
+    benchmark.extra_info.update({"peak_alloc_kib": round(peak / 1024, 1), "allocated_blocks": blocks})
@@ -0,0 +1,271 @@
+"""ChatGPT SSE stream parsing on generated answers: incremental chunk parsing, message events, follow-up pipelining"""
+import asyncio
+import json
+import random
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+import pytest
+from scrapfly import ScrapeApiResponse, ScrapeConfig
+
+from measure import timed
+from replay import load_scraper, make_response
+
+chatgpt = load_scraper("chatgpt")
+
+WORDS = ["web", "scraping", "is", "automated", "data", "extraction", "café", "日本語", "\U0001f600", "\n"]
+
+
+def previous_parse_chatgpt_stream(raw_sse: str) -> Dict:
+    """the previous parser: splits the whole body into lines and concatenates every appended text"""
+    messages: Dict[str, dict] = {}
+    conversation_id: Optional[str] = None
+    current_id: Optional[str] = None
+    last_o: Optional[str] = None
+    last_p: Optional[str] = None
+
+    def store(msg: dict) -> Optional[str]:
+        msg_id = msg.get("id")
+        if not msg_id:
+            return None
+        parts = msg.get("content", {}).get("parts") or [""]
+        messages[msg_id] = {
+            "role": msg.get("author", {}).get("role", ""),
+            "content": parts[0] if isinstance(parts[0], str) else "",
+        }
+        return msg_id
+
+    def append(path: Optional[str], op: Optional[str], val) -> None:
+        if op == "append" and isinstance(val, str) and path and "content/parts/0" in path and current_id in messages:
+            messages[current_id]["content"] += val
+
+    for line in raw_sse.splitlines():
+        line = line.strip()
+        if not line.startswith("data:"):
+            continue
+        raw = line[len("data:") :].strip()
+        if raw == "[DONE]":
+            break
+        try:
+            data = json.loads(raw)
+        except json.JSONDecodeError:
+            continue
+        if not isinstance(data, dict):
+            continue
+        if data.get("type") == "input_message":
+            current_id = store(data.get("input_message", {})) or current_id
+            conversation_id = conversation_id or data.get("conversation_id")
+            continue
+        last_o = data.get("o", last_o)
+        last_p = data.get("p", last_p)
+        v = data.get("v")
+        if isinstance(v, dict) and "message" in v:
+            current_id = store(v["message"]) or current_id
+            conversation_id = (
+                conversation_id or v.get("conversation_id") or v["message"].get("metadata", {}).get("conversation_id")
+            )
+        elif isinstance(v, list):
+            for patch in v:
+                append(patch.get("p"), patch.get("o"), patch.get("v"))
+        else:
+            append(last_p, last_o, v)
+
+    parent_message_id = next((mid for mid, m in reversed(messages.items()) if m["role"] == "assistant"), None)
+    result_messages = [
+        {"role": m["role"], "content": m["content"]} for m in messages.values() if m["role"] and m["content"]
+    ]
+    return {"conversation_id": conversation_id, "parent_message_id": parent_message_id, "messages": result_messages}
+
+
+def sse_events(
+    deltas: int = 500,
+    seed: int = 1,
+    trailing: int = 5,
+    message_id: str = "assistant-1",
+    conversation_id: str = "conv-1",
+    words: List[str] = WORDS,
+) -> List[str]:
+    """
+    data lines of a generated ChatGPT answer: the user's input message, an assistant message appended to in all
+    three event shapes, its finalization patch and `trailing` metadata events after it
+    """
+    rng = random.Random(seed)
+    lines = []
+
+    def add(event):
+        lines.append(f"data: {json.dumps(event, ensure_ascii=False)}")
+
+    add(
+        {
+            "type": "input_message",
+            "conversation_id": conversation_id,
+            "input_message": {
+                "id": f"user-{message_id}",
+                "author": {"role": "user"},
+                "content": {"parts": ["prompt"]},
+            },
+        }
+    )
+    lines.append('data: "v1"')
+    message = {"id": message_id, "author": {"role": "assistant"}, "content": {"parts": [""]}, "metadata": {}}
+    add({"v": {"message": message, "conversation_id": conversation_id}, "c": 0})
+    sticky = False
+    for _ in range(deltas):
+        word = rng.choice(words) + " "
+        roll = rng.random()
+        if roll < 0.5 and sticky:
+            add({"v": word})
+        elif roll < 0.8:
+            add({"p": "/message/content/parts/0", "o": "append", "v": word})
+            sticky = True
+        else:
+            add({"v": [{"p": "/message/content/parts/0", "o": "append", "v": word}, {"p": "/message/metadata"}]})
+            sticky = False
+    end = [
+        {"p": "/message/content/parts/0", "o": "append", "v": "."},
+        {"p": "/message/status", "o": "replace", "v": "finished_successfully"},
+        {"p": "/message/end_turn", "o": "replace", "v": True},
+    ]
+    add({"p": "", "o": "patch", "v": end})
+    for i in range(trailing):
+        add({"type": "server_ste_metadata", "metadata": {"turn": i, "tool_invoked": False}})
+    add({"type": "message_stream_complete", "conversation_id": conversation_id})
+    lines.append("data: [DONE]")
+    return lines
+
+
+def sse_stream(*args, **kwargs) -> str:
+    return "\n\n".join(["event: delta_encoding", *sse_events(*args, **kwargs)]) + "\n\n"
+
+
+def random_chunks(data: bytes, rng: random.Random, max_size: int = 64) -> List[bytes]:
+    """split a stream at random byte offsets, including in the middle of lines and multi-byte characters"""
+    chunks, start = [], 0
+    while start < len(data):
+        size = rng.randint(1, max_size)
+        chunks.append(data[start : start + size])
+        start += size
+    return chunks
+
+
+def test_parser_matches_previous_parser():
+    for seed in range(5):
+        stream = sse_stream(deltas=300, seed=seed)
+        expected = previous_parse_chatgpt_stream(stream)
+        assert chatgpt.parse_chatgpt_stream(stream) == expected
+        assert chatgpt.parse_chatgpt_stream(stream.encode()) == expected
+        assert chatgpt.parse_chatgpt_stream(stream.replace("\n", "\r\n")) == expected
+        # bodies without a trailing newline or [DONE]
+        truncated = stream.rsplit("data: [DONE]", 1)[0].rstrip()
+        assert chatgpt.parse_chatgpt_stream(truncated) == previous_parse_chatgpt_stream(truncated)
+    assert expected["conversation_id"] == "conv-1" and expected["parent_message_id"] == "assistant-1"
+
+
+def test_chunked_stream_matches_whole_body():
+    rng = random.Random(4)
+    stream = sse_stream(deltas=500)
+    expected = chatgpt.parse_chatgpt_stream(stream)
+    for _ in range(20):
+        parser = chatgpt.ChatgptStreamParser()
+        events = list(parser.parse(random_chunks(stream.encode(), rng)))
+        assert parser.result() == expected
+        deltas = "".join(event["content"] for event in events if event["type"] == "delta")
+        assert deltas == expected["messages"][-1]["content"]
+        assert [event["type"] for event in events if event["type"] != "delta"] == [
+            "message",
+            "message",
+            "final",
+            "done",
+        ]
+
+
+def test_final_message_id_is_known_before_the_stream_ends():
+    lines = sse_events(deltas=50, trailing=20)
+    parser = chatgpt.ChatgptStreamParser()
+    end_turn = next(i for i, line in enumerate(lines) if "end_turn" in line)
+    events = list(parser.feed("\n\n".join(lines[: end_turn + 1]) + "\n\n"))
+    assert events[-1] == {"type": "final", "id": "assistant-1"}
+    assert parser.final_message_id == "assistant-1" and not parser.done
+    assert [event["type"] for event in parser.parse(["\n\n".join(lines[end_turn + 1 :])])] == ["done"]
+    # answers that never set end_turn are final once the stream ends
+    lines = [line for line in lines if "end_turn" not in line and "message_stream_complete" not in line]
+    parser = chatgpt.ChatgptStreamParser()
+    events = list(parser.parse(["\n\n".join(lines)]))
+    assert [event["type"] for event in events[-2:]] == ["final", "done"]
+
+
+def test_unicode_line_separators_in_content():
+    # str.splitlines() also splits on characters that JSON strings may contain unescaped
+    stream = sse_stream(deltas=100, words=["line\u2028separator", "next\x85line", "group\x1dseparator"])
+    content = chatgpt.parse_chatgpt_stream(stream)["messages"][-1]["content"]
+    assert content.count(" ") == 100 and "\u2028" in content and "\x85" in content
+
+
+def test_long_answers_parse_in_linear_time():
+    stream = sse_stream(deltas=10_000, words=["lorem ipsum dolor sit amet " * 4])
+    assert chatgpt.parse_chatgpt_stream(stream) == previous_parse_chatgpt_stream(stream)
+    incremental = timed(lambda: chatgpt.parse_chatgpt_stream(stream), repeat=3)
+    previous = timed(lambda: previous_parse_chatgpt_stream(stream), repeat=1)
+    assert incremental < previous / 2, f"incremental {incremental:.3f}s vs previous {previous:.3f}s"
+
+
+class ConversationClient:
+    """serves the chat page with a generated initial answer stream and answers every follow-up prompt POST"""
+
+    def __init__(self, trailing: int = 50):
+        self.trailing = trailing
+        self.posts = []
+        self.lines_parsed = 0
+
+    def loads(self, data):
+        self.lines_parsed += 1
+        return json.loads(data)
+
+    async def async_scrape(self, config: ScrapeConfig, loop=None) -> ScrapeApiResponse:
+        if config.method != "POST":
+            response = make_response(config.url, "<html></html>")
+            xhr = {
+                "url": "https://chatgpt.com/backend-anon/f/conversation",
+                "body": json.dumps({"action": "next", "model": "auto"}),
+                "headers": {"oai-device-id": "device"},
+                "response": {"content_type": "text/event-stream; charset=utf-8", "body": self.answer(0)},
+            }
+            response.result["result"]["browser_data"] = {"xhr_call": [xhr]}
+            return response
+        body = json.loads(config.body)
+        self.posts.append({**body, "lines_parsed": self.lines_parsed})
+        await asyncio.sleep(0.01)
+        return make_response(config.url, self.answer(len(self.posts)), method="POST", body=config.body)
+
+    def answer(self, index: int) -> str:
+        return sse_stream(deltas=200, seed=index, trailing=self.trailing, message_id=f"assistant-{index}")
+
+
+def test_follow_up_prompts_are_pipelined(monkeypatch):
+    client = ConversationClient()
+    monkeypatch.setattr(chatgpt, "SCRAPFLY", client)
+    counting_json = SimpleNamespace(loads=client.loads, dumps=json.dumps, JSONDecodeError=json.JSONDecodeError)
+    monkeypatch.setattr(chatgpt, "json", counting_json)
+    conversations = asyncio.run(chatgpt.scrape_conversations(["first", "second", "third"]))
+    assert [(post["conversation_id"], post["parent_message_id"]) for post in client.posts] == [
+        ("conv-1", "assistant-0"),
+        ("conv-1", "assistant-1"),
+    ]
+    assert [post["messages"][0]["content"]["parts"] for post in client.posts] == [["second"], ["third"]]
+    # each follow-up was sent before the trailing events of the previous answer were parsed
+    answer_lines = len([line for line in sse_events(deltas=200, trailing=client.trailing) if "[DONE]" not in line])
+    assert client.posts[0]["lines_parsed"] <= 1 + answer_lines - client.trailing
+    assert client.posts[1]["lines_parsed"] <= 1 + 2 * answer_lines - client.trailing
+    assert len(conversations) == 1
+    roles = [message["role"] for message in conversations[0]["messages"]]
+    assert roles == ["user", "assistant", "user", "assistant", "user", "assistant"]
+    assert conversations[0]["messages"][-1] == chatgpt.parse_chatgpt_stream(client.answer(2))["messages"][-1]
+
+
+@pytest.mark.parametrize("parser", ["previous", "incremental"])
+@pytest.mark.parametrize("deltas", [1_000, 20_000])
+def test_bench_stream_parse(benchmark, parser, deltas):
+    stream = sse_stream(deltas=deltas, words=["lorem ipsum dolor sit amet " * 4])
+    parse = previous_parse_chatgpt_stream if parser == "previous" else chatgpt.parse_chatgpt_stream
+    benchmark.extra_info["stream_kib"] = round(len(stream.encode()) / 1024, 1)
+    benchmark.pedantic(parse, args=(stream,), rounds=5)
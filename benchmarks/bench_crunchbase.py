@@ -0,0 +1,92 @@
+"""Crunchbase sitemap discovery: concurrent fan-out over child sitemaps and lastmod checkpoints"""
+import asyncio
+import json
+
+from scrapfly import ScrapeConfig
+
+from bench_sitemap import NAMESPACE, gzipped_sitemap, sitemap_response
+from replay import load_scraper, make_response
+
+crunchbase = load_scraper("crunchbase")
+
+INDEX = "https://www.crunchbase.com/www-sitemaps/sitemap-index.xml"
+
+
+class SitemapClient:
+    """serves a sitemap index of child sitemaps with given lastmod values, each child holding 10 urls"""
+
+    def __init__(self, lastmods, failing=()):
+        self.lastmods = lastmods
+        self.failing = set(failing)
+        self.scraped = []
+        self.concurrency = None
+
+    def url(self, i):
+        kind = "organizations" if i % 2 == 0 else "people"
+        return f"https://www.crunchbase.com/www-sitemaps/sitemap-{kind}-{i}.xml.gz"
+
+    async def async_scrape(self, config: ScrapeConfig, loop=None):
+        items = "".join(
+            f"<sitemap><loc>{self.url(i)}</loc><lastmod>{lastmod}</lastmod></sitemap>"
+            for i, lastmod in enumerate(self.lastmods)
+        )
+        index = f'<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="{NAMESPACE}">{items}</sitemapindex>'
+        return make_response(config.url, index)
+
+    async def concurrent_scrape(self, configs, concurrency=None):
+        self.concurrency = concurrency
+        for config in configs:
+            if config.url in self.failing:
+                yield RuntimeError(f"failed {config.url}")
+                continue
+            self.scraped.append(config.url)
+            yield sitemap_response(gzipped_sitemap(10), url=config.url)
+
+
+def discover(client, monkeypatch, **kwargs):
+    monkeypatch.setattr(crunchbase, "SCRAPFLY", client)
+
+    async def run():
+        return [url async for url in crunchbase.discover_target("organizations", **kwargs)]
+
+    return asyncio.run(run())
+
+
+def test_namespaced_sitemap_index(monkeypatch):
+    client = SitemapClient(["2024-01-01", ""])
+    monkeypatch.setattr(crunchbase, "SCRAPFLY", client)
+    sitemaps = asyncio.run(crunchbase._scrape_sitemap_index())
+    assert sitemaps == {client.url(0): "2024-01-01", client.url(1): None}
+
+
+def test_discovery_fans_out_over_matching_sitemaps(monkeypatch):
+    client = SitemapClient(["2024-01-01"] * 6)
+    urls = discover(client, monkeypatch, concurrency=3)
+    assert client.concurrency == 3
+    assert client.scraped == [client.url(i) for i in (0, 2, 4)]
+    assert len(urls) == 30
+
+
+def test_checkpoints_skip_unchanged_sitemaps(monkeypatch, tmp_path):
+    checkpoint = tmp_path / "checkpoint.json"
+    first = SitemapClient(["2024-01-01"] * 6, failing=[SitemapClient([]).url(4)])
+    assert len(discover(first, monkeypatch, checkpoint=checkpoint)) == 20
+    assert json.loads(checkpoint.read_text()) == {first.url(0): "2024-01-01", first.url(2): "2024-01-01"}
+
+    # sitemap 2 changed and sitemap 4 failed last time, sitemap 0 is up to date
+    second = SitemapClient(["2024-01-01", "", "2024-02-01", "", "2024-01-01", ""])
+    assert len(discover(second, monkeypatch, checkpoint=checkpoint)) == 20
+    assert second.scraped == [second.url(2), second.url(4)]
+    assert len(json.loads(checkpoint.read_text())) == 3
+
+
+def test_partially_consumed_sitemaps_are_not_checkpointed(monkeypatch, tmp_path):
+    checkpoint = tmp_path / "checkpoint.json"
+    monkeypatch.setattr(crunchbase, "SCRAPFLY", SitemapClient(["2024-01-01"] * 2))
+
+    async def run():
+        async for _ in crunchbase.discover_target("organizations", checkpoint=checkpoint):
+            break
+
+    asyncio.run(run())
+    assert not checkpoint.exists()
@@ -0,0 +1,195 @@
+"""Compiled JMESPath expression registry benchmarks: threads/instagram/tiktok reducers on 10k generated posts"""
+import inspect
+import random
+import re
+import threading
+
+import jmespath
+import pytest
+from jmespath import parser
+
+from measure import timed
+from replay import load_scraper
+
+SCRAPERS = ("instagram", "threads", "tiktok", "youtube")
+
+
+def _load(name: str):
+    if name == "youtube":
+        pytest.importorskip("jsonpath_ng")
+    return load_scraper(name)
+
+
+threads = load_scraper("threads")
+tiktok = load_scraper("tiktok")
+
+
+class JmespathExpressions:
+    """the previous behavior: every search goes through jmespath.search"""
+
+    def search(self, expression, data):
+        return jmespath.search(expression, data)
+
+    def search_many(self, expression, items):
+        return [jmespath.search(expression, item) for item in items]
+
+
+def thread_post(i: int, rng: random.Random) -> dict:
+    """threads.net thread item as found in the page's hidden relay data"""
+    carousel = [
+        {"image_versions2": {"candidates": [{"url": f"https://cdn.example.com/{i}/{j}/{k}.jpg"} for k in range(3)]}}
+        for j in range(rng.randint(0, 4))
+    ]
+    return {
+        "post": {
+            "caption": {"text": "lorem ipsum " * rng.randint(1, 20)} if rng.random() < 0.9 else None,
+            "taken_at": 1_700_000_000 + i,
+            "id": f"{i}_1",
+            "pk": str(i),
+            "code": f"C{i:08d}",
+            "user": {"username": f"user{i % 100}", "profile_pic_url": "https://cdn.example.com/p.jpg", "pk": "1"},
+            "has_audio": rng.random() < 0.3,
+            "text_post_app_info": {"direct_reply_count": rng.randint(0, 50)},
+            "like_count": rng.randint(0, 10_000),
+            "carousel_media": carousel or None,
+            "carousel_media_count": len(carousel) or None,
+            "video_versions": [{"url": f"https://cdn.example.com/{i}.mp4"}] if rng.random() < 0.2 else [],
+        }
+    }
+
+
+def thread_posts(count: int = 10_000, seed: int = 1) -> list:
+    rng = random.Random(seed)
+    return [thread_post(i, rng) for i in range(count)]
+
+
+def _module_expressions(module) -> list:
+    """every JMESPath expression string a scraper module searches with"""
+    source = inspect.getsource(module)
+    found = re.findall(r'EXPRESSIONS\.search(?:_many)?\(\s*(?:"""(.*?)"""|"([^"]*)")', source, re.S)
+    return [triple or single for triple, single in found]
+
+
+def _fields(node: dict) -> set:
+    names = {node["value"]} if node["type"] == "field" else set()
+    for child in node.get("children", []):
+        if isinstance(child, dict):
+            names |= _fields(child)
+    return names
+
+
+def random_document(rng: random.Random, names: list, depth: int = 0):
+    """document built from the field names an expression uses so most of its paths partially resolve"""
+    roll = rng.random()
+    if depth > 4 or roll < 0.25:
+        return rng.choice([None, 0, 1, "text", True, {"unrelated": 1}, []])
+    if roll < 0.45:
+        return [random_document(rng, names, depth + 1) for _ in range(rng.randint(0, 3))]
+    return {name: random_document(rng, names, depth + 1) for name in rng.sample(names, min(len(names), 6))}
+
+
+@pytest.mark.parametrize("name", SCRAPERS)
+def test_module_expressions_are_fully_compiled(monkeypatch, name):
+    """each module's registry only compiles the syntax it uses, none of its own expressions hit the interpreter"""
+    module = _load(name)
+
+    class Interpreter:
+        def __init__(self):
+            raise AssertionError(f"{name} expression ran through jmespath's interpreter")
+
+    monkeypatch.setattr(module, "TreeInterpreter", Interpreter)
+    registry = module.CompiledExpressions()
+    rng = random.Random(5)
+    for expression in _module_expressions(module):
+        names = sorted(_fields(parser.Parser().parse(expression).parsed))
+        for _ in range(50):
+            registry.search(expression, random_document(rng, names))
+
+
+@pytest.mark.parametrize("name", SCRAPERS)
+def test_compiled_expressions_match_jmespath(name):
+    module = _load(name)
+    expressions = _module_expressions(module)
+    assert expressions, f"no expressions found in {name}"
+    rng = random.Random(3)
+    for expression in expressions:
+        names = sorted(_fields(parser.Parser().parse(expression).parsed))
+        for _ in range(300):
+            document = random_document(rng, names)
+            assert module.EXPRESSIONS.search(expression, document) == jmespath.search(expression, document)
+
+
+def test_uncompiled_nodes_fall_back_to_interpreter():
+    registry = threads.CompiledExpressions()
+    document = {"items": [{"x": 1, "name": "a"}, {"x": 3, "name": "b"}, {"x": 5}], "tags": ["a", "b"]}
+    for expression in (
+        "items[?x > `2`].name",
+        "length(items)",
+        "items[*].x | max(@)",
+        "tags[0:1]",
+        "items[].{name: name, big: x > `2` || `false`}",
+        "*.length(@)",
+    ):
+        assert registry.search(expression, document) == jmespath.search(expression, document), expression
+
+
+def test_expressions_compile_once_across_threads():
+    registry = threads.CompiledExpressions()
+    expression = "{a: a, b: b.c[0]}"
+    barrier = threading.Barrier(8)
+    compiled = []
+
+    def worker():
+        barrier.wait()
+        compiled.append(registry.compile(expression))
+
+    workers = [threading.Thread(target=worker) for _ in range(8)]
+    for worker_thread in workers:
+        worker_thread.start()
+    for worker_thread in workers:
+        worker_thread.join()
+    assert len({id(function) for function in compiled}) == 1
+    assert list(registry.compiled) == [expression]
+
+
+def test_thread_reducer_is_faster(monkeypatch):
+    posts = thread_posts(2_000)
+    compiled = [threads.parse_thread(post) for post in posts]
+    compiled_time = timed(lambda: [threads.parse_thread(post) for post in posts], repeat=3)
+    monkeypatch.setattr(threads, "EXPRESSIONS", JmespathExpressions())
+    assert [threads.parse_thread(post) for post in posts] == compiled
+    jmespath_time = timed(lambda: [threads.parse_thread(post) for post in posts], repeat=3)
+    assert compiled_time < jmespath_time / 2, f"compiled {compiled_time:.3f}s vs jmespath {jmespath_time:.3f}s"
+
+
+@pytest.fixture(scope="module")
+def posts():
+    return thread_posts()
+
+
+@pytest.mark.parametrize("expressions", ["compiled", "jmespath"])
+def test_bench_thread_reducer(benchmark, monkeypatch, posts, expressions):
+    if expressions == "jmespath":
+        monkeypatch.setattr(threads, "EXPRESSIONS", JmespathExpressions())
+    benchmark.extra_info["posts"] = len(posts)
+    benchmark.pedantic(lambda: [threads.parse_thread(post) for post in posts], rounds=3)
+
+
+@pytest.mark.parametrize("expressions", ["compiled", "jmespath"])
+def test_bench_tiktok_channel_posts(benchmark, monkeypatch, expressions):
+    if expressions == "jmespath":
+        monkeypatch.setattr(tiktok, "EXPRESSIONS", JmespathExpressions())
+    rng = random.Random(2)
+    items = [
+        {
+            "createTime": 1_700_000_000 + i,
+            "desc": "video",
+            "id": str(i),
+            "stats": {"playCount": rng.randint(0, 10**6)},
+            "contents": [{"desc": "part", "textExtra": [{"hashtagName": f"tag{j}"} for j in range(3)]}],
+        }
+        for i in range(10_000)
+    ]
+    expression = _module_expressions(tiktok)[-1]  # parse_channel's post reducer
+    benchmark.extra_info["posts"] = len(items)
+    benchmark.pedantic(lambda: tiktok.EXPRESSIONS.search_many(expression, items), rounds=3)
@@ -0,0 +1,112 @@
+"""
+JSON backend benchmarks: hidden web data decoding with orjson/msgspec against the stdlib json module.
+Payloads are the __NEXT_DATA__ scripts of recorded fixtures (see replay.py) and a generated next.js page cache.
+"""
+import gzip
+import json
+import random
+
+import pytest
+from parsel import Selector
+
+from measure import timed
+from replay import FIXTURES, load_scraper
+
+
+def _load(name: str):
+    if name == "youtube":
+        pytest.importorskip("jsonpath_ng")
+    return load_scraper(name)
+
+
+SCRAPERS = ("zillow", "glassdoor", "zoopla", "youtube", "stockx")
+MODULES = {name: load_scraper(name) for name in SCRAPERS if name != "youtube"}
+fast_backend = pytest.mark.skipif(
+    MODULES["zillow"]._fast_json_loads is None, reason="neither orjson nor msgspec is installed"
+)
+
+
+def next_data(listings: int = 2_000, seed: int = 1) -> str:
+    """generate a next.js page cache shaped like a property search page with `listings` results"""
+    rng = random.Random(seed)
+    results = [
+        {
+            "zpid": str(10_000_000 + i),
+            "address": f"{rng.randint(1, 9999)} Main St, Springfield, IL 6270{i % 10}",
+            "price": rng.randint(50_000, 3_000_000),
+            "latLong": {"latitude": rng.uniform(-90, 90), "longitude": rng.uniform(-180, 180)},
+            "beds": rng.randint(1, 6),
+            "isFeatured": rng.random() < 0.1,
+            "brokerName": None if i % 3 else "Realty éè \U0001f3e0 \"quoted\"",
+            "description": "<p>bright & spacious</p>\n" * rng.randint(1, 5),
+            "photos": [{"url": f"https://photos.example.com/{i}/{j}.jpg", "width": 1024} for j in range(8)],
+        }
+        for i in range(listings)
+    ]
+    data = {"props": {"pageProps": {"searchPageState": {"cat1": {"searchResults": {"listResults": results}}}}}}
+    return json.dumps(data)
+
+
+def _recorded_next_data():
+    """__NEXT_DATA__ script payloads of every recorded fixture"""
+    for path in sorted(FIXTURES.glob("*/*.json.gz")):
+        content = json.loads(gzip.decompress(path.read_bytes()))["result"].get("content")
+        if isinstance(content, str) and "__NEXT_DATA__" in content:
+            script = Selector(content).css("script#__NEXT_DATA__::text").get()
+            if script:
+                yield pytest.param(script, id=f"{path.parent.name}-{path.stem[:8]}")
+
+
+PAYLOADS = [pytest.param(next_data(), id="generated"), *_recorded_next_data()]
+
+
+@pytest.mark.parametrize("name", SCRAPERS)
+def test_json_loads_matches_stdlib(name):
+    json_loads = _load(name).json_loads
+    payload = next_data(listings=50)
+    assert json_loads(payload) == json.loads(payload)
+    assert json_loads(payload.encode()) == json.loads(payload)
+    # documents only the stdlib decoder accepts still decode
+    assert json_loads('{"a": NaN, "b": 1e400}')["b"] == float("inf")
+    assert json_loads('{"id": 18446744073709551615}') == {"id": 2**64 - 1}
+    # and errors are stdlib json errors
+    with pytest.raises(json.JSONDecodeError):
+        json_loads("<html>blocked</html>")
+
+
+def test_youtube_script_variable():
+    youtube = _load("youtube")
+    data = {"contents": {"title": "video } with braces {", "views": 10}}
+    script = f"var ytInitialData = {json.dumps(data)};"
+    assert youtube.parse_script_variable(script, "ytInitialData") == data
+    script = f'var ytInitialPlayerResponse = {json.dumps(data)};var meta = {{"a": 1}};if (x) {{ y(); }}'
+    assert youtube.parse_script_variable(script, "ytInitialPlayerResponse") == data
+
+
+@pytest.mark.parametrize("name", SCRAPERS)
+def test_stdlib_fallback(name, monkeypatch):
+    module = _load(name)
+    monkeypatch.setattr(module, "_fast_json_loads", None)
+    payload = next_data(listings=50)
+    assert module.json_loads(payload) == json.loads(payload)
+
+
+@fast_backend
+def test_fast_backend_is_faster():
+    payload = next_data()
+    json_loads = MODULES["zillow"].json_loads
+    stdlib = timed(lambda: json.loads(payload), repeat=5)
+    fast = timed(lambda: json_loads(payload), repeat=5)
+    assert fast < stdlib / 1.5, f"fast backend {fast:.4f}s vs json module {stdlib:.4f}s"
+
+
+@pytest.mark.parametrize("backend", ["json", "fast"])
+@pytest.mark.parametrize("payload", PAYLOADS)
+def test_bench_next_data_decode(benchmark, backend, payload):
+    if backend == "fast" and MODULES["zillow"]._fast_json_loads is None:
+        pytest.skip("neither orjson nor msgspec is installed")
+    decode = json.loads if backend == "json" else MODULES["zillow"].json_loads
+    benchmark.pedantic(decode, args=(payload,), rounds=10, warmup_rounds=1)
+    mean = benchmark.stats.stats.mean if benchmark.stats else None
+    benchmark.extra_info["payload_kib"] = round(len(payload.encode()) / 1024, 1)
+    benchmark.extra_info["mib_per_second"] = round(len(payload.encode()) / 1024**2 / mean, 1) if mean else None
@@ -0,0 +1,144 @@
+"""Embedded JSON extraction benchmarks for naver, ticketmaster and ebay on multi-megabyte scripts"""
+import json
+
+import pytest
+
+from measure import timed
+from replay import load_scraper, make_response
+
+naver = load_scraper("naver")
+ticketmaster = load_scraper("ticketmaster")
+ebay = load_scraper("ebay")
+
+
+def char_by_char_extract(content: str, start_pos: int):
+    """the previous naver scanner walking the content one python character at a time"""
+    brace_count, in_string, escape = 0, False, False
+    for i in range(start_pos, len(content)):
+        char = content[i]
+        if escape:
+            escape = False
+            continue
+        if char == "\\":
+            escape = True
+            continue
+        if char == '"':
+            in_string = not in_string
+            continue
+        if not in_string:
+            if char == "{":
+                brace_count += 1
+            elif char == "}":
+                brace_count -= 1
+                if brace_count == 0:
+                    return content[start_pos : i + 1]
+    return None
+
+
+def sliced_find_json_objects(text: str, decoder=json.JSONDecoder()):
+    """the previous ebay extractor copying the rest of the text for every attempted brace"""
+    pos = 0
+    while True:
+        match = text.find("{", pos)
+        if match == -1:
+            break
+        try:
+            result, index = decoder.raw_decode(text[match:])
+            yield result
+            pos = match + index
+        except ValueError:
+            pos = match + 1
+
+
+def big_payload(items: int) -> dict:
+    web_items = [
+        {
+            "templateId": "webItem",
+            "props": {"title": f'title {{{i}}} "quoted" it\'s', "href": f"https://example.com/{i}"},
+        }
+        for i in range(items)
+    ]
+    return {"body": {"props": {"children": [{"props": {"children": web_items}}]}}}
+
+
+@pytest.fixture(scope="module")
+def naver_page():
+    payload = json.dumps(big_payload(20_000))  # ~2MB
+    return f"<html><script>entry.bootstrap(document.body, {payload});</script><div>{{ trailing }}</div></html>"
+
+
+def msku_script(blocks: int, variations: int) -> str:
+    # real MSKU scripts mix many js blocks with braces that are not json, followed by large json objects
+    js = "function f(a){if(a){return {a:a}}}; " * blocks
+    payload = json.dumps({"MSKU": {"variations": {str(i): {"price": i, "sku": f"sku-{i}"} for i in range(variations)}}})
+    return js + payload
+
+
+def test_naver_extractor_matches_previous(naver_page):
+    start = naver_page.index("{", naver_page.index("entry.bootstrap"))
+    assert naver._extract_json_from_html(naver_page, start) == char_by_char_extract(naver_page, start)
+    js = '{a: "b } \\" c", d: "e { f", g: {h: 1}} trailing }'
+    assert naver._extract_json_from_html(js, 0) == js[: js.index(" trailing")]
+    assert naver._extract_json_from_html(js, 0) == char_by_char_extract(js, 0)
+    assert naver._extract_json_from_html('{a: "unterminated}', 0) is None
+    # as in JSON only double quotes delimit strings
+    assert naver._extract_json_from_html("{a: 'b }', c: 1}", 0) == "{a: 'b }"
+
+
+def test_naver_extractor_is_faster(naver_page):
+    start = naver_page.index("{", naver_page.index("entry.bootstrap"))
+    previous = timed(char_by_char_extract, naver_page, start)
+    current = timed(naver._extract_json_from_html, naver_page, start)
+    assert current < previous / 3, f"regex scanner {current:.3f}s vs char scanner {previous:.3f}s"
+
+
+def test_naver_web_search_decodes_in_place(naver_page):
+    parsed = naver.parse_web_search(make_response("https://search.naver.com/search.naver?query=a", naver_page))
+    assert parsed["num_of_displayed_results"] == 20_000
+    assert parsed["results"][1]["title"] == 'title {1} "quoted" it\'s'
+
+
+def test_ticketmaster_extracts_digital_data():
+    script = 'window.digitalData={"page": {"name": "a } b", "items": [{"x": 1}]}}; window.other={};'
+    assert ticketmaster.extract_balanced_dict(script, "window.digitalData=") == {
+        "page": {"name": "a } b", "items": [{"x": 1}]}
+    }
+    assert ticketmaster.extract_balanced_dict("window.digitalData={broken", "window.digitalData=") is None
+
+
+def test_ebay_objects_match_previous():
+    script = msku_script(blocks=100, variations=100)
+    assert list(ebay.JSON_SCANNER.objects(script)) == list(sliced_find_json_objects(script))
+
+
+def test_ebay_extractor_is_linear():
+    script = msku_script(blocks=2_000, variations=10_000)
+    previous = timed(lambda: list(sliced_find_json_objects(script)), repeat=3)
+    current = timed(lambda: list(ebay.JSON_SCANNER.objects(script)), repeat=3)
+    assert current < previous / 5, f"in place decoding {current:.3f}s vs sliced decoding {previous:.3f}s"
+
+
+def test_naver_extract(naver_page, benchmark):
+    start = naver_page.index("{", naver_page.index("entry.bootstrap"))
+    benchmark.extra_info["script_bytes"] = len(naver_page)
+    benchmark(naver._extract_json_from_html, naver_page, start)
+
+
+def test_naver_extract_js_object(naver_page, benchmark):
+    # image search data is a javascript object literal which can't be decoded so the brace scanner is used
+    js_page = naver_page.replace('"templateId"', "templateId")
+    start = js_page.index("{", js_page.index("entry.bootstrap"))
+    benchmark.extra_info["script_bytes"] = len(js_page)
+    benchmark(naver._extract_json_from_html, js_page, start)
+
+
+def test_ticketmaster_extract(naver_page, benchmark):
+    script = "window.digitalData=" + naver_page[naver_page.index("{") :]
+    benchmark.extra_info["script_bytes"] = len(script)
+    benchmark(ticketmaster.extract_balanced_dict, script, "window.digitalData=")
+
+
+def test_ebay_find_json_objects(benchmark):
+    script = msku_script(blocks=20_000, variations=50_000)  # ~3MB
+    benchmark.extra_info["script_bytes"] = len(script)
+    benchmark(lambda: list(ebay.JSON_SCANNER.objects(script)))
@@ -0,0 +1,161 @@
+"""Nested JSON key lookup benchmarks: first-match and indexed lookups against nested_lookup on generated payloads"""
+import inspect
+import json
+import random
+
+import pytest
+from nested_lookup import nested_lookup
+
+from measure import timed
+from replay import load_scraper
+
+MODULES = {name: load_scraper(name) for name in ("instagram", "ebay", "stockx", "threads", "nordstorm")}
+stockx = MODULES["stockx"]
+threads = MODULES["threads"]
+
+
+def relay_payload(posts: int = 3_000, seed: int = 1) -> dict:
+    """threads/instagram-like ScheduledServerJS payload: relay results nested in several __bbox layers"""
+    rng = random.Random(seed)
+    thread_items = [
+        [
+            {
+                "post": {
+                    "id": str(i),
+                    "user": {"username": f"user{i}", "pk": i, "is_verified": rng.random() < 0.1},
+                    "caption": {"text": "lorem ipsum " * rng.randint(5, 40)},
+                    "images": {"candidates": [{"url": f"https://cdn.example.com/{i}/{j}.jpg"} for j in range(4)]},
+                    "like_count": rng.randint(0, 10_000),
+                }
+            }
+        ]
+        for i in range(posts)
+    ]
+    user = {"username": "zuck", "follower_count": 3_000_000, "bio_links": [{"url": "https://example.com"}]}
+    edges = [{"node": {"thread_items": items}} for items in thread_items]
+    result = {"data": {"user": user, "mediaData": {"edges": edges}}}
+    relay = ["RelayPrefetchedStreamCache", "next", [], ["adp_query", {"__bbox": {"result": result}}]]
+    bbox = {"__bbox": {"require": [relay]}}
+    return {"require": [["ScheduledServerJS", "handle", None, [bbox]]]}
+
+
+def next_payload(products: int = 4_000, seed: int = 1) -> dict:
+    """stockx/nordstorm-like next.js cache: a large apollo-style cache with the search results at the end"""
+    rng = random.Random(seed)
+    cache = {
+        f"Product:{i}": {
+            "id": str(i),
+            "title": f"product {i}",
+            "market": {"bidAskData": {"lowestAsk": rng.randint(50, 500), "highestBid": rng.randint(10, 400)}},
+            "media": {"gallery": [f"https://images.example.com/{i}/{j}.jpg" for j in range(6)]},
+            "traits": [{"name": f"trait {j}", "value": str(rng.random())} for j in range(5)],
+        }
+        for i in range(products)
+    }
+    results = {"edges": [{"node": {"id": str(i)}} for i in range(40)], "pageInfo": {"pageCount": 25, "limit": 40}}
+    return {"props": {"pageProps": {"req": {"appContext": {"states": {"query": {"value": {"queries": [
+        {"state": {"data": {"browse": {"results": results}}}},
+        {"state": {"data": {"cache": cache}}},
+    ]}}}}}}}}
+
+
+def random_document(rng: random.Random, depth: int = 0):
+    """small random nested document where the looked up keys repeat at different depths"""
+    if depth > 5 or rng.random() < 0.2:
+        return rng.choice([1, "text", None, True, [], {}])
+    if rng.random() < 0.3:
+        return [random_document(rng, depth + 1) for _ in range(rng.randint(0, 4))]
+    keys = rng.sample(["a", "b", "product", "results", "user", "thread_items", "x"], rng.randint(1, 4))
+    return {key: random_document(rng, depth + 1) for key in keys}
+
+
+def test_lookup_helpers_are_identical_copies():
+    for name in ("iter_lookup", "find_first"):
+        sources = {inspect.getsource(getattr(module, name)) for module in MODULES.values()}
+        assert len(sources) == 1, f"{name} copies differ"
+
+
+def test_lookup_order_matches_nested_lookup():
+    rng = random.Random(7)
+    for _ in range(500):
+        document = random_document(rng)
+        index = threads.LookupIndex(document) if isinstance(document, (dict, list)) else None
+        for key in ("product", "results", "user", "thread_items"):
+            expected = nested_lookup(key, document)
+            assert list(stockx.iter_lookup(key, document)) == expected
+            assert stockx.find_first(key, document, default="missing") == (expected[0] if expected else "missing")
+            if index is not None:
+                assert index.getall(key) == expected
+                assert index.get(key, "missing") == (expected[0] if expected else "missing")
+
+
+def test_index_paths_point_at_values():
+    document = relay_payload(posts=20)
+    index = threads.LookupIndex(document)
+    paths = index.paths("thread_items")
+    assert len(paths) == 20
+    for path, value in zip(paths, index.getall("thread_items")):
+        node = document
+        for step in path:
+            node = node[step]
+        assert node is value
+    bbox_path = ("require", 0, 3, 0, "__bbox", "require", 0, 3, 1, "__bbox")
+    assert index.paths("user")[0] == bbox_path + ("result", "data", "user")
+    assert index.paths("missing") == [] and index.get("missing") is None
+
+
+def test_first_match_stops_early():
+    document = next_payload()
+    first = timed(lambda: stockx.find_first("results", document), repeat=5)
+    full = timed(lambda: nested_lookup("results", document)[0], repeat=1)
+    assert stockx.find_first("results", document) is nested_lookup("results", document)[0]
+    assert first < full / 20, f"first match {first:.5f}s vs nested_lookup {full:.5f}s"
+
+
+def test_keyed_index_matches_full_index():
+    document = relay_payload(posts=50)
+    keys = ("user", "thread_items")
+    keyed, full = threads.LookupIndex(document, keys=keys), threads.LookupIndex(document)
+    assert set(keyed.index) == set(keys)
+    for key in keys:
+        assert keyed.getall(key) == full.getall(key) == nested_lookup(key, document)
+        assert keyed.paths(key) == full.paths(key)
+
+
+def test_index_pays_off_for_repeated_lookups():
+    # threads profiles look up "user" and "thread_items" in the same document
+    document = relay_payload()
+    keys = ("user", "thread_items")
+    indexed = timed(lambda: threads.LookupIndex(document, keys=keys), repeat=3)
+    scans = timed(lambda: [nested_lookup(key, document) for key in keys], repeat=3)
+    assert indexed < scans / 1.5, f"index build {indexed:.3f}s vs {len(keys)} nested_lookup scans {scans:.3f}s"
+
+
+@pytest.fixture(scope="module")
+def payloads():
+    return {"relay": relay_payload(), "next": next_payload()}
+
+
+@pytest.mark.parametrize("lookup", ["nested_lookup", "find_first"])
+@pytest.mark.parametrize("payload, key", [("next", "results"), ("relay", "user"), ("relay", "thread_items")])
+def test_bench_first_match(benchmark, payloads, payload, key, lookup):
+    document = payloads[payload]
+    benchmark.extra_info["payload_mib"] = round(len(json.dumps(document)) / 1024**2, 1)
+    if lookup == "nested_lookup":
+        benchmark(lambda: nested_lookup(key, document)[0])
+    else:
+        benchmark(lambda: stockx.find_first(key, document))
+
+
+@pytest.mark.parametrize("lookup", ["nested_lookup", "index"])
+def test_bench_repeated_lookups(benchmark, payloads, lookup):
+    document = payloads["relay"]
+    if lookup == "nested_lookup":
+        benchmark(lambda: (nested_lookup("user", document), nested_lookup("thread_items", document)))
+    else:
+
+        def indexed():
+            index = threads.LookupIndex(document, keys=("user", "thread_items"))
+            return index.getall("user"), index.getall("thread_items")
+
+        benchmark(indexed)
@@ -0,0 +1,80 @@
+"""Marriott operation signature cache: single-flight fetches, expiry, persistence and stale signature refresh"""
+import asyncio
+import json
+from datetime import timedelta
+
+import pytest
+from scrapfly import ScrapeConfig
+
+from replay import load_scraper, make_response
+
+marriott = load_scraper("marriott")
+
+
+def signature_page(signature: str) -> str:
+    signatures = [{"operationName": marriott._HQV_OP, "signature": signature}]
+    data = {"props": {"pageProps": {"operationSignatures": signatures}}}
+    return f'<html><script id="__NEXT_DATA__" type="application/json">{json.dumps(data)}</script></html>'
+
+
+class SignatureClient:
+    """serves signature pages (a new signature per fetch) and hotel graphql calls accepting the latest one"""
+
+    def __init__(self):
+        self.fetches = 0
+
+    @property
+    def signature(self):
+        return f"sig-{self.fetches}"
+
+    async def async_scrape(self, config: ScrapeConfig, loop=None):
+        self.fetches += 1
+        await asyncio.sleep(0.01)  # let other coroutines pile up on the missing signature
+        return make_response(config.url, signature_page(self.signature))
+
+    async def concurrent_scrape(self, configs, concurrency=None):
+        for config in configs:
+            property_id = json.loads(config.body)["variables"]["propertyId"]
+            if config.headers["graphql-operation-signature"] == self.signature:
+                data = {"data": {"property": {"id": property_id}}}
+            else:
+                data = {"errors": [{"message": "operation signature is not safelisted"}]}
+            yield make_response(config.url, json.dumps(data), method="POST", body=config.body)
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    client = SignatureClient()
+    monkeypatch.setattr(marriott, "SCRAPFLY", client)
+    monkeypatch.setattr(marriott, "_OPERATION_SIGNATURES", marriott.OperationSignatures(tmp_path / "signatures.json"))
+    return client
+
+
+def test_concurrent_lookups_share_one_fetch(client):
+    async def run():
+        return await asyncio.gather(*[marriott._get_operation_signature(marriott._HQV_OP) for _ in range(50)])
+
+    assert set(asyncio.run(run())) == {"sig-1"}
+    assert client.fetches == 1
+    # later event loops reuse the cached signature too
+    asyncio.run(run())
+    assert client.fetches == 1
+
+
+def test_signatures_expire_and_persist(client, tmp_path):
+    asyncio.run(marriott._get_operation_signature(marriott._HQV_OP))
+    restarted = marriott.OperationSignatures(tmp_path / "signatures.json")
+    assert asyncio.run(restarted.get(marriott._HQV_OP)) == "sig-1"
+    assert client.fetches == 1
+
+    expired = marriott.OperationSignatures(tmp_path / "signatures.json", ttl=timedelta(0))
+    assert expired.cached(marriott._HQV_OP) is None
+    assert asyncio.run(expired.get(marriott._HQV_OP)) == "sig-2"
+
+
+def test_stale_signature_is_refreshed_once(client):
+    marriott._OPERATION_SIGNATURES.update({marriott._HQV_OP: "rotated"})
+    hotels = asyncio.run(marriott.scrape_hotels([str(i) for i in range(20)]))
+    assert sorted(int(hotel["marriott_id"]) for hotel in hotels) == list(range(20))
+    assert client.fetches == 1
+    assert marriott._OPERATION_SIGNATURES.cached(marriott._HQV_OP) == "sig-1"
@@ -0,0 +1,214 @@
+"""Expedia hotel search and kayak flight poll pages requested at once from offsets known after the first page"""
+import asyncio
+import json
+
+import pytest
+from scrapfly import ScrapeApiResponse, ScrapeConfig
+
+from replay import load_scraper, make_response
+
+expedia = load_scraper("expedia")
+kayak = load_scraper("kayak")
+
+
+class PagedClient:
+    """
+    serves generated search results, `latency` seconds per request. Later pages answer faster than earlier ones
+    so concurrent pages complete out of order. Pages starting at an offset in `failing` raise an error
+    """
+
+    def __init__(self, total: int, latency: float = 0.0):
+        self.total = total
+        self.latency = latency
+        self.failing = set()
+        self.scraped = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def async_scrape(self, config: ScrapeConfig, loop=None) -> ScrapeApiResponse:
+        self.scraped.append(config)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            offset = self.offset(config) if config.method == "POST" else 0
+            await asyncio.sleep(self.latency * (1 + 1 / (1 + offset)))
+        finally:
+            self.in_flight -= 1
+        if config.method != "POST":
+            response = make_response(config.url, "<html></html>")
+            response.result["result"]["browser_data"] = {"xhr_call": [self.captured_call(config)]}
+            return response
+        if offset in self.failing:
+            raise RuntimeError(f"failed page at offset {offset}")
+        return make_response(config.url, json.dumps(self.page(offset)), method="POST", body=config.body)
+
+
+class ExpediaClient(PagedClient):
+    """PropertyListingQuery pages of `expedia.PAGE_SIZE` hotels, `summary` toggles the matched properties count"""
+
+    def __init__(self, total: int, latency: float = 0.0, summary: bool = True):
+        super().__init__(total, latency)
+        self.summary = summary
+
+    def offset(self, config: ScrapeConfig) -> int:
+        counts = json.loads(config.body)["variables"]["criteria"]["secondary"]["counts"]
+        return {count["id"]: count["value"] for count in counts}["resultsStartingIndex"]
+
+    def page(self, offset: int) -> dict:
+        ids = range(offset, min(self.total, offset + expedia.PAGE_SIZE))
+        listings = [{"__typename": "LodgingCard", "id": str(i)} for i in ids]
+        search = {"propertySearchListings": listings}
+        if offset + expedia.PAGE_SIZE < self.total:
+            search["pagination"] = {"subSets": {"nextSubSet": {"startingIndex": offset + expedia.PAGE_SIZE}}}
+        if self.summary:
+            search["summary"] = {"matchedPropertiesSize": self.total}
+        return {"data": {"propertySearch": search}}
+
+    def captured_call(self, config: ScrapeConfig) -> dict:
+        counts = [{"id": "resultsStartingIndex", "value": 0}, {"id": "resultsSize", "value": expedia.PAGE_SIZE}]
+        body = {"operationName": "PropertyListingQuery", "variables": {"criteria": {"secondary": {"counts": counts}}}}
+        return {
+            "url": expedia.GRAPHQL_URL,
+            "body": json.dumps(body),
+            "headers": {"client-info": "shopping-pwa"},
+            "response": {"body": json.dumps(self.page(0))},
+        }
+
+
+class KayakClient(PagedClient):
+    """poll API pages of 15 flights priced by their position in the results"""
+
+    PAGE_SIZE = 15
+
+    def offset(self, config: ScrapeConfig) -> int:
+        return (json.loads(config.body)["searchMetaData"]["pageNumber"] - 1) * self.PAGE_SIZE
+
+    def page(self, offset: int) -> dict:
+        results = [
+            {"type": "core", "bookingOptions": [{"displayPrice": {"price": i, "currency": "USD"}}]}
+            for i in range(offset, min(self.total, offset + self.PAGE_SIZE))
+        ]
+        return {
+            "searchId": "search",
+            "status": "complete",
+            "pageNumber": offset // self.PAGE_SIZE + 1,
+            "filteredCount": self.total,
+            "results": [{"type": "ad"}] + results,
+        }
+
+    def captured_call(self, config: ScrapeConfig) -> dict:
+        return {"url": kayak.POLL_URL, "headers": {"x-csrf": "csrf"}, "response": {"body": json.dumps(self.page(0))}}
+
+
+def hotel_search(parallel_pages: bool, max_pages: int = 3) -> list:
+    search = expedia.scrape_hotel_search(
+        "Paris", "2026-11-01", "2026-11-03", max_pages=max_pages, parallel_pages=parallel_pages
+    )
+    return asyncio.run(search)
+
+
+def flight_search(parallel_pages: bool, max_pages: int = 10) -> list:
+    search = kayak.scrape_flights("JFK", "LAX", "2026-11-01", max_pages=max_pages, parallel_pages=parallel_pages)
+    # captured_at differs between searches
+    return [{key: value for key, value in flight.items() if key != "captured_at"} for flight in asyncio.run(search)]
+
+
+@pytest.fixture
+def expedia_client(monkeypatch):
+    client = ExpediaClient(total=450)
+    monkeypatch.setattr(expedia, "SCRAPFLY", client)
+    return client
+
+
+@pytest.fixture
+def kayak_client(monkeypatch):
+    client = KayakClient(total=100)
+    monkeypatch.setattr(kayak, "SCRAPFLY", client)
+    return client
+
+
+@pytest.mark.parametrize("max_pages", [1, 3, 5, 10])
+def test_parallel_hotel_pages_match_sequential(expedia_client, max_pages):
+    sequential = hotel_search(parallel_pages=False, max_pages=max_pages)
+    requests = len(expedia_client.scraped)
+    expedia_client.scraped.clear()
+    parallel = hotel_search(parallel_pages=True, max_pages=max_pages)
+    assert [hotel["hotel_id"] for hotel in parallel] == [hotel["hotel_id"] for hotel in sequential]
+    assert len(parallel) == min(450, max_pages * 100)
+    # the matched properties count keeps the batch to the pages the sequential walk requests
+    assert len(expedia_client.scraped) == requests
+    sessions = {config.session for config in expedia_client.scraped}
+    assert len(sessions) == 1 and None not in sessions
+
+
+def test_hotel_pages_without_count_stop_at_the_last_page(expedia_client):
+    expedia_client.summary = False
+    hotels = hotel_search(parallel_pages=True, max_pages=10)
+    assert [hotel["hotel_id"] for hotel in hotels] == [str(i) for i in range(450)]
+    # without a count every page up to max_pages is requested and the ones past the last page are dropped
+    assert len(expedia_client.scraped) == 10
+
+
+def test_hotel_search_without_more_pages(expedia_client):
+    expedia_client.total = 80
+    assert len(hotel_search(parallel_pages=True)) == 80
+    assert len(expedia_client.scraped) == 1
+
+
+def test_failed_hotel_pages_are_skipped(expedia_client, monkeypatch):
+    expedia_client.failing = {200}
+    logged = []
+    monkeypatch.setattr(expedia.log, "info", logged.append)
+    hotels = hotel_search(parallel_pages=True, max_pages=10)
+    # the pages fetched around the failed one are kept
+    assert [hotel["hotel_id"] for hotel in hotels] == [str(i) for i in range(450) if not 200 <= i < 300]
+    assert logged[-1] == "expedia: fetched 4 pages at once (350 hotels)"
+
+
+def test_hotel_pages_count_the_pages_kept(expedia_client, monkeypatch):
+    expedia_client.summary = False
+    logged = []
+    monkeypatch.setattr(expedia.log, "info", logged.append)
+    assert len(hotel_search(parallel_pages=True, max_pages=10)) == 450
+    # pages past the last one with results are requested but not counted
+    assert logged[-1] == "expedia: fetched 5 pages at once (450 hotels)"
+
+
+def test_failed_poll_pages_are_skipped(kayak_client):
+    kayak_client.failing = {30}
+    flights = flight_search(parallel_pages=True)
+    assert [flight["price"] for flight in flights] == [f"${i}" for i in range(100) if not 30 <= i < 45]
+
+
+@pytest.mark.parametrize("max_pages", [0, 2, 10])
+def test_parallel_poll_pages_match_sequential(kayak_client, max_pages):
+    sequential = flight_search(parallel_pages=False, max_pages=max_pages)
+    requests = len(kayak_client.scraped)
+    kayak_client.scraped.clear()
+    parallel = flight_search(parallel_pages=True, max_pages=max_pages)
+    assert parallel == sequential
+    assert [flight["price"] for flight in parallel] == [f"${i}" for i in range(min(100, (max_pages + 1) * 15))]
+    # pages are computed from filteredCount and the first page's size
+    assert len(kayak_client.scraped) == requests
+
+
+def test_poll_pages_are_requested_at_once(kayak_client):
+    kayak_client.latency = 0.005
+    flights = flight_search(parallel_pages=True)
+    assert len(flights) == 100
+    assert kayak_client.max_in_flight == 6
+    assert {config.session for config in kayak_client.scraped[1:]} == {kayak_client.scraped[0].session}
+
+
+@pytest.mark.parametrize("pages", ["sequential", "parallel"])
+def test_bench_hotel_search(benchmark, monkeypatch, pages):
+    monkeypatch.setattr(expedia, "SCRAPFLY", ExpediaClient(total=2000, latency=0.01))
+    hotels = benchmark.pedantic(lambda: hotel_search(parallel_pages=pages == "parallel", max_pages=20), rounds=3)
+    assert [hotel["hotel_id"] for hotel in hotels] == [str(i) for i in range(2000)]
+
+
+@pytest.mark.parametrize("pages", ["sequential", "parallel"])
+def test_bench_flight_polling(benchmark, monkeypatch, pages):
+    monkeypatch.setattr(kayak, "SCRAPFLY", KayakClient(total=300, latency=0.01))
+    flights = benchmark.pedantic(lambda: flight_search(parallel_pages=pages == "parallel", max_pages=20), rounds=3)
+    assert [flight["price"] for flight in flights] == [f"${i}" for i in range(300)]
@@ -0,0 +1,29 @@
+"""
+Parser benchmarks over recorded fixtures (see replay.py). Every parse_* function that consumed
+a recorded response is replayed offline and timed; scrapers without fixtures are skipped.
+"""
+import pytest
+from scrapfly import ScrapeConfig
+
+from replay import FIXTURES, build_response, load_fixtures, load_scraper
+
+
+def _recorded_parsers():
+    for directory in sorted(path for path in FIXTURES.glob("*") if path.is_dir()):
+        for parser in load_fixtures(directory.name):
+            yield pytest.param(directory.name, parser, id=f"{directory.name}.{parser}")
+
+
+@pytest.mark.parametrize("scraper, parser", list(_recorded_parsers()))
+def test_parser(scraper, parser, bench_pages):
+    module = load_scraper(scraper)
+    parse = getattr(module, parser)
+    recorded = load_fixtures(scraper)[parser]
+
+    def make_pages():
+        return [
+            (build_response(ScrapeConfig(config["url"], method=config["method"]), result), args)
+            for config, result, args in recorded
+        ]
+
+    bench_pages(lambda page: parse(page[0], *page[1][0], **page[1][1]), make_pages)
@@ -0,0 +1,162 @@
+"""Bounded concurrency work pool copied into walmart, idealo and realtorcom"""
+import asyncio
+import json
+
+import pytest
+from scrapfly import ScrapeConfig
+
+from replay import load_scraper, make_response
+
+walmart = load_scraper("walmart")
+idealo = load_scraper("idealo")
+
+WorkPool = walmart.WorkPool
+
+
+def collect(pool, func, items):
+    async def run():
+        return [pair async for pair in pool.map(func, items)]
+
+    return asyncio.run(run())
+
+
+def test_idealo_pool_yields_failures_without_retrying():
+    attempts = []
+
+    async def work(item):
+        attempts.append(item)
+        if item % 2:
+            raise RuntimeError(item)
+        return item
+
+    results = dict(collect(idealo.WorkPool(concurrency=2), work, range(6)))
+    assert sorted(attempts) == list(range(6))
+    assert [results[i] for i in (0, 2, 4)] == [0, 2, 4]
+    assert all(isinstance(results[i], RuntimeError) for i in (1, 3, 5))
+
+
+def test_concurrency_is_bounded_and_results_stream_in_completion_order():
+    in_flight = []
+    peak = [0]
+
+    async def work(delay):
+        in_flight.append(delay)
+        peak[0] = max(peak[0], len(in_flight))
+        await asyncio.sleep(delay)
+        in_flight.remove(delay)
+        return delay * 2
+
+    delays = [0.05, 0.01, 0.03, 0.02, 0.04] * 4
+    results = collect(WorkPool(concurrency=5), work, delays)
+    assert peak[0] == 5
+    assert sorted(results) == sorted((delay, delay * 2) for delay in delays)
+    assert [delay for delay, _ in results[:5]] != delays[:5]  # completion order, not input order
+
+
+def test_items_are_consumed_lazily():
+    started = []
+
+    async def work(item):
+        started.append(item)
+        await asyncio.sleep(0)
+        return item
+
+    async def run():
+        async for _ in WorkPool(concurrency=3).map(work, iter(range(20000))):
+            break
+
+    asyncio.run(run())
+    assert len(started) == 3
+
+
+def test_retries_with_jittered_backoff_and_timeouts(monkeypatch):
+    attempts = {}
+    delays = []
+    real_sleep = asyncio.sleep
+
+    async def sleep(delay, *args):
+        delays.append(delay)
+        await real_sleep(0)
+
+    async def flaky(item):
+        attempts[item] = attempts.get(item, 0) + 1
+        if item == "slow":
+            await real_sleep(1)
+        if attempts[item] < 3 or item == "broken":
+            raise RuntimeError(item)
+        return item
+
+    pool = WorkPool(concurrency=4, retries=2, timeout=0.05, backoff=1, max_backoff=3)
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+    results = dict(collect(pool, flaky, ["ok", "broken", "slow", "other"]))
+    assert results["ok"] == "ok" and results["other"] == "other"
+    assert isinstance(results["broken"], RuntimeError)
+    assert isinstance(results["slow"], asyncio.TimeoutError)
+    assert attempts == {"ok": 3, "broken": 3, "slow": 3, "other": 3}
+    # first retries wait up to 1s, second retries up to 2s and the delays are spread out
+    assert len(delays) == 8 and all(0 <= delay <= 2 for delay in delays)
+    assert len(set(delays)) == len(delays)
+
+
+def test_single_run_raises_last_error():
+    async def broken(item):
+        raise ValueError(item)
+
+    with pytest.raises(ValueError):
+        asyncio.run(WorkPool(retries=1, backoff=0).run(broken, "item"))
+
+
+class ReversedClient:
+    """answers the later urls of a batch first, fails the first `failures` requests of every url"""
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.scraped = []
+
+    async def async_scrape(self, config: ScrapeConfig, loop=None):
+        self.scraped.append((config.url, bool(config.render_js)))
+        await asyncio.sleep(0.02 / (1 + int(config.url.rsplit("/", 1)[-1])))
+        if [url for url, _ in self.scraped].count(config.url) <= self.failures:
+            raise RuntimeError(f"failed {config.url}")
+        data = {"props": {"pageProps": {"initialData": {"data": {"product": {"id": config.url}, "reviews": {}}}}}}
+        return make_response(config.url, f'<html><script id="__NEXT_DATA__">{json.dumps(data)}</script></html>')
+
+
+def test_walmart_products_keep_url_order(monkeypatch):
+    client = ReversedClient(failures=1)
+    monkeypatch.setattr(walmart, "SCRAPFLY", client)
+    monkeypatch.setattr(walmart, "RENDER_MODES", walmart.RenderModePredictor(explore=0))
+    monkeypatch.setattr(walmart, "REQUEST_RETRIES", WorkPool(retries=2, backoff=0))
+    urls = [f"https://www.walmart.com/ip/Plain/{i}" for i in range(10)]
+    results = asyncio.run(walmart.scrape_products(urls, concurrency=10))
+    assert [result["product"]["id"] for result in results] == urls
+    # only the failed request is retried, not the whole plain-then-render fallback
+    assert len(client.scraped) == 20 and not any(render_js for _, render_js in client.scraped)
+    assert walmart.RENDER_MODES.stats["plain_hits"] == 10
+
+
+def test_idealo_products_keep_url_order(monkeypatch):
+    client = ReversedClient()
+    parsed_after = []
+
+    def parse_product(response):
+        parsed_after.append(len(client.scraped))
+        return response.context["url"]
+
+    monkeypatch.setattr(idealo, "SCRAPFLY", client)
+    monkeypatch.setattr(idealo, "parse_product", parse_product)
+    urls = [f"https://www.idealo.de/preisvergleich/OffersOfProduct/{i}" for i in range(10)]
+    assert asyncio.run(idealo.scrape_products(urls, concurrency=10)) == urls
+    assert asyncio.run(idealo.scrape_products(urls, concurrency=2)) == urls
+    # pages are parsed as they arrive instead of being held until the pool finishes
+    assert parsed_after[10] < len(urls) * 2
+
+
+@pytest.mark.parametrize("concurrency", [10, 100])
+def test_pool_overhead(concurrency, benchmark):
+    async def work(item):
+        await asyncio.sleep(0)
+        return item
+
+    results = benchmark(collect, WorkPool(concurrency=concurrency), work, range(2000))
+    assert len(results) == 2000
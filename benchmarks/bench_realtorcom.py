@@ -0,0 +1,155 @@
+"""Realtor.com feed tracking on generated feeds: persistent deduplication, batching and bounded concurrency"""
+import asyncio
+import json
+import time
+from datetime import timedelta
+
+import pytest
+from scrapfly import ScrapeApiResponse, ScrapeConfig
+
+from replay import load_scraper, make_response
+
+realtorcom = load_scraper("realtorcom")
+
+FEED = "https://www.realtor.com/feed.xml"
+
+
+def property_page(url: str) -> str:
+    details = {"listing_id": url.rsplit("/", 1)[-1], "href": url, "details": [], "photos": []}
+    data = {"props": {"pageProps": {"initialReduxState": {"propertyDetails": details, "slug": "slug"}}}}
+    return f'<html><script id="__NEXT_DATA__">{json.dumps(data)}</script></html>'
+
+
+class FeedClient:
+    """serves a generated sitemap feed and property pages, optionally failing some property urls"""
+
+    def __init__(self, entries: int, failing=()):
+        self.entries = entries
+        self.failing = set(failing)
+        self.scraped = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def feed(self) -> str:
+        items = "".join(
+            f"<sitemap><loc>https://www.realtor.com/property/{i}</loc><lastmod>2024-01-01T00:00:00</lastmod></sitemap>"
+            for i in range(self.entries)
+        )
+        return f"<sitemapindex>{items}</sitemapindex>"
+
+    async def async_scrape(self, config: ScrapeConfig, loop=None) -> ScrapeApiResponse:
+        if config.url == FEED:
+            return make_response(config.url, self.feed())
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.001)
+        finally:
+            self.in_flight -= 1
+        if config.url in self.failing:
+            raise RuntimeError(f"failed {config.url}")
+        self.scraped.append(config.url)
+        return make_response(config.url, property_page(config.url))
+
+
+def track_once(client, monkeypatch, tmp_path, **kwargs):
+    monkeypatch.setattr(realtorcom, "SCRAPFLY", client)
+    monkeypatch.setattr(realtorcom.WorkPool, "delay", lambda self, attempt: 0)
+    seen = realtorcom.SeenStore(tmp_path / "results.jsonl.seen")
+    writer = realtorcom.JsonlWriter(tmp_path / "results.jsonl")
+    try:
+        return asyncio.run(realtorcom.track_feed_once(FEED, seen, writer, **kwargs))
+    finally:
+        writer.close()
+        seen.close()
+
+
+def test_restart_resumes_without_rescraping(monkeypatch, tmp_path):
+    client = FeedClient(entries=120)
+    assert track_once(client, monkeypatch, tmp_path, batch_size=50, concurrency=3) == 120
+    assert client.max_in_flight == 3
+    lines = (tmp_path / "results.jsonl").read_text().splitlines()
+    assert sorted(int(json.loads(line)["id"]) for line in lines) == list(range(120))
+
+    # a new store and writer on the same files is a restarted tracker
+    restarted = FeedClient(entries=130)
+    assert track_once(restarted, monkeypatch, tmp_path) == 10
+    assert sorted(restarted.scraped) == sorted(f"https://www.realtor.com/property/{i}" for i in range(120, 130))
+    assert len((tmp_path / "results.jsonl").read_text().splitlines()) == 130
+
+
+def test_failed_entries_are_retried(monkeypatch, tmp_path):
+    failing = {"https://www.realtor.com/property/3"}
+    assert track_once(FeedClient(entries=5, failing=failing), monkeypatch, tmp_path) == 4
+    retry = FeedClient(entries=5)
+    assert track_once(retry, monkeypatch, tmp_path) == 1
+    assert retry.scraped == list(failing)
+
+
+def test_seen_store_retention(tmp_path):
+    seen = realtorcom.SeenStore(tmp_path / "seen", retention=timedelta(hours=1))
+    seen.add(["old", "new"])
+    seen.db.execute("UPDATE seen SET seen_at = ? WHERE key = 'old'", (time.time() - 7200,))
+    assert seen.prune() == 1
+    assert "old" not in seen and "new" in seen
+    assert seen.unseen(["old", "new"]) == ["old"]
+    seen.close()
+
+
+def test_listed_entries_do_not_expire(monkeypatch, tmp_path):
+    client = FeedClient(entries=5)
+    assert track_once(client, monkeypatch, tmp_path) == 5
+    seen = realtorcom.SeenStore(tmp_path / "results.jsonl.seen", retention=timedelta(hours=1))
+    seen.db.execute("UPDATE seen SET seen_at = ?", (time.time() - 7200,))
+    seen.db.commit()
+    seen.close()
+    # entries still in the feed are refreshed by the next cycle instead of being pruned and scraped again
+    client.entries = 4
+    assert track_once(client, monkeypatch, tmp_path) == 0
+    seen = realtorcom.SeenStore(tmp_path / "results.jsonl.seen", retention=timedelta(hours=1))
+    assert seen.prune() == 1
+    assert seen.unseen(f"https://www.realtor.com/property/{i}:2024-01-01 00:00:00" for i in range(5)) == [
+        "https://www.realtor.com/property/4:2024-01-01 00:00:00"
+    ]
+    seen.close()
+
+
+def test_cancelled_tracker_closes_its_files(monkeypatch, tmp_path):
+    monkeypatch.setattr(realtorcom, "SCRAPFLY", FeedClient(entries=5))
+    closed = []
+    for cls in (realtorcom.SeenStore, realtorcom.JsonlWriter):
+        monkeypatch.setattr(cls, "close", lambda self, close=cls.close: closed.append(close(self)))
+    output = tmp_path / "results.jsonl"
+
+    async def track():
+        task = asyncio.ensure_future(realtorcom.track_feed(FEED, output, interval=60))
+        while not output.exists() or not output.read_text():
+            await asyncio.sleep(0.001)
+        task.cancel()
+        await task
+
+    # the caller sees the cancellation and the finally block still closes the writer and the store
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(track())
+    assert len(closed) == 2
+    assert len(output.read_text().splitlines()) == 5
+
+
+def test_unseen_lookups_are_batched(tmp_path):
+    seen = realtorcom.SeenStore(tmp_path / "seen")
+    keys = [str(i) for i in range(1200)]
+    seen.add(keys[::2])
+    queries = []
+    seen.db.set_trace_callback(queries.append)
+    assert seen.unseen(keys) == keys[1::2]
+    assert len(queries) == 3
+    seen.close()
+
+
+@pytest.mark.parametrize("entries", [1000, 10000])
+def test_seen_store_lookup(entries, tmp_path, benchmark):
+    seen = realtorcom.SeenStore(tmp_path / "seen")
+    keys = [f"https://www.realtor.com/property/{i}:2024-01-01 00:00:00" for i in range(entries)]
+    seen.add(keys[: entries // 2])
+    assert len(benchmark(seen.unseen, keys)) == entries - entries // 2
+    seen.close()
@@ -0,0 +1,91 @@
+"""Reddit comment tree parser benchmarks on generated old.reddit comment pages"""
+import pytest
+from scrapfly import ScrapeApiResponse
+
+from measure import timed
+from replay import load_scraper, make_response
+
+reddit = load_scraper("reddit")
+
+COMMENT = """
+<div class="thing comment" data-type="comment" data-author="user{id}" data-author-fullname="t2_{id}"
+     data-fullname="t1_{id}" data-permalink="/r/test/comments/abc/post/{id}/">
+  <div class="midcol"></div>
+  <div class="entry unvoted">
+    <p class="tagline">
+      <span class="score dislikes" title="{dislikes}"></span>
+      <span class="score unvoted" title="{votes}"></span>
+      <span class="score likes" title="{likes}"></span>
+      <time datetime="2024-01-01T00:00:{second:02d}+00:00"></time>
+    </p>
+    <form><div class="usertext-body"><div class="md"><p>comment {id}</p></div></div></form>
+  </div>
+  <div class="child">{children}</div>
+</div>
+"""
+
+
+def thread(depth: int, width: int, counter: list = None) -> str:
+    """generate a comment listing where every comment has `width` replies down to `depth` levels"""
+    counter = counter if counter is not None else [0]
+    comments = []
+    for _ in range(width):
+        counter[0] += 1
+        comment_id = counter[0]
+        children = thread(depth - 1, width, counter) if depth > 1 else ""
+        comments.append(
+            COMMENT.format(
+                id=comment_id,
+                dislikes=comment_id,
+                votes=comment_id + 1,
+                likes=comment_id + 2,
+                second=comment_id % 60,
+                children=f'<div class="sitetable listing">{children}</div>' if children else "",
+            )
+        )
+    return "".join(comments)
+
+
+def comments_page(depth: int, width: int) -> ScrapeApiResponse:
+    body = f'<div class="sitetable nestedlisting">{thread(depth, width)}</div>'
+    return make_response("https://old.reddit.com/r/test/comments/abc/post/", f"<html><body>{body}</body></html>")
+
+
+def _flatten(comments, depth=0):
+    for comment in comments:
+        yield depth, comment
+        yield from _flatten(comment.get("replies", []), depth + 1)
+
+
+def test_comment_tree_is_parsed_once_per_comment():
+    comments = reddit.parse_post_comments(comments_page(depth=3, width=2))
+    flat = list(_flatten(comments))
+    ids = [comment["commentId"] for _, comment in flat]
+    assert len(ids) == 2 + 4 + 8
+    assert len(set(ids)) == len(ids)
+    # document order is kept and every comment reads its own fields, not its replies'
+    assert ids == [f"t1_{i}" for i in range(1, 15)]
+    for depth, comment in flat:
+        number = int(comment["commentId"][3:])
+        assert comment["commentBody"] == f"comment {number}"
+        assert (comment["dislikes"], comment["downvotes"]) == (number, number + 1)
+        assert ("replies" in comment) == (depth < 2)
+        assert len(comment.get("replies", [])) in (0, 2)
+
+
+def test_comment_tree_scales_linearly():
+    def parse(depth):
+        page = comments_page(depth, width=2)
+        return lambda: reddit.parse_post_comments(page)
+
+    # a binary tree doubles its comments per level: 2**6 - 2 vs 2**9 - 2 comments
+    small, large = 5, 8
+    small_count, large_count = 2 ** (small + 1) - 2, 2 ** (large + 1) - 2
+    per_comment_ratio = (timed(parse(large)) / large_count) / (timed(parse(small)) / small_count)
+    # recursive descendant scans re-parsed every reply once per ancestor
+    assert per_comment_ratio < 3, f"per comment cost grew {per_comment_ratio:.1f}x from depth {small} to {large}"
+
+
+@pytest.mark.parametrize("depth,width", [(2, 20), (5, 3), (30, 1)], ids=["wide", "bushy", "deep"])
+def test_comment_parser(depth, width, bench_pages):
+    bench_pages(reddit.parse_post_comments, lambda: [comments_page(depth, width) for _ in range(5)])
@@ -0,0 +1,159 @@
+"""Reddit cursor pagination on generated old.reddit listings: request pipelining, queue delivery and checkpoints"""
+import asyncio
+import json
+import time
+
+import pytest
+from scrapfly import ScrapeApiResponse, ScrapeConfig
+
+from replay import load_scraper, make_response
+
+reddit = load_scraper("reddit")
+
+USER = "https://old.reddit.com/user/tester/submitted/?sort=new"
+
+POST = """
+<div class="thing link" data-author="tester" data-author-fullname="t2_tester" data-fullname="t3_{id}"
+     data-permalink="/r/test/comments/{id}/post/" data-timestamp="1700000000000" data-comments-count="{id}"
+     data-score="{id}" data-subreddit-prefixed="r/test" data-type="link" data-url="https://example.com/{id}">
+  <div class="entry"><p class="title"><a href="/r/test/comments/{id}/post/">post {id}</a></p></div>
+</div>
+"""
+
+
+def page_url(page: int) -> str:
+    return USER if page == 0 else f"{USER}&count={page * 25}&after=t3_{page}"
+
+
+def listing_page(page: int, pages: int, per_page: int) -> str:
+    posts = "".join(POST.format(id=page * per_page + i) for i in range(per_page))
+    next_button = f'<span class="next-button"><a href="{page_url(page + 1)}">next</a></span>' if page + 1 < pages else ""
+    return f'<html><body><div id="siteTable">{posts}</div>{next_button}</body></html>'
+
+
+class ListingClient:
+    """serves a generated user listing of `pages` pages with a fixed request latency"""
+
+    def __init__(self, pages: int, per_page: int = 25, latency: float = 0.0):
+        self.pages = {page_url(page): listing_page(page, pages, per_page) for page in range(pages)}
+        self.latency = latency
+        self.scraped = []
+
+    async def async_scrape(self, config: ScrapeConfig, loop=None) -> ScrapeApiResponse:
+        self.scraped.append(config.url)
+        await asyncio.sleep(self.latency)
+        return make_response(config.url, self.pages[config.url])
+
+
+async def serial_user_posts(max_pages=None):
+    """baseline: scrape a page, parse it and only then request the next one"""
+    url, data, pages = USER, [], 0
+    while url and (max_pages is None or pages <= max_pages):
+        page = reddit.parse_user_posts(await reddit.scrape_old_reddit(url))
+        data.extend(page["data"])
+        url, pages = page["url"], pages + 1
+    return data
+
+
+def test_pipelined_pagination_matches_serial(monkeypatch):
+    monkeypatch.setattr(reddit, "SCRAPFLY", ListingClient(pages=6))
+    expected = asyncio.run(serial_user_posts())
+    posts = asyncio.run(reddit.scrape_user_posts("tester", "new"))
+    assert posts == expected
+    assert len(posts) == 6 * 25
+
+
+def test_max_pages_counts_pages_after_the_first(monkeypatch):
+    client = ListingClient(pages=6)
+    monkeypatch.setattr(reddit, "SCRAPFLY", client)
+    posts = asyncio.run(reddit.scrape_user_posts("tester", "new", max_pages=2))
+    assert len(posts) == 3 * 25
+    # the page after the limit is never requested
+    assert client.scraped == [page_url(page) for page in range(3)]
+
+
+def test_rows_are_pushed_to_the_consumer_queue(monkeypatch):
+    monkeypatch.setattr(reddit, "SCRAPFLY", ListingClient(pages=4))
+
+    async def crawl():
+        queue, received = asyncio.Queue(maxsize=10), []
+
+        async def consume():
+            while True:
+                received.append(await queue.get())
+                queue.task_done()
+
+        consumer = asyncio.ensure_future(consume())
+        returned = await reddit.scrape_user_posts("tester", "new", queue=queue)
+        consumer.cancel()
+        return returned, received
+
+    returned, received = asyncio.run(crawl())
+    assert returned == []
+    assert [post["postId"] for post in received] == [f"t3_{i}" for i in range(4 * 25)]
+
+
+def test_checkpoint_resumes_without_refetching(monkeypatch, tmp_path):
+    checkpoint = tmp_path / "posts.checkpoint"
+    client = ListingClient(pages=5)
+    monkeypatch.setattr(reddit, "SCRAPFLY", client)
+
+    async def crawl(fail_after=None):
+        queue, received = asyncio.Queue(), []
+
+        async def consume():
+            while True:
+                post = await queue.get()
+                if fail_after is not None and len(received) == fail_after:
+                    raise RuntimeError("consumer crashed")
+                received.append(post)
+                queue.task_done()
+
+        consumer = asyncio.ensure_future(consume())
+        crawl = asyncio.ensure_future(reddit.scrape_user_posts("tester", "new", queue=queue, checkpoint=checkpoint))
+        await asyncio.wait([consumer, crawl], return_when=asyncio.FIRST_COMPLETED)
+        consumer.cancel()
+        crawl.cancel()
+        await asyncio.gather(consumer, crawl, return_exceptions=True)
+        return received
+
+    # crash halfway through the third page: the first two pages are checkpointed
+    first = asyncio.run(crawl(fail_after=2 * 25 + 10))
+    assert json.loads(checkpoint.read_text())["pages"] == 2
+    client.scraped.clear()
+    second = asyncio.run(crawl())
+    assert client.scraped == [page_url(page) for page in range(2, 5)]
+    assert [post["postId"] for post in first[: 2 * 25] + second] == [f"t3_{i}" for i in range(5 * 25)]
+    # a completed crawl is not repeated
+    client.scraped.clear()
+    assert asyncio.run(crawl()) == []
+    assert client.scraped == []
+
+
+def test_subreddit_info_survives_resume(monkeypatch, tmp_path):
+    checkpoint = tmp_path / "subreddit.checkpoint"
+    checkpoint.write_text(json.dumps({"cursor": None, "pages": 3, "state": {"info": {"id": "test"}}}))
+    monkeypatch.setattr(reddit, "SCRAPFLY", ListingClient(pages=0))
+    data = asyncio.run(reddit.scrape_subreddit("test", checkpoint=checkpoint))
+    assert data == {"info": {"id": "test"}, "posts": []}
+
+
+def test_pipelining_overlaps_requests_with_parsing(monkeypatch):
+    pages, latency = 8, 0.05
+    monkeypatch.setattr(reddit, "SCRAPFLY", ListingClient(pages=pages, per_page=150, latency=latency))
+    start = time.perf_counter()
+    asyncio.run(serial_user_posts())
+    serial = time.perf_counter() - start
+    start = time.perf_counter()
+    asyncio.run(reddit.scrape_user_posts("tester", "new"))
+    pipelined = time.perf_counter() - start
+    parse = serial - pages * latency
+    # every request but the first is hidden behind the previous page's parsing
+    assert pipelined < serial - min(parse, (pages - 1) * latency) * 0.5
+
+
+@pytest.mark.parametrize("mode", ["serial", "pipelined"])
+def test_bench_user_posts_pagination(benchmark, monkeypatch, mode):
+    monkeypatch.setattr(reddit, "SCRAPFLY", ListingClient(pages=8, per_page=100, latency=0.02))
+    crawl = serial_user_posts if mode == "serial" else lambda: reddit.scrape_user_posts("tester", "new")
+    benchmark.pedantic(lambda: asyncio.run(crawl()), rounds=3)
@@ -0,0 +1,229 @@
+"""Per-domain retry budget, decorrelated jitter and circuit breaker shared by the scrapers' retry paths"""
+import asyncio
+import inspect
+from urllib.parse import urlparse
+
+import pytest
+from scrapfly import ScrapeApiResponse, ScrapeConfig
+
+from replay import load_scraper, make_response
+
+SCRAPERS = ("crunchbase", "wellfound", "leboncoin", "idealo", "reddit", "shopify")
+
+crunchbase = load_scraper("crunchbase")
+leboncoin = load_scraper("leboncoin")
+reddit = load_scraper("reddit")
+
+
+class FlakyClient:
+    """fails every request to the `blocked` domains and the first `failures` requests to any other URL"""
+
+    def __init__(self, blocked=(), failures: int = 0):
+        self.blocked = set(blocked)
+        self.failures = failures
+        self.scraped = []
+
+    def attempts(self, domain: str) -> int:
+        return len([url for url in self.scraped if urlparse(url).netloc == domain])
+
+    async def async_scrape(self, config: ScrapeConfig, loop=None) -> ScrapeApiResponse:
+        self.scraped.append(config.url)
+        if urlparse(config.url).netloc in self.blocked or self.scraped.count(config.url) <= self.failures:
+            raise Exception(f"blocked: {config.url}")
+        return make_response(config.url, "<html></html>")
+
+
+def resilience(module=crunchbase, **kwargs):
+    """instance without backoff sleeps"""
+    instance = module.Resilience(**kwargs)
+    instance.delay = lambda previous: 0
+    return instance
+
+
+async def naive_retry(client: FlakyClient, url: str, retries: int = 3):
+    """the previous behavior: every call retries on its own, regardless of how the domain is doing"""
+    for attempt in range(retries + 1):
+        try:
+            return await client.async_scrape(ScrapeConfig(url))
+        except Exception:
+            if attempt == retries:
+                raise
+
+
+async def scrape_many(run, urls):
+    return await asyncio.gather(*(run(url) for url in urls), return_exceptions=True)
+
+
+@pytest.mark.parametrize("name", SCRAPERS)
+def test_resilience_copies_are_identical(name):
+    module = load_scraper(name)
+    assert inspect.getsource(module.Resilience) == inspect.getsource(crunchbase.Resilience)
+    assert inspect.getsource(module.CircuitOpenError) == inspect.getsource(crunchbase.CircuitOpenError)
+
+
+def test_decorrelated_jitter_bounds():
+    policy = crunchbase.Resilience(base_delay=1.0, max_delay=20.0)
+    delay = policy.base_delay
+    for _ in range(1000):
+        previous, delay = delay, policy.delay(delay)
+        assert policy.base_delay <= delay <= min(policy.max_delay, previous * 3)
+    assert len({round(policy.delay(5.0), 6) for _ in range(50)}) > 1
+
+
+def test_transient_failures_are_retried():
+    client = FlakyClient(failures=2)
+    policy = resilience()
+    response = asyncio.run(policy.run(ScrapeConfig("https://example.com/a"), client.async_scrape))
+    assert response.upstream_status_code == 200 and len(client.scraped) == 3
+    stats = policy.metrics()["example.com"]
+    assert stats["requests"] == 3 and stats["retries"] == 2 and stats["successes"] == 1 and stats["failures"] == 2
+    assert stats["state"] == "closed" and stats["consecutive_failures"] == 0
+
+
+def test_retry_budget_limits_retries_to_a_blocking_domain():
+    client = FlakyClient(blocked={"blocked.com"})
+    urls = [f"https://blocked.com/{i}" for i in range(50)]
+    asyncio.run(scrape_many(lambda url: naive_retry(client, url), urls))
+    naive = len(client.scraped)
+    client.scraped.clear()
+    policy = resilience(failure_threshold=10**6, retry_budget=5)
+    results = asyncio.run(scrape_many(lambda url: policy.run(ScrapeConfig(url), client.async_scrape), urls))
+    assert all(isinstance(result, Exception) for result in results)
+    assert naive == 50 * 4
+    # every call makes its first attempt but only the budget's worth of them are retried
+    assert len(client.scraped) <= 50 + 5 + 50 * 0.2
+    assert policy.metrics()["blocked.com"]["budget_exhausted"] > 0
+
+
+def test_circuit_opens_and_recovers(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(crunchbase.time, "monotonic", lambda: now[0])
+    client = FlakyClient(blocked={"example.com"})
+    policy = resilience(max_retries=0, failure_threshold=3, reset_timeout=30)
+    urls = [f"https://example.com/{i}" for i in range(10)]
+    results = asyncio.run(scrape_many(lambda url: policy.run(ScrapeConfig(url), client.async_scrape), urls))
+    assert len(client.scraped) == 3
+    assert [type(result).__name__ for result in results[3:]] == ["CircuitOpenError"] * 7
+    stats = policy.metrics()["example.com"]
+    assert stats["state"] == "open" and stats["circuit_opened"] == 1 and stats["short_circuited"] == 7
+    # after the reset timeout a single trial request is let through, a failure reopens the circuit
+    now[0] += 31
+    asyncio.run(scrape_many(lambda url: policy.run(ScrapeConfig(url), client.async_scrape), urls))
+    assert len(client.scraped) == 4 and policy.metrics()["example.com"]["state"] == "open"
+    # and a success closes it
+    now[0] += 31
+    client.blocked.clear()
+    results = asyncio.run(scrape_many(lambda url: policy.run(ScrapeConfig(url), client.async_scrape), urls[:1]))
+    assert results[0].upstream_status_code == 200 and policy.metrics()["example.com"]["state"] == "closed"
+    results = asyncio.run(scrape_many(lambda url: policy.run(ScrapeConfig(url), client.async_scrape), urls))
+    assert all(result.upstream_status_code == 200 for result in results)
+
+
+def test_domains_are_isolated():
+    client = FlakyClient(blocked={"blocked.com"})
+    policy = resilience(failure_threshold=3)
+    urls = [f"https://blocked.com/{i}" for i in range(10)] + [f"https://healthy.com/{i}" for i in range(10)]
+    results = asyncio.run(scrape_many(lambda url: policy.run(ScrapeConfig(url), client.async_scrape), urls))
+    assert all(not isinstance(result, Exception) for result in results[10:])
+    metrics = policy.metrics()
+    assert metrics["blocked.com"]["state"] == "open" and metrics["healthy.com"]["state"] == "closed"
+    assert metrics["healthy.com"]["retries"] == 0 and client.attempts("healthy.com") == 10
+
+
+def test_timeouts_are_retried():
+    calls = []
+
+    async def slow_once(config, loop=None):
+        calls.append(config.url)
+        await asyncio.sleep(1 if len(calls) == 1 else 0)
+        return make_response(config.url, "<html></html>")
+
+    policy = resilience(timeout=0.05)
+    assert asyncio.run(policy.run(ScrapeConfig("https://example.com/"), slow_once)).upstream_status_code == 200
+    assert len(calls) == 2
+
+
+def test_parse_failures_are_retried(monkeypatch):
+    # leboncoin redirects blocked requests to its homepage, which fails parsing
+    client = FlakyClient()
+    parsed = []
+
+    def parse_ad(response):
+        parsed.append(response.context["url"])
+        if len(parsed) < 2:
+            raise ValueError("no ad data")
+        return {"url": response.context["url"]}
+
+    monkeypatch.setattr(leboncoin, "SCRAPFLY", client)
+    monkeypatch.setattr(leboncoin, "parse_ad", parse_ad)
+    monkeypatch.setattr(leboncoin, "RESILIENCE", resilience(leboncoin, max_retries=2))
+    url = "https://www.leboncoin.fr/ad/voitures/1"
+    assert asyncio.run(leboncoin.scrape_ad(url)) == {"url": url}
+    assert len(client.scraped) == 2
+    # ads that keep failing are skipped instead of raising
+    client.blocked.add("www.leboncoin.fr")
+    assert asyncio.run(leboncoin.scrape_ad(url)) is None
+
+
+class LoginWallClient:
+    """redirects the requests of the first `walled` sessions it sees to the old.reddit login wall"""
+
+    def __init__(self, walled: int):
+        self.walled = walled
+        self.sessions = []
+
+    async def async_scrape(self, config: ScrapeConfig, loop=None) -> ScrapeApiResponse:
+        if config.session not in self.sessions:
+            self.sessions.append(config.session)
+        response = make_response(config.url, "<html></html>")
+        if self.sessions.index(config.session) < self.walled:
+            response.result["result"]["url"] = "https://old.reddit.com/login/?dest=" + config.url
+        return response
+
+
+def test_reddit_login_wall_is_retried_on_new_sessions(monkeypatch):
+    url = "https://old.reddit.com/user/tester/submitted/"
+    client = LoginWallClient(walled=2)
+    monkeypatch.setattr(reddit, "SCRAPFLY", client)
+    monkeypatch.setattr(reddit, "RESILIENCE", resilience(reddit))
+    response = asyncio.run(reddit.scrape_old_reddit(url))
+    assert response.scrape_result["url"] == url
+    # every login wall rotates the session and spends a retry of the domain's budget
+    assert len(client.sessions) == 3
+    stats = reddit.RESILIENCE.metrics()["old.reddit.com"]
+    assert stats["retries"] == 2 and stats["failures"] == 2
+    client.walled = 100
+    with pytest.raises(reddit.LoginWallError):
+        asyncio.run(reddit.scrape_old_reddit(url))
+
+
+def test_crunchbase_uses_the_shared_policy(monkeypatch):
+    client = FlakyClient(blocked={"www.crunchbase.com"})
+    monkeypatch.setattr(crunchbase, "SCRAPFLY", client)
+    monkeypatch.setattr(crunchbase, "RESILIENCE", resilience(failure_threshold=4))
+    urls = [f"https://www.crunchbase.com/organization/company{i}/people" for i in range(20)]
+    results = asyncio.run(scrape_many(crunchbase.scrape_company, urls))
+    assert all(isinstance(result, Exception) for result in results)
+    # the previous recursive retries made 4 attempts for every company, here the circuit opens after 4 failures
+    # and every retry or later company fails fast
+    assert len(client.scraped) == 4
+    assert crunchbase.RESILIENCE.metrics()["www.crunchbase.com"]["short_circuited"] == 20
+
+
+@pytest.mark.parametrize("retries", ["naive", "resilient"])
+def test_bench_blocked_domain(benchmark, retries):
+    urls = [f"https://blocked.com/{i}" for i in range(200)] + [f"https://healthy.com/{i}" for i in range(200)]
+
+    def scrape_all():
+        client = FlakyClient(blocked={"blocked.com"})
+        if retries == "naive":
+            run = lambda url: naive_retry(client, url)  # noqa: E731
+        else:
+            policy = resilience()
+            run = lambda url: policy.run(ScrapeConfig(url), client.async_scrape)  # noqa: E731
+        asyncio.run(scrape_many(run, urls))
+        return client
+
+    client = benchmark.pedantic(scrape_all, rounds=3)
+    benchmark.extra_info["blocked_attempts"] = client.attempts("blocked.com")
+    benchmark.extra_info["healthy_attempts"] = client.attempts("healthy.com")
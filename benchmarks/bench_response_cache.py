@@ -0,0 +1,172 @@
+"""On-disk response cache: config normalization, TTL and size eviction, re-running scrapers over cached pages"""
+import asyncio
+import os
+import time
+from datetime import timedelta
+from io import BytesIO
+
+import pytest
+from scrapfly import ScrapeApiResponse, ScrapeConfig
+
+import response_cache
+from bench_reddit_pagination import ListingClient, reddit
+from replay import make_response
+from response_cache import CachingClient, ResponseCache, cache_key
+
+
+class CountingClient:
+    """scrapes generated pages with a fixed latency and counts every request that reaches it"""
+
+    max_concurrency = 5
+
+    def __init__(self, latency: float = 0.0, status_code: int = 200):
+        self.latency = latency
+        self.status_code = status_code
+        self.scraped = []
+
+    def page(self, config: ScrapeConfig) -> ScrapeApiResponse:
+        self.scraped.append(config.url)
+        response = make_response(config.url, f"<html><body>{config.url} {'x' * 2000}</body></html>")
+        response.result["result"]["status_code"] = self.status_code
+        response.result["result"]["success"] = self.status_code < 400
+        return response
+
+    def scrape(self, config: ScrapeConfig) -> ScrapeApiResponse:
+        return self.page(config)
+
+    async def async_scrape(self, config: ScrapeConfig, loop=None) -> ScrapeApiResponse:
+        await asyncio.sleep(self.latency)
+        return self.page(config)
+
+    async def concurrent_scrape(self, configs, concurrency=None):
+        for config in configs:
+            yield await self.async_scrape(config)
+
+
+def test_cache_key_normalizes_config():
+    key = cache_key(ScrapeConfig("https://example.com/search?q=a&page=2", asp=True))
+    assert key == cache_key(ScrapeConfig("HTTPS://Example.com/search?page=2&q=a#results", asp=True))
+    # volatile options don't change the scraped page
+    assert key == cache_key(ScrapeConfig("https://example.com/search?q=a&page=2", asp=True, cache=True, session="s1"))
+    assert key == cache_key(ScrapeConfig("https://example.com/search?q=a&page=2", asp=True, debug=True, retry=False))
+    assert cache_key(ScrapeConfig("https://example.com/", headers={"Accept": "x"})) == cache_key(
+        ScrapeConfig("https://example.com/", headers={"accept": "x"})
+    )
+    # while everything that does is part of the key
+    variants = [
+        ScrapeConfig("https://example.com/search?q=a&page=3", asp=True),
+        ScrapeConfig("https://example.com/search?q=a&page=2"),
+        ScrapeConfig("https://example.com/search?q=a&page=2", asp=True, country="US"),
+        ScrapeConfig("https://example.com/search?q=a&page=2", asp=True, render_js=True),
+        ScrapeConfig("https://example.com/search?q=a&page=2", asp=True, headers={"accept": "x"}),
+        ScrapeConfig("https://example.com/search?q=a&page=2", asp=True, method="POST", body="q=a"),
+    ]
+    assert len({key, *(cache_key(config) for config in variants)}) == len(variants) + 1
+
+
+def test_cached_responses_are_served_from_disk(tmp_path):
+    client = CountingClient()
+    cached = CachingClient(client, ResponseCache(tmp_path))
+    config = ScrapeConfig("https://example.com/page")
+    first = asyncio.run(cached.async_scrape(config))
+    second = asyncio.run(cached.async_scrape(ScrapeConfig("https://example.com/page", cache=True)))
+    assert second.content == first.content
+    assert second.selector.xpath("//body/text()").get() == first.selector.xpath("//body/text()").get()
+    assert client.scraped == ["https://example.com/page"]
+    assert cached.cache.stats["hits"] == 1
+    # a new cache over the same directory picks up the stored pages
+    assert ResponseCache(tmp_path).get(config).content == first.content
+
+
+def test_binary_responses_round_trip(tmp_path):
+    cache = ResponseCache(tmp_path)
+    config = ScrapeConfig("https://example.com/sitemap.xml.gz")
+    response = make_response(config.url, "")
+    response.result["result"].update({"format": "binary", "content": BytesIO(b"\x1f\x8bbinary")})
+    cache.put(config, response)
+    assert cache.get(config).scrape_result["content"].getvalue() == b"\x1f\x8bbinary"
+
+
+def test_failed_responses_are_not_cached(tmp_path):
+    client = CountingClient(status_code=403)
+    cached = CachingClient(client, ResponseCache(tmp_path))
+    for _ in range(2):
+        cached.scrape(ScrapeConfig("https://example.com/blocked"))
+    assert len(client.scraped) == 2
+    assert list(tmp_path.glob("*.json.gz")) == []
+
+
+def test_expired_entries_are_scraped_again(tmp_path, monkeypatch):
+    client = CountingClient()
+    cached = CachingClient(client, ResponseCache(tmp_path, ttl=timedelta(hours=1)))
+    config = ScrapeConfig("https://example.com/page")
+    cached.scrape(config)
+    now = time.time()
+    monkeypatch.setattr(response_cache.time, "time", lambda: now + 30 * 60)
+    cached.scrape(config)
+    assert len(client.scraped) == 1
+    monkeypatch.setattr(response_cache.time, "time", lambda: now + 2 * 60 * 60)
+    cached.scrape(config)
+    assert len(client.scraped) == 2
+    assert cached.cache.stats["expired"] == 1
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ResponseCache(tmp_path, max_size=None)
+    configs = [ScrapeConfig(f"https://example.com/{i}") for i in range(5)]
+    for i, config in enumerate(configs):
+        cache.put(config, CountingClient().page(config))
+        # spread last use times as file times only have coarse resolution on some filesystems
+        os.utime(cache._path(config), (time.time() - 100 + i, time.time() - 100 + i))
+    entry_size = cache.size // 5
+    assert cache.get(configs[0]) is not None  # makes the oldest entry the most recently used
+    cache.max_size = entry_size * 3 + entry_size // 2
+    cache.evict()
+    remaining = [config.url for config in configs if cache._path(config).exists()]
+    assert remaining == ["https://example.com/0", "https://example.com/3", "https://example.com/4"]
+    assert cache.stats["evicted"] == 2
+    assert cache.size == sum(path.stat().st_size for path in tmp_path.glob("*.json.gz"))
+
+
+def test_concurrent_scrape_only_scrapes_misses(tmp_path):
+    client = CountingClient()
+    cached = CachingClient(client, ResponseCache(tmp_path))
+    configs = [ScrapeConfig(f"https://example.com/{i}") for i in range(6)]
+    cached.scrape(configs[1])
+    cached.scrape(configs[4])
+    client.scraped.clear()
+
+    async def scrape_all():
+        return [response async for response in cached.concurrent_scrape(configs)]
+
+    responses = asyncio.run(scrape_all())
+    assert sorted(response.scrape_result["url"] for response in responses) == [config.url for config in configs]
+    assert client.scraped == [configs[i].url for i in (0, 2, 3, 5)]
+
+
+def test_scraper_reruns_over_cached_corpus(tmp_path, monkeypatch):
+    listing = ListingClient(pages=5)
+    listing.max_concurrency = 1
+    monkeypatch.setattr(reddit, "SCRAPFLY", CachingClient(listing, ResponseCache(tmp_path)))
+    posts = asyncio.run(reddit.scrape_user_posts("tester", "new"))
+    scraped = len(listing.scraped)
+    assert asyncio.run(reddit.scrape_user_posts("tester", "new")) == posts
+    assert len(listing.scraped) == scraped == 5
+
+
+@pytest.mark.parametrize("cache", ["cold", "warm"])
+def test_bench_cached_scrape(benchmark, tmp_path, cache):
+    configs = [ScrapeConfig(f"https://example.com/{i}") for i in range(20)]
+    cached = CachingClient(CountingClient(latency=0.01), ResponseCache(tmp_path))
+
+    async def scrape_all():
+        return [await cached.async_scrape(config) for config in configs]
+
+    def setup():
+        if cache == "cold":
+            cached.cache.clear()
+        else:
+            asyncio.run(scrape_all())
+
+    benchmark.pedantic(lambda: asyncio.run(scrape_all()), setup=setup, rounds=3)
+
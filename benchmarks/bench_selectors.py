@@ -0,0 +1,140 @@
+"""Compiled selector registry benchmarks: search pages with 60 result rows, compiled vs plain parsel queries"""
+import json
+import time
+
+import pytest
+from parsel import Selector, SelectorList
+
+from bench_amazon import search_page as amazon_search_page
+from replay import load_scraper, make_response
+
+amazon = load_scraper("amazon")
+etsy = load_scraper("etsy")
+google = load_scraper("google")
+reddit = load_scraper("reddit")
+
+ROWS = 60
+
+
+class ParselSelectors:
+    """the registry interface on plain parsel .xpath()/.css() calls, i.e. the parsers before the registry"""
+
+    def select(self, selector, query, css=False):
+        return selector.css(query) if css else selector.xpath(query)
+
+    def get(self, selector, query, default=None, css=False):
+        return self.select(selector, query, css).get(default)
+
+    def getall(self, selector, query, css=False):
+        return self.select(selector, query, css).getall()
+
+
+def subreddit_page(rows: int = ROWS):
+    posts = "".join(
+        f"""<article data-post-id="t3_{i}"><a href="/r/test/comments/{i}/post/">post</a>
+        <shreddit-post author="user{i}" author-id="t2_{i}" post-title="Post {i}" created-timestamp="2024-01-01"
+         id="t3_{i}" score="{i}" comment-count="{i * 2}" post-type="{'image' if i % 2 else 'text'}"
+         content-href="https://i.redd.it/{i}.png" more-posts-cursor="cursor"></shreddit-post>
+        <span class="x bg-tone-4"><div> label {i} </div></span>
+        <img class="media-lightbox-img" src="https://preview.redd.it/{i}.png"/></article>"""
+        for i in range(rows)
+    )
+    header = "<shreddit-subreddit-header description='test sub' weekly-active-users='10'></shreddit-subreddit-header>"
+    body = header + posts
+    return make_response("https://www.reddit.com/r/test/", f"<html><body>{body}</body></html>")
+
+
+def serp_page(rows: int = ROWS):
+    boxes = "".join(
+        f"""<div><a href="https://www.example{i}.com/page"><h3>Result {i}</h3></a>
+        <div><div><cite>example{i}.com</cite></div><div><span>Example {i}</span></div></div>
+        <span> — <span>Jan {1 + i % 28}, 2024</span></span>
+        <div data-sncf="1"><span>Jan 1, 2024 — </span><span>description of result {i}</span></div></div>"""
+        for i in range(rows)
+    )
+    body = f"<h1>Search Results</h1><div id='search'><div><div>{boxes}</div></div></div>"
+    return make_response("https://www.google.com/search?q=test", f"<html><body>{body}</body></html>")
+
+
+def etsy_page(rows: int = ROWS):
+    products = "".join(
+        f"""<li><div data-appears-component-name="search">
+        <a class="v2-listing-card" href="https://www.etsy.com/listing/{i}/item/x?ref=1">
+        <h3 class="v2-listing-card__title" title=" Item {i} "></h3>
+        <img data-listing-card-listing-image src="https://i.etsystatic.com/{i}.jpg"/>
+        <span class="review_stars"><span> 4.{i % 10} </span></span>
+        <div aria-label="4.5 star rating"><p> ({i}) </p></div>
+        <span class="currency-symbol">$</span><span class="currency-value">1,{i:03d}.00</span>
+        <span>From shop Shop{i}</span>{'<span>Free shipping</span>' if i % 3 == 0 else ''}</a></div></li>"""
+        for i in range(rows)
+    )
+    ld = json.dumps({"numberOfItems": 1000})
+    body = f"<script type='application/ld+json'>{ld}</script><div data-search-results-lg='1'><ul>{products}</ul></div>"
+    return make_response("https://www.etsy.com/search?q=test", f"<html><body>{body}</body></html>")
+
+
+PARSERS = {
+    "reddit": (reddit, reddit.parse_subreddit, subreddit_page),
+    "google": (google, google.parse_serp, serp_page),
+    "amazon": (amazon, amazon.parse_search, lambda: amazon_search_page(ROWS)),
+    "etsy": (etsy, etsy.parse_search, etsy_page),
+}
+
+
+def test_registry_matches_parsel():
+    sel = Selector(text="<html><body><div class='a' id='x'><p>one <b>two</b></p><p>three</p></div></body></html>")
+    registry = reddit.CompiledSelectors()
+    for query, css in [
+        ("div.a p::text", True),
+        ("div.a::attr(id)", True),
+        ("p b", True),
+        ("//p", False),
+        ("//p//text()", False),
+        ("string(//p)", False),
+        ("count(//p)", False),
+        ("//div[re:test(@id, '^x$')]/@class", False),
+        ("//missing/text()", False),
+    ]:
+        expected = sel.css(query) if css else sel.xpath(query)
+        assert registry.getall(sel, query, css=css) == expected.getall(), query
+        assert registry.get(sel, query, "default", css=css) == expected.get("default"), query
+        assert registry.select(sel, query, css=css).getall() == expected.getall(), query
+    paragraphs = sel.xpath("//p")
+    assert isinstance(registry.select(paragraphs, "./text()"), SelectorList)
+    assert registry.getall(paragraphs, "./text()") == paragraphs.xpath("./text()").getall()
+    assert len(registry.compiled) == 10
+
+
+@pytest.mark.parametrize("name", PARSERS)
+def test_compiled_selectors_are_faster(name, monkeypatch):
+    module, parse, make_page = PARSERS[name]
+
+    compiled_selectors, parsel_selectors = module.SELECTORS, ParselSelectors()
+
+    def parse_pages(selectors) -> float:
+        # pages are built and their html parsed up front so only the parser's own queries are timed
+        monkeypatch.setattr(module, "SELECTORS", selectors)
+        pages = [make_page() for _ in range(5)]
+        for page in pages:
+            page.selector
+        start = time.perf_counter()
+        for page in pages:
+            parse(page)
+        return time.perf_counter() - start
+
+    compiled = parse(make_page())
+    monkeypatch.setattr(module, "SELECTORS", parsel_selectors)
+    assert parse(make_page()) == compiled
+    # rounds are interleaved so machine noise hits both variants alike
+    rounds = [(parse_pages(compiled_selectors), parse_pages(parsel_selectors)) for _ in range(7)]
+    compiled_time, parsel_time = (min(times) for times in zip(*rounds))
+    assert compiled_time < parsel_time / 1.15, f"{name}: compiled {compiled_time:.4f}s vs parsel {parsel_time:.4f}s"
+
+
+@pytest.mark.parametrize("selectors", ["compiled", "parsel"])
+@pytest.mark.parametrize("name", PARSERS)
+def test_search_page_parser(name, selectors, bench_pages, monkeypatch):
+    module, parse, make_page = PARSERS[name]
+    if selectors == "parsel":
+        monkeypatch.setattr(module, "SELECTORS", ParselSelectors())
+    bench_pages(parse, lambda: [make_page() for _ in range(5)])
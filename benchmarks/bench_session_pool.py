@@ -0,0 +1,283 @@
+"""Pooled scrapfly sessions for session bound flows: warm-up reuse, per-session concurrency and retirement"""
+import asyncio
+import json
+from collections import Counter
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import pytest
+from scrapfly import ScrapeApiResponse, ScrapeConfig, ScrapflyAspError
+
+from replay import load_scraper, make_response
+
+target = load_scraper("target")
+pinterest = load_scraper("pinterest")
+chatgpt = load_scraper("chatgpt")
+
+
+def asp_error() -> ScrapflyAspError:
+    return ScrapflyAspError(
+        request=None,
+        response=SimpleNamespace(status_code=422, reason="Unprocessable Entity"),
+        message="blocked",
+        code="ERR::ASP::SHIELD_PROTECTION_FAILED",
+        http_status_code=422,
+    )
+
+
+class TargetClient:
+    """
+    serves a rendered homepage that calls the redsky API with credentials bound to the session,
+    redsky requests with another session's credentials are rejected. Sessions in `blocked` fail with an ASP error
+    """
+
+    def __init__(self, latency: float = 0.0, render_latency: float = 0.0):
+        self.latency = latency
+        self.render_latency = render_latency
+        self.blocked = set()
+        self.scraped = []
+        self.in_flight = Counter()
+        self.max_in_flight = 0
+
+    @property
+    def warmups(self) -> int:
+        return len([url for url, _ in self.scraped if url == "https://www.target.com/"])
+
+    async def async_scrape(self, config: ScrapeConfig, loop=None) -> ScrapeApiResponse:
+        self.scraped.append((config.url, config.session))
+        self.in_flight[config.session] += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight[config.session])
+        try:
+            await asyncio.sleep(self.render_latency if config.render_js else self.latency)
+        finally:
+            self.in_flight[config.session] -= 1
+        if config.session in self.blocked:
+            raise asp_error()
+        if config.render_js:
+            response = make_response(config.url, "<html></html>")
+            params = urlencode({"key": "key", "visitor_id": f"visitor-{config.session}", "store_id": "1"})
+            xhr = {"url": f"https://redsky.target.com/redsky_aggregations/v1/web/store_location_v1?{params}"}
+            response.result["result"]["browser_data"] = {"xhr_call": [xhr]}
+            return response
+        query = parse_qs(urlparse(config.url).query)
+        assert query["visitor_id"] == [f"visitor-{config.session}"], "credentials used outside of their session"
+        if "store_location_v1" in config.url:
+            data = {"data": {"store": {"store_id": query["store_id"][0]}}}
+        else:
+            data = {"data": {"product_summaries": [{"tcin": tcin} for tcin in query["tcins"][0].split(",")]}}
+        return make_response(config.url, json.dumps(data))
+
+
+async def previous_scrape_availability(tcins: list, store_id: str, zip_code: str) -> dict:
+    """the previous behavior: a new session warmed with a rendered homepage for every call"""
+    session = f"target-{len(target.SCRAPFLY.scraped)}"
+    warm_up = await target.SCRAPFLY.async_scrape(
+        ScrapeConfig("https://www.target.com/", session=session, render_js=True, **target.BASE_CONFIG)
+    )
+    credentials = target._extract_redsky_credentials(warm_up)
+    url = "https://redsky.target.com/redsky_aggregations/v1/web/product_summary_with_fulfillment_v1?" + urlencode(
+        {"key": credentials["key"], "visitor_id": credentials["visitor_id"], "tcins": ",".join(tcins)}
+    )
+    response = await target.SCRAPFLY.async_scrape(ScrapeConfig(url, session=session, **target.BASE_CONFIG))
+    return target.parse_availability(response)
+
+
+@pytest.fixture
+def target_client(monkeypatch):
+    client = TargetClient()
+    monkeypatch.setattr(target, "SCRAPFLY", client)
+    monkeypatch.setattr(target, "SESSION_POOL", target.SessionPool("target", warm=target._warm_redsky_session))
+    return client
+
+
+def test_warm_sessions_are_reused(target_client):
+    for i in range(10):
+        availability = asyncio.run(target.scrape_availability([str(i), "x"], store_id="1", zip_code="10001"))
+        assert list(availability) == [str(i), "x"]
+    assert target_client.warmups == 1
+    assert target.SESSION_POOL.metrics() == {
+        "sessions": 1,
+        "warmups": 1,
+        "jobs": 10,
+        "blocked": 0,
+        "retired": 0,
+        "open": 1,
+    }
+
+
+def test_store_lookups_are_pipelined_within_session_caps(target_client, monkeypatch):
+    target_client.latency = 0.005
+    pool = target.SessionPool("target", warm=target._warm_redsky_session, max_sessions=3, session_concurrency=4)
+    monkeypatch.setattr(target, "SESSION_POOL", pool)
+    store_ids = [str(i) for i in range(40)]
+    stores = asyncio.run(target.scrape_store_locations(store_ids))
+    assert [store["store_id"] for store in stores] == store_ids
+    assert target_client.max_in_flight == 4
+    assert target_client.warmups == 3 and pool.metrics()["open"] == 3
+    # jobs sharing a session wait for its single warm-up
+    assert len({session for url, session in target_client.scraped if url == "https://www.target.com/"}) == 3
+
+
+def test_blocked_sessions_are_retired(target_client):
+    asyncio.run(target.scrape_availability(["1"], store_id="1", zip_code="10001"))
+    (blocked,) = [session["id"] for session in target.SESSION_POOL.sessions]
+    target_client.blocked.add(blocked)
+    assert list(asyncio.run(target.scrape_availability(["2"], store_id="1", zip_code="10001"))) == ["2"]
+    assert [session["id"] for session in target.SESSION_POOL.sessions] != [blocked]
+    metrics = target.SESSION_POOL.metrics()
+    assert metrics["blocked"] == 1 and metrics["retired"] == 1 and metrics["warmups"] == 2
+
+
+def test_jobs_give_up_after_their_retries():
+    async def blocked_warm(session):
+        raise asp_error()
+
+    pool = target.SessionPool("target", warm=blocked_warm, retries=2)
+    with pytest.raises(ScrapflyAspError):
+        asyncio.run(pool.run(lambda session, credentials: asyncio.sleep(0)))
+    assert pool.metrics() == {"sessions": 3, "warmups": 3, "jobs": 3, "blocked": 3, "retired": 3, "open": 0}
+
+
+def test_sessions_rotate_after_max_uses(target_client, monkeypatch):
+    pool = target.SessionPool("target", warm=target._warm_redsky_session, max_uses=3)
+    monkeypatch.setattr(target, "SESSION_POOL", pool)
+    for i in range(7):
+        asyncio.run(target.scrape_availability([str(i)], store_id="1", zip_code="10001"))
+    assert target_client.warmups == 3
+    assert pool.metrics()["retired"] == 2
+
+
+def test_other_errors_are_raised_without_retiring(monkeypatch):
+    pool = target.SessionPool("job")
+
+    async def failing(session, state):
+        raise ValueError("parsing failed")
+
+    with pytest.raises(ValueError):
+        asyncio.run(pool.run(failing))
+    assert pool.metrics() == {"sessions": 1, "warmups": 0, "jobs": 1, "blocked": 0, "retired": 0, "open": 1}
+
+
+def test_concurrent_conversations_get_their_own_session(monkeypatch):
+    pool = chatgpt.SessionPool("chatgpt")
+    sessions = []
+
+    async def conversation(session):
+        sessions.append(session)
+        await asyncio.sleep(0.01)
+        return session
+
+    async def conversations(count):
+        return await asyncio.gather(*(pool.run(conversation) for _ in range(count)))
+
+    assert len(set(asyncio.run(conversations(5)))) == 5
+    # later conversations reuse the same sessions and conversations beyond max_sessions wait for a free one
+    assert set(asyncio.run(conversations(12))) == set(sessions[:5])
+    assert len(pool.sessions) == 5
+
+
+def test_plain_pool_retires_blocked_and_used_up_sessions():
+    pool = chatgpt.SessionPool("chatgpt", max_uses=2)
+    blocked = set()
+
+    async def job(session):
+        if session in blocked:
+            raise asp_error()
+        return session
+
+    first = asyncio.run(pool.run(job))
+    blocked.add(first)
+    second = asyncio.run(pool.run(job))
+    assert second != first and [session["id"] for session in pool.sessions] == [second]
+    assert asyncio.run(pool.run(job)) == second
+    # the second job on a session used it up
+    assert pool.sessions == []
+
+    async def always_blocked(session):
+        blocked.add(session)
+        raise asp_error()
+
+    with pytest.raises(ScrapflyAspError):
+        asyncio.run(pool.run(always_blocked))
+    # the job was retried once on another session, both sessions got retired
+    assert len(blocked) == 3 and pool.sessions == []
+
+
+class PinterestClient:
+    """serves rendered search pages capturing the search API call and the search API itself"""
+
+    def __init__(self):
+        self.scraped = []
+        self.api_empty = False
+
+    @property
+    def rendered(self) -> int:
+        return len([config for config in self.scraped if config.render_js])
+
+    def search_page(self, query: str, bookmark: str = None) -> dict:
+        page = int(bookmark or 0)
+        pins = [{"type": "pin", "id": f"{query}-{page}-{i}", "images": {}} for i in range(5)]
+        return {"resource_response": {"data": {"results": pins}, "bookmark": str(page + 1) if page < 2 else None}}
+
+    async def async_scrape(self, config: ScrapeConfig, loop=None) -> ScrapeApiResponse:
+        self.scraped.append(config)
+        if config.render_js:
+            query = parse_qs(urlparse(config.url).query)["q"][0]
+            response = make_response(config.url, "<html></html>")
+            xhr = {
+                "url": f"{pinterest.SEARCH_API_URL}?source_url=/search/pins/?q={query}",
+                "headers": {
+                    "x-csrftoken": f"csrf-{config.session}",
+                    "x-pinterest-source-url": f"/search/pins/?q={query}",
+                },
+                "response": {"body": json.dumps(self.search_page(query))},
+            }
+            response.result["result"]["browser_data"] = {"xhr_call": [xhr]}
+            return response
+        assert config.headers["x-csrftoken"] == f"csrf-{config.session}"
+        form = parse_qs(config.body)
+        options = json.loads(form["data"][0])["options"]
+        query = options["query"]
+        assert config.headers["x-pinterest-source-url"] == form["source_url"][0] == f"/search/pins/?q={query}"
+        bookmark = (options.get("bookmarks") or [None])[0]
+        page = {"resource_response": {}} if self.api_empty and not bookmark else self.search_page(query, bookmark)
+        return make_response(config.url, json.dumps(page), method="POST", body=config.body)
+
+
+def test_warm_pinterest_sessions_skip_the_rendered_search(monkeypatch):
+    client = PinterestClient()
+    monkeypatch.setattr(pinterest, "SCRAPFLY", client)
+    pool = pinterest.SessionPool("pinterest", warm=pinterest._new_search_session)
+    monkeypatch.setattr(pinterest, "SESSION_POOL", pool)
+    queries = ["cats", "dogs", "birds"]
+    results = [asyncio.run(pinterest.scrape_pinterest(query)) for query in queries]
+    for query, result in zip(queries, results):
+        expected = [f"{query}-{page}-{i}" for page in range(3) for i in range(5)]
+        assert [pin["pin_id"] for pin in result["pins"]] == expected
+    # only the first search renders the search page, the others start from the search API
+    assert client.rendered == 1 and len(client.scraped) == 9
+
+    # searches the API has no data for fall back to rendering the search page
+    client.api_empty = True
+    assert len(asyncio.run(pinterest.scrape_pinterest("fish"))["pins"]) == 15
+    assert client.rendered == 2
+
+
+@pytest.mark.parametrize("sessions", ["per_call", "pooled"])
+def test_bench_availability_calls(benchmark, monkeypatch, sessions):
+    client = TargetClient(latency=0.005, render_latency=0.05)
+    monkeypatch.setattr(target, "SCRAPFLY", client)
+    scrape = previous_scrape_availability if sessions == "per_call" else target.scrape_availability
+
+    async def scrape_all():
+        pool = target.SessionPool("target", warm=target._warm_redsky_session, session_concurrency=4)
+        monkeypatch.setattr(target, "SESSION_POOL", pool)
+        results = []
+        for wave in range(5):  # jobs keep arriving over time
+            tcins = [str(wave * 20 + i) for i in range(20)]
+            results += await asyncio.gather(*(scrape([tcin], store_id="1", zip_code="10001") for tcin in tcins))
+        return results
+
+    results = benchmark.pedantic(lambda: asyncio.run(scrape_all()), rounds=3)
+    assert [list(result) for result in results] == [[str(i)] for i in range(100)]
+    benchmark.extra_info["rendered_warmups"] = client.warmups // 3
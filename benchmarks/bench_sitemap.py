@@ -0,0 +1,137 @@
+"""Sitemap parser benchmarks on generated sitemaps: streamed parsing vs full DOM parsing"""
+import base64
+import gzip
+import subprocess
+import sys
+from datetime import datetime
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+from parsel import Selector
+from scrapfly import ScrapeConfig
+
+from measure import measure_allocations
+from replay import build_response, load_scraper
+
+bestbuy = load_scraper("bestbuy")
+crunchbase = load_scraper("crunchbase")
+shopify = load_scraper("shopify")
+similarweb = load_scraper("similarweb")
+target = load_scraper("target")
+
+NAMESPACE = "http://www.sitemaps.org/schemas/sitemap/0.9"
+
+
+def sitemap_chunks(entries: int, tag: str = "url"):
+    yield f'<?xml version="1.0" encoding="UTF-8"?>\n<{tag}set xmlns="{NAMESPACE}">\n'.replace("sitemapset", "sitemapindex")
+    for i in range(entries):
+        yield (
+            f"<{tag}><loc>https://www.example.com/store/store-{i}/{i}</loc>"
+            f"<lastmod>2024-01-{1 + i % 28:02d}T00:00:00Z</lastmod><changefreq>daily</changefreq></{tag}>\n"
+        )
+    yield f"</{tag}set>".replace("sitemapset", "sitemapindex")
+
+
+def gzipped_sitemap(entries: int, tag: str = "url") -> bytes:
+    buffer = BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode="wb") as f:
+        for chunk in sitemap_chunks(entries, tag):
+            f.write(chunk.encode())
+    return buffer.getvalue()
+
+
+def sitemap_response(content, binary: bool = True, url: str = "https://www.example.com/sitemap.xml.gz"):
+    result = {
+        "url": url,
+        "content": base64.b64encode(content).decode() if binary else content,
+        "format": "binary" if binary else "text",
+        "status_code": 200,
+        "success": True,
+        "request_headers": {},
+        "response_headers": {},
+    }
+    config = {"url": url, "method": "GET", "headers": {}}
+    return build_response(ScrapeConfig(url), {"config": config, "context": {"url": url}, "result": result})
+
+
+def dom_parse_sitemap(result):
+    """previous crunchbase.parse_sitemap: decompress the whole sitemap and parse it into a DOM"""
+    # html parsing as with parsel<1.8; newer parsel detects the xml declaration and then
+    # the un-namespaced //url query of the previous parsers matched nothing
+    sel = Selector(text=gzip.decompress(result.content.read()).decode(), type="html")
+    for url_node in sel.xpath("//url"):
+        url = url_node.xpath("loc/text()").get()
+        yield url, datetime.fromisoformat(url_node.xpath("lastmod/text()").get().strip("Z"))
+
+
+def test_sitemap_parsers_agree_with_dom_parsing():
+    data = gzipped_sitemap(100)
+    expected = list(dom_parse_sitemap(sitemap_response(data)))
+    urls = [url for url, _ in expected]
+    assert len(expected) == 100
+    assert list(crunchbase.parse_sitemap(sitemap_response(data))) == expected
+    assert bestbuy.parse_sitemaps(sitemap_response(data)) == urls
+    assert [location["url"] for location in target.parse_store_locations_sitemap(sitemap_response(data))] == urls
+    assert target.parse_store_locations_sitemap(sitemap_response(data))[7] == {
+        "url": urls[7], "slug": "store-7", "store_id": "7"
+    }
+    plain = "".join(sitemap_chunks(100))
+    assert similarweb.parse_sitemaps(sitemap_response(data)) == urls
+    assert similarweb.parse_sitemaps(sitemap_response(plain, binary=False)) == urls
+    assert shopify.parse_sitemap_locations(sitemap_response(plain, binary=False)) == urls
+    index = "".join(sitemap_chunks(3, tag="sitemap"))
+    assert len(shopify.parse_sitemap_locations(sitemap_response(index, binary=False))) == 3
+
+
+def test_streamed_parsing_allocates_less():
+    def parse(func, data):
+        response = sitemap_response(data)
+        return lambda: sum(1 for _ in func(response))
+
+    small, large = gzipped_sitemap(5000), gzipped_sitemap(50000)
+    dom_peak, _ = measure_allocations(parse(dom_parse_sitemap, large))
+    small_peak, _ = measure_allocations(parse(crunchbase.parse_sitemap, small))
+    large_peak, _ = measure_allocations(parse(crunchbase.parse_sitemap, large))
+    assert large_peak < dom_peak / 10, f"streamed peak {large_peak} vs dom peak {dom_peak}"
+    assert large_peak < small_peak * 2, f"peak grew from {small_peak} to {large_peak} with 10x sitemap size"
+
+
+RSS_SCRIPT = """
+import os, resource, sys
+os.environ.setdefault("SCRAPFLY_KEY", "replay")
+from loguru import logger
+logger.remove()
+import bench_sitemap
+response = bench_sitemap.sitemap_response(bench_sitemap.gzipped_sitemap(int(sys.argv[2])))
+parse = bench_sitemap.dom_parse_sitemap if sys.argv[1] == "dom" else bench_sitemap.crunchbase.parse_sitemap
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+assert sum(1 for _ in parse(response)) == int(sys.argv[2])
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before)
+"""
+
+
+def peak_rss_growth(parser: str, entries: int) -> int:
+    """peak RSS growth in KiB of parsing a generated sitemap in a fresh interpreter (includes libxml2 memory)"""
+    output = subprocess.run(
+        [sys.executable, "-c", RSS_SCRIPT, parser, str(entries)],
+        cwd=Path(__file__).parent,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return int(output.stdout.strip())
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="resource module is not available")
+def test_streamed_parsing_peak_rss_is_constant():
+    dom = peak_rss_growth("dom", 100000)
+    streamed = peak_rss_growth("stream", 100000)
+    assert streamed < dom / 4, f"streamed RSS growth {streamed} KiB vs dom {dom} KiB"
+    assert streamed < 8 * 1024, f"streamed RSS grew by {streamed} KiB"
+
+
+@pytest.mark.parametrize("entries", [5000, 50000])
+def test_sitemap_parser(entries, bench_pages):
+    data = gzipped_sitemap(entries)
+    bench_pages(lambda response: list(crunchbase.parse_sitemap(response)), lambda: [sitemap_response(data)])
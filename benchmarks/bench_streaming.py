@@ -0,0 +1,172 @@
+"""
+Streaming search generators replayed against their list-returning wrappers: the generator's pages are recorded
+into replay fixtures and the list function is served from those fixtures only
+"""
+import asyncio
+import json
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from scrapfly import ScrapeApiResponse, ScrapeConfig
+
+from bench_amazon import BOX
+from bench_trustpilot import TrustpilotClient, company_url
+from replay import ReplayClient, load_scraper, make_response
+
+amazon = load_scraper("amazon")
+ebay = load_scraper("ebay")
+glassdoor = load_scraper("glassdoor")
+trustpilot = load_scraper("trustpilot")
+zillow = load_scraper("zillow")
+
+PAGES = 3
+
+
+def page_number(config: ScrapeConfig, param: str) -> int:
+    return int(parse_qs(urlparse(config.url).query).get(param, ["1"])[0])
+
+
+def amazon_page(config: ScrapeConfig) -> str:
+    page = page_number(config, "page")
+    boxes = "".join(BOX.format(i=page * 100 + i, rating=4.5, count=1000 + i) for i in range(16))
+    info = f'<div cel_widget_id="UPPER-RESULT_INFO_BAR-0"><span>1-16 of over {16 * PAGES} results</span></div>'
+    return f"<html><body>{info}{boxes}</body></html>"
+
+
+def ebay_page(config: ScrapeConfig) -> str:
+    page = page_number(config, "_pgn")
+    boxes = "".join(
+        f'<li><a class="s-card__link" href="https://www.ebay.com/itm/{page}{i:02d}?hash=1"></a>'
+        f'<div class="s-card__title"><span>item {page}-{i}</span></div><span class="s-card__price">${i}.99</span></li>'
+        for i in range(60)
+    )
+    heading = f'<h1 class="srp-controls__count-heading"><span>{60 * PAGES}</span> results</h1>'
+    return f'<html><body>{heading}<ul class="srp-results">{boxes}</ul></body></html>'
+
+
+def glassdoor_page(config: ScrapeConfig) -> str:
+    page = int(urlparse(config.url).path.rsplit("_IP", 1)[-1].split(".")[0]) if "_IP" in config.url else 1
+    boxes = "".join(
+        f'<div class="jobCard JobCard_jobCardContainer"><a href="/job-listing/{page}-{i}">job {page}-{i}</a></div>'
+        for i in range(30)
+    )
+    links = [
+        {"urlLink": f"/Job/python-jobs-SRCH_KO0,6_IP{number}.htm", "isCurrentPage": number == page}
+        for number in range(1, PAGES + 1)
+    ]
+    escaped = json.dumps(links).replace('"', '\\"')
+    script = f'self.__next_f.push([1,"{{\\"paginationLinks\\":{escaped},\\"searchResultsMetadata\\":{{}}}}"])'
+    return f"<html><body>{boxes}<script>{script}</script></body></html>"
+
+
+def zillow_page(config: ScrapeConfig) -> str:
+    if config.method != "PUT":
+        next_data = {"props": {"pageProps": {"searchPageState": {"queryState": {"usersSearchTerm": "Seattle"}}}}}
+        return f'<html><script id="__NEXT_DATA__">{json.dumps(next_data)}</script></html>'
+    page = json.loads(config.body)["searchQueryState"].get("pagination", {}).get("currentPage", 1)
+    listings = [{"zpid": f"{page}-{i}"} for i in range(40)]
+    return json.dumps({"cat1": {"searchResults": {"listResults": listings}, "searchList": {"totalPages": PAGES}}})
+
+
+class SiteClient:
+    """serves generated pages of a search, `page(config)` returns the content of a scrape config"""
+
+    max_concurrency = 5
+
+    def __init__(self, page):
+        self.page = page
+        self.scraped = []
+
+    async def async_scrape(self, config: ScrapeConfig, loop=None) -> ScrapeApiResponse:
+        self.scraped.append(config.url)
+        response = make_response(config.url, self.page(config), method=config.method, body=config.body)
+        # like the live client, responses carry the config they were scraped with which keys recorded fixtures
+        response.scrape_config = config
+        return response
+
+    async def concurrent_scrape(self, configs, concurrency=None):
+        for config in configs:
+            yield await self.async_scrape(config)
+
+
+def trustpilot_client() -> TrustpilotClient:
+    client = TrustpilotClient(review_pages=PAGES)
+    client.max_concurrency = 5
+    return client
+
+
+# scraper -> (module, client, generator, list function, requests made before the first item)
+SEARCHES = {
+    "amazon": (
+        amazon,
+        lambda: SiteClient(amazon_page),
+        lambda **kwargs: amazon.iter_search("https://www.amazon.com/s?k=kindle", **kwargs),
+        lambda **kwargs: amazon.scrape_search("https://www.amazon.com/s?k=kindle", **kwargs),
+        1,
+    ),
+    "ebay": (
+        ebay,
+        lambda: SiteClient(ebay_page),
+        lambda **kwargs: ebay.iter_search("https://www.ebay.com/sch/i.html?_nkw=iphone", **kwargs),
+        lambda **kwargs: ebay.scrape_search("https://www.ebay.com/sch/i.html?_nkw=iphone", **kwargs),
+        1,
+    ),
+    "glassdoor": (
+        glassdoor,
+        lambda: SiteClient(glassdoor_page),
+        lambda **kwargs: glassdoor.iter_jobs("https://www.glassdoor.com/Job/python-jobs-SRCH_KO0,6.htm", **kwargs),
+        lambda **kwargs: glassdoor.scrape_jobs("https://www.glassdoor.com/Job/python-jobs-SRCH_KO0,6.htm", **kwargs),
+        1,
+    ),
+    "trustpilot": (
+        trustpilot,
+        trustpilot_client,
+        lambda **kwargs: trustpilot.iter_reviews(company_url(1), **kwargs),
+        lambda **kwargs: trustpilot.scrape_reviews(company_url(1), **kwargs),
+        2,
+    ),
+    "zillow": (
+        zillow,
+        lambda: SiteClient(zillow_page),
+        lambda max_pages=None: zillow.iter_search("https://www.zillow.com/seattle-wa/", max_scrape_pages=max_pages),
+        lambda max_pages=None: zillow.scrape_search("https://www.zillow.com/seattle-wa/", max_scrape_pages=max_pages),
+        2,
+    ),
+}
+
+
+@pytest.fixture(autouse=True)
+def deterministic_requests(monkeypatch):
+    # zillow's search API payloads carry a random request id which is part of the replay fixture key
+    monkeypatch.setattr(zillow, "random", SimpleNamespace(randint=lambda low, high: low))
+    monkeypatch.setattr(trustpilot, "BUILD_ID", trustpilot.BuildIdCache())
+
+
+async def collect(generator) -> list:
+    return [item async for item in generator]
+
+
+async def first_item(generator):
+    async for item in generator:
+        return item
+
+
+@pytest.mark.parametrize("max_pages", [None, 2])
+@pytest.mark.parametrize("name", SEARCHES)
+def test_streamed_items_match_the_list(tmp_path, monkeypatch, name, max_pages):
+    module, client, iterate, scrape, _ = SEARCHES[name]
+    monkeypatch.setattr(module, "SCRAPFLY", ReplayClient(tmp_path, client=client(), mode="record"))
+    streamed = asyncio.run(collect(iterate(max_pages=max_pages)))
+    monkeypatch.setattr(module, "SCRAPFLY", ReplayClient(tmp_path))
+    assert asyncio.run(scrape(max_pages=max_pages)) == streamed
+    assert len(streamed) > len(asyncio.run(collect(iterate(max_pages=1))))
+
+
+@pytest.mark.parametrize("name", SEARCHES)
+def test_first_items_arrive_before_the_other_pages(monkeypatch, name):
+    module, client, iterate, _, first_requests = SEARCHES[name]
+    client = client()
+    monkeypatch.setattr(module, "SCRAPFLY", client)
+    assert asyncio.run(first_item(iterate())) is not None
+    assert len(client.scraped) == first_requests
@@ -0,0 +1,219 @@
+"""Tripadvisor hotel reviews on generated hotel pages: review pages without rendering, review-only parsing"""
+import asyncio
+import json
+import math
+import re
+
+import pytest
+from scrapfly import ScrapeApiResponse, ScrapeConfig
+
+from measure import timed
+from replay import load_scraper, make_response
+
+tripadvisor = load_scraper("tripadvisor")
+
+HOTEL_URL = "https://www.tripadvisor.com/Hotel_Review-g190327-d264936-Reviews-Hotel-Sliema_Island_of_Malta.html"
+
+
+def review_card(i: int) -> str:
+    return f"""
+    <div data-test-target="HR_CC_CARD"><div>
+      <div data-test-target="review-title"><a><span><span>Review title {i}</span></span></a></div>
+      <svg><title>{i % 5 + 1}.0 of 5 bubbles</title></svg>
+      <div class="_c"><div class="fIrGe _T">
+        <span class="JguWG"><span>Review text {i} </span><span>more</span></span>
+      </div></div>
+      <div><div><span>Date of stay:</span></div><span>May 2023</span></div>
+      <div><div><span>Trip type:</span></div><span>Traveled as a couple</span></div>
+    </div></div>"""
+
+
+def hotel_page(total_reviews: int, offset: int = 0, head_kib: int = 200) -> str:
+    """hotel page with a large head, hotel details and a page of review cards starting at review `offset`"""
+    basic_data = {"@type": "Hotel", "name": "Hotel", "aggregateRating": {"reviewCount": total_reviews}}
+    head = "".join(f"<script>window.__DATA_{i}__ = {json.dumps('x' * 1000)};</script>" for i in range(head_kib))
+    amenities = "".join(f'<div data-test-target="amenity_text">Amenity {i}</div>' for i in range(50))
+    cards = "".join(review_card(i) for i in range(offset, min(offset + 10, total_reviews)))
+    return f"""<html><head>{head}<script type="application/ld+json">{json.dumps(basic_data)}</script></head>
+    <body><div data-automation="aboutTabDescription"><div><div><div>Description</div></div></div></div>
+    {amenities}<div class="reviews">{cards}</div><footer>{head}</footer></body></html>"""
+
+
+class TripadvisorClient:
+    """
+    serves generated hotel review pages, rendered requests take `render_latency` seconds and plain ones `latency`.
+    Review pages listed in `unrendered_empty` come back without reviews unless rendered
+    """
+
+    def __init__(self, total_reviews=95, latency=0.0, render_latency=0.0, unrendered_empty=(), failing=()):
+        self.total_reviews = total_reviews
+        self.latency = latency
+        self.render_latency = render_latency
+        self.unrendered_empty = set(unrendered_empty)
+        self.failing = set(failing)
+        self.scraped = []
+
+    @property
+    def rendered(self) -> int:
+        return len([rendered for _, rendered in self.scraped if rendered])
+
+    async def async_scrape(self, config: ScrapeConfig, loop=None) -> ScrapeApiResponse:
+        self.scraped.append((config.url, bool(config.render_js)))
+        await asyncio.sleep(self.render_latency if config.render_js else self.latency)
+        if config.url in self.failing and not config.render_js:
+            raise Exception(f"failed to scrape {config.url}")
+        match = re.search(r"-Reviews-or(\d+)-", config.url)
+        offset = int(match.group(1)) if match else 0
+        if offset and offset // 10 in self.unrendered_empty and not config.render_js:
+            return make_response(config.url, hotel_page(self.total_reviews, offset=self.total_reviews))
+        return make_response(config.url, hotel_page(self.total_reviews, offset=offset))
+
+    async def concurrent_scrape(self, configs, concurrency=10):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def scrape(config):
+            async with semaphore:
+                try:
+                    return await self.async_scrape(config)
+                except Exception as e:
+                    return e
+
+        for task in asyncio.as_completed([scrape(config) for config in configs]):
+            yield await task
+
+
+async def previous_scrape_hotel(url: str, max_review_pages=None) -> dict:
+    """the previous behavior: every review page is rendered and fully parsed as a hotel page"""
+    first_page = await tripadvisor.SCRAPFLY.async_scrape(ScrapeConfig(url, **tripadvisor.BASE_CONFIG, render_js=True))
+    hotel_data = tripadvisor.parse_hotel_page(first_page)
+    total_reviews = int(hotel_data["basic_data"]["aggregateRating"]["reviewCount"])
+    total_review_pages = math.ceil(total_reviews / 10)
+    if max_review_pages and max_review_pages < total_review_pages:
+        total_review_pages = max_review_pages
+    review_urls = [url.replace("-Reviews-", f"-Reviews-or{10 * i}-") for i in range(1, total_review_pages)]
+    configs = [ScrapeConfig(url, **tripadvisor.BASE_CONFIG, render_js=True) for url in review_urls]
+    async for result in tripadvisor.SCRAPFLY.concurrent_scrape(configs):
+        hotel_data["reviews"].extend(tripadvisor.parse_hotel_page(result)["reviews"])
+    return hotel_data
+
+
+async def collect(generator) -> list:
+    return [item async for item in generator]
+
+
+def _titles(reviews: list) -> list:
+    return sorted(review["title"] for review in reviews)
+
+
+def test_review_parser_matches_hotel_parser():
+    for offset in (0, 10, 90):
+        response = make_response(HOTEL_URL, hotel_page(95, offset=offset))
+        reviews = tripadvisor.parse_reviews(response)
+        assert reviews == tripadvisor.parse_hotel_page(response)["reviews"]
+        assert len(reviews) == min(10, 95 - offset)
+    assert reviews[0] == {
+        "title": "Review title 90",
+        "text": "Review text 90 more",
+        "rate": 1.0,
+        "tripDate": "May 2023",
+        "tripType": "Traveled as a couple",
+    }
+    assert tripadvisor.parse_reviews(make_response(HOTEL_URL, hotel_page(95, offset=95))) == []
+
+
+def test_review_pages_are_not_rendered(monkeypatch):
+    client = TripadvisorClient(total_reviews=95)
+    monkeypatch.setattr(tripadvisor, "SCRAPFLY", client)
+    hotel = asyncio.run(tripadvisor.scrape_hotel(HOTEL_URL))
+    assert _titles(hotel["reviews"]) == sorted(f"Review title {i}" for i in range(95))
+    assert hotel["reviews"][:10] == tripadvisor.parse_reviews(make_response(HOTEL_URL, hotel_page(95)))
+    # only the first page needs a browser and no page past the last review is requested
+    assert len(client.scraped) == 10 and client.rendered == 1
+    assert hotel == asyncio.run(previous_scrape_hotel(HOTEL_URL)) | {"reviews": hotel["reviews"]}
+    client.scraped.clear()
+    assert len(asyncio.run(tripadvisor.scrape_hotel(HOTEL_URL, max_review_pages=3))["reviews"]) == 30
+    assert len(client.scraped) == 3
+
+
+def test_pages_without_reviews_are_rendered(monkeypatch):
+    review_urls = tripadvisor.review_page_urls(HOTEL_URL, 95)
+    client = TripadvisorClient(total_reviews=95, unrendered_empty={2, 5}, failing={review_urls[6]})
+    monkeypatch.setattr(tripadvisor, "SCRAPFLY", client)
+    hotel = asyncio.run(tripadvisor.scrape_hotel(HOTEL_URL))
+    assert _titles(hotel["reviews"]) == sorted(f"Review title {i}" for i in range(95))
+    rendered = [url for url, render_js in client.scraped[1:] if render_js]
+    assert sorted(rendered) == sorted([review_urls[1], review_urls[4], review_urls[6]])
+
+
+def test_normalized_urls_are_not_rendered_again(monkeypatch):
+    client = TripadvisorClient(total_reviews=95, unrendered_empty={3})
+    scrape = client.async_scrape
+
+    async def normalizing(config, loop=None):
+        response = await scrape(config)
+        # the API echoes back a normalized url in the response context
+        response.result["context"]["url"] = config.url.lower()
+        return response
+
+    monkeypatch.setattr(client, "async_scrape", normalizing)
+    monkeypatch.setattr(tripadvisor, "SCRAPFLY", client)
+    review_urls = tripadvisor.review_page_urls(HOTEL_URL, 95)
+    reviews = asyncio.run(collect(tripadvisor.iter_reviews(review_urls)))
+    assert _titles(reviews) == sorted(f"Review title {i}" for i in range(10, 95))
+    assert [url for url, render_js in client.scraped if render_js] == [review_urls[2]]
+
+
+def test_rendered_pages_skip_yielded_reviews(monkeypatch):
+    review_urls = tripadvisor.review_page_urls(HOTEL_URL, 95)
+    client = TripadvisorClient(total_reviews=95, unrendered_empty={1})
+    scrape = client.async_scrape
+
+    async def overlapping(config, loop=None):
+        # the rendered page comes back with the reviews of the next page which were already yielded
+        if config.render_js:
+            config = ScrapeConfig(review_urls[1], render_js=True)
+        return await scrape(config)
+
+    monkeypatch.setattr(client, "async_scrape", overlapping)
+    monkeypatch.setattr(tripadvisor, "SCRAPFLY", client)
+    reviews = asyncio.run(collect(tripadvisor.iter_reviews(review_urls)))
+    assert _titles(reviews) == sorted(f"Review title {i}" for i in range(20, 95))
+
+
+def test_review_pages_stream(monkeypatch):
+    client = TripadvisorClient(total_reviews=1000, latency=0.002)
+    monkeypatch.setattr(tripadvisor, "SCRAPFLY", client)
+
+    async def first_review():
+        stream = tripadvisor.iter_reviews(tripadvisor.review_page_urls(HOTEL_URL, 1000))
+        review = await stream.__anext__()
+        scraped = len(client.scraped)
+        await stream.aclose()
+        return review, scraped
+
+    review, scraped = asyncio.run(first_review())
+    # the first reviews are yielded before the remaining pages are requested
+    assert review["title"].startswith("Review title") and scraped < 99
+
+
+def test_review_parser_is_faster():
+    pages = [hotel_page(1000, offset=offset) for offset in range(0, 100, 10)]
+
+    def parse(parser):
+        # fresh responses as they cache their parsed selector
+        return [parser(make_response(HOTEL_URL, page)) for page in pages]
+
+    review_only = timed(parse, tripadvisor.parse_reviews, repeat=5)
+    full = timed(parse, tripadvisor.parse_hotel_page, repeat=5)
+    # the review cards are parsed the same way, the page around them is skipped
+    assert review_only < full * 0.75, f"review only {review_only:.3f}s vs full page {full:.3f}s"
+
+
+@pytest.mark.parametrize("scrape", ["rendered", "unrendered"])
+def test_bench_hotel_reviews(benchmark, monkeypatch, scrape):
+    client = TripadvisorClient(total_reviews=1000, latency=0.005, render_latency=0.05)
+    monkeypatch.setattr(tripadvisor, "SCRAPFLY", client)
+    scrape_hotel = previous_scrape_hotel if scrape == "rendered" else tripadvisor.scrape_hotel
+    hotel = benchmark.pedantic(lambda: asyncio.run(scrape_hotel(HOTEL_URL)), rounds=3)
+    assert len(hotel["reviews"]) == 1000
+    benchmark.extra_info["rendered_requests"] = client.rendered // 3
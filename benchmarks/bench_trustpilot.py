@@ -0,0 +1,195 @@
+"""Trustpilot review API discovery on generated company pages: shared buildId cache, TTL and refresh on 404"""
+import asyncio
+import json
+import time
+from datetime import timedelta
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from scrapfly import ScrapeApiResponse, ScrapeConfig, UpstreamHttpClientError
+
+from replay import load_scraper, make_response
+
+trustpilot = load_scraper("trustpilot")
+
+
+def company_url(i: int) -> str:
+    return f"https://www.trustpilot.com/review/company{i}.com"
+
+
+class TrustpilotClient:
+    """
+    serves company pages carrying the current Next.js buildId and their review API pages,
+    API urls with any other buildId respond with 404 like a Next.js app after a new deploy.
+    Company pages scraped with `cache` are served from the cache like the Scrapfly API unless `cache_clear` is set
+    """
+
+    def __init__(self, build_id: str = "build-1", review_pages: int = 3, latency: float = 0.0):
+        self.build_id = build_id
+        self.review_pages = review_pages
+        self.latency = latency
+        self.scraped = []
+        self.cached = {}
+
+    @property
+    def page_loads(self) -> int:
+        return len([url for url in self.scraped if "/_next/data/" not in url])
+
+    async def async_scrape(self, config: ScrapeConfig, loop=None) -> ScrapeApiResponse:
+        self.scraped.append(config.url)
+        await asyncio.sleep(self.latency)
+        parts = urlparse(config.url)
+        if not parts.path.startswith("/_next/data/"):
+            if config.cache and not config.cache_clear and config.url in self.cached:
+                return make_response(config.url, self.cached[config.url])
+            next_data = json.dumps({"buildId": self.build_id, "props": {"pageProps": {}}})
+            html = f'<html><script id="__NEXT_DATA__" type="application/json">{next_data}</script></html>'
+            if config.cache:
+                self.cached[config.url] = html
+            return make_response(config.url, html)
+        if parts.path.split("/")[3] != self.build_id:
+            raise UpstreamHttpClientError(
+                request=None,
+                response=None,
+                message="404 ERR::SCRAPE::BAD_UPSTREAM_RESPONSE",
+                code="ERR::SCRAPE::BAD_UPSTREAM_RESPONSE",
+                http_status_code=404,
+            )
+        query = parse_qs(parts.query)
+        page = int(query.get("page", ["1"])[0])
+        reviews = [{"id": f"{query['businessUnit'][0]}-{page}-{i}"} for i in range(20)]
+        pagination = {"pagination": {"totalPages": self.review_pages}}
+        content = json.dumps({"pageProps": {"reviews": reviews, "filters": pagination}})
+        return make_response(config.url, content, method="POST")
+
+    async def concurrent_scrape(self, configs, concurrency=None):
+        for config in configs:
+            try:
+                yield await self.async_scrape(config)
+            except Exception as e:
+                yield e
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = TrustpilotClient()
+    monkeypatch.setattr(trustpilot, "SCRAPFLY", client)
+    monkeypatch.setattr(trustpilot, "BUILD_ID", trustpilot.BuildIdCache())
+    return client
+
+
+async def scrape_companies(count: int) -> list:
+    return await asyncio.gather(*(trustpilot.scrape_reviews(company_url(i)) for i in range(count)))
+
+
+def test_build_id_is_loaded_once(client):
+    results = asyncio.run(scrape_companies(20))
+    assert [len(reviews) for reviews in results] == [60] * 20
+    assert results[3][0] == {"id": "company3.com-1-0"}
+    # companies scraped at the same time share the first company page load
+    assert client.page_loads == 1
+    asyncio.run(scrape_companies(5))
+    assert client.page_loads == 1
+    assert asyncio.run(trustpilot.get_reviews_api_url(company_url(1))).startswith(
+        "https://www.trustpilot.com/_next/data/build-1/review/company1.com.json"
+    )
+
+
+def test_expired_build_id_is_reloaded(client, monkeypatch):
+    asyncio.run(trustpilot.scrape_reviews(company_url(0)))
+    now = time.time()
+    monkeypatch.setattr(trustpilot.time, "time", lambda: now + 30 * 60)
+    asyncio.run(trustpilot.scrape_reviews(company_url(1)))
+    assert client.page_loads == 1
+    monkeypatch.setattr(trustpilot.time, "time", lambda: now + 2 * 60 * 60)
+    asyncio.run(trustpilot.scrape_reviews(company_url(2)))
+    assert client.page_loads == 2
+
+
+def test_outdated_build_id_is_refreshed_on_404(client):
+    asyncio.run(scrape_companies(3))
+    client.build_id = "build-2"
+    results = asyncio.run(scrape_companies(10))
+    assert [len(reviews) for reviews in results] == [60] * 10
+    # every company hit the outdated build at once but the buildId was only reloaded once
+    assert client.page_loads == 2
+    assert trustpilot.BUILD_ID.build_id == "build-2"
+
+
+def test_refresh_skips_the_cached_page(client, monkeypatch):
+    monkeypatch.setitem(trustpilot.BASE_CONFIG, "cache", True)
+    asyncio.run(trustpilot.scrape_reviews(company_url(0)))
+    client.build_id = "build-2"
+    # the cached company page still carries build-1, the refresh has to reach the site for the new one
+    assert len(asyncio.run(trustpilot.scrape_reviews(company_url(0)))) == 60
+    assert trustpilot.BUILD_ID.build_id == "build-2"
+    assert client.cached[company_url(0)].count("build-2") == 1
+
+
+def test_deploy_during_the_crawl(client, monkeypatch):
+    scrape = client.async_scrape
+
+    async def deploying(config, loop=None):
+        response = await scrape(config)
+        if "&page=2" in config.url:
+            client.build_id = "build-2"
+        return response
+
+    monkeypatch.setattr(client, "async_scrape", deploying)
+    client.review_pages = 5
+    reviews = asyncio.run(trustpilot.scrape_reviews(company_url(0)))
+    # the pages after the deploy 404 and are retried with the new buildId
+    assert [review["id"] for review in reviews] == [
+        f"company0.com-{page}-{i}" for page in range(1, 6) for i in range(20)
+    ]
+    assert client.page_loads == 2
+    assert trustpilot.BUILD_ID.build_id == "build-2"
+
+
+def test_failed_review_pages_are_skipped(client, monkeypatch):
+    scrape = client.async_scrape
+
+    async def failing(config, loop=None):
+        if "&page=2" in config.url:
+            raise UpstreamHttpClientError(
+                request=None,
+                response=None,
+                message="403",
+                code="ERR::SCRAPE::BAD_UPSTREAM_RESPONSE",
+                http_status_code=403,
+            )
+        return await scrape(config)
+
+    monkeypatch.setattr(client, "async_scrape", failing)
+    reviews = asyncio.run(trustpilot.scrape_reviews(company_url(0)))
+    assert [review["id"] for review in reviews] == [f"company0.com-{page}-{i}" for page in (1, 3) for i in range(20)]
+    assert client.page_loads == 1
+
+
+def test_other_errors_are_raised(client, monkeypatch):
+    async def blocked(config, loop=None):
+        raise UpstreamHttpClientError(
+            request=None, response=None, message="403", code="ERR::SCRAPE::BAD_UPSTREAM_RESPONSE", http_status_code=403
+        )
+
+    asyncio.run(trustpilot.BUILD_ID.get(company_url(0)))
+    monkeypatch.setattr(client, "async_scrape", blocked)
+    with pytest.raises(UpstreamHttpClientError):
+        asyncio.run(trustpilot.scrape_reviews(company_url(0)))
+    assert trustpilot.BUILD_ID.build_id == "build-1"
+
+
+@pytest.mark.parametrize("cache", ["uncached", "shared"])
+def test_bench_company_reviews(benchmark, monkeypatch, cache):
+    client = TrustpilotClient(review_pages=1, latency=0.01)
+    monkeypatch.setattr(trustpilot, "SCRAPFLY", client)
+
+    async def scrape_all():
+        # the previous behavior loaded every company page before calling its review API
+        ttl = timedelta(0) if cache == "uncached" else timedelta(hours=1)
+        monkeypatch.setattr(trustpilot, "BUILD_ID", trustpilot.BuildIdCache(ttl=ttl))
+        client.scraped.clear()
+        return [await trustpilot.scrape_reviews(company_url(i)) for i in range(20)]
+
+    benchmark.pedantic(lambda: asyncio.run(scrape_all()), rounds=3)
+    benchmark.extra_info["page_loads"] = client.page_loads
@@ -0,0 +1,80 @@
+"""Walmart render mode prediction: url groups that always need JS rendering skip the plain request"""
+import asyncio
+import json
+
+import pytest
+from scrapfly import ScrapeConfig
+
+from replay import load_scraper, make_response
+
+walmart = load_scraper("walmart")
+
+
+def product_page(url: str) -> str:
+    data = {"props": {"pageProps": {"initialData": {"data": {"product": {"id": url}, "reviews": {}}}}}}
+    return f'<html><script id="__NEXT_DATA__">{json.dumps(data)}</script></html>'
+
+
+class ProductClient:
+    """serves product pages that only have product data when rendered for brands in `render_brands`"""
+
+    def __init__(self, render_brands=("rendered",)):
+        self.render_brands = set(render_brands)
+        self.requests = {"plain": 0, "render": 0}
+
+    async def async_scrape(self, config: ScrapeConfig, loop=None):
+        self.requests["render" if config.render_js else "plain"] += 1
+        await asyncio.sleep(0)  # gathered scrapes are all in flight before any of them finishes
+        brand = config.url.split("/")[-2].lower()
+        if brand in self.render_brands and not config.render_js:
+            return make_response(config.url, "<html><body>loading</body></html>")
+        return make_response(config.url, product_page(config.url))
+
+
+def products(brand: str, count: int, start: int = 0):
+    return [f"https://www.walmart.com/ip/{brand}/{i}" for i in range(start, start + count)]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = ProductClient()
+    monkeypatch.setattr(walmart, "SCRAPFLY", client)
+    monkeypatch.setattr(walmart, "RENDER_MODES", walmart.RenderModePredictor(explore=0))
+    return client
+
+
+def scrape(urls):
+    return asyncio.run(walmart.scrape_products(urls))
+
+
+def test_render_only_groups_skip_plain_requests(client):
+    # first batch learns the render mode: every rendered-brand product pays for two requests
+    first = scrape(products("Rendered", 5) + products("Plain", 5))
+    assert all("product" in result for result in first)
+    assert client.requests == {"plain": 10, "render": 5}
+    first_wasted = walmart.RENDER_MODES.wasted_rate
+
+    results = []
+    for batch in range(1, 5):
+        results += scrape(products("Rendered", 5, start=batch * 5) + products("Plain", 5, start=batch * 5))
+    assert all("product" in result for result in results)
+    assert client.requests == {"plain": 30, "render": 25}
+    assert walmart.RENDER_MODES.stats == {"plain_hits": 25, "plain_misses": 5, "rendered_direct": 20}
+    assert walmart.RENDER_MODES.wasted_rate < first_wasted / 3
+
+
+def test_exploration_notices_groups_that_stop_needing_rendering(client):
+    scrape(products("Rendered", 5))
+    assert walmart.RENDER_MODES.should_render(products("Rendered", 1)[0])
+    client.render_brands.clear()
+    walmart.RENDER_MODES.explore = 1  # every predicted render is re-checked with a plain request
+    for batch in range(1, 4):
+        scrape(products("Rendered", 5, start=batch * 5))
+    walmart.RENDER_MODES.explore = 0
+    assert not walmart.RENDER_MODES.should_render(products("Rendered", 1)[0])
+
+
+def test_render_groups():
+    assert walmart._render_group("https://www.walmart.com/ip/1736740710") == "/ip/{id}"
+    assert walmart._render_group("https://www.walmart.com/ip/Apple-AirPods-Pro/123?x=1") == "/ip/apple/{id}"
+    assert walmart._render_group("https://www.walmart.com/browse/electronics/tvs/3944_1060825") == "/browse/electronics"
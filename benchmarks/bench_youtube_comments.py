@@ -0,0 +1,271 @@
+"""YouTube comment crawling on a generated comments API: concurrent page and reply frontier, sort orders, token cache"""
+import asyncio
+import json
+import time
+
+import pytest
+from scrapfly import ScrapeApiResponse, ScrapeConfig
+
+from replay import load_scraper, make_response
+
+pytest.importorskip("jsonpath_ng")
+youtube = load_scraper("youtube")
+
+
+def _token(item: dict) -> dict:
+    return {"continuationCommand": {"token": item}}
+
+
+def comment_entity(comment_id: str) -> dict:
+    return {
+        "properties": {"commentId": comment_id, "content": {"content": f"comment {comment_id}"}, "publishedTime": "1d"},
+        "author": {"channelId": "UC1", "displayName": "@author", "avatarThumbnailUrl": "https://yt3.example.com/a"},
+        "toolbar": {"likeCountLiked": "1", "replyCount": "2"},
+    }
+
+
+class CommentsClient:
+    """
+    serves a generated comments API: `pages` top level pages of `threads` comments for each sort order
+    where every thread has `reply_pages` pages of replies. Tokens are "<sort>:<page>" and "replies:<thread>:<page>"
+    """
+
+    def __init__(self, pages: int = 4, threads: int = 5, reply_pages: int = 2, latency: float = 0.0, failing=()):
+        self.pages = pages
+        self.failing = set(failing)
+        self.threads = threads
+        self.reply_pages = reply_pages
+        self.latency = latency
+        self.scraped = []
+        self.in_flight = self.max_in_flight = 0
+
+    def thread_ids(self, sort: str, page: int) -> list:
+        ids = [f"c{i}" for i in range(self.pages * self.threads)]
+        if sort == "newest":
+            ids.reverse()
+        return ids[page * self.threads : (page + 1) * self.threads]
+
+    def comments_page(self, sort: str, page: int) -> dict:
+        ids = self.thread_ids(sort, page)
+        items = [
+            {
+                "commentThreadRenderer": {
+                    "replies": {
+                        "commentRepliesRenderer": {
+                            "contents": [
+                                {"continuationItemRenderer": {"continuationEndpoint": _token(f"replies:{i}:0")}}
+                            ]
+                        }
+                    },
+                    "commentViewModel": {"commentViewModel": {"commentId": i}},
+                }
+            }
+            for i in ids
+        ]
+        if page + 1 < self.pages:
+            items.append({"continuationItemRenderer": {"continuationEndpoint": _token(f"{sort}:{page + 1}")}})
+        header = {
+            "commentsHeaderRenderer": {
+                "sortMenu": {
+                    "sortFilterSubMenuRenderer": {
+                        "subMenuItems": [
+                            {"title": "Top comments", "serviceEndpoint": _token("top:0")},
+                            {"title": "Newest first", "serviceEndpoint": _token("newest:0")},
+                        ]
+                    }
+                }
+            }
+        }
+        endpoints = [{"appendContinuationItemsAction": {"continuationItems": items}}]
+        if page == 0:
+            endpoints = [
+                {"reloadContinuationItemsCommand": {"continuationItems": [header]}},
+                {"reloadContinuationItemsCommand": {"continuationItems": items}},
+            ]
+        mutations = [{"payload": {"commentEntityPayload": comment_entity(i)}} for i in ids]
+        return {
+            "onResponseReceivedEndpoints": endpoints,
+            "frameworkUpdates": {"entityBatchUpdate": {"mutations": mutations}},
+        }
+
+    def replies_page(self, thread_id: str, page: int) -> dict:
+        ids = [f"{thread_id}.r{page * 3 + i}" for i in range(3)]
+        items = [{"commentViewModel": {"commentViewModel": {"commentId": i}}} for i in ids]
+        if page + 1 < self.reply_pages:
+            button = {"buttonRenderer": {"command": _token(f"replies:{thread_id}:{page + 1}")}}
+            items.append({"continuationItemRenderer": {"button": button}})
+        mutations = [{"payload": {"commentEntityPayload": comment_entity(i)}} for i in ids]
+        return {
+            "onResponseReceivedEndpoints": [{"appendContinuationItemsAction": {"continuationItems": items}}],
+            "frameworkUpdates": {"entityBatchUpdate": {"mutations": mutations}},
+        }
+
+    def api_page(self, token: str) -> dict:
+        kind, *key, page = token.split(":")
+        if kind == "replies":
+            return self.replies_page(key[0], int(page))
+        if kind in ("top", "newest"):
+            return self.comments_page(kind, int(page))
+        return {"responseContext": {}}  # expired or unknown tokens
+
+    async def async_scrape(self, config: ScrapeConfig, loop=None) -> ScrapeApiResponse:
+        token = json.loads(config.body)["continuation"]
+        self.scraped.append(token)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+        if token in self.failing:
+            raise Exception(f"failed to scrape {token}")
+        return make_response(config.url, json.dumps(self.api_page(token)), method="POST", body=config.body)
+
+
+async def serial_comments(continuation_token: str, replies: bool = True) -> list:
+    """baseline: follow every top level page and then every reply thread one request at a time"""
+    comments = []
+    while continuation_token:
+        data = await youtube.scrape_comments_page(continuation_token)
+        for comment in data["comments"]:
+            comment["comment"]["parentId"] = None
+            comments.append(comment)
+            thread_id = comment["comment"]["id"]
+            reply_token = dict(data["replyTokens"]).get(thread_id) if replies else None
+            while reply_token:
+                thread = await youtube.scrape_comments_page(reply_token)
+                for reply in thread["comments"]:
+                    reply["comment"]["parentId"] = thread_id
+                comments.extend(thread["comments"])
+                reply_token = thread["continuationToken"]
+        continuation_token = data["continuationToken"]
+    return comments
+
+
+def _ids(comments: list) -> list:
+    return [comment["comment"]["id"] for comment in comments]
+
+
+def test_parse_comments_page_tokens(monkeypatch):
+    client = CommentsClient(pages=2, threads=3)
+    monkeypatch.setattr(youtube, "SCRAPFLY", client)
+    data = asyncio.run(youtube.scrape_comments_page("top:0"))
+    assert _ids(data["comments"]) == ["c0", "c1", "c2"]
+    assert data["continuationToken"] == "top:1"
+    assert data["replyTokens"] == [(f"c{i}", f"replies:c{i}:0") for i in range(3)]
+    assert data["sortTokens"] == {"top": "top:0", "newest": "newest:0"}
+    last = asyncio.run(youtube.scrape_comments_page("top:1"))
+    assert last["continuationToken"] is None and last["sortTokens"] == {}
+    thread = asyncio.run(youtube.scrape_comments_page("replies:c0:0"))
+    assert _ids(thread["comments"]) == ["c0.r0", "c0.r1", "c0.r2"]
+    assert thread["continuationToken"] == "replies:c0:1" and thread["replyTokens"] == []
+
+
+def test_crawl_matches_serial_order(monkeypatch):
+    monkeypatch.setattr(youtube, "SCRAPFLY", CommentsClient())
+    expected = asyncio.run(serial_comments("top:0"))
+    assert asyncio.run(youtube.crawl_comments("top:0", replies=True)) == expected
+    assert len(expected) == 20 + 20 * 6
+    top_level = asyncio.run(youtube.crawl_comments("top:0"))
+    assert top_level == asyncio.run(serial_comments("top:0", replies=False))
+    assert _ids(asyncio.run(youtube.crawl_comments("top:0", max_scrape_pages=2))) == _ids(top_level)[:10]
+
+
+def test_sort_orders_are_crawled_once(monkeypatch):
+    client = CommentsClient(pages=4, threads=5)
+    monkeypatch.setattr(youtube, "SCRAPFLY", client)
+    crawl = youtube.crawl_comments("top:0", max_scrape_pages=2, sorts=("top", "newest"), replies=True)
+    comments = asyncio.run(crawl)
+    top_level = [comment for comment in comments if comment["comment"]["parentId"] is None]
+    assert _ids(top_level) == [f"c{i}" for i in range(10)] + [f"c{i}" for i in range(19, 9, -1)]
+    assert sorted(token for token in client.scraped if not token.startswith("replies")) == sorted(
+        ["top:0", "top:1", "newest:0", "newest:1"]
+    )
+    # every thread is expanded once even when several sort orders list it
+    assert len([token for token in client.scraped if token.startswith("replies")]) == 20 * 2
+    client.scraped.clear()
+    newest = asyncio.run(youtube.crawl_comments("top:0", max_scrape_pages=1, sorts=("newest",)))
+    assert _ids(newest) == [f"c{i}" for i in range(19, 14, -1)]
+    assert client.scraped == ["top:0", "newest:0"]
+
+
+def test_reply_pages_are_bounded(monkeypatch):
+    client = CommentsClient(pages=4, threads=5)
+    monkeypatch.setattr(youtube, "SCRAPFLY", client)
+    # replies are opt-in so a page limit bounds the whole crawl by default
+    asyncio.run(youtube.crawl_comments("top:0", max_scrape_pages=2))
+    assert client.scraped == ["top:0", "top:1"]
+    client.scraped.clear()
+    comments = asyncio.run(youtube.crawl_comments("top:0", max_scrape_pages=2, replies=True, max_reply_pages=7))
+    assert len([token for token in client.scraped if token.startswith("replies")]) == 7
+    assert len(comments) == 10 + 7 * 3
+
+
+def test_failed_pages_are_skipped(monkeypatch):
+    client = CommentsClient(pages=4, threads=5, failing={"top:2", "replies:c0:1"})
+    monkeypatch.setattr(youtube, "SCRAPFLY", client)
+    comments = asyncio.run(youtube.crawl_comments("top:0", replies=True))
+    # the pages after a failed page are not reached, every other page is kept
+    top_level = [comment for comment in comments if comment["comment"]["parentId"] is None]
+    assert _ids(top_level) == [f"c{i}" for i in range(10)]
+    assert _ids(comments)[:4] == ["c0", "c0.r0", "c0.r1", "c0.r2"]
+    assert len(comments) == 10 + 10 * 6 - 3
+    client.failing.add("top:0")
+    with pytest.raises(Exception, match="top:0"):
+        asyncio.run(youtube.crawl_comments("top:0"))
+
+
+def test_frontier_is_bounded(monkeypatch):
+    client = CommentsClient(pages=3, threads=10, latency=0.005)
+    monkeypatch.setattr(youtube, "SCRAPFLY", client)
+    asyncio.run(youtube.crawl_comments("top:0", replies=True, concurrency=4))
+    assert client.max_in_flight == 4
+    assert len(client.scraped) == 3 + 30 * 2
+
+
+def test_cached_token_skips_video_page(monkeypatch, tmp_path):
+    monkeypatch.setattr(youtube, "SCRAPFLY", CommentsClient(pages=2))
+    video_pages = []
+
+    async def scrape_video(ids):
+        video_pages.extend(ids)
+        return [{"commentContinuationToken": "top:0"}]
+
+    monkeypatch.setattr(youtube, "scrape_video", scrape_video)
+    cache = youtube.CommentTokenCache(tmp_path / "tokens.json")
+    first = asyncio.run(youtube.scrape_comments("video", token_cache=cache))
+    assert asyncio.run(youtube.scrape_comments("video", token_cache=cache)) == first
+    # the token is persisted for the next run
+    persisted = youtube.CommentTokenCache(tmp_path / "tokens.json")
+    assert asyncio.run(youtube.scrape_comments("video", token_cache=persisted)) == first
+    assert video_pages == ["video"]
+    # stale tokens are replaced with a fresh one from the video page
+    cache.set("video", "expired:0")
+    assert asyncio.run(youtube.scrape_comments("video", token_cache=cache)) == first
+    assert video_pages == ["video", "video"] and cache.get("video") == "top:0"
+    # as are tokens past their TTL
+    now = time.time()
+    monkeypatch.setattr(youtube.time, "time", lambda: now + 2 * 24 * 60 * 60)
+    assert cache.get("video") is None
+
+
+def test_frontier_is_faster_than_serial_crawl(monkeypatch):
+    client = CommentsClient(pages=4, threads=5, reply_pages=2, latency=0.01)
+    monkeypatch.setattr(youtube, "SCRAPFLY", client)
+    start = time.perf_counter()
+    expected = asyncio.run(serial_comments("top:0"))
+    serial = time.perf_counter() - start
+    start = time.perf_counter()
+    assert asyncio.run(youtube.crawl_comments("top:0", replies=True, concurrency=8)) == expected
+    frontier = time.perf_counter() - start
+    assert frontier < serial / 2, f"frontier {frontier:.3f}s vs serial {serial:.3f}s"
+
+
+@pytest.mark.parametrize("crawl", ["serial", "frontier"])
+def test_bench_comment_crawl(benchmark, monkeypatch, crawl):
+    monkeypatch.setattr(youtube, "SCRAPFLY", CommentsClient(pages=4, threads=5, reply_pages=2, latency=0.01))
+    if crawl == "serial":
+        benchmark.pedantic(lambda: asyncio.run(serial_comments("top:0")), rounds=3)
+    else:
+        crawl = lambda: youtube.crawl_comments("top:0", replies=True, concurrency=8)  # noqa: E731
+        benchmark.pedantic(lambda: asyncio.run(crawl()), rounds=3)
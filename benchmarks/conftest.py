@@ -0,0 +1,43 @@
+import os
+
+import pytest
+from loguru import logger
+
+from measure import measure_allocations
+
+# scraper modules create their ScrapflyClient on import; replayed benchmarks never reach the API
+os.environ.setdefault("SCRAPFLY_KEY", "replay")
+# scrapers log every parsed page which would dominate parser timings
+logger.remove()
+
+
+@pytest.fixture
+def bench_pages(benchmark):
+    """
+    benchmark a page parsing callable: `bench_pages(parse, make_pages)` where make_pages() returns fresh pages
+    so every round pays for the full parse (ScrapeApiResponse caches its parsed selector).
+    Reports wall time through pytest-benchmark and allocations, pages/second in extra_info.
+    """
+
+    def run(parse, make_pages, rounds: int = 5):
+        pages = make_pages()
+        peak, blocks = measure_allocations(lambda: [parse(page) for page in pages])
+        benchmark.pedantic(
+            lambda pages: [parse(page) for page in pages],
+            setup=lambda: ((make_pages(),), {}),
+            rounds=rounds,
+            warmup_rounds=1,
+        )
+        # stats are missing when benchmarks only run as tests (--benchmark-disable)
+        mean = benchmark.stats.stats.mean if benchmark.stats else None
+        benchmark.extra_info.update(
+            {
+                "pages": len(pages),
+                "pages_per_second": round(len(pages) / mean, 2) if mean else None,
+                "peak_alloc_kib": round(peak / 1024, 1),
+                "allocated_blocks": blocks,
+            }
+        )
+        return benchmark.extra_info
+
+    return run
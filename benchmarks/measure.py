@@ -0,0 +1,27 @@
+"""helpers for measuring parser cost in benchmarks"""
+import time
+import tracemalloc
+
+
+def measure_allocations(func, *args, **kwargs):
+    """run function once under tracemalloc and return (peak bytes, allocated blocks)"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        func(*args, **kwargs)
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+    return peak, blocks
+
+
+def timed(func, *args, repeat: int = 3, **kwargs) -> float:
+    """best wall time in seconds of a few runs, for scaling comparisons within a single test"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best
@@ -0,0 +1,233 @@
+"""
+This is an offline replay harness for the scrapers in this repository.
+
+Scrape responses are recorded once from the live Scrapfly API into gzipped JSON fixtures
+and then replayed into the scrapers' parse_* functions with no network access.
+
+To record fixtures set env variable $SCRAPFLY_KEY with your scrapfly API key and run the scraper's run.py:
+$ export $SCRAPFLY_KEY="your key from https://scrapfly.io/dashboard"
+$ python replay.py record amazon
+"""
+import asyncio
+import base64
+import functools
+import gzip
+import hashlib
+import importlib
+import importlib.util
+import json
+import sys
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger as log
+from scrapfly import ScrapeApiResponse, ScrapeConfig, ScrapflyClient
+
+REPO = Path(__file__).parent.parent
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+class FixtureNotFound(KeyError):
+    """raised in replay mode when a scrape config has no recorded response"""
+
+
+def scraper_dir(name: str) -> Path:
+    """find scraper project directory, e.g. "amazon" -> ./amazon-scraper"""
+    for candidate in (REPO / f"{name}-scraper", REPO / f"{name.replace('_', '-')}-scraper"):
+        if candidate.is_dir():
+            return candidate
+    raise ValueError(f"no scraper directory found for {name}")
+
+
+def load_scraper(name: str):
+    """import scraper module of a given scraper project, e.g. "amazon" -> ./amazon-scraper/amazon.py"""
+    directory = scraper_dir(name)
+    modules = [path for path in directory.glob("*.py") if path.stem not in ("run", "test")]
+    if len(modules) != 1:
+        raise ValueError(f"expected a single scraper module in {directory}, found {[m.name for m in modules]}")
+    # scrapers import each other by bare module name (e.g. run.py does `import amazon`)
+    # so the project directory has to be importable
+    if str(directory) not in sys.path:
+        sys.path.insert(0, str(directory))
+    return importlib.import_module(modules[0].stem)
+
+
+def fixture_key(config: ScrapeConfig) -> str:
+    """unique fixture name for a scrape config; volatile options like session or cache are ignored"""
+    identity = [config.method, config.url, config.body, config.render_js, config.js, config.js_scenario]
+    return hashlib.sha1(json.dumps(identity, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _serialize(value):
+    """json default for the non-json types of a scrape api result"""
+    if isinstance(value, BytesIO):
+        return base64.b64encode(value.getvalue()).decode()
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    return dict(value)
+
+
+def build_response(config: ScrapeConfig, api_result: Dict) -> ScrapeApiResponse:
+    """construct a ScrapeApiResponse from recorded api result without any network"""
+    api_result = json.loads(json.dumps(api_result))  # fresh copy as responses cache parsed content
+    result = api_result.get("result") or {}
+    if result.get("format") == "binary" and isinstance(result.get("content"), str):
+        result["content"] = BytesIO(base64.b64decode(result["content"]))
+    return ScrapeApiResponse(request=None, response=None, scrape_config=config, api_result=api_result)
+
+
+def make_response(url: str, content: str, method: str = "GET", body: Optional[str] = None) -> ScrapeApiResponse:
+    """construct a ScrapeApiResponse for a generated page, e.g. for parser benchmarks"""
+    api_result = {
+        "config": {"url": url, "method": method, "headers": {}},
+        "context": {"url": url},
+        "result": {
+            "url": url,
+            "content": content,
+            "format": "text",
+            "status_code": 200,
+            "success": True,
+            "request_headers": {},
+            "response_headers": {"content-type": "text/html"},
+        },
+    }
+    config = ScrapeConfig(url, method=method, body=body)
+    return ScrapeApiResponse(request=None, response=None, scrape_config=config, api_result=api_result)
+
+
+class ReplayClient:
+    """
+    Drop-in replacement for ScrapflyClient that records responses to fixtures (mode="record")
+    or serves them from fixtures without network access (mode="replay").
+    """
+
+    def __init__(self, directory: Path, client: Optional[ScrapflyClient] = None, mode: str = "replay"):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"unknown replay mode: {mode}")
+        if mode == "record" and client is None:
+            raise ValueError("recording requires a live ScrapflyClient")
+        self.directory = Path(directory)
+        self.client = client
+        self.mode = mode
+        self.max_concurrency = client.max_concurrency if client else 1
+        self._recorded: Dict[int, Path] = {}  # id(response) -> fixture path for parser tracking
+
+    def _path(self, config: ScrapeConfig) -> Path:
+        return self.directory / f"{fixture_key(config)}.json.gz"
+
+    def _save(self, config: ScrapeConfig, response: ScrapeApiResponse):
+        path = self._path(config)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fixture = {
+            "config": {"url": config.url, "method": config.method, "body": config.body},
+            "result": response.result,
+            "parsers": [],
+        }
+        path.write_bytes(gzip.compress(json.dumps(fixture, default=_serialize).encode()))
+        self._recorded[id(response)] = path
+        log.debug(f"recorded {config.url} to {path.name}")
+
+    def _load(self, config: ScrapeConfig) -> ScrapeApiResponse:
+        path = self._path(config)
+        if not path.exists():
+            raise FixtureNotFound(f"no recorded response for {config.method} {config.url} ({path.name})")
+        fixture = json.loads(gzip.decompress(path.read_bytes()))
+        return build_response(config, fixture["result"])
+
+    def track_parser(self, response: ScrapeApiResponse, name: str, args: Tuple, kwargs: Dict):
+        """remember which parse function consumed a recorded response so it can be replayed later"""
+        path = self._recorded.get(id(response))
+        if path is None:
+            return
+        call = {"name": name, "args": list(args), "kwargs": kwargs}
+        try:
+            json.dumps(call)
+        except TypeError:
+            log.warning(f"{name} called with non-json arguments, it will be replayed without them")
+            call = {"name": name, "args": [], "kwargs": {}}
+        fixture = json.loads(gzip.decompress(path.read_bytes()))
+        if call not in fixture["parsers"]:
+            fixture["parsers"].append(call)
+            path.write_bytes(gzip.compress(json.dumps(fixture).encode()))
+
+    def scrape(self, scrape_config: ScrapeConfig) -> ScrapeApiResponse:
+        if self.mode == "replay":
+            return self._load(scrape_config)
+        response = self.client.scrape(scrape_config)
+        self._save(scrape_config, response)
+        return response
+
+    async def async_scrape(self, scrape_config: ScrapeConfig, loop=None) -> ScrapeApiResponse:
+        if self.mode == "replay":
+            return self._load(scrape_config)
+        response = await self.client.async_scrape(scrape_config, loop=loop)
+        self._save(scrape_config, response)
+        return response
+
+    async def concurrent_scrape(self, scrape_configs: List[ScrapeConfig], concurrency: Optional[int] = None):
+        # same contract as ScrapflyClient.concurrent_scrape: errors are yielded rather than raised
+        if self.mode == "replay":
+            for config in scrape_configs:
+                try:
+                    yield self._load(config)
+                except FixtureNotFound as e:
+                    yield e
+            return
+        async for response in self.client.concurrent_scrape(scrape_configs, concurrency=concurrency):
+            if isinstance(response, ScrapeApiResponse):
+                self._save(response.scrape_config, response)
+            yield response
+
+
+def _tracked(client: ReplayClient, name: str, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if args and isinstance(args[0], ScrapeApiResponse):
+            client.track_parser(args[0], name, args[1:], kwargs)
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def install(module, client: ReplayClient):
+    """swap every ScrapflyClient of a scraper module for the replay client and track its parse_* calls"""
+    for attr, value in list(vars(module).items()):
+        if isinstance(value, ScrapflyClient):
+            setattr(module, attr, client)
+        elif client.mode == "record" and attr.startswith("parse_") and callable(value):
+            setattr(module, attr, _tracked(client, attr, value))
+
+
+def load_fixtures(name: str) -> Dict[str, List[Tuple[Dict, Dict, Tuple]]]:
+    """group recorded api results of a scraper by the parse function that consumes them"""
+    grouped = {}
+    for path in sorted((FIXTURES / name).glob("*.json.gz")):
+        fixture = json.loads(gzip.decompress(path.read_bytes()))
+        for call in fixture["parsers"]:
+            grouped.setdefault(call["name"], []).append(
+                (fixture["config"], fixture["result"], (call["args"], call["kwargs"]))
+            )
+    return grouped
+
+
+def record(name: str):
+    """record fixtures by running the scraper's run.py example against the live API"""
+    module = load_scraper(name)
+    client = next(value for value in vars(module).values() if isinstance(value, ScrapflyClient))
+    install(module, ReplayClient(FIXTURES / name, client=client, mode="record"))
+    spec = importlib.util.spec_from_file_location(f"{name}_run", scraper_dir(name) / "run.py")
+    runner = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(runner)
+    result = runner.run()
+    if asyncio.iscoroutine(result):
+        asyncio.run(result)
+    log.success(f"recorded {len(list((FIXTURES / name).glob('*.json.gz')))} fixtures for {name}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "record":
+        print("usage: python replay.py record <scraper name> [<scraper name> ...]")
+        sys.exit(1)
+    for scraper in sys.argv[2:]:
+        record(scraper)
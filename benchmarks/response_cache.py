@@ -0,0 +1,219 @@
+"""
+This is a local on-disk response cache for the scrapers in this repository.
+
+Successful scrape responses are stored gzipped under a hash of their normalized ScrapeConfig so a changed parser
+can be re-run over an already scraped corpus at disk speed instead of paying for every page again.
+Entries expire after a TTL and the least recently used ones are evicted once the cache outgrows its size limit.
+
+To run a scraper's run.py through the cache set env variable $SCRAPFLY_KEY with your scrapfly API key:
+$ export $SCRAPFLY_KEY="your key from https://scrapfly.io/dashboard"
+$ python response_cache.py run amazon
+"""
+import asyncio
+import gzip
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+import time
+from datetime import timedelta
+from pathlib import Path
+from typing import List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from loguru import logger as log
+from scrapfly import ScrapeApiResponse, ScrapeConfig, ScrapflyClient
+
+from replay import _serialize, build_response, install, load_scraper, scraper_dir
+
+CACHE_DIR = Path(__file__).parent / ".response_cache"
+
+# scrape options that don't change the scraped page
+VOLATILE_PARAMS = {
+    "key",
+    "cache",
+    "cache_ttl",
+    "cache_clear",
+    "debug",
+    "tags",
+    "correlation_id",
+    "webhook_name",
+    "timeout",
+    "retry",
+    "session",
+    "session_sticky_proxy",
+    "cost_budget",
+}
+
+
+def normalize_url(url: str) -> str:
+    """lowercase scheme and host, sort query parameters and drop the fragment"""
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or "/", query, ""))
+
+
+def cache_key(config: ScrapeConfig) -> str:
+    """hash of the scrape options that affect the scraped page"""
+    params = {}
+    for name, value in config.to_api_params(key="").items():
+        if name in VOLATILE_PARAMS:
+            continue
+        if name.startswith("headers["):
+            name = name.lower()
+        params[name] = value
+    params["url"] = normalize_url(config.url)
+    identity = [config.method.upper(), config.body, sorted(params.items())]
+    return hashlib.sha256(json.dumps(identity, default=str).encode()).hexdigest()
+
+
+class ResponseCache:
+    """gzipped scrape responses on disk with TTL expiry and least recently used size eviction"""
+
+    def __init__(
+        self,
+        directory: Path = CACHE_DIR,
+        ttl: Optional[timedelta] = timedelta(days=7),
+        max_size: Optional[int] = 2 * 1024**3,
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_size = max_size
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0}
+        self.size = sum(path.stat().st_size for path in self.directory.glob("*.json.gz"))
+
+    def _path(self, config: ScrapeConfig) -> Path:
+        return self.directory / f"{cache_key(config)}.json.gz"
+
+    def _remove(self, path: Path):
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except FileNotFoundError:
+            return
+        self.size -= size
+
+    def get(self, config: ScrapeConfig) -> Optional[ScrapeApiResponse]:
+        """cached response of a scrape config or None when it's missing or expired"""
+        path = self._path(config)
+        try:
+            stored = json.loads(gzip.decompress(path.read_bytes()))
+        except (FileNotFoundError, EOFError, OSError, ValueError):
+            self.stats["misses"] += 1
+            return None
+        if self.ttl is not None and time.time() - stored["stored_at"] > self.ttl.total_seconds():
+            self._remove(path)
+            self.stats["expired"] += 1
+            self.stats["misses"] += 1
+            return None
+        # the file's modification time tracks last use for eviction
+        os.utime(path)
+        self.stats["hits"] += 1
+        return build_response(config, stored["result"])
+
+    def put(self, config: ScrapeConfig, response: ScrapeApiResponse):
+        """store a successful scrape response, failed ones are always scraped again"""
+        result = response.scrape_result or {}
+        if not result.get("success") or result.get("status_code", 200) >= 400:
+            return
+        path = self._path(config)
+        stored = {"stored_at": time.time(), "result": response.result}
+        data = gzip.compress(json.dumps(stored, default=_serialize).encode())
+        self._remove(path)
+        # write and rename so concurrent readers never see a partial entry
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        tmp.replace(path)
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """drop expired entries and then the least recently used ones until the cache fits its size limit"""
+        entries = []
+        for path in self.directory.glob("*.json.gz"):
+            try:
+                entries.append((path.stat().st_mtime, path))
+            except FileNotFoundError:
+                continue
+        entries.sort()
+        if self.ttl is not None:
+            cutoff = time.time() - self.ttl.total_seconds()
+            # stored_at is only ever older than the last use so entries unused for a whole TTL have expired
+            while entries and entries[0][0] < cutoff:
+                self._remove(entries.pop(0)[1])
+                self.stats["expired"] += 1
+        while entries and self.max_size is not None and self.size > self.max_size:
+            self._remove(entries.pop(0)[1])
+            self.stats["evicted"] += 1
+
+    def clear(self):
+        for path in self.directory.glob("*.json.gz"):
+            self._remove(path)
+
+
+class CachingClient:
+    """Drop-in replacement for ScrapflyClient that serves responses from a ResponseCache and stores new ones"""
+
+    def __init__(self, client: ScrapflyClient, cache: ResponseCache):
+        self.client = client
+        self.cache = cache
+        self.max_concurrency = client.max_concurrency
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def scrape(self, scrape_config: ScrapeConfig) -> ScrapeApiResponse:
+        response = self.cache.get(scrape_config)
+        if response is None:
+            response = self.client.scrape(scrape_config)
+            self.cache.put(scrape_config, response)
+        return response
+
+    async def async_scrape(self, scrape_config: ScrapeConfig, loop=None) -> ScrapeApiResponse:
+        response = self.cache.get(scrape_config)
+        if response is None:
+            response = await self.client.async_scrape(scrape_config, loop=loop)
+            self.cache.put(scrape_config, response)
+        return response
+
+    async def concurrent_scrape(self, scrape_configs: List[ScrapeConfig], concurrency: Optional[int] = None):
+        # cached responses are yielded right away and only the misses are scraped
+        misses = []
+        for config in scrape_configs:
+            response = self.cache.get(config)
+            if response is None:
+                misses.append(config)
+            else:
+                yield response
+        if not misses:
+            return
+        async for response in self.client.concurrent_scrape(misses, concurrency=concurrency):
+            if isinstance(response, ScrapeApiResponse):
+                self.cache.put(response.scrape_config, response)
+            yield response
+
+
+def run(name: str, cache: ResponseCache):
+    """run the scraper's run.py example with every response served from or stored to the cache"""
+    module = load_scraper(name)
+    client = next(value for value in vars(module).values() if isinstance(value, ScrapflyClient))
+    install(module, CachingClient(client, cache))
+    spec = importlib.util.spec_from_file_location(f"{name}_run", scraper_dir(name) / "run.py")
+    runner = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(runner)
+    result = runner.run()
+    if asyncio.iscoroutine(result):
+        asyncio.run(result)
+    log.success(f"ran {name} through the response cache: {cache.stats}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "run":
+        print("usage: python response_cache.py run <scraper name> [<scraper name> ...]")
+        sys.exit(1)
+    response_cache = ResponseCache()
+    for scraper in sys.argv[2:]:
+        run(scraper, response_cache)
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+from scrapfly import ScrapeApiResponse, ScrapeConfig
+
+import replay
+
+PAGE = "<html><body><div class='item'>first</div><div class='item'>second</div></body></html>"
+
+
+class FakeClient:
+    """stand-in for a live ScrapflyClient that answers every url with the same page"""
+
+    max_concurrency = 2
+
+    def __init__(self):
+        self.calls = 0
+
+    def _response(self, config: ScrapeConfig) -> ScrapeApiResponse:
+        self.calls += 1
+        return replay.make_response(config.url, PAGE, method=config.method, body=config.body)
+
+    def scrape(self, config):
+        return self._response(config)
+
+    async def async_scrape(self, config, loop=None):
+        return self._response(config)
+
+    async def concurrent_scrape(self, configs, concurrency=None):
+        for config in configs:
+            yield self._response(config)
+
+
+class FakeScraper:
+    """minimal scraper module shape: module level client and parse_* functions"""
+
+    @staticmethod
+    def parse_items(response: ScrapeApiResponse, limit: int = 10):
+        return response.selector.css(".item::text").getall()[:limit]
+
+
+def test_record_and_replay(tmp_path):
+    live = FakeClient()
+    recorder = replay.ReplayClient(tmp_path, client=live, mode="record")
+    configs = [ScrapeConfig("https://example.com/1"), ScrapeConfig("https://example.com/2", method="POST", body="q")]
+
+    async def run(client):
+        first = await client.async_scrape(configs[0])
+        rest = [response async for response in client.concurrent_scrape(configs[1:])]
+        return [first, *rest]
+
+    recorded = asyncio.run(run(recorder))
+    assert live.calls == 2
+    assert len(list(tmp_path.glob("*.json.gz"))) == 2
+
+    replayed = asyncio.run(run(replay.ReplayClient(tmp_path)))
+    assert live.calls == 2  # replay never reaches the client
+    assert [r.context["url"] for r in replayed] == [r.context["url"] for r in recorded]
+    assert replayed[0].selector.css(".item::text").getall() == ["first", "second"]
+
+
+def test_replay_missing_fixture(tmp_path):
+    client = replay.ReplayClient(tmp_path)
+    with pytest.raises(replay.FixtureNotFound):
+        client.scrape(ScrapeConfig("https://example.com/missing"))
+
+    async def run():
+        return [response async for response in client.concurrent_scrape([ScrapeConfig("https://example.com/missing")])]
+
+    assert isinstance(asyncio.run(run())[0], replay.FixtureNotFound)
+
+
+def test_parser_tracking(tmp_path, monkeypatch):
+    monkeypatch.setattr(replay, "FIXTURES", tmp_path)
+    recorder = replay.ReplayClient(tmp_path / "fake", client=FakeClient(), mode="record")
+    parse_items = replay._tracked(recorder, "parse_items", FakeScraper.parse_items)
+
+    response = recorder.scrape(ScrapeConfig("https://example.com/1"))
+    assert parse_items(response, 1) == ["first"]
+
+    grouped = replay.load_fixtures("fake")
+    assert list(grouped) == ["parse_items"]
+    config, result, (args, kwargs) = grouped["parse_items"][0]
+    assert config["url"] == "https://example.com/1"
+    assert args == [1]
@@ -9,8 +9,9 @@ import os
 import gzip
 import json
 import jmespath
-from typing import Dict, List, Union
-from parsel import Selector
+from io import BytesIO
+from typing import IO, Dict, Iterator, List, Optional, Tuple, Union
+from lxml import etree
 from urllib.parse import urlencode, quote_plus
 from loguru import logger as log
 from scrapfly import ScrapeConfig, ScrapflyClient, ScrapeApiResponse
@@ -27,17 +28,33 @@ BASE_CONFIG = {
 }
 
 
+def iter_sitemap(stream: IO[bytes]) -> Iterator[Tuple[str, Optional[str]]]:
+    """
+    stream (loc, lastmod) entries of a sitemap or sitemap index from a plain or gzipped xml byte stream.
+    The xml is parsed incrementally and every parsed entry is dropped from the tree so memory use stays
+    constant regardless of sitemap size.
+    """
+    if stream.read(2) == b"\x1f\x8b":
+        stream.seek(0)
+        stream = gzip.GzipFile(fileobj=stream)
+    else:
+        stream.seek(0)
+    for _, node in etree.iterparse(stream, events=("end",), tag=("{*}url", "{*}sitemap")):
+        loc = node.findtext("{*}loc")
+        lastmod = node.findtext("{*}lastmod")
+        node.clear()
+        while node.getprevious() is not None:
+            del node.getparent()[0]
+        if loc:
+            yield loc.strip(), lastmod.strip() if lastmod else None
+
+
 def parse_sitemaps(response: ScrapeApiResponse) -> List[str]:
     """parse links for bestbuy sitemap"""
-    # decode the .gz file
+    # the .gz file is decoded while parsing
     content = response.scrape_result["content"]
-    bytes_data = content.read() if hasattr(content, "read") else content.encode("latin1")
-    xml = str(gzip.decompress(bytes_data), "utf-8")
-    selector = Selector(xml)
-    data = []
-    for url in selector.xpath("//url/loc/text()"):
-        data.append(url.get())
-    return data
+    stream = content if hasattr(content, "read") else BytesIO(content.encode("latin1"))
+    return [loc for loc, _ in iter_sitemap(stream)]
 
 
 async def scrape_sitemaps(url: str) -> List[str]:
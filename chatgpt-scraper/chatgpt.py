@@ -8,13 +8,22 @@ $ export $SCRAPFLY_KEY="your key from https://scrapfly.io/dashboard"
 import os
 import json
 import time
+import asyncio
+import codecs
 from pathlib import Path
 from urllib.parse import quote_plus
 from uuid import uuid4
-from typing import Dict, List, Optional, TypedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, TypedDict, Union
 
 from loguru import logger as log
-from scrapfly import ScrapeConfig, ScrapflyClient
+from scrapfly import (
+    ScrapeConfig,
+    ScrapflyAspError,
+    ScrapflyClient,
+    ScrapflyProxyError,
+    ScrapflySessionError,
+    UpstreamHttpClientError,
+)
 
 
 SCRAPFLY = ScrapflyClient(key=os.environ["SCRAPFLY_KEY"])
@@ -107,93 +116,160 @@ async def scrape_conversation(prompt: str) -> str:
     return response.content
 
 
-def parse_chatgpt_stream(raw_sse: str) -> Dict:
-    """Parse a ChatGPT SSE stream body into structured messages JSON object.
+class ChatgptStreamParser:
+    """Incremental parser for ChatGPT SSE streams that takes raw byte chunks as they arrive.
 
     ChatGPT SSE events come in three shapes (besides "input_message"):
       1. "v={"message": {...}}" - seed/finalization of a message object.
       2. "v=[{p, o, v}, ...]"  - list of JSON-Patch-like operations.
       3. "v="text"" with sticky "p"/"o" inherited from the previous event.
+
+    Partial lines and multi-byte characters are carried over between chunks, appended text is kept in
+    per-message lists that are only joined by result() and every parsed event is emitted as a message event:
+      {"type": "message", "id", "role"}   - a message was seeded or finalized
+      {"type": "delta", "id", "content"}  - text appended to a message
+      {"type": "final", "id"}             - the answer's last assistant message, the parent of a follow-up prompt
+      {"type": "done"}                    - end of the stream
     """
-    messages: Dict[str, dict] = {}
-    conversation_id: Optional[str] = None
-    current_id: Optional[str] = None
-    last_o: Optional[str] = None
-    last_p: Optional[str] = None
 
-    def store(msg: dict) -> Optional[str]:
+    def __init__(self):
+        self.messages: Dict[str, dict] = {}
+        self.conversation_id: Optional[str] = None
+        self.final_message_id: Optional[str] = None
+        self.done = False
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._partial: List[str] = []
+        self._current_id: Optional[str] = None
+        self._last_o: Optional[str] = None
+        self._last_p: Optional[str] = None
+
+    def feed(self, chunk: Union[bytes, str]) -> Iterator[Dict]:
+        """parse the complete lines of a chunk, lazily yielding their events"""
+        text = chunk if isinstance(chunk, str) else self._decoder.decode(chunk)
+        lines = text.split("\n")
+        if len(lines) > 1:
+            # the line left over from previous chunks ends in this one
+            lines[0] = "".join(self._partial) + lines[0]
+            self._partial = []
+        self._partial.append(lines.pop())
+        for line in lines:
+            if self.done:
+                return
+            yield from self._parse_line(line)
+
+    def close(self) -> Iterator[Dict]:
+        """parse the stream's last line and finish the stream"""
+        yield from self.feed(self._decoder.decode(b"", final=True) + "\n")
+        if not self.done:
+            self.done = True
+            yield from self._finalize()
+            yield {"type": "done"}
+
+    def parse(self, chunks: Iterable[Union[bytes, str]]) -> Iterator[Dict]:
+        """events of a whole stream: feed every chunk and close it"""
+        for chunk in chunks:
+            yield from self.feed(chunk)
+        yield from self.close()
+
+    def result(self) -> Dict:
+        result_messages: List[ChatgptMessage] = []
+        for message in self.messages.values():
+            content = "".join(message["parts"])
+            if message["role"] and content:
+                result_messages.append({"role": message["role"], "content": content})
+        return {
+            "conversation_id": self.conversation_id,
+            "parent_message_id": self._last_assistant_id(),
+            "messages": result_messages,
+        }
+
+    def _last_assistant_id(self) -> Optional[str]:
+        return next(
+            (mid for mid, m in reversed(self.messages.items()) if m["role"] == "assistant"),
+            None,
+        )
+
+    def _finalize(self) -> Iterator[Dict]:
+        if self.final_message_id is None:
+            self.final_message_id = self._last_assistant_id()
+            if self.final_message_id:
+                yield {"type": "final", "id": self.final_message_id}
+
+    def _store(self, msg: dict) -> Iterator[Dict]:
         msg_id = msg.get("id")
         if not msg_id:
-            return None
+            return
+        role = msg.get("author", {}).get("role", "")
         parts = msg.get("content", {}).get("parts") or [""]
-        messages[msg_id] = {
-            "role": msg.get("author", {}).get("role", ""),
-            "content": parts[0] if isinstance(parts[0], str) else "",
-        }
-        return msg_id
+        self.messages[msg_id] = {"role": role, "parts": [parts[0] if isinstance(parts[0], str) else ""]}
+        self._current_id = msg_id
+        yield {"type": "message", "id": msg_id, "role": role}
+        if role == "assistant" and msg.get("end_turn"):
+            yield from self._finalize()
 
-    def append(path: Optional[str], op: Optional[str], val) -> None:
+    def _patch(self, path: Optional[str], op: Optional[str], val) -> Iterator[Dict]:
         if (
             op == "append"
             and isinstance(val, str)
             and path
             and "content/parts/0" in path
-            and current_id in messages
+            and self._current_id in self.messages
         ):
-            messages[current_id]["content"] += val
+            self.messages[self._current_id]["parts"].append(val)
+            yield {"type": "delta", "id": self._current_id, "content": val}
+        elif path == "/message/end_turn" and op == "replace" and val is True:
+            yield from self._finalize()
 
-    for line in raw_sse.splitlines():
+    def _parse_line(self, line: str) -> Iterator[Dict]:
         line = line.strip()
         if not line.startswith("data:"):
-            continue
+            return
         raw = line[len("data:") :].strip()
         if raw == "[DONE]":
-            break
+            self.done = True
+            yield from self._finalize()
+            yield {"type": "done"}
+            return
         try:
             data = json.loads(raw)
         except json.JSONDecodeError:
-            continue
+            return
         if not isinstance(data, dict):
-            continue
+            return
 
         if data.get("type") == "input_message":
-            current_id = store(data.get("input_message", {})) or current_id
-            conversation_id = conversation_id or data.get("conversation_id")
-            continue
+            yield from self._store(data.get("input_message", {}))
+            self.conversation_id = self.conversation_id or data.get("conversation_id")
+            return
+        if data.get("type") == "message_stream_complete":
+            yield from self._finalize()
+            return
 
         # Inherit sticky path/op when the event omits them.
-        last_o = data.get("o", last_o)
-        last_p = data.get("p", last_p)
+        self._last_o = data.get("o", self._last_o)
+        self._last_p = data.get("p", self._last_p)
         v = data.get("v")
 
         if isinstance(v, dict) and "message" in v:
-            current_id = store(v["message"]) or current_id
-            conversation_id = (
-                conversation_id
+            yield from self._store(v["message"])
+            self.conversation_id = (
+                self.conversation_id
                 or v.get("conversation_id")
                 or v["message"].get("metadata", {}).get("conversation_id")
             )
         elif isinstance(v, list):
             for patch in v:
-                append(patch.get("p"), patch.get("o"), patch.get("v"))
+                yield from self._patch(patch.get("p"), patch.get("o"), patch.get("v"))
         else:
-            append(last_p, last_o, v)
+            yield from self._patch(self._last_p, self._last_o, v)
 
-    parent_message_id = next(
-        (mid for mid, m in reversed(messages.items()) if m["role"] == "assistant"),
-        None,
-    )
-    result_messages: List[ChatgptMessage] = [
-        {"role": m["role"], "content": m["content"]}
-        for m in messages.values()
-        if m["role"] and m["content"]
-    ]
 
-    return {
-        "conversation_id": conversation_id,
-        "parent_message_id": parent_message_id,
-        "messages": result_messages,
-    }
+def parse_chatgpt_stream(raw_sse: Union[bytes, str]) -> Dict:
+    """Parse a ChatGPT SSE stream body into structured messages JSON object."""
+    parser = ChatgptStreamParser()
+    for _ in parser.parse([raw_sse]):
+        pass
+    return parser.result()
 
 
 def _build_post_request(
@@ -222,10 +298,111 @@ def _build_post_request(
     }
 
 
-async def scrape_conversations(prompt: List[str]) -> List[ChatgptConversation]:
+async def _send_prompt(
+    prompt: str,
+    conversation_id: str,
+    parent_message_id: str,
+    original_body: dict,
+    headers: dict,
+    session: str,
+) -> asyncio.Task:
+    """Start a follow-up prompt POST request in the background and return its task."""
+    post_request = _build_post_request(prompt, conversation_id, parent_message_id, original_body, headers)
+    task = asyncio.ensure_future(
+        SCRAPFLY.async_scrape(
+            ScrapeConfig(
+                url="https://chatgpt.com/backend-anon/conversation",
+                session=session,
+                method="POST",
+                body=json.dumps(post_request["body"]),
+                headers=post_request["headers"],
+                **BASE_CONFIG,
+            )
+        )
+    )
+    # let the request start so it's in flight while the rest of the previous answer is parsed
+    await asyncio.sleep(0)
+    return task
+
+
+class SessionPool:
+    """
+    Scrapfly sessions shared by many jobs instead of a new session for every job:
+    - a session runs one job at a time and at most `max_sessions` sessions are open, further jobs wait for a
+      free session
+    - sessions are retired when a job on them gets blocked or after `max_uses` jobs, blocked jobs are retried
+      on another session up to `retries` times
+    """
+
+    def __init__(self, prefix: str, max_sessions: int = 5, max_uses: int = 50, retries: int = 1):
+        self.prefix = prefix
+        self.max_sessions = max_sessions
+        self.max_uses = max_uses
+        self.retries = retries
+        self.sessions: List[Dict[str, Any]] = []
+        self._waiters: List[asyncio.Future] = []
+
+    @staticmethod
+    def is_blocked(error: Exception) -> bool:
+        """errors that mean the session is no longer usable on the target"""
+        if isinstance(error, (ScrapflyAspError, ScrapflyProxyError, ScrapflySessionError)):
+            return True
+        return isinstance(error, UpstreamHttpClientError) and error.http_status_code in (403, 429)
+
+    async def _acquire(self) -> Dict[str, Any]:
+        while True:
+            free = [session for session in self.sessions if not session["busy"]]
+            if free:
+                session = free[0]
+                break
+            if len(self.sessions) < self.max_sessions:
+                session = {"id": f"{self.prefix}-{uuid4().hex}", "busy": False, "uses": 0}
+                self.sessions.append(session)
+                break
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+        session["busy"] = True
+        session["uses"] += 1
+        return session
+
+    def _release(self, session: Dict[str, Any]):
+        session["busy"] = False
+        if session["uses"] >= self.max_uses:
+            self._retire(session)
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _retire(self, session: Dict[str, Any]):
+        if session in self.sessions:
+            self.sessions.remove(session)
+
+    async def run(self, job: Callable[[str], Awaitable[Any]]) -> Any:
+        """run job(session_id) on a pooled session and return its result"""
+        for attempt in range(self.retries + 1):
+            session = await self._acquire()
+            try:
+                return await job(session["id"])
+            except Exception as e:
+                if not self.is_blocked(e):
+                    raise
+                self._retire(session)
+                if attempt == self.retries:
+                    raise
+                log.warning(f"session {session['id']} got blocked, retrying on another session: {e!r}")
+            finally:
+                self._release(session)
+
+
+# conversations reuse warmed sessions, one conversation at a time on each as its prompts follow each other
+SESSION_POOL = SessionPool("chatgpt")
+
+
+async def _scrape_conversations(session: str, prompt: List[str]) -> List[ChatgptConversation]:
     prompt_index = 0
     url = f"https://chatgpt.com/?prompt={quote_plus(prompt[prompt_index])}"
-    session = "chatgpt-" + str(uuid4()).replace("-", "")
     conversations: List[ChatgptConversation] = []
     response = await SCRAPFLY.async_scrape(
         ScrapeConfig(
@@ -251,48 +428,62 @@ async def scrape_conversations(prompt: List[str]) -> List[ChatgptConversation]:
         if not xhr.get("response"):
             continue
 
-        # Parse initial GET SSE stream
-        parsed = parse_chatgpt_stream(xhr["response"]["body"])
-        conversation_id = parsed.get("conversation_id")
-        parent_message_id = parsed.get("parent_message_id")
-
-        if conversation_id:
-            conversations.append(
-                {
-                    "conversation_id": conversation_id,
-                    "messages": parsed.get("messages", []),
-                }
-            )
-
         original_body = json.loads(xhr["body"])
         headers = xhr.get("headers", {}).copy()
-
-        while prompt_index < len(prompt) - 1:
-            prompt_index += 1
-            post_request = _build_post_request(
-                prompt[prompt_index],
-                conversation_id,
-                parent_message_id,
-                original_body,
-                headers,
-            )
-            post_response = await SCRAPFLY.async_scrape(
-                ScrapeConfig(
-                    url="https://chatgpt.com/backend-anon/conversation",
-                    session=session,
-                    method="POST",
-                    body=json.dumps(post_request["body"]),
-                    headers=post_request["headers"],
-                    **BASE_CONFIG,
+        conversation_id = None
+        parent_message_id = None
+
+        # Parse initial GET SSE stream, then the POST SSE response of every follow-up prompt
+        stream = xhr["response"]["body"]
+        initial = True
+        while stream is not None:
+            parser = ChatgptStreamParser()
+            follow_up = None
+            for event in parser.parse([stream]):
+                # the next prompt only needs the answer's final message id, send it before the rest is parsed
+                if event["type"] == "final" and prompt_index < len(prompt) - 1:
+                    follow_up = await _send_prompt(
+                        prompt[prompt_index + 1],
+                        conversation_id or parser.conversation_id,
+                        event["id"],
+                        original_body,
+                        headers,
+                        session,
+                    )
+            parsed = parser.result()
+
+            if initial:
+                conversation_id = parsed.get("conversation_id")
+                if conversation_id:
+                    conversations.append(
+                        {
+                            "conversation_id": conversation_id,
+                            "messages": parsed.get("messages", []),
+                        }
+                    )
+            elif conversations and parsed.get("messages"):
+                conversations[-1]["messages"].extend(parsed["messages"])
+            if parsed.get("parent_message_id"):
+                parent_message_id = parsed["parent_message_id"]
+
+            if follow_up is None and prompt_index < len(prompt) - 1:
+                # the answer had no assistant message, continue from the last known one
+                follow_up = await _send_prompt(
+                    prompt[prompt_index + 1],
+                    conversation_id,
+                    parent_message_id,
+                    original_body,
+                    headers,
+                    session,
                 )
-            )
+            stream = None
+            if follow_up is not None:
+                prompt_index += 1
+                stream = (await follow_up).content
+            initial = False
 
-            # Parse POST SSE response and update state for next iteration
-            post_parsed = parse_chatgpt_stream(post_response.content)
-            if post_parsed.get("parent_message_id"):
-                parent_message_id = post_parsed["parent_message_id"]
+    return conversations
 
-            if conversations and post_parsed.get("messages"):
-                conversations[-1]["messages"].extend(post_parsed["messages"])
 
-    return conversations
+async def scrape_conversations(prompt: List[str]) -> List[ChatgptConversation]:
+    return await SESSION_POOL.run(lambda session: _scrape_conversations(session, prompt))
@@ -6,13 +6,19 @@ To run this scraper set env variable $SCRAPFLY_KEY with your scrapfly API key:
 $ export $SCRAPFLY_KEY="your key from https://scrapfly.io/dashboard"
 """
 from datetime import datetime
+import asyncio
 import gzip
 import json
 import os
+import random
+import time
 import jmespath
 
-from parsel import Selector
-from typing import Dict, Iterator, List, Literal, Tuple, TypedDict
+from io import BytesIO
+from lxml import etree
+from pathlib import Path
+from typing import IO, Any, Awaitable, Callable, Dict, Iterator, List, Literal, Optional, Tuple, TypedDict
+from urllib.parse import urlparse
 
 from loguru import logger as log
 from scrapfly import ScrapeApiResponse, ScrapeConfig, ScrapflyClient
@@ -27,6 +33,146 @@ BASE_CONFIG = {
 }
 
 
+class CircuitOpenError(Exception):
+    """raised instead of scraping while the circuit breaker of the target domain is open"""
+
+
+class Resilience:
+    """
+    Retry layer around ScrapflyClient.async_scrape that keeps per-domain state shared by every coroutine:
+    - retry budget: a domain holds up to `retry_budget` retry tokens, every first attempt earns `budget_ratio`
+      of a token and every retry spends one, so a target that starts blocking can't make every caller retry at once
+    - decorrelated jitter backoff between the retries of a request
+    - circuit breaker: `failure_threshold` consecutive failures open the domain's circuit and requests fail fast
+      with CircuitOpenError for `reset_timeout` seconds, after which a single trial request closes or reopens it
+    Per-domain counters are available from metrics().
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 3,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        retry_budget: int = 10,
+        budget_ratio: float = 0.2,
+        failure_threshold: int = 5,
+        reset_timeout: float = 60.0,
+        timeout: Optional[float] = None,
+    ):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_budget = retry_budget
+        self.budget_ratio = budget_ratio
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.timeout = timeout
+        self.domains: Dict[str, Dict[str, Any]] = {}
+
+    def _domain(self, url: str) -> Dict[str, Any]:
+        domain = urlparse(url).netloc
+        if domain not in self.domains:
+            self.domains[domain] = {
+                "state": "closed",
+                "opened_at": 0.0,
+                "trial": False,
+                "consecutive_failures": 0,
+                "tokens": float(self.retry_budget),
+                "requests": 0,
+                "successes": 0,
+                "failures": 0,
+                "retries": 0,
+                "budget_exhausted": 0,
+                "short_circuited": 0,
+                "circuit_opened": 0,
+            }
+        return self.domains[domain]
+
+    def delay(self, previous: float) -> float:
+        """decorrelated jitter: anywhere between the base delay and three times the previous delay"""
+        return min(self.max_delay, random.uniform(self.base_delay, previous * 3))
+
+    def _allow(self, stats: Dict[str, Any]) -> bool:
+        if stats["state"] == "open":
+            if time.monotonic() - stats["opened_at"] < self.reset_timeout:
+                return False
+            stats["state"] = "half_open"
+        if stats["state"] == "half_open":
+            if stats["trial"]:
+                return False
+            stats["trial"] = True
+        return True
+
+    def _record(self, domain: str, stats: Dict[str, Any], success: bool):
+        stats["trial"] = False
+        if success:
+            stats["successes"] += 1
+            stats["consecutive_failures"] = 0
+            stats["state"] = "closed"
+            return
+        stats["failures"] += 1
+        stats["consecutive_failures"] += 1
+        if stats["state"] == "half_open" or stats["consecutive_failures"] >= self.failure_threshold:
+            if stats["state"] != "open":
+                log.warning(f"opening the circuit breaker of {domain} after {stats['consecutive_failures']} failures")
+                stats["circuit_opened"] += 1
+            stats["state"] = "open"
+            stats["opened_at"] = time.monotonic()
+
+    async def run(
+        self,
+        config: ScrapeConfig,
+        scrape: Callable[[ScrapeConfig], Awaitable[ScrapeApiResponse]],
+        parse: Optional[Callable[[ScrapeApiResponse], Any]] = None,
+    ) -> Any:
+        """
+        scrape a config and return the response, or parse(response) when given. Failures of either are retried
+        within the domain's budget, the last error is raised once retries run out
+        """
+        domain = urlparse(config.url).netloc
+        stats = self._domain(config.url)
+        stats["tokens"] = min(self.retry_budget, stats["tokens"] + self.budget_ratio)
+        delay = self.base_delay
+        for attempt in range(self.max_retries + 1):
+            if not self._allow(stats):
+                stats["short_circuited"] += 1
+                raise CircuitOpenError(f"the circuit breaker of {domain} is open, not scraping {config.url}")
+            stats["requests"] += 1
+            try:
+                response = await asyncio.wait_for(scrape(config), self.timeout)
+                result = parse(response) if parse else response
+            except asyncio.CancelledError:
+                stats["trial"] = False
+                raise
+            except Exception as e:
+                self._record(domain, stats, success=False)
+                if attempt == self.max_retries:
+                    raise
+                if stats["tokens"] < 1:
+                    stats["budget_exhausted"] += 1
+                    log.warning(f"the retry budget of {domain} is exhausted, not retrying {config.url}")
+                    raise
+                stats["tokens"] -= 1
+                stats["retries"] += 1
+                delay = self.delay(delay)
+                log.debug(f"retrying {config.url} in {delay:.1f} seconds: {e!r}")
+                await asyncio.sleep(delay)
+            else:
+                self._record(domain, stats, success=True)
+                return result
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        """request, retry and circuit breaker counters of every domain"""
+        hidden = ("opened_at", "trial")
+        return {
+            domain: {key: value for key, value in stats.items() if key not in hidden}
+            for domain, stats in self.domains.items()
+        }
+
+
+RESILIENCE = Resilience()
+
+
 class CompanyData(TypedDict):
     """Type hint for data returned by Crunchbase company page parser"""
 
@@ -56,28 +202,18 @@ def parse_company(result: ScrapeApiResponse) -> CompanyData:
     }
 
 
-async def scrape_company(url: str, _retries: int = 0) -> CompanyData:
+async def scrape_company(url: str) -> CompanyData:
     """scrape crunchbase company page for organization and employee data"""
     # note: we use /people tab because it contains the most data:
     log.info(f"scraping company: {url}")
-    try:    
-        result = await SCRAPFLY.async_scrape(ScrapeConfig(url, **BASE_CONFIG))
-    except:
-        while _retries <= 2:
-            log.debug("retrying failed request")
-            return await scrape_company(url, _retries=_retries + 1)
+    result = await RESILIENCE.run(ScrapeConfig(url, **BASE_CONFIG), SCRAPFLY.async_scrape)
     return parse_company(result)
 
 
-async def scrape_person(url: str, _retries: int = 0) -> Dict:
+async def scrape_person(url: str) -> Dict:
     log.info(f"scraping person: {url}")
-    try:
-        result = await SCRAPFLY.async_scrape(ScrapeConfig(url, **BASE_CONFIG))
-    except:
-        while _retries <= 2:
-            log.debug("retrying failed request")
-            return await scrape_person(url, _retries=_retries + 1)
-    return parse_person(result)            
+    result = await RESILIENCE.run(ScrapeConfig(url, **BASE_CONFIG), SCRAPFLY.async_scrape)
+    return parse_person(result)
 
 
 def parse_person(result: ScrapeApiResponse) -> Dict:
@@ -91,45 +227,100 @@ def parse_person(result: ScrapeApiResponse) -> Dict:
     return _reduce_person_dataset(dataset)
 
 
-async def _scrape_sitemap_index() -> List[str]:
-    """scrape Crunchbase Sitemap index for all sitemap urls"""
+async def _scrape_sitemap_index() -> Dict[str, Optional[str]]:
+    """scrape Crunchbase Sitemap index for all sitemap urls and their last modification times"""
     log.info("scraping sitemap index for sitemap urls")
     result = await SCRAPFLY.async_scrape(
         ScrapeConfig("https://www.crunchbase.com/www-sitemaps/sitemap-index.xml", **BASE_CONFIG)
     )
-    urls = result.selector.xpath("//sitemap/loc/text()").getall()
-    log.info(f"found {len(urls)} sitemaps")
-    return urls
+    content = result.scrape_result["content"]
+    stream = content if hasattr(content, "read") else BytesIO(content.encode())
+    sitemaps = dict(iter_sitemap(stream))
+    log.info(f"found {len(sitemaps)} sitemaps")
+    return sitemaps
+
+
+def iter_sitemap(stream: IO[bytes]) -> Iterator[Tuple[str, Optional[str]]]:
+    """
+    stream (loc, lastmod) entries of a sitemap or sitemap index from a plain or gzipped xml byte stream.
+    The xml is parsed incrementally and every parsed entry is dropped from the tree so memory use stays
+    constant regardless of sitemap size.
+    """
+    if stream.read(2) == b"\x1f\x8b":
+        stream.seek(0)
+        stream = gzip.GzipFile(fileobj=stream)
+    else:
+        stream.seek(0)
+    for _, node in etree.iterparse(stream, events=("end",), tag=("{*}url", "{*}sitemap")):
+        loc = node.findtext("{*}loc")
+        lastmod = node.findtext("{*}lastmod")
+        node.clear()
+        while node.getprevious() is not None:
+            del node.getparent()[0]
+        if loc:
+            yield loc.strip(), lastmod.strip() if lastmod else None
 
 
 def parse_sitemap(result: ScrapeApiResponse) -> Iterator[Tuple[str, datetime]]:
     """parse sitemap for location urls and their last modification times"""
-    sel = Selector(text=gzip.decompress(result.content.read()).decode())
-    urls = sel.xpath("//url")
-    log.info(f"found {len(urls)} in sitemap {result.context['url']}")
-    for url_node in urls:
-        url = url_node.xpath("loc/text()").get()
-        last_modified = datetime.fromisoformat(url_node.xpath("lastmod/text()").get().strip("Z"))
-        yield url, last_modified
+    count = 0
+    for url, last_modified in iter_sitemap(result.content):
+        count += 1
+        yield url, datetime.fromisoformat(last_modified.strip("Z"))
+    log.info(f"found {count} in sitemap {result.context['url']}")
 
 
-async def discover_target(target: Literal["organizations", "people"], min_last_modified=None):
+def _load_checkpoints(path: Optional[Path]) -> Dict[str, str]:
+    if not path or not path.exists():
+        return {}
+    return json.loads(path.read_text())
+
+
+def _save_checkpoints(path: Optional[Path], checkpoints: Dict[str, str]):
+    if not path:
+        return
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(checkpoints, indent=2))
+    tmp.replace(path)
+
+
+async def discover_target(
+    target: Literal["organizations", "people"],
+    min_last_modified=None,
+    checkpoint: Optional[Path] = None,
+    concurrency: int = 5,
+):
     """
     discover all crunchbase urls for a given target (organizations or people)
     using crunchbase sitemaps.
-    
-    The min_last_modified field can be used to discover only recently updated targets
+
+    The min_last_modified field can be used to discover only recently updated targets.
+    The checkpoint file keeps the lastmod value of every fully discovered sitemap so
+    later runs only scrape sitemaps that changed since.
     """
-    sitemap_urls = await _scrape_sitemap_index()
-    urls = [url for url in sitemap_urls if target in url]
-    log.info(f"found {len(urls)} matching sitemap urls (from total of {len(sitemap_urls)})")
-    for url in urls:
-        log.info(f"scraping sitemap: {url}")
-        result = await SCRAPFLY.async_scrape(ScrapeConfig(url, **BASE_CONFIG))
+    sitemaps = await _scrape_sitemap_index()
+    matching = {url: lastmod for url, lastmod in sitemaps.items() if target in url}
+    log.info(f"found {len(matching)} matching sitemap urls (from total of {len(sitemaps)})")
+    checkpoints = _load_checkpoints(checkpoint)
+    changed = [url for url, lastmod in matching.items() if not lastmod or checkpoints.get(url) != lastmod]
+    if len(changed) < len(matching):
+        log.info(f"skipping {len(matching) - len(changed)} sitemaps unchanged since last checkpoint")
+
+    to_scrape = [ScrapeConfig(url, **BASE_CONFIG) for url in changed]
+    async for result in SCRAPFLY.concurrent_scrape(to_scrape, concurrency=concurrency):
+        if not isinstance(result, ScrapeApiResponse):
+            log.error(f"failed to scrape sitemap: {result}")
+            continue
+        sitemap_url = result.scrape_config.url
+        log.info(f"scraped sitemap: {sitemap_url}")
         for url, mod_time in parse_sitemap(result):
             if min_last_modified and mod_time < min_last_modified:
                 continue  # skip
             yield url
+        # only checkpoint sitemaps that were fully consumed
+        if matching[sitemap_url]:
+            checkpoints[sitemap_url] = matching[sitemap_url]
+            _save_checkpoints(checkpoint, checkpoints)
 
 
 def _reduce_organization_dataset(data: Dict) -> Dict:
@@ -11,11 +11,11 @@ import math
 import os
 import re
 from collections import defaultdict
-from typing import Dict, List, Optional
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
 from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
 
 import dateutil
-from nested_lookup import nested_lookup
+from itertools import repeat
 from loguru import logger as log
 from scrapfly import ScrapeApiResponse, ScrapeConfig, ScrapflyClient, ScrapflyScrapeError
 
@@ -29,19 +29,58 @@ BASE_CONFIG = {
 }
 
 
-def _find_json_objects(text: str, decoder=json.JSONDecoder()):
-    """Find JSON objects in text, and generate decoded JSON data"""
-    pos = 0
-    while True:
-        match = text.find("{", pos)
-        if match == -1:
-            break
-        try:
-            result, index = decoder.raw_decode(text[match:])
-            yield result
-            pos = match + index
-        except ValueError:
-            pos = match + 1
+class JsonScanner:
+    """
+    Decodes the JSON objects embedded in page scripts in place with the C decoder, without copying the rest of
+    the script for every attempted brace.
+    """
+
+    # a JSON object can only start with "{" followed by a quoted key or "}" - this skips js blocks like "{if(a)"
+    # which would otherwise each cost a failed decode
+    OBJECT_START = re.compile(r'\{\s*["}]')
+
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+
+    def objects(self, text: str) -> Iterator[Any]:
+        """decode every JSON object in text, e.g. a script mixing javascript and JSON data"""
+        pos = 0
+        while match := self.OBJECT_START.search(text, pos):
+            try:
+                # decode in place: slicing text[match:] would copy the rest of the script for every attempt
+                data, pos = self.decoder.raw_decode(text, match.start())
+            except ValueError:
+                pos = match.start() + 1
+                continue
+            yield data
+
+
+JSON_SCANNER = JsonScanner()
+
+
+def iter_lookup(key: str, document: Any) -> Iterator[Any]:
+    """
+    yield values of `key` anywhere in a nested JSON document in the same depth-first order as nested_lookup.
+    The document is walked lazily so taking only the first few matches doesn't scan the whole tree.
+    """
+    stack = [iter(((None, document),))]
+    while stack:
+        for name, value in stack[-1]:
+            if name == key:
+                yield value
+            if isinstance(value, dict):
+                stack.append(iter(value.items()))
+                break
+            if isinstance(value, list):
+                stack.append(zip(repeat(None), value))
+                break
+        else:
+            stack.pop()
+
+
+def find_first(key: str, document: Any, default: Any = None) -> Any:
+    """first value of `key` in a nested JSON document, the walk stops at the first match"""
+    return next(iter_lookup(key, document), default)
 
 
 def parse_variants(result: ScrapeApiResponse) -> dict:
@@ -52,11 +91,10 @@ def parse_variants(result: ScrapeApiResponse) -> dict:
     script = result.selector.xpath('//script[contains(., "MSKU")]/text()').get()
     if not script:
         return []
-    all_data = list(_find_json_objects(script))
-    msku_data = nested_lookup("MSKU", all_data)
-    if not msku_data:
+    all_data = list(JSON_SCANNER.objects(script))
+    data = find_first("MSKU", all_data)
+    if data is None:
         return []  # No variants found for this product
-    data = msku_data[0]
 
     # First retrieve names for all selection options (e.g. Model, Color)
     selection_names = {}
@@ -100,7 +138,7 @@ def parse_variants(result: ScrapeApiResponse) -> dict:
     
     # Finally, extract variants and apply selection details to each
     results = []
-    variant_data = nested_lookup("variationsMap", data)[0]
+    variant_data = find_first("variationsMap", data)
     for id_, variant in variant_data.items():
         item: dict = {"id": id_}
         for selection in selections:
@@ -235,12 +273,13 @@ def _update_url_param(url: str, **params):
     return urlunparse(updated_url)
 
 
-async def scrape_search(url: str, max_pages: Optional[int] = None) -> List[Dict]:
-    """Scrape Ebay's search for product preview data for given"""
+async def iter_search(url: str, max_pages: Optional[int] = None) -> AsyncIterator[Dict]:
+    """Scrape Ebay's search and yield product previews as soon as each page is parsed"""
     log.info("Scraping search for {}", url)
 
     first_page = await SCRAPFLY.async_scrape(ScrapeConfig(url, **BASE_CONFIG))
-    results = parse_search(first_page)
+    for preview in parse_search(first_page):
+        yield preview
     # find total amount of results for concurrent pagination
     total_results = first_page.selector.css(".srp-controls__count-heading>span::text").get()
     total_results = int(total_results.replace(",", "").replace(".", ""))
@@ -256,9 +295,16 @@ async def scrape_search(url: str, max_pages: Optional[int] = None) -> List[Dict]
     async for result in SCRAPFLY.concurrent_scrape(other_pages):
         if not isinstance(result, ScrapflyScrapeError):
             try:
-                results.extend(parse_search(result))
+                previews = parse_search(result)
             except Exception as e:
                 log.error(f"failed to parse search: {result.context['url']}: {e}")
+                continue
+            for preview in previews:
+                yield preview
         else:
             log.error(f"failed to scrape {result.api_response.config['url']}, got: {result.message}")
-    return results
+
+
+async def scrape_search(url: str, max_pages: Optional[int] = None) -> List[Dict]:
+    """Scrape Ebay's search for product preview data for given"""
+    return [preview async for preview in iter_search(url, max_pages=max_pages)]
@@ -9,8 +9,11 @@ import os
 import math
 import json
 from scrapfly import ScrapeConfig, ScrapflyClient, ScrapeApiResponse
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple, Union
 from loguru import logger as log
+from lxml import etree
+from parsel import Selector, SelectorList
+from parsel.csstranslator import HTMLTranslator
 
 SCRAPFLY = ScrapflyClient(key=os.environ["SCRAPFLY_KEY"])
 
@@ -22,6 +25,61 @@ BASE_CONFIG = {
 }
 
 
+class CompiledSelectors:
+    """
+    Registry of compiled selectors for hot parse loops: CSS queries are translated to XPath once and every
+    XPath is compiled once, rather than on every .css()/.xpath() call. get()/getall() also return
+    string results directly instead of wrapping every match in a Selector.
+    """
+
+    namespaces = {"re": "http://exslt.org/regular-expressions"}
+
+    def __init__(self):
+        self.compiled: Dict[Tuple[str, bool], etree.XPath] = {}
+        self.translator = HTMLTranslator()
+
+    def compile(self, query: str, css: bool = False) -> etree.XPath:
+        compiled = self.compiled.get((query, css))
+        if compiled is None:
+            xpath = self.translator.css_to_xpath(query) if css else query
+            compiled = etree.XPath(xpath, namespaces=self.namespaces, smart_strings=False)
+            self.compiled[(query, css)] = compiled
+        return compiled
+
+    def _evaluate(self, selector: Union[Selector, SelectorList], query: str, css: bool) -> list:
+        compiled = self.compile(query, css)
+        nodes = []
+        for item in selector if isinstance(selector, SelectorList) else [selector]:
+            result = compiled(item.root)
+            nodes.extend(result if isinstance(result, list) else [result])
+        return nodes
+
+    @staticmethod
+    def _wrap(node) -> Selector:
+        return Selector(root=node, type="html")
+
+    def select(self, selector: Union[Selector, SelectorList], query: str, css: bool = False) -> SelectorList:
+        """same as selector.xpath(query) or selector.css(query)"""
+        return SelectorList(self._wrap(node) for node in self._evaluate(selector, query, css))
+
+    def get(
+        self, selector: Union[Selector, SelectorList], query: str, default: Optional[str] = None, css: bool = False
+    ) -> Optional[str]:
+        """same as selector.xpath(query).get(default) or selector.css(query).get(default)"""
+        for node in self._evaluate(selector, query, css):
+            return node if isinstance(node, str) else self._wrap(node).get()
+        return default
+
+    def getall(self, selector: Union[Selector, SelectorList], query: str, css: bool = False) -> List[str]:
+        """same as selector.xpath(query).getall() or selector.css(query).getall()"""
+        nodes = self._evaluate(selector, query, css)
+        return [node if isinstance(node, str) else self._wrap(node).get() for node in nodes]
+
+
+SELECTORS = CompiledSelectors()
+SEARCH_PRODUCT_XPATH = "//div[@data-search-results-lg]/ul/li[div[@data-appears-component-name]]"
+
+
 def strip_text(text):
     """remove extra spaces while handling None values"""
     if text != None:
@@ -33,14 +91,14 @@ def parse_search(response: ScrapeApiResponse) -> Dict:
     """parse data from Etsy search pages"""
     selector = response.selector
     data = []
-    script = json.loads(selector.xpath("//script[@type='application/ld+json']/text()").get())
+    script = json.loads(SELECTORS.get(selector, "//script[@type='application/ld+json']/text()"))
     # get the total number of pages
     total_listings = script["numberOfItems"]
     total_pages = math.ceil(total_listings / 48)
-    for product in selector.xpath("//div[@data-search-results-lg]/ul/li[div[@data-appears-component-name]]"):
-        link = product.xpath(".//a[contains(@class, 'v2-listing-card')]/@href").get()
-        rate = product.xpath(".//span[contains(@class, 'review_stars')]/span/text()").get()
-        number_of_reviews = strip_text(product.xpath(".//div[contains(@aria-label,'star rating')]/p/text()").get())
+    for product in SELECTORS.select(selector, SEARCH_PRODUCT_XPATH):
+        link = SELECTORS.get(product, ".//a[contains(@class, 'v2-listing-card')]/@href")
+        rate = SELECTORS.get(product, ".//span[contains(@class, 'review_stars')]/span/text()")
+        number_of_reviews = strip_text(SELECTORS.get(product, ".//div[contains(@aria-label,'star rating')]/p/text()"))
         if number_of_reviews:
             number_of_reviews = number_of_reviews.replace("(", "").replace(")", "")
             number_of_reviews = (
@@ -48,26 +106,28 @@ def parse_search(response: ScrapeApiResponse) -> Dict:
                 if "k" in number_of_reviews
                 else number_of_reviews
             )
-        price = product.xpath(".//span[@class='currency-value']/text()").get()
-        original_price = product.xpath(".//span[contains(text(),'Original Price')]/text()").get()
-        discount = strip_text(product.xpath(".//span[contains(text(),'off')]/text()").get())
-        seller = product.xpath(".//span[contains(text(),'From shop')]/text()").get()
-        currency = product.xpath(".//span[@class='currency-symbol']/text()").get()
+        price = SELECTORS.get(product, ".//span[@class='currency-value']/text()")
+        original_price = SELECTORS.get(product, ".//span[contains(text(),'Original Price')]/text()")
+        discount = strip_text(SELECTORS.get(product, ".//span[contains(text(),'off')]/text()"))
+        seller = SELECTORS.get(product, ".//span[contains(text(),'From shop')]/text()")
+        currency = SELECTORS.get(product, ".//span[@class='currency-symbol']/text()")
         data.append(
             {
                 "productLink": "/".join(link.split("/")[:5]) if link else None,
                 "productTitle": strip_text(
-                    product.xpath(".//h3[contains(@class, 'v2-listing-card__titl')]/@title").get()
+                    SELECTORS.get(product, ".//h3[contains(@class, 'v2-listing-card__titl')]/@title")
                 ),
-                "productImage": product.xpath("//img[@data-listing-card-listing-image]/@src").get(),
+                "productImage": SELECTORS.get(product, ".//img[@data-listing-card-listing-image]/@src"),
                 "seller": seller.replace("From shop ", "") if seller else None,
                 "listingType": (
-                    "Paid listing" if product.xpath(".//span[@data-ad-label='Ad by Etsy seller']") else "Free listing"
+                    "Paid listing"
+                    if SELECTORS.select(product, ".//span[@data-ad-label='Ad by Etsy seller']")
+                    else "Free listing"
                 ),
                 "productRate": float(rate.strip()) if rate else None,
                 "numberOfReviews": int(number_of_reviews) if number_of_reviews else None,
                 "freeShipping": (
-                    "Yes" if product.xpath(".//span[contains(text(),'Free shipping')]/text()").get() else "No"
+                    "Yes" if SELECTORS.get(product, ".//span[contains(text(),'Free shipping')]/text()") else "No"
                 ),
                 "productPrice": float(price.replace(",", "")) if price else None,
                 "priceCurrency": currency,
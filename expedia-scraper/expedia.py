@@ -4,7 +4,9 @@ This is an example web scraper for expedia.com.
 To run this scraper set env variable $SCRAPFLY_KEY with your scrapfly API key:
 $ export SCRAPFLY_KEY="your key from https://scrapfly.io/dashboard"
 """
+import asyncio
 import json
+import math
 import os
 import re
 from datetime import datetime, timezone
@@ -232,8 +234,17 @@ def parse_flights(page_data: List[Dict], origin: str, destination: str, cabin_cl
 
 
 async def scrape_hotel_search(
-    destination: str, check_in: str, check_out: str, adults: int = 2, max_pages: int = 3
+    destination: str,
+    check_in: str,
+    check_out: str,
+    adults: int = 2,
+    max_pages: int = 3,
+    parallel_pages: bool = False,
 ) -> List[Hotel]:
+    """
+    scrape hotel search results page by page, or with parallel_pages request every page after the first
+    concurrently within the search's session
+    """
     session = f"expedia-{uuid.uuid4().hex}"
     captured_at = datetime.now(timezone.utc).isoformat()
 
@@ -252,6 +263,28 @@ async def scrape_hotel_search(
     page_data = json.loads(captured_call["response"]["body"])
     hotels = parse_hotels(page_data, captured_at)
 
+    if parallel_pages and _has_next_page(page_data, "hotel") and max_pages > 1:
+        # the offsets of the remaining pages are known up front, request them all at once on the captured session
+        total = (page_data["data"]["propertySearch"].get("summary") or {}).get("matchedPropertiesSize")
+        last_page = min(max_pages, math.ceil(total / PAGE_SIZE)) if total else max_pages
+        responses = await asyncio.gather(*(
+            SCRAPFLY.async_scrape(build_next_page_config(captured_call, session, page * PAGE_SIZE, PAGE_SIZE, "hotel"))
+            for page in range(1, last_page)
+        ), return_exceptions=True)
+        # gather keeps the page order, pages past the last one with results are dropped
+        fetched = 1
+        for page, response in enumerate(responses, start=2):
+            if isinstance(response, Exception):
+                log.error(f"expedia: failed to fetch page {page}/{last_page}: {response!r}")
+                continue
+            fetched += 1
+            page_data = json.loads(response.content)
+            hotels.extend(parse_hotels(page_data, captured_at))
+            if not _has_next_page(page_data, "hotel"):
+                break
+        log.info(f"expedia: fetched {fetched} pages at once ({len(hotels)} hotels)")
+        return hotels
+
     page = 1
     next_start_index = PAGE_SIZE
     while _has_next_page(page_data, "hotel") and page < max_pages:
@@ -9,7 +9,8 @@ from enum import Enum
 import json
 import os
 import re
-from typing import Dict, List, Optional, Tuple, TypedDict
+from collections.abc import Mapping, Sequence
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple, TypedDict, Union
 from urllib.parse import urljoin
 
 from loguru import logger as log
@@ -25,45 +26,179 @@ BASE_CONFIG = {
 }
 
 
-def find_hidden_data(result: ScrapeApiResponse) -> Optional[dict]:
+# orjson or msgspec decode large hidden web data several times faster than the json module when installed
+try:
+    import orjson
+
+    _fast_json_loads, _FAST_JSON_ERRORS = orjson.loads, (orjson.JSONDecodeError,)
+except ImportError:
+    try:
+        import msgspec
+
+        _fast_json_loads, _FAST_JSON_ERRORS = msgspec.json.decode, (msgspec.DecodeError,)
+    except ImportError:
+        _fast_json_loads, _FAST_JSON_ERRORS = None, ()
+
+
+def json_loads(data: Union[str, bytes]) -> Any:
+    """
+    decode JSON with the fastest available backend. Documents the fast decoders reject (e.g. NaN values)
+    are decoded again with json.loads so errors match it. Note that integers over 64 bits decode as floats with orjson.
+    """
+    if _fast_json_loads is not None:
+        try:
+            return _fast_json_loads(data)
+        except _FAST_JSON_ERRORS:
+            pass
+    return json.loads(data)
+
+
+class ApolloGraph:
+    """
+    Resolver for Apollo GraphQL caches where nodes reference each other by key, e.g. {"__ref": "Employer:123"}
+    or {"type": "id", "id": "Startup:1"}: `reference(value)` returns the key a value references and the optional
+    `unwrap(key, node)` transforms referenced nodes before they are resolved.
+    Every referenced node is resolved only once and the result is shared by all of its references, so resolved
+    values are shared objects and must be copied before they are modified.
+    Cyclic references are left unresolved at the point where the cycle closes.
+    """
+
+    def __init__(self, graph: Dict, reference: Callable[[Any], Optional[str]], unwrap: Optional[Callable] = None):
+        self.graph = graph
+        self.reference = reference  # returns graph key if value is a reference
+        self.unwrap = unwrap  # optional transformation of referenced (key, node)
+        self._resolved = {}
+        self._resolving = {}  # key -> depth of references being resolved
+        self._cycle_depth = float("inf")
+        self._lazy = {}
+
+    def resolve(self, value):
+        """expand all references of a value"""
+        if isinstance(value, (LazyApolloNode, LazyApolloList)):
+            value = value.data
+        key = self.reference(value)
+        if key is not None:
+            return self._resolve_reference(key, value)
+        if isinstance(value, dict):
+            return {k: self.resolve(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.resolve(v) for v in value]
+        return value
+
+    def _resolve_reference(self, key: str, reference):
+        if key in self._resolved:
+            return self._resolved[key]
+        if key not in self.graph:
+            return reference  # dangling reference
+        if key in self._resolving:
+            # cycle: keep the reference and remember how far up the resolution stack it points
+            self._cycle_depth = min(self._cycle_depth, self._resolving[key])
+            return reference
+        depth = self._resolving[key] = len(self._resolving)
+        outer_cycle_depth, self._cycle_depth = self._cycle_depth, depth
+        try:
+            node = self.graph[key]
+            resolved = self.resolve(self.unwrap(key, node) if self.unwrap else node)
+        finally:
+            del self._resolving[key]
+        # nodes that cut a cycle through one of their ancestors are only valid in this context
+        if self._cycle_depth >= depth:
+            self._resolved[key] = resolved
+        self._cycle_depth = min(outer_cycle_depth, self._cycle_depth)
+        return resolved
+
+    def lazy(self, value):
+        """wrap a value so its references are only expanded when accessed"""
+        key = self.reference(value)
+        if key is not None:
+            if key not in self.graph:
+                return value
+            if key not in self._lazy:
+                node = self.graph[key]
+                self._lazy[key] = self.lazy(self.unwrap(key, node) if self.unwrap else node)
+            return self._lazy[key]
+        if isinstance(value, dict):
+            return LazyApolloNode(self, value)
+        if isinstance(value, list):
+            return LazyApolloList(self, value)
+        return value
+
+
+class LazyApolloNode(Mapping):
+    """read-only view of an Apollo graph node that resolves references on access"""
+
+    def __init__(self, graph: ApolloGraph, data: Dict):
+        self.graph = graph
+        self.data = data
+        self._values = {}
+
+    def __getitem__(self, key):
+        if key not in self._values:
+            self._values[key] = self.graph.lazy(self.data[key])
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def resolve(self) -> Dict:
+        """fully expanded plain dict"""
+        return self.graph.resolve(self.data)
+
+
+class LazyApolloList(Sequence):
+    """read-only view of an Apollo graph list that resolves references on access"""
+
+    def __init__(self, graph: ApolloGraph, data: List):
+        self.graph = graph
+        self.data = data
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.graph.lazy(value) for value in self.data[index]]
+        return self.graph.lazy(self.data[index])
+
+    def __len__(self):
+        return len(self.data)
+
+    def resolve(self) -> List:
+        """fully expanded plain list"""
+        return self.graph.resolve(self.data)
+
+
+def _apollo_reference(value) -> Optional[str]:
+    """Glassdoor's Apollo cache references look like {"__ref": "Employer:123"}"""
+    if isinstance(value, dict) and "__ref" in value:
+        return value["__ref"]
+    return None
+
+
+def find_hidden_data(result: ScrapeApiResponse, lazy: bool = False) -> Optional[dict]:
     """
     Extract hidden web cache (Apollo Graphql framework) from Glassdoor page HTML
     It's either in NEXT_DATA script or direct apolloState js variable
+    Glassdoor uses Apollo GraphQL client and the dataset is a graph of references which are unpacked
+    to actual values. With lazy=True references are only unpacked when accessed.
     """
     # data can be in __NEXT_DATA__ cache
     data = result.selector.css("script#__NEXT_DATA__::text").get()
     if data:
-        data = json.loads(data)["props"]["pageProps"]["apolloCache"]
+        data = json_loads(data)["props"]["pageProps"]["apolloCache"]
     else:
         match = re.search(r'apolloState":\s*({.+})};', result.content)
         if match:
-            data = json.loads(match.group(1))
+            data = json_loads(match.group(1))
         else:
             log.warning(f"Could not find __NEXT_DATA__ or apolloState on page {result.context['url']}")
             return None
 
-    def _unpack_apollo_data(apollo_data):
-        """
-        Glassdoor uses Apollo GraphQL client and the dataset is a graph of references.
-        This function unpacks the __ref references to actual values.
-        """
-
-        def resolve_refs(data, root):
-            if isinstance(data, dict):
-                if "__ref" in data:
-                    return resolve_refs(root[data["__ref"]], root)
-                else:
-                    return {k: resolve_refs(v, root) for k, v in data.items()}
-            elif isinstance(data, list):
-                return [resolve_refs(i, root) for i in data]
-            else:
-                return data
-
-        if not apollo_data:
-            return {}
-        return resolve_refs(apollo_data.get("ROOT_QUERY") or apollo_data, apollo_data)
-
-    return _unpack_apollo_data(data)
+    if not data:
+        return {}
+    graph = ApolloGraph(data, reference=_apollo_reference)
+    root = data.get("ROOT_QUERY") or data
+    return graph.lazy(root) if lazy else graph.resolve(root)
 
 
 def parse_jobs(result: ScrapeApiResponse) -> Tuple[List[Dict], List[str]]:
@@ -82,7 +217,7 @@ def parse_jobs(result: ScrapeApiResponse) -> Tuple[List[Dict], List[str]]:
     script_data = selector.xpath("//script[contains(text(), 'paginationLinks')]/text()").get()
     pagination_links = re.search(r'\\"paginationLinks\\":\s*(\[.*?\])\s*,\s*\\"searchResultsMetadata\\"', script_data).group(1)
     unescaped = pagination_links.replace('\\"', '"').replace('\\u0026', '&')
-    pagination_links = json.loads(unescaped)
+    pagination_links = json_loads(unescaped)
     
     other_pages = [
         urljoin(result.context["url"], page["urlLink"])
@@ -93,12 +228,14 @@ def parse_jobs(result: ScrapeApiResponse) -> Tuple[List[Dict], List[str]]:
     return job_data, other_pages
 
 
-async def scrape_jobs(url: str, max_pages: Optional[int] = None) -> List[Dict]:
-    """Scrape Glassdoor job listing page for job listings (with pagination)"""
+async def iter_jobs(url: str, max_pages: Optional[int] = None) -> AsyncIterator[Dict]:
+    """Scrape Glassdoor job listing pages and yield job listings as soon as each page is parsed"""
     log.info("scraping job listings from {}", url)
     first_page = await SCRAPFLY.async_scrape(ScrapeConfig(url, **BASE_CONFIG))
 
     jobs, other_page_urls = parse_jobs(first_page)
+    for job in jobs:
+        yield job
     _total_pages = len(other_page_urls) + 1
     if max_pages and _total_pages > max_pages:
         other_page_urls = other_page_urls[:max_pages]
@@ -107,27 +244,34 @@ async def scrape_jobs(url: str, max_pages: Optional[int] = None) -> List[Dict]:
     other_pages = [ScrapeConfig(url, **BASE_CONFIG) for url in other_page_urls]
     async for result in SCRAPFLY.concurrent_scrape(other_pages):
         if not isinstance(result, ScrapflyScrapeError):
-            jobs.extend(parse_jobs(result)[0])
+            for job in parse_jobs(result)[0]:
+                yield job
         else:
             log.error(f"failed to scrape {result.api_response.config['url']}, got: {result.message}")
-    log.info("scraped {} jobs from {} in {} pages", len(jobs), url, _total_pages)
+
+
+async def scrape_jobs(url: str, max_pages: Optional[int] = None) -> List[Dict]:
+    """Scrape Glassdoor job listing page for job listings (with pagination)"""
+    jobs = [job async for job in iter_jobs(url, max_pages=max_pages)]
+    log.info("scraped {} jobs from {}", len(jobs), url)
     return jobs
 
 
 def parse_reviews(result: ScrapeApiResponse) -> Dict:
     """parse Glassdoor reviews page for review data"""
-    cache = find_hidden_data(result)
+    cache = find_hidden_data(result, lazy=True)
     if not cache:
         return {}
-    reviews_data = next((v for k, v in cache.items() if k.startswith("employerReviewsRG")), {})
-    return reviews_data
+    # only the reviews entry of the cache is expanded
+    reviews_data = next((v for k, v in cache.items() if k.startswith("employerReviewsRG")), None)
+    return cache.graph.resolve(reviews_data) if reviews_data is not None else {}
 
 
 def parse_reviews_api_metadata(result: ScrapeApiResponse) -> Dict:
     """parse Glassdoor reviews api metadata from html page"""
     selector = result.selector
     script_data = selector.xpath("//script[contains(text(), 'profileId')]/text()").get()
-    employer_metadata = json.loads(re.search(r'"employer"\s*:\s*(\{[^}]+\})', script_data).group(1))
+    employer_metadata = json_loads(re.search(r'"employer"\s*:\s*(\{[^}]+\})', script_data).group(1))
     return {
         'employer_id': int(employer_metadata['id']),
         'dynamic_profile_id': int(employer_metadata['profileId']),
@@ -183,7 +327,7 @@ async def scrape_reviews(url: str, max_pages: Optional[int] = None) -> Dict:
     first_api_page = await SCRAPFLY.async_scrape(
         generate_api_request_config(employer_metadata['employer_id'], employer_metadata['dynamic_profile_id'], 1)
     )
-    first_page_data = json.loads(first_api_page.content)
+    first_page_data = json_loads(first_api_page.content)
     review_data.extend(first_page_data['data']['employerReviews']['reviews'])
     total_pages = first_page_data['data']['employerReviews']['numberOfPages']
 
@@ -197,7 +341,7 @@ async def scrape_reviews(url: str, max_pages: Optional[int] = None) -> Dict:
     ]
 
     async for result in SCRAPFLY.concurrent_scrape(remaining_pages):
-        page_data = json.loads(result.content)
+        page_data = json_loads(result.content)
         review_data.extend(page_data['data']['employerReviews']['reviews'])
 
     log.info("scraped {} reviews from {} in {} pages", len(review_data), url, total_pages)
@@ -324,7 +468,7 @@ async def find_companies(query: str) -> List[FoundCompany]:
             **BASE_CONFIG,
         )
     )
-    data = json.loads(result.content)
+    data = json_loads(result.content)
     companies = []
     for result in data:
         companies.append(
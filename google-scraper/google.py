@@ -10,7 +10,10 @@ import operator
 from datetime import datetime, timezone
 from urllib.parse import quote
 from loguru import logger as log
-from typing import Dict, List, TypedDict
+from typing import Dict, List, Optional, Tuple, TypedDict, Union
+from lxml import etree
+from parsel import Selector, SelectorList
+from parsel.csstranslator import HTMLTranslator
 from scrapfly import ScrapeConfig, ScrapflyClient, ScrapeApiResponse
 
 
@@ -25,6 +28,60 @@ BASE_CONFIG = {
 }
 
 
+class CompiledSelectors:
+    """
+    Registry of compiled selectors for hot parse loops: CSS queries are translated to XPath once and every
+    XPath is compiled once, rather than on every .css()/.xpath() call. get()/getall() also return
+    string results directly instead of wrapping every match in a Selector.
+    """
+
+    namespaces = {"re": "http://exslt.org/regular-expressions"}
+
+    def __init__(self):
+        self.compiled: Dict[Tuple[str, bool], etree.XPath] = {}
+        self.translator = HTMLTranslator()
+
+    def compile(self, query: str, css: bool = False) -> etree.XPath:
+        compiled = self.compiled.get((query, css))
+        if compiled is None:
+            xpath = self.translator.css_to_xpath(query) if css else query
+            compiled = etree.XPath(xpath, namespaces=self.namespaces, smart_strings=False)
+            self.compiled[(query, css)] = compiled
+        return compiled
+
+    def _evaluate(self, selector: Union[Selector, SelectorList], query: str, css: bool) -> list:
+        compiled = self.compile(query, css)
+        nodes = []
+        for item in selector if isinstance(selector, SelectorList) else [selector]:
+            result = compiled(item.root)
+            nodes.extend(result if isinstance(result, list) else [result])
+        return nodes
+
+    @staticmethod
+    def _wrap(node) -> Selector:
+        return Selector(root=node, type="html")
+
+    def select(self, selector: Union[Selector, SelectorList], query: str, css: bool = False) -> SelectorList:
+        """same as selector.xpath(query) or selector.css(query)"""
+        return SelectorList(self._wrap(node) for node in self._evaluate(selector, query, css))
+
+    def get(
+        self, selector: Union[Selector, SelectorList], query: str, default: Optional[str] = None, css: bool = False
+    ) -> Optional[str]:
+        """same as selector.xpath(query).get(default) or selector.css(query).get(default)"""
+        for node in self._evaluate(selector, query, css):
+            return node if isinstance(node, str) else self._wrap(node).get()
+        return default
+
+    def getall(self, selector: Union[Selector, SelectorList], query: str, css: bool = False) -> List[str]:
+        """same as selector.xpath(query).getall() or selector.css(query).getall()"""
+        nodes = self._evaluate(selector, query, css)
+        return [node if isinstance(node, str) else self._wrap(node).get() for node in nodes]
+
+
+SELECTORS = CompiledSelectors()
+
+
 class NoResults(Exception):
     "Raised when requesting pagination without results"
     pass
@@ -221,7 +278,7 @@ def parse_serp(response: ScrapeApiResponse) -> List[Dict]:
     """parse search results from google search page"""
     results = []
     selector = response.selector
-    has_data = selector.xpath("//h1[contains(text(),'Search Results')]").get()
+    has_data = SELECTORS.get(selector, "//h1[contains(text(),'Search Results')]")
     if not has_data:
         raise NoResults("No search results found")
 
@@ -230,12 +287,10 @@ def parse_serp(response: ScrapeApiResponse) -> List[Dict]:
     else:
         position = int(response.context["url"].split("start=")[-1])
 
-    for box in selector.xpath(
-        "//div[@id='search']/div/div/div"
-    ):
-        title = box.xpath(".//h3/text()").get()
-        url = box.xpath(".//h3/../@href").get()
-        description = "".join(box.xpath(".//div[@data-sncf]//text()").getall())
+    for box in SELECTORS.select(selector, "//div[@id='search']/div/div/div"):
+        title = SELECTORS.get(box, ".//h3/text()")
+        url = SELECTORS.get(box, ".//h3/../@href")
+        description = "".join(SELECTORS.getall(box, ".//div[@data-sncf]//text()"))
         if not title or not url:
             continue
         position += 1
@@ -244,10 +299,10 @@ def parse_serp(response: ScrapeApiResponse) -> List[Dict]:
                 "position": position,
                 "title": title,
                 "url": url,
-                "origin": box.xpath(".//div[*[cite]]/div/span/text()").get(),
+                "origin": SELECTORS.get(box, ".//div[*[cite]]/div/span/text()"),
                 "domain": url.split("https://")[-1].split("/")[0].replace("www.", ""),
                 "description": description.split(" — ")[-1] if description else None,
-                "date": box.xpath(".//span[contains(text(),' —')]/span/text()").get(),
+                "date": SELECTORS.get(box, ".//span[contains(text(),' —')]/span/text()"),
             }
         )
     results.sort(key=lambda x: x["position"])
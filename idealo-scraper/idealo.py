@@ -7,9 +7,12 @@ $ export $SCRAPFLY_KEY="your key from https://scrapfly.io/dashboard"
 import os
 import re
 import json
+import time
+import random
 import asyncio
-from urllib.parse import urljoin, urlencode
-from typing import List, Literal, Optional, TypedDict
+import itertools
+from urllib.parse import urljoin, urlencode, urlparse
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Literal, Optional, Tuple, TypedDict
 
 from loguru import logger as log
 import uuid
@@ -39,19 +42,194 @@ await clickUntilGone();
 BASE_URL = "https://www.idealo.de"
 SEARCH_PAGE_SIZE = 15
 MAX_RETRIES = 3
-RETRY_DELAY = 5
+RETRY_DELAY = 5  # base delay of the decorrelated jitter backoff
+SCRAPE_TIMEOUT = 300
 PeriodType = Literal["1Y", "3M", "6M", "1M"]
 
 
-async def scrape_with_retry(config: ScrapeConfig, _retries: int = 0) -> ScrapeApiResponse:
+class WorkPool:
+    """
+    Run an async function over many items with bounded concurrency, yielding (item, result) pairs
+    in completion order. Like ScrapflyClient.concurrent_scrape, items that fail are yielded with their
+    exception instead of raising it. Scrapes are retried by the resilience layer, so the pool doesn't retry.
+    """
+
+    def __init__(self, concurrency: int = 5):
+        self.concurrency = concurrency
+
+    async def _run(self, func: Callable[[Any], Awaitable], item) -> Any:
+        try:
+            return await func(item)
+        except Exception as e:
+            return e
+
+    async def map(self, func: Callable[[Any], Awaitable], items: Iterable) -> AsyncIterator[Tuple[Any, Any]]:
+        items = iter(items)
+        pending = {}
+        try:
+            while True:
+                for item in itertools.islice(items, self.concurrency - len(pending)):
+                    pending[asyncio.ensure_future(self._run(func, item))] = item
+                if not pending:
+                    return
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield pending.pop(task), task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+class CircuitOpenError(Exception):
+    """raised instead of scraping while the circuit breaker of the target domain is open"""
+
+
+class Resilience:
+    """
+    Retry layer around ScrapflyClient.async_scrape that keeps per-domain state shared by every coroutine:
+    - retry budget: a domain holds up to `retry_budget` retry tokens, every first attempt earns `budget_ratio`
+      of a token and every retry spends one, so a target that starts blocking can't make every caller retry at once
+    - decorrelated jitter backoff between the retries of a request
+    - circuit breaker: `failure_threshold` consecutive failures open the domain's circuit and requests fail fast
+      with CircuitOpenError for `reset_timeout` seconds, after which a single trial request closes or reopens it
+    Per-domain counters are available from metrics().
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 3,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        retry_budget: int = 10,
+        budget_ratio: float = 0.2,
+        failure_threshold: int = 5,
+        reset_timeout: float = 60.0,
+        timeout: Optional[float] = None,
+    ):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_budget = retry_budget
+        self.budget_ratio = budget_ratio
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.timeout = timeout
+        self.domains: Dict[str, Dict[str, Any]] = {}
+
+    def _domain(self, url: str) -> Dict[str, Any]:
+        domain = urlparse(url).netloc
+        if domain not in self.domains:
+            self.domains[domain] = {
+                "state": "closed",
+                "opened_at": 0.0,
+                "trial": False,
+                "consecutive_failures": 0,
+                "tokens": float(self.retry_budget),
+                "requests": 0,
+                "successes": 0,
+                "failures": 0,
+                "retries": 0,
+                "budget_exhausted": 0,
+                "short_circuited": 0,
+                "circuit_opened": 0,
+            }
+        return self.domains[domain]
+
+    def delay(self, previous: float) -> float:
+        """decorrelated jitter: anywhere between the base delay and three times the previous delay"""
+        return min(self.max_delay, random.uniform(self.base_delay, previous * 3))
+
+    def _allow(self, stats: Dict[str, Any]) -> bool:
+        if stats["state"] == "open":
+            if time.monotonic() - stats["opened_at"] < self.reset_timeout:
+                return False
+            stats["state"] = "half_open"
+        if stats["state"] == "half_open":
+            if stats["trial"]:
+                return False
+            stats["trial"] = True
+        return True
+
+    def _record(self, domain: str, stats: Dict[str, Any], success: bool):
+        stats["trial"] = False
+        if success:
+            stats["successes"] += 1
+            stats["consecutive_failures"] = 0
+            stats["state"] = "closed"
+            return
+        stats["failures"] += 1
+        stats["consecutive_failures"] += 1
+        if stats["state"] == "half_open" or stats["consecutive_failures"] >= self.failure_threshold:
+            if stats["state"] != "open":
+                log.warning(f"opening the circuit breaker of {domain} after {stats['consecutive_failures']} failures")
+                stats["circuit_opened"] += 1
+            stats["state"] = "open"
+            stats["opened_at"] = time.monotonic()
+
+    async def run(
+        self,
+        config: ScrapeConfig,
+        scrape: Callable[[ScrapeConfig], Awaitable[ScrapeApiResponse]],
+        parse: Optional[Callable[[ScrapeApiResponse], Any]] = None,
+    ) -> Any:
+        """
+        scrape a config and return the response, or parse(response) when given. Failures of either are retried
+        within the domain's budget, the last error is raised once retries run out
+        """
+        domain = urlparse(config.url).netloc
+        stats = self._domain(config.url)
+        stats["tokens"] = min(self.retry_budget, stats["tokens"] + self.budget_ratio)
+        delay = self.base_delay
+        for attempt in range(self.max_retries + 1):
+            if not self._allow(stats):
+                stats["short_circuited"] += 1
+                raise CircuitOpenError(f"the circuit breaker of {domain} is open, not scraping {config.url}")
+            stats["requests"] += 1
+            try:
+                response = await asyncio.wait_for(scrape(config), self.timeout)
+                result = parse(response) if parse else response
+            except asyncio.CancelledError:
+                stats["trial"] = False
+                raise
+            except Exception as e:
+                self._record(domain, stats, success=False)
+                if attempt == self.max_retries:
+                    raise
+                if stats["tokens"] < 1:
+                    stats["budget_exhausted"] += 1
+                    log.warning(f"the retry budget of {domain} is exhausted, not retrying {config.url}")
+                    raise
+                stats["tokens"] -= 1
+                stats["retries"] += 1
+                delay = self.delay(delay)
+                log.debug(f"retrying {config.url} in {delay:.1f} seconds: {e!r}")
+                await asyncio.sleep(delay)
+            else:
+                self._record(domain, stats, success=True)
+                return result
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        """request, retry and circuit breaker counters of every domain"""
+        hidden = ("opened_at", "trial")
+        return {
+            domain: {key: value for key, value in stats.items() if key not in hidden}
+            for domain, stats in self.domains.items()
+        }
+
+
+RESILIENCE = Resilience(max_retries=MAX_RETRIES, base_delay=RETRY_DELAY, timeout=SCRAPE_TIMEOUT)
+
+
+def _scrape_pool(concurrency: int = 5) -> WorkPool:
+    """bounded concurrency pool, failures are retried by the resilience layer of every scrape"""
+    return WorkPool(concurrency=concurrency)
+
+
+async def scrape_with_retry(config: ScrapeConfig) -> ScrapeApiResponse:
     """scrape a config and retry on any failure - idealo blocks requests intermittently"""
     try:
-        return await SCRAPFLY.async_scrape(config)
+        return await RESILIENCE.run(config, SCRAPFLY.async_scrape)
     except Exception as e:
-        if _retries < MAX_RETRIES:
-            log.debug(f"retrying failed request to {config.url}: {e}")
-            await asyncio.sleep(RETRY_DELAY)
-            return await scrape_with_retry(config, _retries=_retries + 1)
         raise Exception(f"unable to scrape {config.url}, max retries exceeded") from e
 
 
@@ -276,23 +454,23 @@ def parse_product(response: ScrapeApiResponse) -> IdealoProduct:
     )
 
 
-async def scrape_products(urls: List[str]) -> List[IdealoProduct]:
+async def scrape_products(urls: List[str], concurrency: int = 5) -> List[IdealoProduct]:
     """scrape product pages from idealo.de"""
-    products = []
+    parsed = {}
     to_scrape = [ScrapeConfig(url, js=LOAD_MORE_JS, **BASE_CONFIG) for url in urls]
-    responses = await asyncio.gather(
-        *[scrape_with_retry(config) for config in to_scrape], return_exceptions=True
-    )
-    for response in responses:
+    async for config, response in _scrape_pool(concurrency).map(scrape_with_retry, to_scrape):
         if isinstance(response, Exception):
-            log.error(f"failed to scrape product: {response}")
+            log.error(f"failed to scrape product {config.url}: {response}")
             continue
-        products.append(parse_product(response))
+        # parse right away so only the products are kept, not every page's HTML
+        parsed[config.url] = parse_product(response)
+    # the pool yields in completion order, products are returned in the order of urls
+    products = [parsed[url] for url in urls if url in parsed]
     log.success(f"scraped {len(products)} products")
     return products
 
 
-async def scrape_search(query: str, max_pages: int = 3) -> List[IdealoListingItem]:
+async def scrape_search(query: str, max_pages: int = 3, concurrency: int = 5) -> List[IdealoListingItem]:
     """scrape search listings from idealo.de"""
     params = urlencode({"q": query})
     first_url = f"{BASE_URL}/preisvergleich/MainSearchProductCategory.html?{params}"
@@ -313,14 +491,15 @@ async def scrape_search(query: str, max_pages: int = 3) -> List[IdealoListingIte
             url = f"{BASE_URL}/preisvergleich/MainSearchProductCategory/100I16-{offset}.html?{params}"
             other_pages.append(ScrapeConfig(url, wait_for_selector='[class*="sr-resultList"]', **BASE_CONFIG))
 
-        responses = await asyncio.gather(
-            *[scrape_with_retry(config) for config in other_pages], return_exceptions=True
-        )
-        for response in responses:
+        pages = {}
+        async for config, response in _scrape_pool(concurrency).map(scrape_with_retry, other_pages):
             if isinstance(response, Exception):
-                log.error(f"failed to scrape search page: {response}")
+                log.error(f"failed to scrape search page {config.url}: {response}")
                 continue
-            results.extend(parse_search(response)["results"])
+            pages[config.url] = parse_search(response)["results"]
+        # keep the results in page order
+        for config in other_pages:
+            results.extend(pages.get(config.url, []))
 
     log.success(f"scraped {len(results)} search results")
     return results
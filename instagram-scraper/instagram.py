@@ -7,11 +7,13 @@ $ export $SCRAPFLY_KEY="your key from https://scrapfly.io/dashboard"
 """
 import json
 import os
-from typing import Dict, Optional
+from typing import Any, Callable, Dict, Iterator, Optional
 from urllib.parse import quote, urlencode
+import threading
 import jmespath
+from jmespath.visitor import TreeInterpreter
 import re
-from nested_lookup import nested_lookup
+from itertools import repeat
 from loguru import logger as log
 from scrapfly import ScrapeConfig, ScrapflyClient
 
@@ -49,10 +51,123 @@ COMMENTS_JS_SCENARIO = [
     },
 ]
 
+class CompiledExpressions:
+    """
+    JMESPath expressions compiled once on first use into plain python functions, shared between threads.
+    jmespath.search() caches parsed expressions but still walks the expression's syntax tree with a new
+    interpreter for every searched item; compiled expressions skip both.
+    Only the syntax nodes this module's expressions use are compiled, anything else runs through jmespath's
+    interpreter.
+    """
+
+    def __init__(self):
+        self.compiled: Dict[str, Callable[[Any], Any]] = {}
+        self._lock = threading.Lock()
+
+    def compile(self, expression: str) -> Callable[[Any], Any]:
+        try:
+            return self.compiled[expression]
+        except KeyError:
+            pass
+        with self._lock:
+            if expression not in self.compiled:
+                self.compiled[expression] = self._compile(jmespath.compile(expression).parsed)
+        return self.compiled[expression]
+
+    def search(self, expression: str, data: Any) -> Any:
+        """same as jmespath.search(expression, data)"""
+        return self.compile(expression)(data)
+
+    def _compile(self, node: Dict) -> Callable[[Any], Any]:
+        kind = node["type"]
+        if kind == "field" or (kind == "subexpression" and all(c["type"] == "field" for c in node["children"])):
+            names = [node["value"]] if kind == "field" else [child["value"] for child in node["children"]]
+
+            def field(value):
+                for name in names:
+                    if type(value) is dict:
+                        value = value.get(name)
+                    else:
+                        try:
+                            value = value.get(name)
+                        except AttributeError:
+                            value = None
+                return value
+
+            return field
+        if kind == "subexpression":
+            steps = [self._compile(child) for child in node["children"]]
+
+            def chain(value):
+                for step in steps:
+                    value = step(value)
+                return value
+
+            return chain
+        if kind == "multi_select_dict":
+            pairs = [(child["value"], self._compile(child["children"][0])) for child in node["children"]]
+            return lambda value: None if value is None else {key: step(value) for key, step in pairs}
+        if kind == "projection":
+            base, step = (self._compile(child) for child in node["children"])
+
+            def projection(value):
+                value = base(value)
+                if not isinstance(value, list):
+                    return None
+                return [result for result in map(step, value) if result is not None]
+
+            return projection
+        if kind == "flatten":
+            base = self._compile(node["children"][0])
+
+            def flatten(value):
+                value = base(value)
+                if not isinstance(value, list):
+                    return None
+                merged = []
+                for element in value:
+                    if isinstance(element, list):
+                        merged.extend(element)
+                    else:
+                        merged.append(element)
+                return merged
+
+            return flatten
+        return lambda value: TreeInterpreter().visit(node, value)
+
+
+EXPRESSIONS = CompiledExpressions()
+
+
+def iter_lookup(key: str, document: Any) -> Iterator[Any]:
+    """
+    yield values of `key` anywhere in a nested JSON document in the same depth-first order as nested_lookup.
+    The document is walked lazily so taking only the first few matches doesn't scan the whole tree.
+    """
+    stack = [iter(((None, document),))]
+    while stack:
+        for name, value in stack[-1]:
+            if name == key:
+                yield value
+            if isinstance(value, dict):
+                stack.append(iter(value.items()))
+                break
+            if isinstance(value, list):
+                stack.append(zip(repeat(None), value))
+                break
+        else:
+            stack.pop()
+
+
+def find_first(key: str, document: Any, default: Any = None) -> Any:
+    """first value of `key` in a nested JSON document, the walk stops at the first match"""
+    return next(iter_lookup(key, document), default)
+
+
 def parse_user(data: Dict) -> Dict:
     """Reduce the user data to the relevant fields"""
     log.debug("parsing user data {}", data["username"])
-    result = jmespath.search(
+    result = EXPRESSIONS.search(
         """{
         name: full_name,
         username: username,
@@ -97,13 +212,15 @@ async def scrape_user(username: str) -> Dict:
     user_hidden_data = [d for d in hidden_datasets if "xig_user_by_username" in d and "follower_count" in d]
     if not user_hidden_data:
         raise ValueError(f"Could not find user data in page: {username}")
-    data = nested_lookup("xig_user_by_username", json.loads(user_hidden_data[0]))[0]
+    data = find_first("xig_user_by_username", json.loads(user_hidden_data[0]))
+    if data is None:
+        raise ValueError(f"Could not find user data in page: {username}")
     return parse_user(data)
 
 def parse_comments(data: Dict) -> Dict:
     """Parse the comments data from the post dataset"""
     if "edge_media_to_comment" in data:
-        return jmespath.search(
+        return EXPRESSIONS.search(
             """{
                 comments_count: edge_media_to_comment.count,
                 comments_disabled: comments_disabled,
@@ -121,7 +238,7 @@ def parse_comments(data: Dict) -> Dict:
             data,
         )
     else:
-        return jmespath.search(
+        return EXPRESSIONS.search(
             """{
                 comments_count: edge_media_to_parent_comment.count,
                 comments_disabled: comments_disabled,
@@ -226,7 +343,7 @@ async def scrape_post(url_or_shortcode: str) -> Dict:
 
 def parse_user_posts(data: Dict) -> Dict:
     """Reduce users posts' dataset to the most important fields"""
-    result = jmespath.search(
+    result = EXPRESSIONS.search(
         """{
         id: id,
         shortcode: code,
@@ -312,7 +429,7 @@ async def scrape_user_posts(username: str, page_size=12, max_pages: Optional[int
 
 def parse_post_comment(data: Dict) -> Dict:
     """refine the comment dataset"""
-    return jmespath.search(
+    return EXPRESSIONS.search(
         """{
         id: pk,
         text: text,
@@ -354,7 +471,7 @@ async def scrape_post_comments(url: str):
             log.warning("no JSON comments found, skipping")
             continue
 
-        edges = jmespath.search(
+        edges = EXPRESSIONS.search(
             "data.xig_polaris_media.comments_connection.edges[].node", data
         ) or []
         for node in edges:
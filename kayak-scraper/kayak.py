@@ -4,7 +4,9 @@ This is an example web scraper for kayak.com.
 To run this scraper set env variable $SCRAPFLY_KEY with your scrapfly API key:
 $ export SCRAPFLY_KEY="your key from https://scrapfly.io/dashboard"
 """
+import asyncio
 import json
+import math
 import os
 from datetime import datetime, timezone
 from typing import Any, Dict, List, Optional
@@ -141,7 +143,12 @@ async def scrape_flights(
     return_date: Optional[str] = None,
     sort: str = "bestflight_a",
     max_pages: int = 10,
+    parallel_pages: bool = False,
 ) -> List[Dict[str, Any]]:
+    """
+    scrape flight search results polling the pages one by one, or with parallel_pages poll every remaining page
+    concurrently within the search's session
+    """
     origin, destination = origin.upper(), destination.upper()
     url = build_search_url(origin, destination, departure_date, return_date, sort)
     log.info(f"scraping kayak {origin}->{destination} on {departure_date}")
@@ -162,15 +169,37 @@ async def scrape_flights(
     start_page = page_data.get("pageNumber", 1)
     pages_scraped = 1
 
-    for page_number in range(start_page + 1, start_page + max_pages + 1):
-        if len(all_results) >= filtered_count:
-            break
-        response = await SCRAPFLY.async_scrape(ScrapeConfig(
+    def poll_config(page_number: int) -> ScrapeConfig:
+        return ScrapeConfig(
             POLL_URL, **BASE_CONFIG, session=session_id, method="POST",
             headers=poll_headers,
             body=json.dumps(_build_poll_payload(origin, destination, departure_date, return_date, search_id, sort, page_number)),
             render_js=False,
-        ))
+        )
+
+    if parallel_pages:
+        # filteredCount and the page size are known from the first page, poll the remaining pages at once
+        remaining = filtered_count - len(all_results)
+        page_count = min(max_pages, math.ceil(remaining / len(all_results))) if all_results and remaining > 0 else 0
+        page_numbers = range(start_page + 1, start_page + page_count + 1)
+        responses = await asyncio.gather(
+            *(SCRAPFLY.async_scrape(poll_config(number)) for number in page_numbers), return_exceptions=True
+        )
+        # gather keeps the page order
+        for page_number, response in zip(page_numbers, responses):
+            if isinstance(response, Exception):
+                log.error(f"failed to poll page {page_number} of {origin}->{destination}: {response!r}")
+                continue
+            page_data = json.loads(response.content)
+            all_results.extend(parse_flight_results(page_data, origin, destination, departure_date, captured_at))
+            pages_scraped += 1
+        log.success(f"scraped {len(all_results)} flights for {origin}->{destination} across {pages_scraped} pages")
+        return all_results
+
+    for page_number in range(start_page + 1, start_page + max_pages + 1):
+        if len(all_results) >= filtered_count:
+            break
+        response = await SCRAPFLY.async_scrape(poll_config(page_number))
         page_data = json.loads(response.content)
         page_results = parse_flight_results(page_data, origin, destination, departure_date, captured_at)
         all_results.extend(page_results)
@@ -4,15 +4,20 @@ This is an example web scraper for marriott.com hotel prices and availability.
 To run this scraper set env variable $SCRAPFLY_KEY with your scrapfly API key:
 $ export $SCRAPFLY_KEY="your key from https://scrapfly.io/dashboard"
 """
+import asyncio
 import json
 import os
 import re
+import tempfile
+import time
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, TypedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, TypedDict, Union
 from urllib.parse import urlencode
 
 from loguru import logger as log
-from scrapfly import ScrapeConfig, ScrapflyClient
+from scrapfly import ScrapeApiResponse, ScrapeConfig, ScrapflyClient
+from scrapfly.errors import ScrapflyError
 
 SCRAPFLY = ScrapflyClient(key=os.environ["SCRAPFLY_KEY"])
 
@@ -34,8 +39,8 @@ _HQV_HEADERS = {
     "graphql-require-safelisting": "true",
 }
 
-# required header for the graphql call
-_OPERATION_SIGNATURES: Dict[str, str] = {}
+# graphql errors returned for calls made with an outdated operation signature
+_STALE_SIGNATURE = re.compile(r"signature|safelist|persisted ?query", re.I)
 
 _HQV_QUERY = """
 query phoenixShopHQVPropertyInfoCall($propertyId: ID!, $filter: [ContactNumberType], $descriptionsFilter: [PropertyDescriptionType]) {
@@ -143,24 +148,108 @@ def _parse_operation_signatures(html: str) -> Dict[str, str]:
     }
 
 
-async def _get_operation_signature(operation: str) -> str:
+async def _fetch_operation_signatures() -> Dict[str, str]:
+    """fetch a search page to harvest operation safelist signatures from"""
+    from_date = (datetime.now() + timedelta(days=30)).strftime("%Y-%m-%d")
+    to_date = (datetime.now() + timedelta(days=32)).strftime("%Y-%m-%d")
+    url = _build_search_url("New York", from_date, to_date)
+    log.info("fetching operation signatures from {}", url)
+    response = await SCRAPFLY.async_scrape(
+        ScrapeConfig(url, asp=True, country="US", proxy_pool="public_residential_pool")
+    )
+    return _parse_operation_signatures(response.content)
+
+
+class OperationSignatures:
+    """
+    Cache of GraphQL operation safelist signatures (required header for the graphql calls).
+    Signatures expire after the ttl and are persisted to disk so new processes can reuse them.
+    Concurrent lookups of missing or expired signatures share a single signature page fetch.
+    """
+
+    def __init__(self, path: Optional[Path] = None, ttl: timedelta = timedelta(hours=12)):
+        self.path = path
+        self.ttl = ttl
+        self.signatures: Dict[str, Tuple[str, float]] = {}  # operation -> (signature, fetched at)
+        self._refresh: Optional[asyncio.Task] = None
+        self._load()
+
+    def _load(self):
+        if not self.path or not self.path.exists():
+            return
+        try:
+            self.signatures = {op: tuple(entry) for op, entry in json.loads(self.path.read_text()).items()}
+        except (OSError, ValueError, TypeError):
+            log.warning("ignoring unreadable operation signature cache {}", self.path)
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(self.signatures))
+            tmp.replace(self.path)
+        except OSError as e:
+            log.warning("failed to persist operation signatures to {}: {}", self.path, e)
+
+    def cached(self, operation: str) -> Optional[str]:
+        """return operation's signature if it's cached and not expired"""
+        signature, fetched_at = self.signatures.get(operation, (None, 0))
+        if time.time() - fetched_at > self.ttl.total_seconds():
+            return None
+        return signature
+
+    def update(self, signatures: Dict[str, str]):
+        if not signatures:
+            return
+        now = time.time()
+        self.signatures.update({op: (signature, now) for op, signature in signatures.items()})
+        self._save()
+
+    async def _fetch(self) -> Dict[str, str]:
+        signatures = await _fetch_operation_signatures()
+        self.update(signatures)
+        return signatures
+
+    async def refresh(self) -> Dict[str, str]:
+        """fetch fresh signatures; callers that arrive while a fetch is in flight wait for it instead"""
+        task = self._refresh
+        if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+            task = self._refresh = asyncio.ensure_future(self._fetch())
+        return await asyncio.shield(task)
+
+    async def get(self, operation: str, stale: Optional[str] = None) -> str:
+        """
+        resolve an operation's signature, fetching a search page to harvest it if not cached.
+        Pass a signature the api rejected as `stale` to get a refreshed one.
+        """
+        signature = self.cached(operation)
+        if signature is None or signature == stale:
+            signature = (await self.refresh()).get(operation)
+        if signature is None:
+            raise RuntimeError(f"operation signature for '{operation}' not found in page data")
+        return signature
+
+
+_OPERATION_SIGNATURES = OperationSignatures(Path(tempfile.gettempdir()) / "marriott_operation_signatures.json")
+
+
+async def _get_operation_signature(operation: str, stale: Optional[str] = None) -> str:
     """resolve an operation's safelist signature, fetching a search page to harvest it if not cached"""
+    return await _OPERATION_SIGNATURES.get(operation, stale=stale)
 
-    if operation not in _OPERATION_SIGNATURES:
-        from_date = (datetime.now() + timedelta(days=30)).strftime("%Y-%m-%d")
-        to_date = (datetime.now() + timedelta(days=32)).strftime("%Y-%m-%d")
-        url = _build_search_url("New York", from_date, to_date)
-        log.info("fetching operation signatures from {}", url)
-
-        response = await SCRAPFLY.async_scrape(
-            ScrapeConfig(url, asp=True, country="US", proxy_pool="public_residential_pool")
-        )
-        _OPERATION_SIGNATURES.update(_parse_operation_signatures(response.content))
-
-    if operation not in _OPERATION_SIGNATURES:
-        raise RuntimeError(f"operation signature for '{operation}' not found in page data")
 
-    return _OPERATION_SIGNATURES[operation]
+def _is_stale_signature(response: Union[ScrapeApiResponse, Exception]) -> bool:
+    """check whether a graphql call failed because of an outdated operation signature"""
+    if isinstance(response, ScrapflyError):
+        response = response.api_response
+    if not isinstance(response, ScrapeApiResponse):
+        return False
+    try:
+        errors = json.loads(response.content).get("errors") or []
+    except (ValueError, AttributeError, TypeError):
+        return False
+    return any(_STALE_SIGNATURE.search(str(error.get("message", ""))) for error in errors if isinstance(error, dict))
 
 
 def parse_search(data: Dict) -> List[MarriottProperty]:
@@ -269,6 +358,7 @@ async def scrape_search(
     response = await SCRAPFLY.async_scrape(
         ScrapeConfig(url, **BASE_CONFIG, wait_for_selector=f"xhr:{_SEARCH_XHR}")
     )
+    # search pages carry the signatures too so refresh the cache for free
     _OPERATION_SIGNATURES.update(_parse_operation_signatures(response.content))
     xhr_calls = response.scrape_result.get("browser_data", {}).get("xhr_call", [])
     call = next((c for c in xhr_calls if _SEARCH_XHR in c.get("url", "")), None)
@@ -279,29 +369,43 @@ async def scrape_search(
     return results
 
 
+def _hqv_config(property_id: str, signature: str) -> ScrapeConfig:
+    return ScrapeConfig(
+        _HQV_URL,
+        method="POST",
+        headers={**_HQV_HEADERS, "graphql-operation-signature": signature},
+        body=json.dumps({
+            "operationName": _HQV_OP,
+            "query": _HQV_QUERY,
+            "variables": {"propertyId": property_id, "filter": "PHONE", "descriptionsFilter": ["LOCATION"]},
+        }),
+        asp=True,
+        country="US",
+        proxy_pool="public_residential_pool",
+    )
+
+
 async def scrape_hotels(property_ids: List[str]) -> List[MarriottHotel]:
     """Scrape hotel details for the given Marriott property ids."""
     log.info("scraping hotel details for {} properties", len(property_ids))
     signature = await _get_operation_signature(_HQV_OP)
-    headers = {**_HQV_HEADERS, "graphql-operation-signature": signature}
-    to_scrape = [
-        ScrapeConfig(
-            _HQV_URL,
-            method="POST",
-            headers=headers,
-            body=json.dumps({
-                "operationName": _HQV_OP,
-                "query": _HQV_QUERY,
-                "variables": {"propertyId": pid, "filter": "PHONE", "descriptionsFilter": ["LOCATION"]},
-            }),
-            asp=True,
-            country="US",
-            proxy_pool="public_residential_pool",
-        )
-        for pid in property_ids
-    ]
     results = []
-    async for response in SCRAPFLY.concurrent_scrape(to_scrape):
-        results.append(parse_hotel(json.loads(response.content)))
+    remaining = list(property_ids)
+    # properties rejected for an outdated signature are retried once with a refreshed one
+    for attempt in range(2):
+        to_scrape = [_hqv_config(pid, signature) for pid in remaining]
+        remaining = []
+        async for response in SCRAPFLY.concurrent_scrape(to_scrape):
+            if attempt == 0 and _is_stale_signature(response):
+                failed = response.api_response if isinstance(response, ScrapflyError) else response
+                remaining.append(json.loads(failed.scrape_config.body)["variables"]["propertyId"])
+                continue
+            if isinstance(response, Exception):
+                raise response
+            results.append(parse_hotel(json.loads(response.content)))
+        if not remaining:
+            break
+        log.warning("operation signature for {} is outdated, refreshing it", _HQV_OP)
+        signature = await _get_operation_signature(_HQV_OP, stale=signature)
     log.success("scraped {} hotel details", len(results))
     return results
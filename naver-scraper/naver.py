@@ -12,7 +12,7 @@ import re
 from pathlib import Path
 from urllib.parse import urlencode
 from loguru import logger as log
-from typing import List, Dict, TypedDict, Optional, Literal, Any
+from typing import Any, Dict, List, Literal, Optional, Tuple, TypedDict
 
 from scrapfly import ScrapeConfig, ScrapflyClient, ScrapeApiResponse
 
@@ -189,34 +189,47 @@ class NewsArticle(TypedDict):
     origin_url: Optional[str]
 
 
+class JsonScanner:
+    """
+    Locates JSON embedded in page scripts without walking them one python character at a time: JSON is decoded
+    in place by the C decoder and javascript object literals are matched by a regex that skips whole
+    double-quoted strings, so braces inside strings don't count.
+    """
+
+    # everything up to the next structural brace, including whole double-quoted strings, is consumed by the
+    # regex engine so the python loop in balanced_end() only runs once per brace
+    NEXT_BRACE = re.compile(r'[^{}"]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^{}"]*)*([{}])')
+
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+
+    def decode(self, text: str, start: int) -> Tuple[Any, int]:
+        """decode the JSON value at start in place, returns (data, end index) or raises ValueError"""
+        return self.decoder.raw_decode(text, start)
+
+    def balanced_end(self, text: str, start: int) -> int:
+        """end index of the {...} block opening at start, -1 if it never closes"""
+        depth = 0
+        pos = start
+        while match := self.NEXT_BRACE.match(text, pos):
+            depth += 1 if match.group(1) == "{" else -1
+            pos = match.end()
+            if depth == 0:
+                return pos
+        return -1
+
+
+JSON_SCANNER = JsonScanner()
+
+
 def _extract_json_from_html(content: str, start_pos: int) -> Optional[str]:
     """Extract a balanced JSON object from HTML at start_pos (opening brace); returns JSON or None."""
-    brace_count = 0
-    in_string = False
-    escape = False
-
-    for i in range(start_pos, len(content)):
-        char = content[i]
-
-        if escape:
-            escape = False
-            continue
-        if char == "\\":
-            escape = True
-            continue
-        if char == '"':
-            in_string = not in_string
-            continue
-
-        if not in_string:
-            if char == "{":
-                brace_count += 1
-            elif char == "}":
-                brace_count -= 1
-                if brace_count == 0:
-                    return content[start_pos : i + 1]
-
-    return None
+    try:
+        # strict JSON is matched by the C decoder; javascript objects fall back to the brace scanner
+        _, end = JSON_SCANNER.decode(content, start_pos)
+    except ValueError:
+        end = JSON_SCANNER.balanced_end(content, start_pos)
+    return content[start_pos:end] if end != -1 else None
 
 
 def _js_to_json(js_str: str) -> str:
@@ -258,13 +271,10 @@ def parse_web_search(result: ScrapeApiResponse) -> dict[str, Any]:
 
     if match:
         json_start = content.index("{", match.end() - 1)
-        json_str = _extract_json_from_html(content, json_start)
 
         try:
-            if json_str:
-                data = json.loads(json_str)
-            else:
-                return {"results": [], "max_pages": None, "num_of_displayed_results": 0}
+            # bootstrap data is strict JSON so it's decoded in place - the decoder stops at the closing brace
+            data, _ = JSON_SCANNER.decode(content, json_start)
             items = data.get("body", {}).get("props", {}).get("children", [])
 
             if items and "props" in items[0]:
@@ -8,9 +8,9 @@ $ export $SCRAPFLY_KEY="your key from https://scrapfly.io/dashboard"
 import os
 import json
 import jmespath
-from typing import Dict, List
+from typing import Any, Dict, Iterator, List
 from urllib.parse import urlencode, parse_qs, urlparse
-from nested_lookup import nested_lookup
+from itertools import repeat
 from loguru import logger as log
 from scrapfly import ScrapeConfig, ScrapflyClient, ScrapeApiResponse
 
@@ -26,6 +26,31 @@ BASE_CONFIG = {
 }
 
 
+def iter_lookup(key: str, document: Any) -> Iterator[Any]:
+    """
+    yield values of `key` anywhere in a nested JSON document in the same depth-first order as nested_lookup.
+    The document is walked lazily so taking only the first few matches doesn't scan the whole tree.
+    """
+    stack = [iter(((None, document),))]
+    while stack:
+        for name, value in stack[-1]:
+            if name == key:
+                yield value
+            if isinstance(value, dict):
+                stack.append(iter(value.items()))
+                break
+            if isinstance(value, list):
+                stack.append(zip(repeat(None), value))
+                break
+        else:
+            stack.pop()
+
+
+def find_first(key: str, document: Any, default: Any = None) -> Any:
+    """first value of `key` in a nested JSON document, the walk stops at the first match"""
+    return next(iter_lookup(key, document), default)
+
+
 def parse_product(data: dict) -> dict:
     core_product = data["coreProducts"][0]
     npt_parts = [part for part in core_product.get("nptHierarchy", "").split(".") if part]
@@ -110,7 +135,7 @@ async def scrape_search(url: str, max_pages: int = 10) -> List[Dict]:
     first_page = await SCRAPFLY.async_scrape(ScrapeConfig(url, **BASE_CONFIG))
     # parse first page for product search data and total amount of pages:
     data = find_hidden_data(first_page)
-    _first_page_results = nested_lookup("productResults", data)[0]
+    _first_page_results = find_first("productResults", data)
     products = list(_first_page_results["productsById"].values())
     paging_info = _first_page_results["query"]
     total_pages = paging_info["pageCount"]
@@ -125,7 +150,7 @@ async def scrape_search(url: str, max_pages: int = 10) -> List[Dict]:
     ]
     async for result in SCRAPFLY.concurrent_scrape(_other_pages):
         data = find_hidden_data(result)
-        data = nested_lookup("productResults", data)[0]
+        data = find_first("productResults", data)
         products.extend(list(data["productsById"].values()))
     log.success(f"scraped {len(products)} product listings from search pages")
     return products
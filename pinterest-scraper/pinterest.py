@@ -4,15 +4,24 @@ This is an example web scraper for pinterest.com.
 To run this scraper set env variable $SCRAPFLY_KEY with your scrapfly API key:
 $ export $SCRAPFLY_KEY="your key from https://scrapfly.io/dashboard"
 """
+import asyncio
 import json
 import os
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Tuple, TypedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypedDict
 from urllib.parse import parse_qs, quote, urlencode, urlparse
 from uuid import uuid4
 
 from loguru import logger as log
-from scrapfly import ScrapeConfig, ScrapflyClient, ScrapeApiResponse
+from scrapfly import (
+    ScrapeApiResponse,
+    ScrapeConfig,
+    ScrapflyAspError,
+    ScrapflyClient,
+    ScrapflyProxyError,
+    ScrapflySessionError,
+    UpstreamHttpClientError,
+)
 
 SCRAPFLY = ScrapflyClient(key=os.environ["SCRAPFLY_KEY"])
 BASE_CONFIG = {
@@ -121,20 +130,155 @@ def parse_search_results(pages: List[dict] | dict, query: str) -> PinSearch:
     return PinSearch(query=query, search_date=datetime.now().strftime("%Y-%m-%d"), pins=pins)
 
 
-async def scrape_pinterest(query: str, max_pages: int = 3) -> PinSearch:
-    """Scrape Pinterest search results and return parsed pin data."""
-    session_id = str(uuid4()).replace("-", "")
-    url = build_url(query)
-    pages: List[dict] = []
+class SessionPool:
+    """
+    Scrapfly sessions shared by many jobs instead of a new session for every job:
+    - a new session is warmed once with `warm(session_id)` and whatever it returns (e.g. API credentials or
+      captured headers) is passed to every job that runs on that session
+    - a session runs one job at a time and at most `max_sessions` sessions are open, further jobs wait for a
+      free session
+    - sessions are retired when a job on them gets blocked or after `max_uses` jobs, blocked jobs are retried
+      on another session up to `retries` times
+    """
+
+    def __init__(
+        self,
+        prefix: str,
+        warm: Callable[[str], Awaitable[Any]],
+        max_sessions: int = 5,
+        max_uses: int = 50,
+        retries: int = 1,
+    ):
+        self.prefix = prefix
+        self.warm = warm
+        self.max_sessions = max_sessions
+        self.max_uses = max_uses
+        self.retries = retries
+        self.sessions: List[Dict[str, Any]] = []
+        self._waiters: List[asyncio.Future] = []
+
+    @staticmethod
+    def is_blocked(error: Exception) -> bool:
+        """errors that mean the session is no longer usable on the target"""
+        if isinstance(error, (ScrapflyAspError, ScrapflyProxyError, ScrapflySessionError)):
+            return True
+        return isinstance(error, UpstreamHttpClientError) and error.http_status_code in (403, 429)
+
+    async def _acquire(self) -> Dict[str, Any]:
+        while True:
+            free = [session for session in self.sessions if not session["busy"]]
+            if free:
+                session = free[0]
+                break
+            if len(self.sessions) < self.max_sessions:
+                session = {"id": f"{self.prefix}-{uuid4().hex}", "busy": False, "uses": 0}
+                self.sessions.append(session)
+                break
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+        session["busy"] = True
+        session["uses"] += 1
+        return session
+
+    def _release(self, session: Dict[str, Any]):
+        session["busy"] = False
+        if session["uses"] >= self.max_uses:
+            self._retire(session)
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _retire(self, session: Dict[str, Any]):
+        if session in self.sessions:
+            self.sessions.remove(session)
+
+    async def _warm(self, session: Dict[str, Any]) -> Any:
+        if "state" not in session:
+            log.debug(f"warming up session {session['id']}")
+            try:
+                session["state"] = await self.warm(session["id"])
+            except Exception:
+                self._retire(session)
+                raise
+        return session["state"]
+
+    async def run(self, job: Callable[[str, Any], Awaitable[Any]]) -> Any:
+        """run job(session_id, warm_state) on a pooled session and return its result"""
+        for attempt in range(self.retries + 1):
+            session = await self._acquire()
+            try:
+                state = await self._warm(session)
+                return await job(session["id"], state)
+            except Exception as e:
+                if not self.is_blocked(e):
+                    raise
+                self._retire(session)
+                if attempt == self.retries:
+                    raise
+                log.warning(f"session {session['id']} got blocked, retrying on another session: {e!r}")
+            finally:
+                self._release(session)
+
+
+async def _new_search_session(session: str) -> Dict[str, Any]:
+    """search sessions start empty, the first search rendered on a session keeps the API headers it captured"""
+    return {}
+
+
+# searches reuse warmed sessions: once a session has captured the search API headers, the first page of
+# every following search on it is requested from the API instead of rendering the search page
+SESSION_POOL = SessionPool("pinterest", warm=_new_search_session)
+
+
+def search_api_headers(headers: dict, query: str) -> dict:
+    """point the search API headers captured for another query at the given query"""
+    source_url = f"/search/pins/?q={quote(query)}"
+    headers = {**headers, "content-type": "application/x-www-form-urlencoded"}
+    for name in list(headers):
+        if name.lower() == "x-pinterest-source-url":
+            headers[name] = source_url
+        elif name.lower() == "referer":
+            headers[name] = "https://www.pinterest.com" + source_url
+    return headers
+
+
+async def _scrape_first_page(session_id: str, state: Dict[str, Any], query: str) -> Tuple[dict, Optional[dict], dict]:
+    """scrape the first search page, returning its data, the captured search call and the search API headers"""
+    if state.get("headers"):
+        headers = search_api_headers(state["headers"], query)
+        resp = await SCRAPFLY.async_scrape(
+            ScrapeConfig(
+                SEARCH_API_URL,
+                **BASE_CONFIG,
+                session=session_id,
+                method="POST",
+                headers=headers,
+                body=build_post_payload(query),
+                render_js=False,
+            )
+        )
+        data = json.loads(resp.content)
+        if data.get("resource_response", {}).get("data") is not None:
+            return data, None, headers
+        log.warning(f"search API returned no data for {query}, rendering the search page instead")
 
-    log.info(f"scraping Pinterest search: {query}")
     first = await SCRAPFLY.async_scrape(
-        ScrapeConfig(url, session=session_id, render_js=True, auto_scroll=True,rendering_wait=8000, **BASE_CONFIG)
+        ScrapeConfig(
+            build_url(query), session=session_id, render_js=True, auto_scroll=True, rendering_wait=8000, **BASE_CONFIG
+        )
     )
-
     search_call, headers = get_search_call(first)
-    headers = {**headers, "content-type": "application/x-www-form-urlencoded"}
-    first_data = json.loads(search_call["response"]["body"])
+    state["headers"] = headers
+    return json.loads(search_call["response"]["body"]), search_call, search_api_headers(headers, query)
+
+
+async def _scrape_pinterest(session_id: str, state: Dict[str, Any], query: str, max_pages: int) -> PinSearch:
+    pages: List[dict] = []
+
+    log.info(f"scraping Pinterest search: {query}")
+    first_data, search_call, headers = await _scrape_first_page(session_id, state, query)
     pages.append(first_data)
     bookmark = first_data.get("resource_response", {}).get("bookmark")
     log.info("page 1: captured")
@@ -162,3 +306,8 @@ async def scrape_pinterest(query: str, max_pages: int = 3) -> PinSearch:
 
     log.success(f"scraped {len(pages)} pages for query: {query}")
     return parse_search_results(pages, query)
+
+
+async def scrape_pinterest(query: str, max_pages: int = 3) -> PinSearch:
+    """Scrape Pinterest search results and return parsed pin data."""
+    return await SESSION_POOL.run(lambda session, state: _scrape_pinterest(session, state, query, max_pages))
@@ -6,15 +6,19 @@ To run this scraper set env variable $SCRAPFLY_KEY with your scrapfly API key:
 $ export $SCRAPFLY_KEY="your key from https://scrapfly.io/dashboard"
 """
 import asyncio
+import itertools
 import json
 import math
 import os
+import random
 import re
+import sqlite3
+import time
 import jmespath
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
 from loguru import logger as log
 from parsel import Selector
 from scrapfly import ScrapeApiResponse, ScrapeConfig, ScrapflyClient
@@ -256,25 +260,188 @@ async def scrape_feed(url) -> Dict[str, datetime]:
     return results
 
 
-async def track_feed(url: str, output: Path, interval=60):
-    """Track Realtor.com feed, scrape new listings and append them as JSON to the output file"""
-    seen = set()
-    output.touch(exist_ok=True)
+class WorkPool:
+    """
+    Run an async function over many items with bounded concurrency, yielding (item, result) pairs
+    in completion order. Failed attempts are retried with jittered exponential backoff and every
+    attempt can be capped with a timeout. Like ScrapflyClient.concurrent_scrape, items that still
+    fail are yielded with their exception instead of raising it.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 5,
+        retries: int = 0,
+        timeout: Optional[float] = None,
+        backoff: float = 1.0,
+        max_backoff: float = 60.0,
+    ):
+        self.concurrency = concurrency
+        self.retries = retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def delay(self, attempt: int) -> float:
+        """full jitter backoff delay so retries of tasks that failed together don't retry together"""
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+    async def _run(self, func: Callable[[Any], Awaitable], item) -> Any:
+        for attempt in range(self.retries + 1):
+            try:
+                return await asyncio.wait_for(func(item), self.timeout)
+            except Exception as e:
+                if attempt == self.retries:
+                    return e
+                delay = self.delay(attempt)
+                log.debug(f"retrying {item} in {delay:.1f} seconds: {e!r}")
+                await asyncio.sleep(delay)
+
+    async def map(self, func: Callable[[Any], Awaitable], items: Iterable) -> AsyncIterator[Tuple[Any, Any]]:
+        items = iter(items)
+        pending = {}
+        try:
+            while True:
+                for item in itertools.islice(items, self.concurrency - len(pending)):
+                    pending[asyncio.ensure_future(self._run(func, item))] = item
+                if not pending:
+                    return
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield pending.pop(task), task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+class SeenStore:
+    """
+    On-disk deduplication index of feed entries ("url:publish date" keys) backed by SQLite.
+    Entries that dropped out of the feed longer than the retention window ago are pruned so the index
+    stays bounded no matter how long the tracker runs.
+    """
+
+    def __init__(self, path: Path, retention: timedelta = timedelta(days=30)):
+        self.retention = retention
+        self.db = sqlite3.connect(str(path))
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS seen (key TEXT PRIMARY KEY, seen_at REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS seen_at_index ON seen (seen_at)")
+        self.db.commit()
+
+    def __contains__(self, key: str) -> bool:
+        return self.db.execute("SELECT 1 FROM seen WHERE key = ?", (key,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM seen").fetchone()[0]
+
+    def unseen(self, keys: Iterable[str], batch_size: int = 500) -> List[str]:
+        """return keys that are not in the index yet, looked up with one query per batch of keys"""
+        keys = list(keys)
+        seen = set()
+        for i in range(0, len(keys), batch_size):
+            batch = keys[i : i + batch_size]
+            rows = self.db.execute(f"SELECT key FROM seen WHERE key IN ({','.join('?' * len(batch))})", batch)
+            seen.update(key for key, in rows)
+        return [key for key in keys if key not in seen]
+
+    def add(self, keys: Iterable[str]):
+        """mark keys as seen now, keys already in the index get their seen time refreshed"""
+        now = time.time()
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO seen (key, seen_at) VALUES (?, ?)", ((key, now) for key in keys)
+            )
+
+    def prune(self) -> int:
+        """drop entries older than the retention window, returns the number of dropped entries"""
+        with self.db:
+            expired = time.time() - self.retention.total_seconds()
+            cursor = self.db.execute("DELETE FROM seen WHERE seen_at < ?", (expired,))
+        return cursor.rowcount
+
+    def close(self):
+        self.db.close()
+
+
+class JsonlWriter:
+    """Buffered JSON lines writer that flushes and fsyncs each batch so written batches survive crashes"""
+
+    def __init__(self, path: Path):
+        self.file = path.open("a", encoding="utf-8")
+        self.buffer: List[str] = []
+
+    def write(self, item: Dict):
+        self.buffer.append(json.dumps(item) + "\n")
+
+    def flush(self):
+        if not self.buffer:
+            return
+        self.file.write("".join(self.buffer))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.buffer.clear()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+async def track_feed_once(
+    url: str, seen: SeenStore, writer: JsonlWriter, concurrency: int = 5, batch_size: int = 50
+) -> int:
+    """
+    Scrape new entries of a Realtor.com feed and write them to the writer in batches of finished properties.
+    Entries are only marked as seen once their batch is written so an interrupted run resumes where it stopped.
+    Returns the number of scraped properties.
+    """
+    changed = await scrape_feed(url=url)
+    keys = {k: f"{k}:{v}" for k, v in changed.items()}
+    new = set(seen.unseen(keys.values()))
+    log.info("found {} new feed entries out of {}", len(new), len(keys))
+    # entries still listed in the feed are kept from expiring
+    seen.add(key for key in keys.values() if key not in new)
+    pool = WorkPool(concurrency=concurrency, retries=2, timeout=300)
+    scraped = 0
+    done = []
+    async for property_url, property in pool.map(scrape_property, [k for k, key in keys.items() if key in new]):
+        if isinstance(property, Exception):
+            # failed entries stay unseen and are retried on the next cycle
+            log.warning("failed to scrape feed property {}: {!r}", property_url, property)
+            continue
+        if property:
+            writer.write(property)
+        done.append(keys[property_url])
+        if len(done) >= batch_size:
+            writer.flush()
+            seen.add(done)
+            scraped += len(done)
+            done = []
+    writer.flush()
+    seen.add(done)
+    return scraped + len(done)
+
+
+async def track_feed(
+    url: str, output: Path, interval=60, concurrency: int = 5, retention: timedelta = timedelta(days=30)
+):
+    """
+    Track Realtor.com feed, scrape new listings and append them as JSON to the output file.
+    Seen entries are kept in a SQLite index next to the output file (e.g. results.jsonl.seen)
+    so restarted trackers don't scrape the same listings again.
+    """
+    seen = SeenStore(output.with_name(output.name + ".seen"), retention=retention)
+    writer = JsonlWriter(output)
     try:
         while True:
-            changed = await scrape_feed(url=url)
-            # check deduplication filter
-            changed = {k: v for k, v in changed.items() if f"{k}:{v}" not in seen}
-            if changed:
-                # scrape properties and save to file - 1 property as JSON per line
-                properties = await asyncio.gather(scrape_property(url) for url in changed.keys())
-                with output.open("a") as f:
-                    f.write("\n".join(json.dumps(property) for property in properties))
-
-                # add seen to deduplication filter
-                for k, v in changed.items():
-                    seen.add(f"{k}:{v}")
-            print(f"scraped {len(properties)} properties; waiting {interval} seconds")
+            scraped = await track_feed_once(url, seen, writer, concurrency=concurrency)
+            pruned = seen.prune()
+            if pruned:
+                log.info("pruned {} expired entries from deduplication index", pruned)
+            print(f"scraped {scraped} properties; waiting {interval} seconds")
             await asyncio.sleep(interval)
     except KeyboardInterrupt:
         print("stopping price tracking")
+    finally:
+        writer.close()
+        seen.close()
@@ -6,10 +6,19 @@ $ export $SCRAPFLY_KEY="your key from https://scrapfly.io/dashboard"
 """
 
 import os
-from typing import Dict, List, Union
+import json
+import time
+import random
+import asyncio
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
 from datetime import datetime
+from urllib.parse import urlparse
 from uuid import uuid4
 from loguru import logger as log
+from lxml import etree
+from parsel import Selector, SelectorList
+from parsel.csstranslator import HTMLTranslator
 from scrapfly import ScrapeConfig, ScrapflyClient, ScrapeApiResponse
 
 SCRAPFLY = ScrapflyClient(key=os.environ["SCRAPFLY_KEY"])
@@ -29,18 +38,291 @@ BASE_CONFIG = {
 OLD_REDDIT_SESSION = "reddit-" + str(uuid4()).replace("-", "")
 
 
-async def scrape_old_reddit(url: str) -> ScrapeApiResponse:
-    """scrape an old.reddit URL, which sends some logged out requests to a login wall on HTTP 200"""
+class CompiledSelectors:
+    """
+    Registry of compiled selectors for hot parse loops: CSS queries are translated to XPath once and every
+    XPath is compiled once, rather than on every .css()/.xpath() call. get()/getall() also return
+    string results directly instead of wrapping every match in a Selector.
+    """
+
+    namespaces = {"re": "http://exslt.org/regular-expressions"}
+
+    def __init__(self):
+        self.compiled: Dict[Tuple[str, bool], etree.XPath] = {}
+        self.translator = HTMLTranslator()
+
+    def compile(self, query: str, css: bool = False) -> etree.XPath:
+        compiled = self.compiled.get((query, css))
+        if compiled is None:
+            xpath = self.translator.css_to_xpath(query) if css else query
+            compiled = etree.XPath(xpath, namespaces=self.namespaces, smart_strings=False)
+            self.compiled[(query, css)] = compiled
+        return compiled
+
+    def _evaluate(self, selector: Union[Selector, SelectorList], query: str, css: bool) -> list:
+        compiled = self.compile(query, css)
+        nodes = []
+        for item in selector if isinstance(selector, SelectorList) else [selector]:
+            result = compiled(item.root)
+            nodes.extend(result if isinstance(result, list) else [result])
+        return nodes
+
+    @staticmethod
+    def _wrap(node) -> Selector:
+        return Selector(root=node, type="html")
+
+    def select(self, selector: Union[Selector, SelectorList], query: str, css: bool = False) -> SelectorList:
+        """same as selector.xpath(query) or selector.css(query)"""
+        return SelectorList(self._wrap(node) for node in self._evaluate(selector, query, css))
+
+    def get(
+        self, selector: Union[Selector, SelectorList], query: str, default: Optional[str] = None, css: bool = False
+    ) -> Optional[str]:
+        """same as selector.xpath(query).get(default) or selector.css(query).get(default)"""
+        for node in self._evaluate(selector, query, css):
+            return node if isinstance(node, str) else self._wrap(node).get()
+        return default
+
+    def getall(self, selector: Union[Selector, SelectorList], query: str, css: bool = False) -> List[str]:
+        """same as selector.xpath(query).getall() or selector.css(query).getall()"""
+        nodes = self._evaluate(selector, query, css)
+        return [node if isinstance(node, str) else self._wrap(node).get() for node in nodes]
+
+
+SELECTORS = CompiledSelectors()
+
+
+async def paginate(
+    fetch: Callable[[Optional[str]], Awaitable[ScrapeApiResponse]],
+    next_cursor: Callable[[ScrapeApiResponse], Optional[str]],
+    parse: Callable[[ScrapeApiResponse], List[Dict]],
+    queue: asyncio.Queue,
+    max_pages: Optional[int] = None,
+    checkpoint: Optional[Path] = None,
+    state: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    Scrape cursor paginated pages and put their parsed rows on the queue.
+    fetch(None) scrapes the first page and fetch(cursor) the following ones. The next page request is started
+    as soon as its cursor is extracted so it's in flight while the current page is parsed and consumed.
+    The consumer has to call queue.task_done() for every row: the cursor of the next page (and the `state` dict)
+    is saved to the checkpoint file once all rows of a page are processed, so a restarted crawl resumes from it.
+    max_pages limits the pages scraped after the first one.
+    """
+    state = state if state is not None else {}
+    cursor, pages = None, 0
+    if checkpoint and checkpoint.exists():
+        saved = json.loads(checkpoint.read_text())
+        cursor, pages = saved["cursor"], saved["pages"]
+        state.update(saved["state"])
+        if cursor is None:
+            log.info(f"pagination in {checkpoint} is already complete")
+            return state
+        log.info(f"resuming pagination after {pages} pages from {checkpoint}")
+
+    def has_more(cursor: Optional[str], pages: int) -> bool:
+        return bool(cursor) and (max_pages is None or pages <= max_pages)
+
+    next_page = asyncio.ensure_future(fetch(cursor))
+    while next_page:
+        response = await next_page
+        pages += 1
+        cursor = next_cursor(response)
+        next_page = None
+        if has_more(cursor, pages):
+            next_page = asyncio.ensure_future(fetch(cursor))
+            await asyncio.sleep(0)  # let the next request start before parsing blocks the loop
+        try:
+            for row in parse(response):
+                await queue.put(row)
+            await queue.join()
+        except BaseException:
+            if next_page:
+                next_page.cancel()
+            raise
+        if checkpoint:
+            remaining = cursor if has_more(cursor, pages) else None
+            checkpoint.write_text(json.dumps({"cursor": remaining, "pages": pages, "state": state}))
+    return state
+
+
+async def _collect(queue: asyncio.Queue, rows: List[Dict]):
+    while True:
+        rows.append(await queue.get())
+        queue.task_done()
+
+
+async def _paginate_rows(queue: Optional[asyncio.Queue], **kwargs) -> Tuple[List[Dict], Dict[str, Any]]:
+    """paginate to the given queue or, without one, collect all rows into a list"""
+    if queue is not None:
+        return [], await paginate(queue=queue, **kwargs)
+    rows = []
+    queue = asyncio.Queue()
+    collector = asyncio.ensure_future(_collect(queue, rows))
+    try:
+        state = await paginate(queue=queue, **kwargs)
+    finally:
+        collector.cancel()
+    return rows, state
+
+
+class CircuitOpenError(Exception):
+    """raised instead of scraping while the circuit breaker of the target domain is open"""
+
+
+class Resilience:
+    """
+    Retry layer around ScrapflyClient.async_scrape that keeps per-domain state shared by every coroutine:
+    - retry budget: a domain holds up to `retry_budget` retry tokens, every first attempt earns `budget_ratio`
+      of a token and every retry spends one, so a target that starts blocking can't make every caller retry at once
+    - decorrelated jitter backoff between the retries of a request
+    - circuit breaker: `failure_threshold` consecutive failures open the domain's circuit and requests fail fast
+      with CircuitOpenError for `reset_timeout` seconds, after which a single trial request closes or reopens it
+    Per-domain counters are available from metrics().
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 3,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        retry_budget: int = 10,
+        budget_ratio: float = 0.2,
+        failure_threshold: int = 5,
+        reset_timeout: float = 60.0,
+        timeout: Optional[float] = None,
+    ):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_budget = retry_budget
+        self.budget_ratio = budget_ratio
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.timeout = timeout
+        self.domains: Dict[str, Dict[str, Any]] = {}
+
+    def _domain(self, url: str) -> Dict[str, Any]:
+        domain = urlparse(url).netloc
+        if domain not in self.domains:
+            self.domains[domain] = {
+                "state": "closed",
+                "opened_at": 0.0,
+                "trial": False,
+                "consecutive_failures": 0,
+                "tokens": float(self.retry_budget),
+                "requests": 0,
+                "successes": 0,
+                "failures": 0,
+                "retries": 0,
+                "budget_exhausted": 0,
+                "short_circuited": 0,
+                "circuit_opened": 0,
+            }
+        return self.domains[domain]
+
+    def delay(self, previous: float) -> float:
+        """decorrelated jitter: anywhere between the base delay and three times the previous delay"""
+        return min(self.max_delay, random.uniform(self.base_delay, previous * 3))
+
+    def _allow(self, stats: Dict[str, Any]) -> bool:
+        if stats["state"] == "open":
+            if time.monotonic() - stats["opened_at"] < self.reset_timeout:
+                return False
+            stats["state"] = "half_open"
+        if stats["state"] == "half_open":
+            if stats["trial"]:
+                return False
+            stats["trial"] = True
+        return True
+
+    def _record(self, domain: str, stats: Dict[str, Any], success: bool):
+        stats["trial"] = False
+        if success:
+            stats["successes"] += 1
+            stats["consecutive_failures"] = 0
+            stats["state"] = "closed"
+            return
+        stats["failures"] += 1
+        stats["consecutive_failures"] += 1
+        if stats["state"] == "half_open" or stats["consecutive_failures"] >= self.failure_threshold:
+            if stats["state"] != "open":
+                log.warning(f"opening the circuit breaker of {domain} after {stats['consecutive_failures']} failures")
+                stats["circuit_opened"] += 1
+            stats["state"] = "open"
+            stats["opened_at"] = time.monotonic()
+
+    async def run(
+        self,
+        config: ScrapeConfig,
+        scrape: Callable[[ScrapeConfig], Awaitable[ScrapeApiResponse]],
+        parse: Optional[Callable[[ScrapeApiResponse], Any]] = None,
+    ) -> Any:
+        """
+        scrape a config and return the response, or parse(response) when given. Failures of either are retried
+        within the domain's budget, the last error is raised once retries run out
+        """
+        domain = urlparse(config.url).netloc
+        stats = self._domain(config.url)
+        stats["tokens"] = min(self.retry_budget, stats["tokens"] + self.budget_ratio)
+        delay = self.base_delay
+        for attempt in range(self.max_retries + 1):
+            if not self._allow(stats):
+                stats["short_circuited"] += 1
+                raise CircuitOpenError(f"the circuit breaker of {domain} is open, not scraping {config.url}")
+            stats["requests"] += 1
+            try:
+                response = await asyncio.wait_for(scrape(config), self.timeout)
+                result = parse(response) if parse else response
+            except asyncio.CancelledError:
+                stats["trial"] = False
+                raise
+            except Exception as e:
+                self._record(domain, stats, success=False)
+                if attempt == self.max_retries:
+                    raise
+                if stats["tokens"] < 1:
+                    stats["budget_exhausted"] += 1
+                    log.warning(f"the retry budget of {domain} is exhausted, not retrying {config.url}")
+                    raise
+                stats["tokens"] -= 1
+                stats["retries"] += 1
+                delay = self.delay(delay)
+                log.debug(f"retrying {config.url} in {delay:.1f} seconds: {e!r}")
+                await asyncio.sleep(delay)
+            else:
+                self._record(domain, stats, success=True)
+                return result
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        """request, retry and circuit breaker counters of every domain"""
+        hidden = ("opened_at", "trial")
+        return {
+            domain: {key: value for key, value in stats.items() if key not in hidden}
+            for domain, stats in self.domains.items()
+        }
+
+
+RESILIENCE = Resilience()
+
+
+class LoginWallError(Exception):
+    """old.reddit redirected a logged out request to its login wall"""
+
+
+async def _scrape_old_reddit_session(config: ScrapeConfig) -> ScrapeApiResponse:
+    """scrape with the current old.reddit session, the login wall follows the session so it's rotated on a hit"""
     global OLD_REDDIT_SESSION
-    for _ in range(3):  # retry the login wall, it follows the session rather than the URL
-        response = await SCRAPFLY.async_scrape(
-            ScrapeConfig(url, **BASE_CONFIG, session=OLD_REDDIT_SESSION)
-        )
-        if "/login/" not in (response.scrape_result.get("url") or ""):
-            return response
-        log.debug("Redirected to the login wall, rotating the session and retrying...")
+    response = await SCRAPFLY.async_scrape(ScrapeConfig(config.url, **BASE_CONFIG, session=OLD_REDDIT_SESSION))
+    if "/login/" in (response.scrape_result.get("url") or ""):
         OLD_REDDIT_SESSION = "reddit-" + str(uuid4()).replace("-", "")
-    raise RuntimeError(f"old.reddit kept redirecting to the login wall for {url}")
+        raise LoginWallError(f"old.reddit redirected {config.url} to the login wall")
+    return response
+
+
+async def scrape_old_reddit(url: str) -> ScrapeApiResponse:
+    """scrape an old.reddit URL, login wall redirects are retried on a new session within the retry budget"""
+    return await RESILIENCE.run(ScrapeConfig(url, **BASE_CONFIG), _scrape_old_reddit_session)
 
 
 def parse_subreddit(response: ScrapeApiResponse) -> Dict:
@@ -49,50 +331,52 @@ def parse_subreddit(response: ScrapeApiResponse) -> Dict:
     url = response.context["url"]
     info = {}
     info["id"] = url.split("/r")[-1].replace("/", "")
-    info["description"] = selector.xpath("//shreddit-subreddit-header/@description").get()
-    members_text = selector.xpath("//faceplate-number[following-sibling::text()[contains(., 'members')]]/@number").get()
-    weekly_active = selector.xpath("//shreddit-subreddit-header/@weekly-active-users").get()
-    rank = selector.xpath("//strong[@id='position']/text()").get()
+    info["description"] = SELECTORS.get(selector, "//shreddit-subreddit-header/@description")
+    members_text = SELECTORS.get(
+        selector, "//faceplate-number[following-sibling::text()[contains(., 'members')]]/@number"
+    )
+    weekly_active = SELECTORS.get(selector, "//shreddit-subreddit-header/@weekly-active-users")
+    rank = SELECTORS.get(selector, "//strong[@id='position']/text()")
     info["rank"] = rank.strip() if rank else None
     info["members"] = int(members_text) if members_text else (int(weekly_active) if weekly_active else None)
     info["bookmarks"] = {}
-    for item in selector.xpath("//div[faceplate-tracker[@source='community_menu']]/faceplate-tracker"):
-        name = item.xpath(".//a/span/span/span/text()").get()
-        link = item.xpath(".//a/@href").get()
+    for item in SELECTORS.select(selector, "//div[faceplate-tracker[@source='community_menu']]/faceplate-tracker"):
+        name = SELECTORS.get(item, ".//a/span/span/span/text()")
+        link = SELECTORS.get(item, ".//a/@href")
         if name and link:
             info["bookmarks"][name] = link
 
     info["url"] = url
     post_data = []
-    for box in selector.xpath("//article[@data-post-id]"):
-        link = box.xpath(".//a/@href").get()
-        author = box.xpath(".//shreddit-post/@author").get()
-        post_label = box.xpath(".//span[contains(@class, 'bg-tone-4')]/div/text()").get()
-        upvotes = box.xpath(".//shreddit-post/@score").get()
-        comment_count = box.xpath(".//shreddit-post/@comment-count").get()
-        attachment_type = box.xpath(".//shreddit-post/@post-type").get()
+    for box in SELECTORS.select(selector, "//article[@data-post-id]"):
+        link = SELECTORS.get(box, ".//a/@href")
+        author = SELECTORS.get(box, ".//shreddit-post/@author")
+        post_label = SELECTORS.get(box, ".//span[contains(@class, 'bg-tone-4')]/div/text()")
+        upvotes = SELECTORS.get(box, ".//shreddit-post/@score")
+        comment_count = SELECTORS.get(box, ".//shreddit-post/@comment-count")
+        attachment_type = SELECTORS.get(box, ".//shreddit-post/@post-type")
 
         attachment_link = None
         if attachment_type:
             if attachment_type == "image":
-                attachment_link = box.xpath(".//img[contains(@class, 'media-lightbox-img')]/@src").get()
+                attachment_link = SELECTORS.get(box, ".//img[contains(@class, 'media-lightbox-img')]/@src")
                 if not attachment_link:
-                    attachment_link = box.xpath(".//img[contains(@alt, 'r/wallstreetbets')]/@src").get()
+                    attachment_link = SELECTORS.get(box, ".//img[contains(@alt, 'r/wallstreetbets')]/@src")
             elif attachment_type == "video":
-                attachment_link = box.xpath(".//shreddit-player/@preview").get()
+                attachment_link = SELECTORS.get(box, ".//shreddit-player/@preview")
             elif attachment_type == "gallery":
-                attachment_link = box.xpath(".//img[contains(@class, 'media-lightbox-img')]/@src").get()
+                attachment_link = SELECTORS.get(box, ".//img[contains(@class, 'media-lightbox-img')]/@src")
             if not attachment_link:
-                attachment_link = box.xpath(".//shreddit-post/@content-href").get()
+                attachment_link = SELECTORS.get(box, ".//shreddit-post/@content-href")
 
         post_data.append(
             {
                 "authorProfile": "https://www.reddit.com/user/" + author if author else None,
-                "authorId": box.xpath(".//shreddit-post/@author-id").get(),
-                "title": box.xpath(".//shreddit-post/@post-title").get(),
+                "authorId": SELECTORS.get(box, ".//shreddit-post/@author-id"),
+                "title": SELECTORS.get(box, ".//shreddit-post/@post-title"),
                 "link": "https://www.reddit.com" + link if link and link.startswith("/") else link,
-                "publishingDate": box.xpath(".//shreddit-post/@created-timestamp").get(),
-                "postId": box.xpath(".//shreddit-post/@id").get(),
+                "publishingDate": SELECTORS.get(box, ".//shreddit-post/@created-timestamp"),
+                "postId": SELECTORS.get(box, ".//shreddit-post/@id"),
                 "postLabel": post_label.strip() if post_label else None,
                 "postUpvotes": int(upvotes) if upvotes else None,
                 "commentCount": int(comment_count) if comment_count else None,
@@ -101,37 +385,50 @@ def parse_subreddit(response: ScrapeApiResponse) -> Dict:
             }
         )
     # id for the next posts batch
-    cursor_id = selector.xpath("//shreddit-post/@more-posts-cursor").get()
+    cursor_id = SELECTORS.get(selector, "//shreddit-post/@more-posts-cursor")
     return {"post_data": post_data, "info": info, "cursor": cursor_id}
 
 
-async def scrape_subreddit(subreddit_id: str, max_pages: int = None) -> Dict:
-    """scrape articles on a subreddit"""
+async def scrape_subreddit(
+    subreddit_id: str,
+    max_pages: int = None,
+    queue: Optional[asyncio.Queue] = None,
+    checkpoint: Optional[Path] = None,
+) -> Dict:
+    """
+    scrape articles on a subreddit.
+    When a queue is given posts are put on it rather than returned, see paginate() for queue and checkpoint use.
+    """
     base_url = f"https://www.reddit.com/r/{subreddit_id}/"
-    response = await SCRAPFLY.async_scrape(
-        ScrapeConfig(base_url, **BASE_CONFIG, wait_for_selector="//article[@data-post-id]")
-    )
-    subreddit_data = {}
-    data = parse_subreddit(response)
-    subreddit_data["info"] = data["info"]
-    subreddit_data["posts"] = data["post_data"]
-    cursor = data["cursor"]
 
     def make_pagination_url(cursor_id: str):
         return f"https://www.reddit.com/svc/shreddit/community-more-posts/hot/?after={cursor_id}%3D%3D&t=DAY&name={subreddit_id}&feedLength=3"
 
-    while cursor and (max_pages is None or max_pages > 0):
-        url = make_pagination_url(cursor)
-        response = await SCRAPFLY.async_scrape(ScrapeConfig(url, **BASE_CONFIG))
-        data = parse_subreddit(response)
-        cursor = data["cursor"]
+    async def fetch(cursor: Optional[str]) -> ScrapeApiResponse:
+        if cursor is None:
+            config = ScrapeConfig(base_url, **BASE_CONFIG, wait_for_selector="//article[@data-post-id]")
+        else:
+            config = ScrapeConfig(make_pagination_url(cursor), **BASE_CONFIG)
+        return await SCRAPFLY.async_scrape(config)
 
-        post_data = data["post_data"]
-        subreddit_data["posts"].extend(post_data)
-        if max_pages is not None:
-            max_pages -= 1
-    log.success(f"scraped {len(subreddit_data['posts'])} posts from the rubreddit: r/{subreddit_id}")
-    return subreddit_data
+    state = {}
+
+    def parse(response: ScrapeApiResponse) -> List[Dict]:
+        data = parse_subreddit(response)
+        state.setdefault("info", data["info"])  # subreddit info is only complete on the first page
+        return data["post_data"]
+
+    posts, state = await _paginate_rows(
+        queue,
+        fetch=fetch,
+        next_cursor=lambda response: SELECTORS.get(response.selector, "//shreddit-post/@more-posts-cursor"),
+        parse=parse,
+        max_pages=max_pages,
+        checkpoint=checkpoint,
+        state=state,
+    )
+    log.success(f"scraped {len(posts)} posts from the rubreddit: r/{subreddit_id}")
+    return {"info": state.get("info"), "posts": posts}
 
 
 def parse_post_info(response: ScrapeApiResponse) -> Dict:
@@ -163,43 +460,41 @@ def parse_post_comments(response: ScrapeApiResponse) -> List[Dict]:
 
     def parse_comment(parent_selector) -> Dict:
         """parse a comment object"""
-        author = parent_selector.xpath("./@data-author").get()
-        link = parent_selector.xpath("./@data-permalink").get()
-        dislikes = parent_selector.xpath(".//span[contains(@class, 'dislikes')]/@title").get()
-        upvotes = parent_selector.xpath(".//span[contains(@class, 'likes')]/@title").get()
-        downvotes = parent_selector.xpath(".//span[contains(@class, 'unvoted')]/@title").get()        
+        # only look into the comment's own entry - descendant queries on the comment box would
+        # scan (and pick up values from) all of its nested replies
+        entry = SELECTORS.select(parent_selector, "./div[contains(@class, 'entry')]")
+        author = SELECTORS.get(parent_selector, "./@data-author")
+        link = SELECTORS.get(parent_selector, "./@data-permalink")
+        dislikes = SELECTORS.get(entry, ".//span[contains(@class, 'dislikes')]/@title")
+        upvotes = SELECTORS.get(entry, ".//span[contains(@class, 'likes')]/@title")
+        downvotes = SELECTORS.get(entry, ".//span[contains(@class, 'unvoted')]/@title")
         return {
-            "authorId": parent_selector.xpath("./@data-author-fullname").get(),
+            "authorId": SELECTORS.get(parent_selector, "./@data-author-fullname"),
             "author": author,
             "authorProfile": "https://www.reddit.com/user/" + author if author else None,
-            "commentId": parent_selector.xpath("./@data-fullname").get(),
+            "commentId": SELECTORS.get(parent_selector, "./@data-fullname"),
             "link": "https://www.reddit.com" + link if link else None,
-            "publishingDate": parent_selector.xpath(".//time/@datetime").get(),
-            "commentBody": parent_selector.xpath(".//div[@class='md']/p/text()").get(),
+            "publishingDate": SELECTORS.get(entry, ".//time/@datetime"),
+            "commentBody": SELECTORS.get(entry, ".//div[@class='md']/p/text()"),
             "upvotes": int(upvotes) if upvotes else None,
             "dislikes": int(dislikes) if dislikes else None,
-            "downvotes": int(downvotes) if downvotes else None,            
+            "downvotes": int(downvotes) if downvotes else None,
         }
 
-    def parse_replies(what) -> List[Dict]:
-        """recursively parse replies"""
-        replies = []
-        for reply_box in what.xpath(".//div[@data-type='comment']"):
-            reply_comment = parse_comment(reply_box)
-            child_replies = parse_replies(reply_box)
-            if child_replies:
-                reply_comment["replies"] = child_replies
-            replies.append(reply_comment)
-        return replies
-
+    # replies are the direct comment children of the comment's "child" listing, so walking the tree
+    # from the top level comments visits every comment exactly once
     selector = response.selector
     data = []
-    for item in selector.xpath("//div[@class='sitetable nestedlisting']/div[@data-type='comment']"):
-        comment_data = parse_comment(item)
-        replies = parse_replies(item)
-        if replies:
-            comment_data["replies"] = replies
-        data.append(comment_data)            
+    top_level = SELECTORS.select(selector, "//div[@class='sitetable nestedlisting']/div[@data-type='comment']")
+    stack = [(item, data) for item in reversed(top_level)]
+    while stack:
+        comment_box, siblings = stack.pop()
+        comment_data = parse_comment(comment_box)
+        siblings.append(comment_data)
+        reply_boxes = SELECTORS.select(comment_box, "./div[@class='child']/div/div[@data-type='comment']")
+        if reply_boxes:
+            comment_data["replies"] = []
+            stack.extend((reply_box, comment_data["replies"]) for reply_box in reversed(reply_boxes))
     return data
 
 
@@ -248,20 +543,42 @@ def parse_user_posts(response: ScrapeApiResponse) -> List[Dict]:
     return {"data": data, "url": next_page_url}
 
 
-async def scrape_user_posts(username: str, sort: Union["new", "top", "controversial"], max_pages: int = None) -> List[Dict]:
-    """scrape user posts"""
+async def _scrape_old_reddit_pages(
+    url: str,
+    parse: Callable[[ScrapeApiResponse], Dict],
+    max_pages: Optional[int],
+    queue: Optional[asyncio.Queue],
+    checkpoint: Optional[Path],
+) -> List[Dict]:
+    """scrape old.reddit listing pages that link to their next page"""
+
+    async def fetch(cursor: Optional[str]) -> ScrapeApiResponse:
+        return await scrape_old_reddit(cursor or url)
+
+    rows, _ = await _paginate_rows(
+        queue,
+        fetch=fetch,
+        next_cursor=lambda response: SELECTORS.get(response.selector, "//span[@class='next-button']/a/@href"),
+        parse=lambda response: parse(response)["data"],
+        max_pages=max_pages,
+        checkpoint=checkpoint,
+    )
+    return rows
+
+
+async def scrape_user_posts(
+    username: str,
+    sort: Union["new", "top", "controversial"],
+    max_pages: int = None,
+    queue: Optional[asyncio.Queue] = None,
+    checkpoint: Optional[Path] = None,
+) -> List[Dict]:
+    """
+    scrape user posts.
+    When a queue is given posts are put on it rather than returned, see paginate() for queue and checkpoint use.
+    """
     url = f"https://old.reddit.com/user/{username}/submitted/?sort={sort}"
-    response = await scrape_old_reddit(url)
-    data = parse_user_posts(response)
-    post_data, next_page_url = data["data"], data["url"]
-
-    while next_page_url and (max_pages is None or max_pages > 0):
-        response = await scrape_old_reddit(next_page_url)
-        data = parse_user_posts(response)
-        next_page_url = data["url"]
-        post_data.extend(data["data"])
-        if max_pages is not None:
-            max_pages -= 1
+    post_data = await _scrape_old_reddit_pages(url, parse_user_posts, max_pages, queue, checkpoint)
     log.success(f"scraped {len(post_data)} posts from the {username} reddit profile")
     return post_data
 
@@ -299,19 +616,18 @@ def parse_user_comments(response: ScrapeApiResponse) -> List[Dict]:
     return {"data": data, "url": next_page_url}
 
 
-async def scrape_user_comments(username: str, sort: Union["new", "top", "controversial"], max_pages: int = None) -> List[Dict]:
-    """scrape user posts"""
+async def scrape_user_comments(
+    username: str,
+    sort: Union["new", "top", "controversial"],
+    max_pages: int = None,
+    queue: Optional[asyncio.Queue] = None,
+    checkpoint: Optional[Path] = None,
+) -> List[Dict]:
+    """
+    scrape user comments.
+    When a queue is given comments are put on it rather than returned, see paginate() for queue and checkpoint use.
+    """
     url = f"https://old.reddit.com/user/{username}/comments/?sort={sort}"
-    response = await scrape_old_reddit(url)
-    data = parse_user_comments(response)
-    post_data, next_page_url = data["data"], data["url"]
-
-    while next_page_url and (max_pages is None or max_pages > 0):
-        response = await scrape_old_reddit(next_page_url)
-        data = parse_user_comments(response)
-        next_page_url = data["url"]
-        post_data.extend(data["data"])
-        if max_pages is not None:
-            max_pages -= 1
+    post_data = await _scrape_old_reddit_pages(url, parse_user_comments, max_pages, queue, checkpoint)
     log.success(f"scraped {len(post_data)} posts from the {username} reddit profile")
     return post_data
@@ -8,12 +8,17 @@ To run this scraper set env variable $SCRAPFLY_KEY with your scrapfly API key:
 $ export $SCRAPFLY_KEY="your key from https://scrapfly.io/dashboard"
 """
 import asyncio
+import gzip
 import json
 import os
-from typing import Dict, List, Optional, Tuple, TypedDict
+import random
+import time
+from io import BytesIO
+from typing import IO, Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, TypedDict
 from urllib.parse import urljoin, urlparse
 
 from loguru import logger as log
+from lxml import etree
 from parsel import Selector
 from scrapfly import ScrapeApiResponse, ScrapeConfig, ScrapflyClient
 
@@ -221,17 +226,166 @@ def parse_catalog_product(product: Dict, store_root: str) -> ShopifyProduct:
     }
 
 
+class CircuitOpenError(Exception):
+    """raised instead of scraping while the circuit breaker of the target domain is open"""
+
+
+class Resilience:
+    """
+    Retry layer around ScrapflyClient.async_scrape that keeps per-domain state shared by every coroutine:
+    - retry budget: a domain holds up to `retry_budget` retry tokens, every first attempt earns `budget_ratio`
+      of a token and every retry spends one, so a target that starts blocking can't make every caller retry at once
+    - decorrelated jitter backoff between the retries of a request
+    - circuit breaker: `failure_threshold` consecutive failures open the domain's circuit and requests fail fast
+      with CircuitOpenError for `reset_timeout` seconds, after which a single trial request closes or reopens it
+    Per-domain counters are available from metrics().
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 3,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        retry_budget: int = 10,
+        budget_ratio: float = 0.2,
+        failure_threshold: int = 5,
+        reset_timeout: float = 60.0,
+        timeout: Optional[float] = None,
+    ):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_budget = retry_budget
+        self.budget_ratio = budget_ratio
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.timeout = timeout
+        self.domains: Dict[str, Dict[str, Any]] = {}
+
+    def _domain(self, url: str) -> Dict[str, Any]:
+        domain = urlparse(url).netloc
+        if domain not in self.domains:
+            self.domains[domain] = {
+                "state": "closed",
+                "opened_at": 0.0,
+                "trial": False,
+                "consecutive_failures": 0,
+                "tokens": float(self.retry_budget),
+                "requests": 0,
+                "successes": 0,
+                "failures": 0,
+                "retries": 0,
+                "budget_exhausted": 0,
+                "short_circuited": 0,
+                "circuit_opened": 0,
+            }
+        return self.domains[domain]
+
+    def delay(self, previous: float) -> float:
+        """decorrelated jitter: anywhere between the base delay and three times the previous delay"""
+        return min(self.max_delay, random.uniform(self.base_delay, previous * 3))
+
+    def _allow(self, stats: Dict[str, Any]) -> bool:
+        if stats["state"] == "open":
+            if time.monotonic() - stats["opened_at"] < self.reset_timeout:
+                return False
+            stats["state"] = "half_open"
+        if stats["state"] == "half_open":
+            if stats["trial"]:
+                return False
+            stats["trial"] = True
+        return True
+
+    def _record(self, domain: str, stats: Dict[str, Any], success: bool):
+        stats["trial"] = False
+        if success:
+            stats["successes"] += 1
+            stats["consecutive_failures"] = 0
+            stats["state"] = "closed"
+            return
+        stats["failures"] += 1
+        stats["consecutive_failures"] += 1
+        if stats["state"] == "half_open" or stats["consecutive_failures"] >= self.failure_threshold:
+            if stats["state"] != "open":
+                log.warning(f"opening the circuit breaker of {domain} after {stats['consecutive_failures']} failures")
+                stats["circuit_opened"] += 1
+            stats["state"] = "open"
+            stats["opened_at"] = time.monotonic()
+
+    async def run(
+        self,
+        config: ScrapeConfig,
+        scrape: Callable[[ScrapeConfig], Awaitable[ScrapeApiResponse]],
+        parse: Optional[Callable[[ScrapeApiResponse], Any]] = None,
+    ) -> Any:
+        """
+        scrape a config and return the response, or parse(response) when given. Failures of either are retried
+        within the domain's budget, the last error is raised once retries run out
+        """
+        domain = urlparse(config.url).netloc
+        stats = self._domain(config.url)
+        stats["tokens"] = min(self.retry_budget, stats["tokens"] + self.budget_ratio)
+        delay = self.base_delay
+        for attempt in range(self.max_retries + 1):
+            if not self._allow(stats):
+                stats["short_circuited"] += 1
+                raise CircuitOpenError(f"the circuit breaker of {domain} is open, not scraping {config.url}")
+            stats["requests"] += 1
+            try:
+                response = await asyncio.wait_for(scrape(config), self.timeout)
+                result = parse(response) if parse else response
+            except asyncio.CancelledError:
+                stats["trial"] = False
+                raise
+            except Exception as e:
+                self._record(domain, stats, success=False)
+                if attempt == self.max_retries:
+                    raise
+                if stats["tokens"] < 1:
+                    stats["budget_exhausted"] += 1
+                    log.warning(f"the retry budget of {domain} is exhausted, not retrying {config.url}")
+                    raise
+                stats["tokens"] -= 1
+                stats["retries"] += 1
+                delay = self.delay(delay)
+                log.debug(f"retrying {config.url} in {delay:.1f} seconds: {e!r}")
+                await asyncio.sleep(delay)
+            else:
+                self._record(domain, stats, success=True)
+                return result
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        """request, retry and circuit breaker counters of every domain"""
+        hidden = ("opened_at", "trial")
+        return {
+            domain: {key: value for key, value in stats.items() if key not in hidden}
+            for domain, stats in self.domains.items()
+        }
+
+
+RESILIENCE = Resilience(max_retries=CATALOG_MAX_RETRIES, base_delay=CATALOG_PAGE_DELAY * 2)
+
+
+class RateLimitedError(Exception):
+    """a catalog page was rate limited"""
+
+
+def _classify_or_raise(response: ScrapeApiResponse) -> Tuple[str, Optional[List[Dict]]]:
+    """classify a catalog page, rate limited ones are retried by the resilience layer"""
+    outcome, products = classify_catalog_response(response)
+    if outcome == "rate_limited":
+        raise RateLimitedError(f"rate limited on {response.context['url']}")
+    return outcome, products
+
+
 async def _scrape_catalog_page(url: str) -> Tuple[str, Optional[List[Dict]]]:
-    """fetch one catalog page, retrying a bounded number of times on a rate limit"""
-    for attempt in range(CATALOG_MAX_RETRIES + 1):
-        response = await SCRAPFLY.async_scrape(ScrapeConfig(url, **CLASSIFY_CONFIG))
-        outcome, products = classify_catalog_response(response)
-        if outcome != "rate_limited" or attempt == CATALOG_MAX_RETRIES:
-            return outcome, products
-        backoff = CATALOG_PAGE_DELAY * 2 ** (attempt + 1)
-        log.warning(f"rate limited on {url}, retrying in {backoff}s")
-        await asyncio.sleep(backoff)
-    return "rate_limited", None
+    """fetch one catalog page, retrying rate limits within the store's retry budget"""
+    try:
+        config = ScrapeConfig(url, **CLASSIFY_CONFIG)
+        return await RESILIENCE.run(config, SCRAPFLY.async_scrape, parse=_classify_or_raise)
+    except (RateLimitedError, CircuitOpenError) as e:
+        log.warning(f"giving up on {url}: {e}")
+        return "rate_limited", None
 
 
 async def scrape_catalog(
@@ -366,9 +520,32 @@ async def scrape_product_pages(urls: List[str]) -> List[ShopifyProductPage]:
     return products
 
 
+def iter_sitemap(stream: IO[bytes]) -> Iterator[Tuple[str, Optional[str]]]:
+    """
+    stream (loc, lastmod) entries of a sitemap or sitemap index from a plain or gzipped xml byte stream.
+    The xml is parsed incrementally and every parsed entry is dropped from the tree so memory use stays
+    constant regardless of sitemap size.
+    """
+    if stream.read(2) == b"\x1f\x8b":
+        stream.seek(0)
+        stream = gzip.GzipFile(fileobj=stream)
+    else:
+        stream.seek(0)
+    for _, node in etree.iterparse(stream, events=("end",), tag=("{*}url", "{*}sitemap")):
+        loc = node.findtext("{*}loc")
+        lastmod = node.findtext("{*}lastmod")
+        node.clear()
+        while node.getprevious() is not None:
+            del node.getparent()[0]
+        if loc:
+            yield loc.strip(), lastmod.strip() if lastmod else None
+
+
 def parse_sitemap_locations(response: ScrapeApiResponse) -> List[str]:
     """parse every loc entry of a sitemap index or a sitemap"""
-    return response.selector.css("loc::text").getall()
+    content = response.scrape_result["content"]
+    stream = content if hasattr(content, "read") else BytesIO(content.encode("utf-8"))
+    return [loc for loc, _ in iter_sitemap(stream)]
 
 
 async def scrape_product_urls(store_url: str, max_sitemaps: int = 1) -> List[str]:
@@ -12,8 +12,8 @@ import json
 import jmespath
 import base64
 from io import BytesIO
-from parsel import Selector
-from typing import Dict, List, Optional
+from lxml import etree
+from typing import IO, Dict, Iterator, List, Optional, Tuple
 from loguru import logger as log
 from scrapfly import ScrapeConfig, ScrapflyClient, ScrapeApiResponse
 
@@ -97,27 +97,43 @@ async def scrape_website_compare(first_domain: str, second_domain: str) -> Dict:
     return data
 
 
+def iter_sitemap(stream: IO[bytes]) -> Iterator[Tuple[str, Optional[str]]]:
+    """
+    stream (loc, lastmod) entries of a sitemap or sitemap index from a plain or gzipped xml byte stream.
+    The xml is parsed incrementally and every parsed entry is dropped from the tree so memory use stays
+    constant regardless of sitemap size.
+    """
+    if stream.read(2) == b"\x1f\x8b":
+        stream.seek(0)
+        stream = gzip.GzipFile(fileobj=stream)
+    else:
+        stream.seek(0)
+    for _, node in etree.iterparse(stream, events=("end",), tag=("{*}url", "{*}sitemap")):
+        loc = node.findtext("{*}loc")
+        lastmod = node.findtext("{*}lastmod")
+        node.clear()
+        while node.getprevious() is not None:
+            del node.getparent()[0]
+        if loc:
+            yield loc.strip(), lastmod.strip() if lastmod else None
+
+
 def parse_sitemaps(response: ScrapeApiResponse) -> List[str]:
     """parse links for bestbuy sitemap"""
     content = response.scrape_result['content']
 
+    # gzip-compressed sitemap, delivered as a byte stream, base64-encoded string or raw bytes
+    # or a plain-text XML sitemap (not gzipped)
     if isinstance(content, BytesIO):
-        content = content.read()
-
-    # gzip-compressed sitemap, delivered as base64-encoded string or raw bytes
-    if isinstance(content, (str, bytes)):
+        stream = content
+    elif isinstance(content, bytes):
+        stream = BytesIO(content)
+    else:
         try:
-            raw_bytes = base64.b64decode(content) if isinstance(content, str) else content
-            xml = gzip.decompress(raw_bytes).decode('utf-8')
-        except Exception:
-            # plain-text XML sitemap (not gzipped)
-            xml = content.decode('utf-8') if isinstance(content, bytes) else content
-
-    selector = Selector(xml)
-    data = []
-    for url in selector.xpath("//url/loc/text()"):
-        data.append(url.get())
-    return data
+            stream = BytesIO(base64.b64decode(content, validate=True))
+        except ValueError:
+            stream = BytesIO(content.encode('utf-8'))
+    return [loc for loc, _ in iter_sitemap(stream)]
 
 
 async def scrape_sitemaps(url: str) -> List[str]:
@@ -8,8 +8,8 @@ $ export $SCRAPFLY_KEY="your key from https://scrapfly.io/dashboard"
 import json
 import math
 import os
-from nested_lookup import nested_lookup
-from typing import Dict, List
+from itertools import repeat
+from typing import Any, Dict, Iterator, List, Union
 
 from loguru import logger as log
 from scrapfly import ScrapeApiResponse, ScrapeConfig, ScrapflyClient
@@ -26,13 +26,65 @@ BASE_CONFIG = {
 }
 
 
+# orjson or msgspec decode large hidden web data several times faster than the json module when installed
+try:
+    import orjson
+
+    _fast_json_loads, _FAST_JSON_ERRORS = orjson.loads, (orjson.JSONDecodeError,)
+except ImportError:
+    try:
+        import msgspec
+
+        _fast_json_loads, _FAST_JSON_ERRORS = msgspec.json.decode, (msgspec.DecodeError,)
+    except ImportError:
+        _fast_json_loads, _FAST_JSON_ERRORS = None, ()
+
+
+def json_loads(data: Union[str, bytes]) -> Any:
+    """
+    decode JSON with the fastest available backend. Documents the fast decoders reject (e.g. NaN values)
+    are decoded again with json.loads so errors match it. Note that integers over 64 bits decode as floats with orjson.
+    """
+    if _fast_json_loads is not None:
+        try:
+            return _fast_json_loads(data)
+        except _FAST_JSON_ERRORS:
+            pass
+    return json.loads(data)
+
+
+def iter_lookup(key: str, document: Any) -> Iterator[Any]:
+    """
+    yield values of `key` anywhere in a nested JSON document in the same depth-first order as nested_lookup.
+    The document is walked lazily so taking only the first few matches doesn't scan the whole tree.
+    """
+    stack = [iter(((None, document),))]
+    while stack:
+        for name, value in stack[-1]:
+            if name == key:
+                yield value
+            if isinstance(value, dict):
+                stack.append(iter(value.items()))
+                break
+            if isinstance(value, list):
+                stack.append(zip(repeat(None), value))
+                break
+        else:
+            stack.pop()
+
+
+def find_first(key: str, document: Any, default: Any = None) -> Any:
+    """first value of `key` in a nested JSON document, the walk stops at the first match"""
+    return next(iter_lookup(key, document), default)
+
+
 def parse_nextjs(result: ScrapeApiResponse) -> Dict:
     """extract nextjs cache from page"""
     data = result.selector.css("script#__NEXT_DATA__::text").get()
     if not data:
         data = result.selector.css("script[data-name=query]::text").get()
         data = data.split("=", 1)[-1].strip().strip(";")
-    data = json.loads(data)
+    data = json_loads(data)
     return data
 
 
@@ -44,7 +96,7 @@ def parse_pricing(result: ScrapeApiResponse, sku: str = None) -> Dict:
         if xhr["response"]["body"] is None:
             continue
         try:
-            data = json.loads(xhr["response"]["body"])
+            data = json_loads(xhr["response"]["body"])
         except json.JSONDecodeError:
             continue
         json_calls.append(data)
@@ -70,8 +122,8 @@ async def scrape_product(url: str) -> Dict:
         url, **BASE_CONFIG, rendering_wait=5000, wait_for_selector="//h2[@data-testid='trade-box-buy-amount']"
     ))
     data = parse_nextjs(result)
-    # extract all products datasets from page cache
-    products = nested_lookup("product", data)
+    # walk products datasets of the page cache
+    products = iter_lookup("product", data)
     # find the current product dataset
     try:
         product = next(p for p in products if p.get("urlKey") in result.context["url"])
@@ -87,7 +139,7 @@ async def scrape_search(url: str, max_pages: int = 25) -> List[Dict]:
     first_page = await SCRAPFLY.async_scrape(ScrapeConfig(url, **BASE_CONFIG))
     # parse first page for product search data and total amount of pages:
     data = parse_nextjs(first_page)
-    _first_page_results = nested_lookup("results", data)[0]
+    _first_page_results = find_first("results", data)
     _paging_info = _first_page_results["pageInfo"]
     total_pages = _paging_info["pageCount"] or math.ceil(_paging_info["total"] / _paging_info["limit"])
     if max_pages < total_pages:
@@ -103,7 +155,7 @@ async def scrape_search(url: str, max_pages: int = 25) -> List[Dict]:
     ]
     async for result in SCRAPFLY.concurrent_scrape(_other_pages):
         data = parse_nextjs(result)
-        _page_results = nested_lookup("results", data)[0]
+        _page_results = find_first("results", data)
         product_previews.extend([edge["node"] for edge in _page_results["edges"]])
     log.info("scraped {} products from {}", len(product_previews), url)
     return product_previews
@@ -5,15 +5,26 @@ To run this scraper set env variable $SCRAPFLY_KEY with your scrapfly API key:
 $ export SCRAPFLY_KEY="your key from https://scrapfly.io/dashboard"
 """
 
+import asyncio
 import gzip
 import os
 import re
 import json
-from typing import Dict, List, Optional, TypedDict
+from io import BytesIO
+from typing import IO, Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, TypedDict
 from urllib.parse import parse_qs, urlencode, urlparse
 from uuid import uuid4
-from parsel import Selector
-from scrapfly import ScrapeConfig, ScrapflyClient, ScrapeApiResponse
+from loguru import logger as log
+from lxml import etree
+from scrapfly import (
+    ScrapeApiResponse,
+    ScrapeConfig,
+    ScrapflyAspError,
+    ScrapflyClient,
+    ScrapflyProxyError,
+    ScrapflySessionError,
+    UpstreamHttpClientError,
+)
 
 SCRAPFLY = ScrapflyClient(key=os.environ["SCRAPFLY_KEY"])
 
@@ -87,6 +98,135 @@ def _extract_redsky_credentials(response: ScrapeApiResponse) -> Dict[str, str]:
     raise ValueError("missing store_location_v1 XHR with key and visitor_id")
 
 
+class SessionPool:
+    """
+    Scrapfly sessions shared by many jobs instead of a new session for every job:
+    - a new session is warmed once with `warm(session_id)` and whatever it returns (e.g. API credentials or
+      captured headers) is passed to every job that runs on that session
+    - a session runs up to `session_concurrency` jobs at once and at most `max_sessions` sessions are open,
+      further jobs wait for a free slot
+    - sessions are retired when a job on them gets blocked or after `max_uses` jobs, blocked jobs are retried
+      on another session up to `retries` times
+    """
+
+    def __init__(
+        self,
+        prefix: str,
+        warm: Optional[Callable[[str], Awaitable[Any]]] = None,
+        max_sessions: int = 5,
+        session_concurrency: int = 1,
+        max_uses: int = 50,
+        retries: int = 1,
+    ):
+        self.prefix = prefix
+        self.warm = warm
+        self.max_sessions = max_sessions
+        self.session_concurrency = session_concurrency
+        self.max_uses = max_uses
+        self.retries = retries
+        self.sessions: List[Dict[str, Any]] = []
+        self.stats = {"sessions": 0, "warmups": 0, "jobs": 0, "blocked": 0, "retired": 0}
+        self._waiters: List[asyncio.Future] = []
+
+    @staticmethod
+    def is_blocked(error: Exception) -> bool:
+        """errors that mean the session is no longer usable on the target"""
+        if isinstance(error, (ScrapflyAspError, ScrapflyProxyError, ScrapflySessionError)):
+            return True
+        return isinstance(error, UpstreamHttpClientError) and error.http_status_code in (403, 429)
+
+    async def _acquire(self) -> Dict[str, Any]:
+        while True:
+            free = [
+                session
+                for session in self.sessions
+                if session["active"] < self.session_concurrency and session["uses"] < self.max_uses
+            ]
+            if free:
+                # fill warmed sessions before opening new ones
+                session = min(free, key=lambda session: session["active"])
+                break
+            if len(self.sessions) < self.max_sessions:
+                session = {"id": f"{self.prefix}-{uuid4().hex}", "warming": None, "active": 0, "uses": 0}
+                self.sessions.append(session)
+                self.stats["sessions"] += 1
+                break
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+        session["active"] += 1
+        session["uses"] += 1
+        self.stats["jobs"] += 1
+        return session
+
+    def _release(self, session: Dict[str, Any]):
+        session["active"] -= 1
+        if session["uses"] >= self.max_uses and not session["active"]:
+            self._retire(session)
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _retire(self, session: Dict[str, Any]):
+        if session in self.sessions:
+            self.sessions.remove(session)
+            self.stats["retired"] += 1
+
+    async def _warm(self, session: Dict[str, Any]) -> Any:
+        if self.warm is None:
+            return None
+        if session["warming"] is None or session["warming"].cancelled():
+            log.debug(f"warming up session {session['id']}")
+            session["warming"] = asyncio.ensure_future(self.warm(session["id"]))
+            self.stats["warmups"] += 1
+        try:
+            # jobs sharing the session wait for the same warm-up
+            return await asyncio.shield(session["warming"])
+        except Exception:
+            self._retire(session)
+            raise
+
+    async def run(self, job: Callable[[str, Any], Awaitable[Any]]) -> Any:
+        """run job(session_id, warm_state) on a pooled session and return its result"""
+        for attempt in range(self.retries + 1):
+            session = await self._acquire()
+            try:
+                state = await self._warm(session)
+                return await job(session["id"], state)
+            except Exception as e:
+                if not self.is_blocked(e):
+                    raise
+                self.stats["blocked"] += 1
+                self._retire(session)
+                if attempt == self.retries:
+                    raise
+                log.warning(f"session {session['id']} got blocked, retrying on another session: {e!r}")
+            finally:
+                self._release(session)
+
+    def metrics(self) -> Dict[str, int]:
+        """session and job counters of the pool"""
+        return {**self.stats, "open": len(self.sessions)}
+
+
+async def _warm_redsky_session(session: str) -> Dict[str, str]:
+    """render the homepage once per session to capture the redsky API credentials bound to it"""
+    warm_up = await SCRAPFLY.async_scrape(ScrapeConfig(
+        "https://www.target.com/",
+        session=session,
+        render_js=True,
+        wait_for_selector="xhr:store_location_v1",
+        rendering_wait=5000,
+        **BASE_CONFIG,
+    ))
+    return _extract_redsky_credentials(warm_up)
+
+
+# redsky API calls reuse warmed sessions and their credentials instead of rendering the homepage for every call
+SESSION_POOL = SessionPool("target", warm=_warm_redsky_session, session_concurrency=4)
+
+
 def _is_in_stock(fulfillment: Optional[Dict]) -> bool:
     if not fulfillment or fulfillment.get("sold_out"):
         return False
@@ -186,44 +326,54 @@ async def scrape_availability(
     zip_code: str,
 ) -> Dict:
     """scrape product availability and fulfillment data from product_summary_with_fulfillment_v1"""
-    session = str(uuid4()).replace("-", "")
-    warm_up = await SCRAPFLY.async_scrape(ScrapeConfig(
-        "https://www.target.com/",
-        session=session,
-        render_js=True,
-        wait_for_selector="xhr:store_location_v1",
-        rendering_wait=5000,
-        **BASE_CONFIG,
-    ))
-    credentials = _extract_redsky_credentials(warm_up)
-
-    url = "https://redsky.target.com/redsky_aggregations/v1/web/product_summary_with_fulfillment_v1?" + urlencode({
-        "key": credentials["key"],
-        "visitor_id": credentials["visitor_id"],
-        "tcins": ",".join(tcins),
-        "store_id": store_id,
-        "pricing_store_id": store_id,
-        "required_store_id": store_id,
-        "scheduled_delivery_store_id": store_id,
-        "zip": zip_code,
-        "channel": "WEB",
-        "page": f"/p/A-{tcins[0]}",
-    })
-
-    response = await SCRAPFLY.async_scrape(ScrapeConfig(url, session=session, **BASE_CONFIG))
-    return parse_availability(response)
+
+    async def scrape(session: str, credentials: Dict[str, str]) -> Dict:
+        url = "https://redsky.target.com/redsky_aggregations/v1/web/product_summary_with_fulfillment_v1?" + urlencode({
+            "key": credentials["key"],
+            "visitor_id": credentials["visitor_id"],
+            "tcins": ",".join(tcins),
+            "store_id": store_id,
+            "pricing_store_id": store_id,
+            "required_store_id": store_id,
+            "scheduled_delivery_store_id": store_id,
+            "zip": zip_code,
+            "channel": "WEB",
+            "page": f"/p/A-{tcins[0]}",
+        })
+        response = await SCRAPFLY.async_scrape(ScrapeConfig(url, session=session, **BASE_CONFIG))
+        return parse_availability(response)
+
+    return await SESSION_POOL.run(scrape)
+
+
+def iter_sitemap(stream: IO[bytes]) -> Iterator[Tuple[str, Optional[str]]]:
+    """
+    stream (loc, lastmod) entries of a sitemap or sitemap index from a plain or gzipped xml byte stream.
+    The xml is parsed incrementally and every parsed entry is dropped from the tree so memory use stays
+    constant regardless of sitemap size.
+    """
+    if stream.read(2) == b"\x1f\x8b":
+        stream.seek(0)
+        stream = gzip.GzipFile(fileobj=stream)
+    else:
+        stream.seek(0)
+    for _, node in etree.iterparse(stream, events=("end",), tag=("{*}url", "{*}sitemap")):
+        loc = node.findtext("{*}loc")
+        lastmod = node.findtext("{*}lastmod")
+        node.clear()
+        while node.getprevious() is not None:
+            del node.getparent()[0]
+        if loc:
+            yield loc.strip(), lastmod.strip() if lastmod else None
+
 
 def parse_store_locations_sitemap(response: ScrapeApiResponse) -> List[Dict]:
     """parse store location entries from a sitemap response"""
     content = response.scrape_result["content"]
-    bytes_data = content.read() if hasattr(content, "read") else content.encode("latin1")
-    if bytes_data.startswith(b"\x1f\x8b"):
-        bytes_data = gzip.decompress(bytes_data)
-    selector = Selector(text=bytes_data.decode("utf-8"))
+    stream = content if hasattr(content, "read") else BytesIO(content.encode("latin1"))
 
     locations = []
-    for url in selector.xpath("//url/loc/text()"):
-        url = url.get()
+    for url, _ in iter_sitemap(stream):
         slug, store_id = urlparse(url).path.strip("/").split("/")[-2:]
         locations.append({"url": url, "slug": slug, "store_id": store_id})
     return locations
@@ -252,36 +402,23 @@ def parse_store_locations(response: ScrapeApiResponse) -> Dict:
 
 async def scrape_store_locations(store_ids: List[str]) -> List[Dict]:
     """scrape store location details from store_location_v1 for a list of store IDs"""
-    session = str(uuid4()).replace("-", "")
-    warm_up = await SCRAPFLY.async_scrape(ScrapeConfig(
-        "https://www.target.com/",
-        session=session,
-        render_js=True,
-        wait_for_selector="xhr:store_location_v1",
-        rendering_wait=5000,
-        **BASE_CONFIG,
-    ))
-    credentials = _extract_redsky_credentials(warm_up)
 
-    to_scrape = [
-        ScrapeConfig(
-            "https://redsky.target.com/redsky_aggregations/v1/web/store_location_v1?" + urlencode({
+    async def scrape_store(store_id: str) -> Dict:
+        async def scrape(session: str, credentials: Dict[str, str]) -> Dict:
+            url = "https://redsky.target.com/redsky_aggregations/v1/web/store_location_v1?" + urlencode({
                 "key": credentials["key"],
                 "visitor_id": credentials["visitor_id"],
                 "store_id": store_id,
                 "channel": "WEB",
                 "page": "/c/root",
-            }),
-            session=session,
-            **BASE_CONFIG,
-        )
-        for store_id in store_ids
-    ]
+            })
+            response = await SCRAPFLY.async_scrape(ScrapeConfig(url, session=session, **BASE_CONFIG))
+            return parse_store_locations(response)
+
+        return await SESSION_POOL.run(scrape)
 
-    stores = []
-    async for response in SCRAPFLY.concurrent_scrape(to_scrape):
-        stores.append(parse_store_locations(response))
-    return stores
+    # store lookups are spread over the pooled sessions, up to session_concurrency at once on each
+    return list(await asyncio.gather(*(scrape_store(store_id) for store_id in store_ids)))
 
 
 
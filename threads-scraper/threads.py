@@ -7,11 +7,13 @@ $ export $SCRAPFLY_KEY="your key from https://scrapfly.io/dashboard"
 """
 import json
 import os
+import threading
 import jmespath
+from jmespath.visitor import TreeInterpreter
 
-from typing import Dict
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
-from nested_lookup import nested_lookup
+from itertools import repeat
 from loguru import logger as log
 from scrapfly import ScrapeConfig, ScrapflyClient
 
@@ -24,9 +26,176 @@ BASE_CONFIG = {
 }
 
 
+class CompiledExpressions:
+    """
+    JMESPath expressions compiled once on first use into plain python functions, shared between threads.
+    jmespath.search() caches parsed expressions but still walks the expression's syntax tree with a new
+    interpreter for every searched item; compiled expressions skip both.
+    Only the syntax nodes this module's expressions use are compiled, anything else runs through jmespath's
+    interpreter.
+    """
+
+    def __init__(self):
+        self.compiled: Dict[str, Callable[[Any], Any]] = {}
+        self._lock = threading.Lock()
+
+    def compile(self, expression: str) -> Callable[[Any], Any]:
+        try:
+            return self.compiled[expression]
+        except KeyError:
+            pass
+        with self._lock:
+            if expression not in self.compiled:
+                self.compiled[expression] = self._compile(jmespath.compile(expression).parsed)
+        return self.compiled[expression]
+
+    def search(self, expression: str, data: Any) -> Any:
+        """same as jmespath.search(expression, data)"""
+        return self.compile(expression)(data)
+
+    def _compile(self, node: Dict) -> Callable[[Any], Any]:
+        kind = node["type"]
+        if kind == "field" or (kind == "subexpression" and all(c["type"] == "field" for c in node["children"])):
+            names = [node["value"]] if kind == "field" else [child["value"] for child in node["children"]]
+
+            def field(value):
+                for name in names:
+                    if type(value) is dict:
+                        value = value.get(name)
+                    else:
+                        try:
+                            value = value.get(name)
+                        except AttributeError:
+                            value = None
+                return value
+
+            return field
+        if kind in ("subexpression", "index_expression"):
+            steps = [self._compile(child) for child in node["children"]]
+
+            def chain(value):
+                for step in steps:
+                    value = step(value)
+                return value
+
+            return chain
+        if kind == "multi_select_dict":
+            pairs = [(child["value"], self._compile(child["children"][0])) for child in node["children"]]
+            return lambda value: None if value is None else {key: step(value) for key, step in pairs}
+        if kind == "index":
+            index = node["value"]
+
+            def index_of(value):
+                if not isinstance(value, list):
+                    return None
+                try:
+                    return value[index]
+                except IndexError:
+                    return None
+
+            return index_of
+        if kind == "projection":
+            base, step = (self._compile(child) for child in node["children"])
+
+            def projection(value):
+                value = base(value)
+                if not isinstance(value, list):
+                    return None
+                return [result for result in map(step, value) if result is not None]
+
+            return projection
+        if kind == "flatten":
+            base = self._compile(node["children"][0])
+
+            def flatten(value):
+                value = base(value)
+                if not isinstance(value, list):
+                    return None
+                merged = []
+                for element in value:
+                    if isinstance(element, list):
+                        merged.extend(element)
+                    else:
+                        merged.append(element)
+                return merged
+
+            return flatten
+        return lambda value: TreeInterpreter().visit(node, value)
+
+
+EXPRESSIONS = CompiledExpressions()
+
+
+def iter_lookup(key: str, document: Any) -> Iterator[Any]:
+    """
+    yield values of `key` anywhere in a nested JSON document in the same depth-first order as nested_lookup.
+    The document is walked lazily so taking only the first few matches doesn't scan the whole tree.
+    """
+    stack = [iter(((None, document),))]
+    while stack:
+        for name, value in stack[-1]:
+            if name == key:
+                yield value
+            if isinstance(value, dict):
+                stack.append(iter(value.items()))
+                break
+            if isinstance(value, list):
+                stack.append(zip(repeat(None), value))
+                break
+        else:
+            stack.pop()
+
+
+def find_first(key: str, document: Any, default: Any = None) -> Any:
+    """first value of `key` in a nested JSON document, the walk stops at the first match"""
+    return next(iter_lookup(key, document), default)
+
+
+class LookupIndex:
+    """
+    key -> paths index of a nested JSON document built in a single walk, for documents that are looked up
+    by several keys. Only the given keys are indexed, all of them when keys is None.
+    Matches keep nested_lookup's depth-first order.
+    """
+
+    def __init__(self, document: Any, keys: Optional[Iterable[str]] = None):
+        self.document = document
+        self.index: Dict[str, List[Tuple[Tuple, Any]]] = {}
+        keys = set(keys) if keys is not None else None
+        stack = [iter(document.items() if isinstance(document, dict) else enumerate(document))]
+        path = []
+        while stack:
+            for name, value in stack[-1]:
+                if isinstance(name, str) and (keys is None or name in keys):
+                    self.index.setdefault(name, []).append((tuple(path) + (name,), value))
+                if isinstance(value, dict):
+                    path.append(name)
+                    stack.append(iter(value.items()))
+                    break
+                if isinstance(value, list):
+                    path.append(name)
+                    stack.append(enumerate(value))
+                    break
+            else:
+                stack.pop()
+                if path:
+                    path.pop()
+
+    def paths(self, key: str) -> List[Tuple]:
+        """paths of every `key` in the document, e.g. ("props", "pageProps", 0, "product")"""
+        return [path for path, _ in self.index.get(key, [])]
+
+    def getall(self, key: str) -> List[Any]:
+        return [value for _, value in self.index.get(key, [])]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        matches = self.index.get(key)
+        return matches[0][1] if matches else default
+
+
 def parse_thread(data: Dict) -> Dict:
     """Parse Twitter tweet JSON dataset for the most important fields"""
-    result = jmespath.search(
+    result = EXPRESSIONS.search(
         """{
         text: post.caption.text,
         published_on: post.taken_at,
@@ -55,7 +224,7 @@ def parse_thread(data: Dict) -> Dict:
 
 def parse_profile(data: Dict) -> Dict:
     """Parse Threads profile JSON dataset for the most important fields"""
-    result = jmespath.search(
+    result = EXPRESSIONS.search(
         """{
         is_private: text_post_app_is_private,
         is_verified: is_verified,
@@ -99,7 +268,7 @@ async def scrape_thread(url: str) -> Dict:
 
     # the thread data is the last one in the list        
     data = json.loads(thread_hidden_data[-1])
-    thread_items = nested_lookup('thread_items', data)
+    thread_items = iter_lookup('thread_items', data)
 
     threads = [
         parse_thread(t) for thread in thread_items for t in thread
@@ -140,12 +309,11 @@ async def scrape_profile(url: str) -> Dict:
         is_threads = 'thread_items' in hidden_dataset
         if not is_profile and not is_threads:
             continue
-        data = json.loads(hidden_dataset)
+        data = LookupIndex(json.loads(hidden_dataset), keys=('user', 'thread_items'))
         if is_profile:
-            user_data = nested_lookup('user', data)
-            parsed['user'] = parse_profile(user_data[0])
+            parsed['user'] = parse_profile(data.get('user'))
         if is_threads:
-            thread_items = nested_lookup('thread_items', data)
+            thread_items = data.getall('thread_items')
             threads = [
                 parse_thread(t) for thread in thread_items for t in thread
             ]
@@ -54,7 +54,7 @@ class TicketmasterSearch(TypedDict):
     total_count: int
 
 
-def extract_balanced_dict(text: str, start_pattern: str) -> Optional[Dict]:
+def extract_balanced_dict(text: str, start_pattern: str, decoder=json.JSONDecoder()) -> Optional[Dict]:
     """
     Extract a balanced JSON dictionary from text starting with a pattern.
 
@@ -74,22 +74,13 @@ def extract_balanced_dict(text: str, start_pattern: str) -> Optional[Dict]:
     if brace_start == -1:
         return None
 
-    # Count braces to find the matching closing brace
-    brace_count = 0
-    for i in range(brace_start, len(text)):
-        if text[i] == "{":
-            brace_count += 1
-        elif text[i] == "}":
-            brace_count -= 1
-            if brace_count == 0:
-                # Found the matching closing brace
-                json_str = text[brace_start : i + 1]
-                try:
-                    return json.loads(json_str)
-                except json.JSONDecodeError:
-                    return None
-
-    return None
+    # decode from the brace position directly - the decoder stops at the matching closing brace
+    # so there is no need to scan for it or copy the text
+    try:
+        data, _ = decoder.raw_decode(text, brace_start)
+    except json.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
 
 
 def parse_artist_page(result: ScrapeApiResponse) -> TicketmasterArtist:
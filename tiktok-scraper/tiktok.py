@@ -10,8 +10,10 @@ import datetime
 import secrets
 import json
 import uuid
+import threading
 import jmespath
-from typing import Dict, List
+from jmespath.visitor import TreeInterpreter
+from typing import Any, Callable, Dict, Iterable, List
 from urllib.parse import urlencode, quote, urlparse, parse_qs
 from loguru import logger as log
 from scrapfly import ScrapeConfig, ScrapflyClient, ScrapeApiResponse
@@ -26,12 +28,105 @@ BASE_CONFIG = {
 }
 
 
+class CompiledExpressions:
+    """
+    JMESPath expressions compiled once on first use into plain python functions, shared between threads.
+    jmespath.search() caches parsed expressions but still walks the expression's syntax tree with a new
+    interpreter for every searched item; compiled expressions skip both.
+    Only the syntax nodes this module's expressions use are compiled, anything else runs through jmespath's
+    interpreter.
+    """
+
+    def __init__(self):
+        self.compiled: Dict[str, Callable[[Any], Any]] = {}
+        self._lock = threading.Lock()
+
+    def compile(self, expression: str) -> Callable[[Any], Any]:
+        try:
+            return self.compiled[expression]
+        except KeyError:
+            pass
+        with self._lock:
+            if expression not in self.compiled:
+                self.compiled[expression] = self._compile(jmespath.compile(expression).parsed)
+        return self.compiled[expression]
+
+    def search(self, expression: str, data: Any) -> Any:
+        """same as jmespath.search(expression, data)"""
+        return self.compile(expression)(data)
+
+    def search_many(self, expression: str, items: Iterable[Any]) -> List[Any]:
+        """search every item of a list with the same expression"""
+        compiled = self.compile(expression)
+        return [compiled(item) for item in items]
+
+    def _compile(self, node: Dict) -> Callable[[Any], Any]:
+        kind = node["type"]
+        if kind == "field" or (kind == "subexpression" and all(c["type"] == "field" for c in node["children"])):
+            names = [node["value"]] if kind == "field" else [child["value"] for child in node["children"]]
+
+            def field(value):
+                for name in names:
+                    if type(value) is dict:
+                        value = value.get(name)
+                    else:
+                        try:
+                            value = value.get(name)
+                        except AttributeError:
+                            value = None
+                return value
+
+            return field
+        if kind == "subexpression":
+            steps = [self._compile(child) for child in node["children"]]
+
+            def chain(value):
+                for step in steps:
+                    value = step(value)
+                return value
+
+            return chain
+        if kind == "multi_select_dict":
+            pairs = [(child["value"], self._compile(child["children"][0])) for child in node["children"]]
+            return lambda value: None if value is None else {key: step(value) for key, step in pairs}
+        if kind == "projection":
+            base, step = (self._compile(child) for child in node["children"])
+
+            def projection(value):
+                value = base(value)
+                if not isinstance(value, list):
+                    return None
+                return [result for result in map(step, value) if result is not None]
+
+            return projection
+        if kind == "flatten":
+            base = self._compile(node["children"][0])
+
+            def flatten(value):
+                value = base(value)
+                if not isinstance(value, list):
+                    return None
+                merged = []
+                for element in value:
+                    if isinstance(element, list):
+                        merged.extend(element)
+                    else:
+                        merged.append(element)
+                return merged
+
+            return flatten
+        return lambda value: TreeInterpreter().visit(node, value)
+
+
+EXPRESSIONS = CompiledExpressions()
+
+
 def parse_post(response: ScrapeApiResponse) -> Dict:
     """parse hidden post data from HTML"""
     selector = response.selector
     data = selector.xpath("//script[@id='__UNIVERSAL_DATA_FOR_REHYDRATION__']/text()").get()
     post_data = json.loads(data)["__DEFAULT_SCOPE__"]["webapp.video-detail"]["itemInfo"]["itemStruct"]
-    parsed_post_data = jmespath.search(
+    parsed_post_data = EXPRESSIONS.search(
         """{
         id: id,
         desc: desc,
@@ -75,25 +170,22 @@ def parse_comments(response: ScrapeApiResponse) -> List[Dict]:
         raise Exception("Comment XHR data not found")
 
     comments_data = data["comments"]
-    parsed_comments = []
     # refine the comments with JMESPath
-    for comment in comments_data:
-        result = jmespath.search(
-            """{
-            text: text,
-            comment_language: comment_language,
-            digg_count: digg_count,
-            reply_comment_total: reply_comment_total,
-            author_pin: author_pin,
-            create_time: create_time,
-            cid: cid,
-            nickname: user.nickname,
-            unique_id: user.unique_id,
-            aweme_id: aweme_id
-            }""",
-            comment,
-        )
-        parsed_comments.append(result)
+    parsed_comments = EXPRESSIONS.search_many(
+        """{
+        text: text,
+        comment_language: comment_language,
+        digg_count: digg_count,
+        reply_comment_total: reply_comment_total,
+        author_pin: author_pin,
+        create_time: create_time,
+        cid: cid,
+        nickname: user.nickname,
+        unique_id: user.unique_id,
+        aweme_id: aweme_id
+        }""",
+        comments_data,
+    )
     return parsed_comments
 
 
@@ -158,7 +250,7 @@ def parse_search(response: ScrapeApiResponse) -> List[Dict]:
     parsed_search = []
     for item in search_data:
         if item["type"] == 1:  # get the item if it was item only
-            result = jmespath.search(
+            result = EXPRESSIONS.search(
                 """{
                 id: id,
                 desc: desc,
@@ -223,19 +315,16 @@ def parse_channel(response: ScrapeApiResponse):
             raise Exception("Post data couldn't load")
         channel_data.extend(data)
     # parse all the data using jmespath
-    parsed_data = []
-    for post in channel_data:
-        result = jmespath.search(
-            """{
-            createTime: createTime,
-            desc: desc,
-            id: id,
-            stats: stats,
-            contents: contents[].{desc: desc, textExtra: textExtra[].{hashtagName: hashtagName}}
-            }""",
-            post,
-        )
-        parsed_data.append(result)
+    parsed_data = EXPRESSIONS.search_many(
+        """{
+        createTime: createTime,
+        desc: desc,
+        id: id,
+        stats: stats,
+        contents: contents[].{desc: desc, textExtra: textExtra[].{hashtagName: hashtagName}}
+        }""",
+        channel_data,
+    )
     return parsed_data
 
 
@@ -10,10 +10,11 @@ import math
 import os
 import random
 import string
-from typing import List, Optional, TypedDict, Dict
+from typing import AsyncIterator, List, Optional, TypedDict, Dict
 from urllib.parse import urljoin, urlparse, urlunparse
 
 from loguru import logger as log
+from parsel import Selector
 from scrapfly import ScrapeApiResponse, ScrapeConfig, ScrapflyClient
 
 SCRAPFLY = ScrapflyClient(key=os.environ["SCRAPFLY_KEY"])
@@ -158,15 +159,13 @@ async def scrape_search(search_url: str, max_pages: Optional[int] = None) -> Lis
     return results
 
 
-def parse_hotel_page(result: ScrapeApiResponse) -> Dict:
-    """parse hotel data from hotel pages"""
-    selector = result.selector
-    basic_data = json.loads(selector.xpath("//script[contains(text(),'aggregateRating')]/text()").get())
-    description = selector.xpath("//div[@data-automation='aboutTabDescription']/div/div/div/text()").get()
-    amenities = []
-    for feature in selector.xpath("//div[contains(@data-test-target, 'amenity')]/text()"):
-        amenities.append(feature.get())
+REVIEW_PAGE_SIZE = 10
+# review pages are server rendered, they only need a browser when the plain HTML comes back without reviews
+REVIEW_CONFIG = {**BASE_CONFIG, "render_js": False}
 
+
+def _parse_review_cards(selector: Selector) -> List[Dict]:
+    """parse the review cards of a hotel page"""
     reviews = []
     for review in selector.xpath("//div[@data-test-target='HR_CC_CARD']"):
         title = review.xpath(".//div[@data-test-target='review-title']//span//text()").get()
@@ -183,6 +182,30 @@ def parse_hotel_page(result: ScrapeApiResponse) -> Dict:
             "tripDate": trip_data,
             "tripType": trip_type,
         })
+    return reviews
+
+
+def parse_reviews(result: ScrapeApiResponse) -> List[Dict]:
+    """parse only the review block of a hotel page rather than the whole document"""
+    html = result.content
+    first_card = html.find("HR_CC_CARD")
+    if first_card == -1:
+        return []
+    # the block starts at the first review card and ends before the page scripts that follow the last one
+    end = html.find("<script", html.rfind("HR_CC_CARD"))
+    block = html[html.rfind("<div", 0, first_card) : end if end != -1 else len(html)]
+    return _parse_review_cards(Selector(text=block))
+
+
+def parse_hotel_page(result: ScrapeApiResponse) -> Dict:
+    """parse hotel data from hotel pages"""
+    selector = result.selector
+    basic_data = json.loads(selector.xpath("//script[contains(text(),'aggregateRating')]/text()").get())
+    description = selector.xpath("//div[@data-automation='aboutTabDescription']/div/div/div/text()").get()
+    amenities = []
+    for feature in selector.xpath("//div[contains(@data-test-target, 'amenity')]/text()"):
+        amenities.append(feature.get())
+    reviews = _parse_review_cards(selector)
 
     return {
         "basic_data": basic_data,
@@ -192,31 +215,63 @@ def parse_hotel_page(result: ScrapeApiResponse) -> Dict:
     }
 
 
+def review_page_urls(url: str, total_reviews: int, max_review_pages: Optional[int] = None) -> List[str]:
+    """create the review page urls of a hotel after its first page"""
+    total_review_pages = math.ceil(total_reviews / REVIEW_PAGE_SIZE)
+    if max_review_pages and max_review_pages < total_review_pages:
+        total_review_pages = max_review_pages
+    return [
+        # note: "or" stands for "offset reviews"
+        url.replace("-Reviews-", f"-Reviews-or{REVIEW_PAGE_SIZE * i}-")
+        for i in range(1, total_review_pages)
+    ]
+
+
+async def iter_reviews(review_urls: List[str]) -> AsyncIterator[Dict]:
+    """
+    scrape review pages without a browser and yield reviews as soon as each page is parsed,
+    pages that fail or come back without reviews are scraped again with javascript rendering
+    """
+    scraped = set()
+    yielded = set()
+    async for result in SCRAPFLY.concurrent_scrape([ScrapeConfig(url, **REVIEW_CONFIG) for url in review_urls]):
+        if isinstance(result, Exception):
+            log.warning(f"failed to scrape a review page without rendering: {result}")
+            continue
+        reviews = parse_reviews(result)
+        if not reviews:
+            continue
+        # the requested url, the one in the response context can be normalized by the API
+        scraped.add(result.scrape_config.url)
+        for review in reviews:
+            yielded.add(tuple(review.items()))
+            yield review
+
+    to_render = [url for url in review_urls if url not in scraped]
+    if not to_render:
+        return
+    log.info(f"scraping {len(to_render)} review pages with javascript rendering")
+    async for result in SCRAPFLY.concurrent_scrape(
+        [ScrapeConfig(url, **BASE_CONFIG, render_js=True) for url in to_render]
+    ):
+        if isinstance(result, Exception):
+            log.error(f"failed to scrape a review page: {result}")
+            continue
+        for review in parse_reviews(result):
+            # reviews carry no id, skip the ones already yielded without rendering
+            if tuple(review.items()) not in yielded:
+                yield review
+
+
 async def scrape_hotel(url: str, max_review_pages: Optional[int] = None) -> Dict:
     """Scrape hotel data and reviews"""
     first_page = await SCRAPFLY.async_scrape(ScrapeConfig(url, **BASE_CONFIG, render_js=True))
     hotel_data = parse_hotel_page(first_page)
 
-    # get the number of total review pages
-    _review_page_size = 10
+    # scrape the remaining review pages concurrently
     total_reviews = int(hotel_data["basic_data"]["aggregateRating"]["reviewCount"])
-    total_review_pages = math.ceil(total_reviews / _review_page_size)
-
-    # get the number of review pages to scrape
-    if max_review_pages and max_review_pages < total_review_pages:
-        total_review_pages = max_review_pages
-    
-    # scrape all review pages concurrently
-    review_urls = [
-        # note: "or" stands for "offset reviews"
-        url.replace("-Reviews-", f"-Reviews-or{_review_page_size * i}-")
-        for i in range(1, total_review_pages + 1)
-    ]
-    async for result in SCRAPFLY.concurrent_scrape([
-            ScrapeConfig(url, **BASE_CONFIG, render_js=True)
-            for url in review_urls
-        ]):
-        data = parse_hotel_page(result)
-        hotel_data["reviews"].extend(data["reviews"])
+    review_urls = review_page_urls(url, total_reviews, max_review_pages)
+    async for review in iter_reviews(review_urls):
+        hotel_data["reviews"].append(review)
     log.success(f"scraped one hotel data with {len(hotel_data['reviews'])} reviews")
     return hotel_data
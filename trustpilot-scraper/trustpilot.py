@@ -6,8 +6,11 @@ $ export $SCRAPFLY_KEY="your key from https://scrapfly.io/dashboard"
 """
 import os
 import json
-from scrapfly import ScrapeConfig, ScrapflyClient, ScrapeApiResponse
-from typing import Dict, List
+import time
+import asyncio
+from datetime import timedelta
+from scrapfly import ScrapeConfig, ScrapflyClient, ScrapeApiResponse, UpstreamHttpClientError
+from typing import AsyncIterator, Dict, List, Optional
 from loguru import logger as log
 
 SCRAPFLY = ScrapflyClient(key=os.environ["SCRAPFLY_KEY"])
@@ -79,28 +82,81 @@ async def scrape_search(url: str, max_pages: int = None) -> List[Dict]:
     return search_data
 
 
-async def get_reviews_api_url(url: str) -> str:
-    """scrape the API version from the HTML and create the reviews API"""
-    response = await SCRAPFLY.async_scrape(
-        ScrapeConfig(url, **BASE_CONFIG)
-    )
-    buildId = json.loads(response.selector.xpath("//script[@id='__NEXT_DATA__']/text()").get())["buildId"]
+class BuildIdCache:
+    """
+    The site-wide Next.js buildId every _next/data API url needs, shared across calls for a TTL.
+    Callers missing it at the same time share a single page load.
+    """
+
+    def __init__(self, ttl: timedelta = timedelta(hours=1)):
+        self.ttl = ttl
+        self.build_id: Optional[str] = None
+        self.loaded_at = 0.0
+        self._loading: Optional[asyncio.Future] = None
+
+    async def get(self, url: str) -> str:
+        """the cached buildId or a fresh one from the given page when it's missing or expired"""
+        if self.build_id and time.time() - self.loaded_at < self.ttl.total_seconds():
+            return self.build_id
+        return await self.refresh(url)
+
+    async def refresh(self, url: str, stale: Optional[str] = None) -> str:
+        """load the buildId from the given page, unless it was already refreshed since the stale one was used"""
+        if stale is not None and self.build_id not in (None, stale):
+            return self.build_id
+        if self._loading is None or self._loading.done():
+            self._loading = asyncio.ensure_future(self._load(url, reload=self.build_id is not None))
+        return await asyncio.shield(self._loading)
+
+    async def _load(self, url: str, reload: bool = False) -> str:
+        log.info(f"scraping {url} for the Next.js buildId")
+        config = dict(BASE_CONFIG)
+        if reload and config.get("cache"):
+            # a cached page still carries the buildId being replaced
+            config["cache_clear"] = True
+        response = await SCRAPFLY.async_scrape(ScrapeConfig(url, **config))
+        self.build_id = parse_hidden_data(response)["buildId"]
+        self.loaded_at = time.time()
+        return self.build_id
+
+
+BUILD_ID = BuildIdCache()
+
+
+def reviews_api_url(build_id: str, url: str) -> str:
+    """create the reviews API url of a company page"""
     business_unit = url.split("review/")[-1]
+    return f"https://www.trustpilot.com/_next/data/{build_id}/review/{business_unit}.json?sort=recency&businessUnit={business_unit}"
 
-    return f"https://www.trustpilot.com/_next/data/{buildId}/review/{business_unit}.json?sort=recency&businessUnit={business_unit}"
 
+async def get_reviews_api_url(url: str) -> str:
+    """create the reviews API with the cached buildId, only scraping the HTML when it's missing"""
+    return reviews_api_url(await BUILD_ID.get(url), url)
 
-async def scrape_reviews(url: str, max_pages: int = None) -> List[Dict]:
-    """parse review data from the API"""
+
+async def iter_reviews(url: str, max_pages: int = None) -> AsyncIterator[Dict]:
+    """parse review data from the API and yield reviews as soon as each page arrives"""
     # create the reviews API url
     log.info(f"getting the reviews API for the URL {url}")
-    api_url = await get_reviews_api_url(url)
+    build_id = await BUILD_ID.get(url)
     # send a POST request to the first review page and get the result directly in JSON
-    first_page = await SCRAPFLY.async_scrape(
-        ScrapeConfig(api_url, method="POST", **BASE_CONFIG)
-    )
+    try:
+        first_page = await SCRAPFLY.async_scrape(
+            ScrapeConfig(reviews_api_url(build_id, url), method="POST", **BASE_CONFIG)
+        )
+    except UpstreamHttpClientError as e:
+        if e.http_status_code != 404:
+            raise
+        # trustpilot deployed a new build since the buildId was cached
+        log.warning(f"the buildId {build_id} is outdated, refreshing it")
+        build_id = await BUILD_ID.refresh(url, stale=build_id)
+        first_page = await SCRAPFLY.async_scrape(
+            ScrapeConfig(reviews_api_url(build_id, url), method="POST", **BASE_CONFIG)
+        )
+    api_url = reviews_api_url(build_id, url)
     data = json.loads(first_page.scrape_result["content"])["pageProps"]
-    reviews_data = data["reviews"]
+    for review in data["reviews"]:
+        yield review
 
     # get the number of review pages to scrape
     total_pages = data["filters"]["pagination"]["totalPages"]
@@ -108,14 +164,36 @@ async def scrape_reviews(url: str, max_pages: int = None) -> List[Dict]:
         total_pages = max_pages
 
     log.info(f"scraping reviews pagination ({total_pages - 1} more pages)")
-    # add the remaining search pages in a scraping list
-    other_pages = [
-        ScrapeConfig(api_url + f"&page={page_number}", method="POST", **BASE_CONFIG)
-        for page_number in range(2, total_pages + 1)
-    ]
-    # scrape the remaining search pages concurrently
-    async for response in SCRAPFLY.concurrent_scrape(other_pages):
-        data = json.loads(response.scrape_result["content"])["pageProps"]["reviews"]
-        reviews_data.extend(data)
+    page_numbers = list(range(2, total_pages + 1))
+    for attempt in range(2):
+        # add the remaining search pages in a scraping list
+        other_pages = {api_url + f"&page={page_number}": page_number for page_number in page_numbers}
+        scraped = set()
+        outdated = False
+        # scrape the remaining search pages concurrently
+        async for response in SCRAPFLY.concurrent_scrape(
+            [ScrapeConfig(page_url, method="POST", **BASE_CONFIG) for page_url in other_pages]
+        ):
+            if isinstance(response, UpstreamHttpClientError) and response.http_status_code == 404 and not attempt:
+                outdated = True
+                continue
+            if isinstance(response, Exception):
+                log.error(f"failed to scrape a review page of {url}: {response!r}")
+                continue
+            scraped.add(response.scrape_config.url)
+            for review in json.loads(response.scrape_result["content"])["pageProps"]["reviews"]:
+                yield review
+        if not outdated:
+            break
+        # trustpilot deployed a new build during the crawl
+        log.warning(f"the buildId {build_id} became outdated, refreshing it for the remaining pages")
+        build_id = await BUILD_ID.refresh(url, stale=build_id)
+        api_url = reviews_api_url(build_id, url)
+        page_numbers = [page_number for page_url, page_number in other_pages.items() if page_url not in scraped]
+
+
+async def scrape_reviews(url: str, max_pages: int = None) -> List[Dict]:
+    """parse review data from the API"""
+    reviews_data = [review async for review in iter_reviews(url, max_pages=max_pages)]
     log.success(f"scraped {len(reviews_data)} company reviews")
     return reviews_data
@@ -6,11 +6,15 @@ $ export $SCRAPFLY_KEY="your key from https://scrapfly.io/dashboard"
 """
 
 import os
+import re
 import json
 import math
+import random
 import asyncio
-from typing import Dict, List, TypedDict, Any
-from urllib.parse import urlencode
+import itertools
+from collections import Counter
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, TypedDict
+from urllib.parse import urlencode, urlparse
 from loguru import logger as log
 from scrapfly import ScrapeConfig, ScrapflyClient, ScrapeApiResponse
 
@@ -69,32 +73,187 @@ def parse_search(response: ScrapeApiResponse) -> List[Dict]:
     return {"results": results, "total_results": total_results}
 
 
+class WorkPool:
+    """
+    Run an async function over many items with bounded concurrency, yielding (item, result) pairs
+    in completion order. Failed attempts are retried with jittered exponential backoff and every
+    attempt can be capped with a timeout. Like ScrapflyClient.concurrent_scrape, items that still
+    fail are yielded with their exception instead of raising it.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 5,
+        retries: int = 0,
+        timeout: Optional[float] = None,
+        backoff: float = 1.0,
+        max_backoff: float = 60.0,
+    ):
+        self.concurrency = concurrency
+        self.retries = retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def delay(self, attempt: int) -> float:
+        """full jitter backoff delay so retries of tasks that failed together don't retry together"""
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+    async def _run(self, func: Callable[[Any], Awaitable], item) -> Any:
+        for attempt in range(self.retries + 1):
+            try:
+                return await asyncio.wait_for(func(item), self.timeout)
+            except Exception as e:
+                if attempt == self.retries:
+                    return e
+                delay = self.delay(attempt)
+                log.debug(f"retrying {item} in {delay:.1f} seconds: {e!r}")
+                await asyncio.sleep(delay)
+
+    async def run(self, func: Callable[[Any], Awaitable], item) -> Any:
+        """run func for a single item with the pool's retries and timeout, raising the last error"""
+        result = await self._run(func, item)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def map(self, func: Callable[[Any], Awaitable], items: Iterable) -> AsyncIterator[Tuple[Any, Any]]:
+        items = iter(items)
+        pending = {}
+        try:
+            while True:
+                for item in itertools.islice(items, self.concurrency - len(pending)):
+                    pending[asyncio.ensure_future(self._run(func, item))] = item
+                if not pending:
+                    return
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield pending.pop(task), task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+def _render_group(url: str) -> str:
+    """
+    group urls that are likely to share a render mode, e.g. products of the same brand:
+    /ip/Apple-AirPods-Pro/123 -> /ip/apple/{id}, /browse/electronics/tvs/3944_1060825 -> /browse/electronics
+    """
+    segments = [segment for segment in urlparse(url).path.split("/") if segment]
+    if segments[:1] == ["ip"]:
+        group = ["ip"]
+        if len(segments) > 2:
+            group.append(segments[1].split("-")[0].lower())
+        return "/" + "/".join(group + ["{id}"])
+    return "/" + "/".join(re.sub(r"^[\d_]+$", "{id}", segment) for segment in segments[:2])
+
+
+class RenderModePredictor:
+    """
+    Learns which url groups can only be parsed with JS rendering so they can skip the wasted plain request.
+    Every plain request outcome is recorded as a decayed vote per url group (older votes weigh less),
+    and a small share of predicted-render urls is still tried plain so groups that stop needing
+    rendering are noticed.
+    """
+
+    def __init__(
+        self,
+        group: Callable[[str], str] = _render_group,
+        decay: float = 0.9,
+        threshold: float = 0.8,
+        min_samples: float = 3,
+        explore: float = 0.05,
+    ):
+        self.group = group
+        self.decay = decay
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.explore = explore
+        self.votes: Dict[str, List[float]] = {}  # group -> [decayed render votes, decayed total votes]
+        self.stats = Counter()
+
+    def render_share(self, url: str) -> float:
+        """decayed share of plain requests in the url's group that needed rendering"""
+        render, total = self.votes.get(self.group(url), (0.0, 0.0))
+        return render / total if total >= self.min_samples else 0.0
+
+    def should_render(self, url: str) -> bool:
+        """predict whether url should be scraped with JS rendering right away"""
+        if self.render_share(url) < self.threshold:
+            return False
+        if random.random() < self.explore:
+            self.stats["explored"] += 1
+            return False
+        return True
+
+    def record(self, url: str, needed_render: bool):
+        """record the outcome of a plain request"""
+        votes = self.votes.setdefault(self.group(url), [0.0, 0.0])
+        votes[0] = votes[0] * self.decay + needed_render
+        votes[1] = votes[1] * self.decay + 1
+
+    @property
+    def wasted_rate(self) -> float:
+        """share of all requests that were plain requests followed by a rendered retry"""
+        requests = self.stats["plain_hits"] + 2 * self.stats["plain_misses"] + self.stats["rendered_direct"]
+        return self.stats["plain_misses"] / requests if requests else 0.0
+
+
+RENDER_MODES = RenderModePredictor()
+
+# failed requests are retried on their own so a retry doesn't repeat the whole plain-then-render fallback
+REQUEST_RETRIES = WorkPool(retries=2, timeout=150)
+
+
+async def _scrape_with_retry(config: ScrapeConfig) -> ScrapeApiResponse:
+    return await REQUEST_RETRIES.run(SCRAPFLY.async_scrape, config)
+
+
 async def _scrape_product_with_fallback(url: str) -> Dict[str, Any]:
     """helper that scrapes a single URL with a JS rendering fallback."""
     log.info(f"scraping product: {url}")
-    response = await SCRAPFLY.async_scrape(ScrapeConfig(url, **BASE_CONFIG))
+    if RENDER_MODES.should_render(url):
+        # this url group is known to need rendering so don't waste a plain request on it
+        RENDER_MODES.stats["rendered_direct"] += 1
+        response = await _scrape_with_retry(ScrapeConfig(url, render_js=True, **BASE_CONFIG))
+        parsed_data = parse_product(response)
+        if parsed_data is None:
+            log.error(f"failed to scrape product with JS rendering: {url}")
+            return {"url": url, "error": "failed to parse"}
+        return parsed_data
+
+    response = await _scrape_with_retry(ScrapeConfig(url, **BASE_CONFIG))
     parsed_data = parse_product(response)
+    RENDER_MODES.record(url, needed_render=parsed_data is None)
 
     if parsed_data is None:
+        RENDER_MODES.stats["plain_misses"] += 1
         log.warning(f"retrying with JS rendering: {url}")
-        response = await SCRAPFLY.async_scrape(ScrapeConfig(url, render_js=True, **BASE_CONFIG))
+        response = await _scrape_with_retry(ScrapeConfig(url, render_js=True, **BASE_CONFIG))
         parsed_data = parse_product(response)
         if parsed_data is None:
             log.error(f"failed to scrape product even with JS rendering: {url}")
             return {"url": url, "error": "failed to parse"}
+    else:
+        RENDER_MODES.stats["plain_hits"] += 1
 
     return parsed_data
 
 
-async def scrape_products(urls: List[str]) -> List[Dict]:
+async def scrape_products(urls: List[str], concurrency: int = 5) -> List[Dict]:
     """Scrape product data from product pages with a JS rendering fallback."""
-    # Create a scraping task for each URL
-    to_scrape_tasks = [_scrape_product_with_fallback(url) for url in urls]
-
-    # Run all scraping tasks concurrently
-    results = await asyncio.gather(*to_scrape_tasks)
+    # scrape products with limited concurrency, results come in completion order so they're put back in url order
+    pool = WorkPool(concurrency=concurrency)
+    products = {}
+    async for url, result in pool.map(_scrape_product_with_fallback, urls):
+        if isinstance(result, Exception):
+            log.error(f"failed to scrape product {url}: {result!r}")
+            result = {"url": url, "error": repr(result)}
+        products[url] = result
+    results = [products[url] for url in urls]
 
     log.success(f"scraped {len(results)} product pages")
+    log.info(f"render mode stats: {dict(RENDER_MODES.stats)}, wasted request rate: {RENDER_MODES.wasted_rate:.1%}")
     return results
 
 
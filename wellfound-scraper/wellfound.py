@@ -7,8 +7,12 @@ $ export $SCRAPFLY_KEY="your key from https://scrapfly.io/dashboard"
 
 import os
 import json
-from typing import Dict, List, TypedDict
-from copy import deepcopy
+import time
+import random
+import asyncio
+from collections.abc import Mapping, Sequence
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypedDict
+from urllib.parse import urlparse
 from loguru import logger as log
 from scrapfly import ScrapeConfig, ScrapflyClient, ScrapeApiResponse
 
@@ -59,34 +63,149 @@ def extract_apollo_state(result: ScrapeApiResponse):
     return graph
 
 
-def unpack_node_references(node, graph, debug=False):
+class ApolloGraph:
     """
-    unpacks references in a graph node to a flat node structure:
-    >>> unpack_node_references({"field": {"id": "reference1", "type": "id"}}, graph={"reference1": {"foo": "bar"}})
-    {'field': {'foo': 'bar'}}
+    Resolver for Apollo GraphQL caches where nodes reference each other by key, e.g. {"__ref": "Employer:123"}
+    or {"type": "id", "id": "Startup:1"}: `reference(value)` returns the key a value references and the optional
+    `unwrap(key, node)` transforms referenced nodes before they are resolved.
+    Every referenced node is resolved only once and the result is shared by all of its references, so resolved
+    values are shared objects and must be copied before they are modified.
+    Cyclic references are left unresolved at the point where the cycle closes.
     """
-    def flatten(value):
+
+    def __init__(self, graph: Dict, reference: Callable[[Any], Optional[str]], unwrap: Optional[Callable] = None):
+        self.graph = graph
+        self.reference = reference  # returns graph key if value is a reference
+        self.unwrap = unwrap  # optional transformation of referenced (key, node)
+        self._resolved = {}
+        self._resolving = {}  # key -> depth of references being resolved
+        self._cycle_depth = float("inf")
+        self._lazy = {}
+
+    def resolve(self, value):
+        """expand all references of a value"""
+        if isinstance(value, (LazyApolloNode, LazyApolloList)):
+            value = value.data
+        key = self.reference(value)
+        if key is not None:
+            return self._resolve_reference(key, value)
+        if isinstance(value, dict):
+            return {k: self.resolve(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.resolve(v) for v in value]
+        return value
+
+    def _resolve_reference(self, key: str, reference):
+        if key in self._resolved:
+            return self._resolved[key]
+        if key not in self.graph:
+            return reference  # dangling reference
+        if key in self._resolving:
+            # cycle: keep the reference and remember how far up the resolution stack it points
+            self._cycle_depth = min(self._cycle_depth, self._resolving[key])
+            return reference
+        depth = self._resolving[key] = len(self._resolving)
+        outer_cycle_depth, self._cycle_depth = self._cycle_depth, depth
         try:
-            if value["type"] != "id":
+            node = self.graph[key]
+            resolved = self.resolve(self.unwrap(key, node) if self.unwrap else node)
+        finally:
+            del self._resolving[key]
+        # nodes that cut a cycle through one of their ancestors are only valid in this context
+        if self._cycle_depth >= depth:
+            self._resolved[key] = resolved
+        self._cycle_depth = min(outer_cycle_depth, self._cycle_depth)
+        return resolved
+
+    def lazy(self, value):
+        """wrap a value so its references are only expanded when accessed"""
+        key = self.reference(value)
+        if key is not None:
+            if key not in self.graph:
                 return value
-        except (KeyError, TypeError):
-            return value
-        data = deepcopy(graph[value["id"]])
-        # flatten nodes too:
-        if data.get("node"):
-            data = flatten(data["node"])
+            if key not in self._lazy:
+                node = self.graph[key]
+                self._lazy[key] = self.lazy(self.unwrap(key, node) if self.unwrap else node)
+            return self._lazy[key]
+        if isinstance(value, dict):
+            return LazyApolloNode(self, value)
+        if isinstance(value, list):
+            return LazyApolloList(self, value)
+        return value
+
+
+class LazyApolloNode(Mapping):
+    """read-only view of an Apollo graph node that resolves references on access"""
+
+    def __init__(self, graph: ApolloGraph, data: Dict):
+        self.graph = graph
+        self.data = data
+        self._values = {}
+
+    def __getitem__(self, key):
+        if key not in self._values:
+            self._values[key] = self.graph.lazy(self.data[key])
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def resolve(self) -> Dict:
+        """fully expanded plain dict"""
+        return self.graph.resolve(self.data)
+
+
+class LazyApolloList(Sequence):
+    """read-only view of an Apollo graph list that resolves references on access"""
+
+    def __init__(self, graph: ApolloGraph, data: List):
+        self.graph = graph
+        self.data = data
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.graph.lazy(value) for value in self.data[index]]
+        return self.graph.lazy(self.data[index])
+
+    def __len__(self):
+        return len(self.data)
+
+    def resolve(self) -> List:
+        """fully expanded plain list"""
+        return self.graph.resolve(self.data)
+
+
+def _apollo_reference(value) -> Optional[str]:
+    """wellfound's Apollo state references look like {"type": "id", "id": "Startup:1"}"""
+    if isinstance(value, dict) and value.get("type") == "id" and "id" in value:
+        return value["id"]
+    return None
+
+
+def apollo_graph(graph: Dict, debug=False) -> ApolloGraph:
+    """create a resolver for wellfound's Apollo state graph; edge nodes are flattened to the node they wrap"""
+
+    def unwrap(key, node):
+        node = node.get("node") or node
         if debug:
-            data["__reference"] = value["id"]
-        return data
+            node = {**node, "__reference": key}
+        return node
 
-    node = flatten(node)
+    return ApolloGraph(graph, reference=_apollo_reference, unwrap=unwrap)
 
-    for key, value in node.items():
-        if isinstance(value, list):
-            node[key] = [flatten(v) for v in value]
-        elif isinstance(value, dict):
-            node[key] = unpack_node_references(value, graph)
-    return node
+
+def unpack_node_references(node, graph, debug=False):
+    """
+    unpacks references in a graph node to a flat node structure. References are resolved at any depth,
+    including references nested in the items of lists
+    (to unpack many nodes of the same graph reuse one apollo_graph() so shared nodes are only resolved once):
+    >>> unpack_node_references({"field": {"id": "reference1", "type": "id"}}, graph={"reference1": {"foo": "bar"}})
+    {'field': {'foo': 'bar'}}
+    """
+    return apollo_graph(graph, debug=debug).resolve(node)
 
 
 def parse_company(result: ScrapeApiResponse) -> CompanyData:
@@ -99,29 +218,163 @@ def parse_company(result: ScrapeApiResponse) -> CompanyData:
             break
     else:
         raise ValueError("no embedded company data could be found")
-    return unpack_node_references(company, graph)
+    return apollo_graph(graph).resolve(company)
 
 
-async def retry_failure(url: str, _retries: int = 0):
-    """retry failed requests with a maximum number of retries"""
-    max_retries = 3
-    try:
-        response = await SCRAPFLY.async_scrape(
-            ScrapeConfig(url, **BASE_CONFIG, render_js=True, proxy_pool="public_residential_pool")
-        )
-        if response.status_code == 403:
-            if _retries < max_retries:
-                log.debug("Retrying failed request")
-                return await retry_failure(url, _retries=_retries + 1)
+class CircuitOpenError(Exception):
+    """raised instead of scraping while the circuit breaker of the target domain is open"""
+
+
+class Resilience:
+    """
+    Retry layer around ScrapflyClient.async_scrape that keeps per-domain state shared by every coroutine:
+    - retry budget: a domain holds up to `retry_budget` retry tokens, every first attempt earns `budget_ratio`
+      of a token and every retry spends one, so a target that starts blocking can't make every caller retry at once
+    - decorrelated jitter backoff between the retries of a request
+    - circuit breaker: `failure_threshold` consecutive failures open the domain's circuit and requests fail fast
+      with CircuitOpenError for `reset_timeout` seconds, after which a single trial request closes or reopens it
+    Per-domain counters are available from metrics().
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 3,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        retry_budget: int = 10,
+        budget_ratio: float = 0.2,
+        failure_threshold: int = 5,
+        reset_timeout: float = 60.0,
+        timeout: Optional[float] = None,
+    ):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_budget = retry_budget
+        self.budget_ratio = budget_ratio
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.timeout = timeout
+        self.domains: Dict[str, Dict[str, Any]] = {}
+
+    def _domain(self, url: str) -> Dict[str, Any]:
+        domain = urlparse(url).netloc
+        if domain not in self.domains:
+            self.domains[domain] = {
+                "state": "closed",
+                "opened_at": 0.0,
+                "trial": False,
+                "consecutive_failures": 0,
+                "tokens": float(self.retry_budget),
+                "requests": 0,
+                "successes": 0,
+                "failures": 0,
+                "retries": 0,
+                "budget_exhausted": 0,
+                "short_circuited": 0,
+                "circuit_opened": 0,
+            }
+        return self.domains[domain]
+
+    def delay(self, previous: float) -> float:
+        """decorrelated jitter: anywhere between the base delay and three times the previous delay"""
+        return min(self.max_delay, random.uniform(self.base_delay, previous * 3))
+
+    def _allow(self, stats: Dict[str, Any]) -> bool:
+        if stats["state"] == "open":
+            if time.monotonic() - stats["opened_at"] < self.reset_timeout:
+                return False
+            stats["state"] = "half_open"
+        if stats["state"] == "half_open":
+            if stats["trial"]:
+                return False
+            stats["trial"] = True
+        return True
+
+    def _record(self, domain: str, stats: Dict[str, Any], success: bool):
+        stats["trial"] = False
+        if success:
+            stats["successes"] += 1
+            stats["consecutive_failures"] = 0
+            stats["state"] = "closed"
+            return
+        stats["failures"] += 1
+        stats["consecutive_failures"] += 1
+        if stats["state"] == "half_open" or stats["consecutive_failures"] >= self.failure_threshold:
+            if stats["state"] != "open":
+                log.warning(f"opening the circuit breaker of {domain} after {stats['consecutive_failures']} failures")
+                stats["circuit_opened"] += 1
+            stats["state"] = "open"
+            stats["opened_at"] = time.monotonic()
+
+    async def run(
+        self,
+        config: ScrapeConfig,
+        scrape: Callable[[ScrapeConfig], Awaitable[ScrapeApiResponse]],
+        parse: Optional[Callable[[ScrapeApiResponse], Any]] = None,
+    ) -> Any:
+        """
+        scrape a config and return the response, or parse(response) when given. Failures of either are retried
+        within the domain's budget, the last error is raised once retries run out
+        """
+        domain = urlparse(config.url).netloc
+        stats = self._domain(config.url)
+        stats["tokens"] = min(self.retry_budget, stats["tokens"] + self.budget_ratio)
+        delay = self.base_delay
+        for attempt in range(self.max_retries + 1):
+            if not self._allow(stats):
+                stats["short_circuited"] += 1
+                raise CircuitOpenError(f"the circuit breaker of {domain} is open, not scraping {config.url}")
+            stats["requests"] += 1
+            try:
+                response = await asyncio.wait_for(scrape(config), self.timeout)
+                result = parse(response) if parse else response
+            except asyncio.CancelledError:
+                stats["trial"] = False
+                raise
+            except Exception as e:
+                self._record(domain, stats, success=False)
+                if attempt == self.max_retries:
+                    raise
+                if stats["tokens"] < 1:
+                    stats["budget_exhausted"] += 1
+                    log.warning(f"the retry budget of {domain} is exhausted, not retrying {config.url}")
+                    raise
+                stats["tokens"] -= 1
+                stats["retries"] += 1
+                delay = self.delay(delay)
+                log.debug(f"retrying {config.url} in {delay:.1f} seconds: {e!r}")
+                await asyncio.sleep(delay)
             else:
-                raise Exception("Unable to scrape rge first search page, max retries exceeded")
-        return response
+                self._record(domain, stats, success=True)
+                return result
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        """request, retry and circuit breaker counters of every domain"""
+        hidden = ("opened_at", "trial")
+        return {
+            domain: {key: value for key, value in stats.items() if key not in hidden}
+            for domain, stats in self.domains.items()
+        }
+
+
+RESILIENCE = Resilience()
+
+
+def _raise_for_block(response: ScrapeApiResponse) -> ScrapeApiResponse:
+    """blocked responses are retried like failed requests"""
+    if response.status_code == 403:
+        raise Exception(f"request to {response.context['url']} was blocked")
+    return response
+
+
+async def retry_failure(url: str) -> ScrapeApiResponse:
+    """retry failed and blocked requests within the retry budget of the resilience layer"""
+    config = ScrapeConfig(url, **BASE_CONFIG, render_js=True, proxy_pool="public_residential_pool")
+    try:
+        return await RESILIENCE.run(config, SCRAPFLY.async_scrape, parse=_raise_for_block)
     except Exception as e:
-        if _retries < max_retries:
-            log.debug("Retrying failed request")
-            return await retry_failure(url, _retries=_retries + 1)
-        else:
-            raise Exception("Unable to scrape rge first search page, max retries exceeded")
+        raise Exception("Unable to scrape the first search page, max retries exceeded") from e
 
 
 async def scrape_search(role: str = "", location: str = "", max_pages: int = None) -> List[CompanyData]:
@@ -139,7 +392,8 @@ async def scrape_search(role: str = "", location: str = "", max_pages: int = Non
     log.info(f"scraping first page of search, {role} in {location}")
     first_page = await retry_failure(url)
     graph = extract_apollo_state(first_page)
-    companies.extend([unpack_node_references(graph[key], graph) for key in graph if key.startswith("StartupResult")])
+    resolver = apollo_graph(graph)
+    companies.extend([resolver.resolve(graph[key]) for key in graph if key.startswith("StartupResult")])
     seo_landing_key = next(key for key in graph["ROOT_QUERY"]["talent"] if "seoLandingPageJobSearchResults" in key)
     total_pages = graph["ROOT_QUERY"]["talent"][seo_landing_key]["pageCount"]
     # find total page count
@@ -152,7 +406,8 @@ async def scrape_search(role: str = "", location: str = "", max_pages: int = Non
     async for response in SCRAPFLY.concurrent_scrape(other_pages):
         try:
             graph = extract_apollo_state(response)
-            companies.extend([unpack_node_references(graph[key], graph) for key in graph if key.startswith("StartupResult")])
+            resolver = apollo_graph(graph)
+            companies.extend([resolver.resolve(graph[key]) for key in graph if key.startswith("StartupResult")])
         except Exception as e:
             log.debug(f"Error occured while crawling search: {e}")
             pass
@@ -78,6 +78,7 @@ comments_schema = {
             "id": {"type": "string"},
             "text": {"type": "string"},
             "publishedTime": {"type": "string", "nullable": True},
+            "parentId": {"type": "string", "nullable": True},
         },
     },
     "author": {
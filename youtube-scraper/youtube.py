@@ -6,16 +6,24 @@ $ export $SCRAPFLY_KEY="your key from https://scrapfly.io/dashboard"
 """
 
 import os
+import asyncio
 import datetime
+import functools
+import time
 import secrets
 import json
+import threading
 import jmespath
+from collections import deque
+from pathlib import Path
+from jmespath.visitor import TreeInterpreter
 
 from jsonpath_ng.ext import parse
-from typing import Dict, List, Literal
+from typing import Any, Callable, Dict, Iterable, List, Literal, Optional, Union
 from urllib.parse import urlencode, quote, urlparse, parse_qs
 from loguru import logger as log
 from scrapfly import ScrapeConfig, ScrapflyClient, ScrapeApiResponse
+from scrapfly.errors import ScrapflyError
 
 SCRAPFLY = ScrapflyClient(key=os.environ["SCRAPFLY_KEY"])
 
@@ -26,10 +34,137 @@ BASE_CONFIG = {
     "country": "US",
 }
 
-jp_all = lambda query, data: [match.value for match in parse(query).find(data)]
-jp_first = lambda query, data: (
-    parse(query).find(data)[0].value if parse(query).find(data) else None
-)
+# jsonpath_ng builds a new parser for every parse() call so each query is parsed once
+_jsonpath = functools.lru_cache(maxsize=None)(parse)
+jp_all = lambda query, data: [match.value for match in _jsonpath(query).find(data)]
+jp_first = lambda query, data: next((match.value for match in _jsonpath(query).find(data)), None)
+
+
+# orjson or msgspec decode large hidden web data several times faster than the json module when installed
+try:
+    import orjson
+
+    _fast_json_loads, _FAST_JSON_ERRORS = orjson.loads, (orjson.JSONDecodeError,)
+except ImportError:
+    try:
+        import msgspec
+
+        _fast_json_loads, _FAST_JSON_ERRORS = msgspec.json.decode, (msgspec.DecodeError,)
+    except ImportError:
+        _fast_json_loads, _FAST_JSON_ERRORS = None, ()
+
+
+def json_loads(data: Union[str, bytes]) -> Any:
+    """
+    decode JSON with the fastest available backend. Documents the fast decoders reject (e.g. NaN values)
+    are decoded again with json.loads so errors match it. Note that integers over 64 bits decode as floats with orjson.
+    """
+    if _fast_json_loads is not None:
+        try:
+            return _fast_json_loads(data)
+        except _FAST_JSON_ERRORS:
+            pass
+    return json.loads(data)
+
+
+class CompiledExpressions:
+    """
+    JMESPath expressions compiled once on first use into plain python functions, shared between threads.
+    jmespath.search() caches parsed expressions but still walks the expression's syntax tree with a new
+    interpreter for every searched item; compiled expressions skip both.
+    Only the syntax nodes this module's expressions use are compiled, anything else runs through jmespath's
+    interpreter.
+    """
+
+    def __init__(self):
+        self.compiled: Dict[str, Callable[[Any], Any]] = {}
+        self._lock = threading.Lock()
+
+    def compile(self, expression: str) -> Callable[[Any], Any]:
+        try:
+            return self.compiled[expression]
+        except KeyError:
+            pass
+        with self._lock:
+            if expression not in self.compiled:
+                self.compiled[expression] = self._compile(jmespath.compile(expression).parsed)
+        return self.compiled[expression]
+
+    def search(self, expression: str, data: Any) -> Any:
+        """same as jmespath.search(expression, data)"""
+        return self.compile(expression)(data)
+
+    def _compile(self, node: Dict) -> Callable[[Any], Any]:
+        kind = node["type"]
+        if kind == "field" or (kind == "subexpression" and all(c["type"] == "field" for c in node["children"])):
+            names = [node["value"]] if kind == "field" else [child["value"] for child in node["children"]]
+
+            def field(value):
+                for name in names:
+                    if type(value) is dict:
+                        value = value.get(name)
+                    else:
+                        try:
+                            value = value.get(name)
+                        except AttributeError:
+                            value = None
+                return value
+
+            return field
+        if kind in ("subexpression", "index_expression"):
+            steps = [self._compile(child) for child in node["children"]]
+
+            def chain(value):
+                for step in steps:
+                    value = step(value)
+                return value
+
+            return chain
+        if kind == "multi_select_dict":
+            pairs = [(child["value"], self._compile(child["children"][0])) for child in node["children"]]
+            return lambda value: None if value is None else {key: step(value) for key, step in pairs}
+        if kind == "index":
+            index = node["value"]
+
+            def index_of(value):
+                if not isinstance(value, list):
+                    return None
+                try:
+                    return value[index]
+                except IndexError:
+                    return None
+
+            return index_of
+        if kind == "projection":
+            base, step = (self._compile(child) for child in node["children"])
+
+            def projection(value):
+                value = base(value)
+                if not isinstance(value, list):
+                    return None
+                return [result for result in map(step, value) if result is not None]
+
+            return projection
+        if kind == "flatten":
+            base = self._compile(node["children"][0])
+
+            def flatten(value):
+                value = base(value)
+                if not isinstance(value, list):
+                    return None
+                merged = []
+                for element in value:
+                    if isinstance(element, list):
+                        merged.extend(element)
+                    else:
+                        merged.append(element)
+                return merged
+
+            return flatten
+        return lambda value: TreeInterpreter().visit(node, value)
+
+
+EXPRESSIONS = CompiledExpressions()
 
 
 def convert_to_number(value):
@@ -134,7 +269,14 @@ def parse_script_variable(script: str, variable: str) -> Dict:
     if start == -1:
         raise ValueError(f"no JSON object was found after {variable}")
 
-    return json.JSONDecoder().raw_decode(payload[start:])[0]
+    payload = payload[start:]
+    if _fast_json_loads is not None:
+        # the object usually runs to the end of the script, otherwise it's followed by more javascript
+        try:
+            return _fast_json_loads(payload[: payload.rfind("}") + 1])
+        except _FAST_JSON_ERRORS:
+            pass
+    return json.JSONDecoder().raw_decode(payload)[0]
 
 
 def parse_yt_initial_data(response: ScrapeApiResponse) -> Dict:
@@ -235,14 +377,34 @@ async def scrape_video(ids: List[str]) -> List[Dict]:
     return data
 
 
-def parse_comments_api(response: ScrapeApiResponse) -> List[Dict]:
-    """parse comments API response for comment data"""
+# the comments header lists the sort order menu in this order and the video page's token loads the first one
+COMMENT_SORTS = ("top", "newest")
+CommentSort = Literal["top", "newest"]
+
+
+def parse_comments_api(response: ScrapeApiResponse) -> Dict:
+    """parse comments API response for comment data and the continuation tokens it links to"""
     parsed_comments = []
-    data = json.loads(response.content)
-    continuation_tokens = jp_all("$..continuationCommand.token", data)
+    data = json_loads(response.content)
+    continuation_token = None
+    reply_tokens = []
+    for items in jp_all("$..continuationItems", data):
+        for item in items:
+            if "continuationItemRenderer" in item:
+                # the next page of comments or the "show more replies" button of a reply thread
+                continuation_token = jp_first("$..continuationCommand.token", item)
+            elif "commentThreadRenderer" in item:
+                thread = item["commentThreadRenderer"]
+                reply_token = jp_first("$.replies..continuationCommand.token", thread)
+                if reply_token:
+                    thread_id = EXPRESSIONS.search("commentViewModel.commentViewModel.commentId", thread)
+                    reply_tokens.append((thread_id, reply_token))
+    sort_tokens = jp_all(
+        "$..sortFilterSubMenuRenderer.subMenuItems[*].serviceEndpoint.continuationCommand.token", data
+    )
     comments = jp_all("$..commentEntityPayload", data)
     for comment in comments:
-        result = jmespath.search(
+        result = EXPRESSIONS.search(
             """{
                 comment: {
                     id: properties.commentId,
@@ -268,31 +430,196 @@ def parse_comments_api(response: ScrapeApiResponse) -> List[Dict]:
 
     return {
         "comments": parsed_comments,
-        "continuationToken": continuation_tokens[-1] if continuation_tokens else None,
+        "continuationToken": continuation_token,
+        "replyTokens": reply_tokens,
+        "sortTokens": dict(zip(COMMENT_SORTS, sort_tokens)),
     }
 
 
-async def scrape_comments(video_id: str, max_scrape_pages=None) -> List[Dict]:
-    """scraper comments from a YouTube video"""
-    comments = []
-    cursor = 0
-    log.info(f"scraping video page for the comments continuation token")
-    video_data = await scrape_video([video_id])
-    continuation_token = video_data[0].get("commentContinuationToken")
+class CommentTokenCache:
+    """
+    Comment continuation tokens of already scraped video pages, so repeated comment scrapes of a video
+    skip rendering its video page. Tokens expire after a TTL and are persisted to a JSON file when a path is given.
+    """
 
-    while continuation_token and (
-        cursor < max_scrape_pages if max_scrape_pages else True
-    ):
-        cursor += 1
-        log.info(f"scraping comments page with index {cursor}")
-        response = await call_youtube_api(
-            base_url="https://www.youtube.com/youtubei/v1/next?prettyPrint=false",
-            continuation_token=continuation_token,
-        )
-        data = parse_comments_api(response)
-        comments.extend(data["comments"])
-        continuation_token = data["continuationToken"]
+    def __init__(self, path: Optional[Path] = None, ttl: datetime.timedelta = datetime.timedelta(days=1)):
+        self.path = Path(path) if path else None
+        self.ttl = ttl
+        self.tokens = json.loads(self.path.read_text()) if self.path and self.path.exists() else {}
+
+    def get(self, video_id: str) -> Optional[str]:
+        entry = self.tokens.get(video_id)
+        if entry is None or time.time() - entry["stored_at"] > self.ttl.total_seconds():
+            return None
+        return entry["token"]
+
+    def set(self, video_id: str, token: str):
+        self.tokens[video_id] = {"token": token, "stored_at": time.time()}
+        self._save()
+
+    def discard(self, video_id: str):
+        if self.tokens.pop(video_id, None) is not None:
+            self._save()
 
+    def _save(self):
+        if self.path:
+            self.path.write_text(json.dumps(self.tokens))
+
+
+COMMENT_TOKENS = CommentTokenCache()
+
+
+async def scrape_comments_page(continuation_token: str) -> Dict:
+    """scrape a single comments API page"""
+    response = await call_youtube_api(
+        base_url="https://www.youtube.com/youtubei/v1/next?prettyPrint=false",
+        continuation_token=continuation_token,
+    )
+    return parse_comments_api(response)
+
+
+async def crawl_comments(
+    continuation_token: str,
+    max_scrape_pages: int = None,
+    sorts: Iterable[CommentSort] = ("top",),
+    replies: bool = False,
+    max_reply_pages: int = None,
+    concurrency: int = 5,
+    first_page: Dict = None,
+) -> List[Dict]:
+    """
+    Crawl the comment pages a video's comments continuation token leads to through a bounded concurrent frontier.
+    Every sort order is a chain of up to max_scrape_pages top level pages. With replies the reply threads of their
+    comments are expanded alongside them, up to max_reply_pages reply pages in total. Comments are returned in page
+    order of each sort order, each followed by its replies, and comments found in several sort orders are kept once.
+    A failed page is logged and the pages it would have led to are skipped.
+    """
+    sorts = list(sorts)
+    pages = {sort: [] for sort in sorts}
+    page_counts = {sort: 0 for sort in sorts}
+    reply_page_count = 0
+    thread_replies = {}
+    # top level pages are the crawl's critical path so they are scraped before any queued reply page
+    frontier = {"page": deque(), "replies": deque()}
+    pending = {}
+
+    def follow(sort: CommentSort, token: Optional[str]):
+        if token and (max_scrape_pages is None or page_counts[sort] < max_scrape_pages):
+            page_counts[sort] += 1
+            frontier["page"].append(("page", sort, token))
+
+    def follow_replies(thread_id: str, token: Optional[str]):
+        nonlocal reply_page_count
+        if token and (max_reply_pages is None or reply_page_count < max_reply_pages):
+            reply_page_count += 1
+            frontier["replies"].append(("replies", thread_id, token))
+
+    def visit(kind: str, key: Optional[str], data: Dict):
+        if kind == "sorts":
+            # the first page of the default sort order which links to the first pages of the others
+            for sort in sorts:
+                if sort == COMMENT_SORTS[0]:
+                    page_counts[sort] += 1
+                    visit("page", sort, data)
+                else:
+                    follow(sort, data["sortTokens"].get(sort))
+        elif kind == "page":
+            for comment in data["comments"]:
+                comment["comment"]["parentId"] = None
+            pages[key].append(data["comments"])
+            follow(key, data["continuationToken"])
+            for thread_id, token in data["replyTokens"] if replies else []:
+                # threads found again in another sort order are only expanded once
+                if thread_id not in thread_replies:
+                    thread_replies[thread_id] = []
+                    follow_replies(thread_id, token)
+        else:
+            for comment in data["comments"]:
+                comment["comment"]["parentId"] = key
+            thread_replies[key].extend(data["comments"])
+            follow_replies(key, data["continuationToken"])
+
+    if first_page is not None:
+        visit("sorts", None, first_page)
+    else:
+        frontier["page"].append(("sorts", None, continuation_token))
+    try:
+        while True:
+            while len(pending) < concurrency and (frontier["page"] or frontier["replies"]):
+                request = (frontier["page"] or frontier["replies"]).popleft()
+                log.info(f"scraping comments {request[0]} page, {len(pending)} pages in flight")
+                pending[asyncio.ensure_future(scrape_comments_page(request[2]))] = request
+            if not pending:
+                break
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                kind, key, _ = pending.pop(task)
+                try:
+                    data = task.result()
+                except Exception as e:
+                    if kind == "sorts":
+                        raise
+                    # drop this branch of the frontier and keep the comments of every other page
+                    log.error(f"failed to scrape comments {kind} page of {key}: {e!r}")
+                    continue
+                visit(kind, key, data)
+    finally:
+        for task in pending:
+            task.cancel()
+
+    comments, seen = [], set()
+    for sort in sorts:
+        for page in pages[sort]:
+            for comment in page:
+                comment_id = comment["comment"]["id"]
+                if comment_id in seen:
+                    continue
+                seen.add(comment_id)
+                comments.append(comment)
+                comments.extend(thread_replies.get(comment_id, []))
+    return comments
+
+
+async def scrape_comments(
+    video_id: str,
+    max_scrape_pages: int = None,
+    sorts: Iterable[CommentSort] = ("top",),
+    replies: bool = False,
+    max_reply_pages: int = None,
+    concurrency: int = 5,
+    token_cache: CommentTokenCache = COMMENT_TOKENS,
+) -> List[Dict]:
+    """scraper comments from a YouTube video, with replies=True their reply threads too"""
+    first_page = None
+    continuation_token = token_cache.get(video_id)
+    if continuation_token:
+        log.info(f"using the cached comments continuation token of the video {video_id}")
+        try:
+            first_page = await scrape_comments_page(continuation_token)
+        except ScrapflyError as e:
+            log.warning(f"cached comments continuation token failed: {e}")
+        # a valid first page always carries the comments header with its sort order menu
+        if first_page is None or not first_page["sortTokens"]:
+            token_cache.discard(video_id)
+            first_page = None
+    if first_page is None:
+        log.info(f"scraping video page for the comments continuation token")
+        video_data = await scrape_video([video_id])
+        continuation_token = video_data[0].get("commentContinuationToken")
+        if not continuation_token:
+            log.warning(f"no comments continuation token was found for the video {video_id}")
+            return []
+        token_cache.set(video_id, continuation_token)
+
+    comments = await crawl_comments(
+        continuation_token,
+        max_scrape_pages,
+        sorts,
+        replies=replies,
+        max_reply_pages=max_reply_pages,
+        concurrency=concurrency,
+        first_page=first_page,
+    )
     log.success(f"scraped {len(comments)} comments for the video {video_id}")
     return comments
 
@@ -306,7 +633,7 @@ def parse_channel(response: ScrapeApiResponse) -> Dict:
         raise ValueError(
             "no browse API call was captured, the channel About panel didn't load"
         )
-    data = json.loads(info_call[0]["response"]["body"])
+    data = json_loads(info_call[0]["response"]["body"])
 
     metadata = jp_first("$..aboutChannelViewModel", data)
     if not metadata:
@@ -322,7 +649,7 @@ def parse_channel(response: ScrapeApiResponse) -> Dict:
                 "favicon": i["favicon"],
             }
         )
-    result = jmespath.search(
+    result = EXPRESSIONS.search(
         """{
         description: description,
         url: displayCanonicalChannelUrl,
@@ -382,7 +709,7 @@ def parse_video_items(items: List[Dict]) -> List[Dict]:
         lockup = jp_first("$.richItemRenderer.content.lockupViewModel", i)
         if not lockup:
             continue
-        result = jmespath.search(
+        result = EXPRESSIONS.search(
             """{
             videoId: contentId,
             title: metadata.lockupMetadataViewModel.title.content,
@@ -412,7 +739,7 @@ def parse_channel_videos_page(data: Dict) -> Dict:
 
 def parse_video_api(response: ScrapeApiResponse) -> Dict:
     """parse video data from YouTube API response"""
-    data = json.loads(response.content)
+    data = json_loads(response.content)
     continuation_tokens = jp_all("$..continuationCommand.token", data)
 
     videos = jp_all("$..reloadContinuationItemsCommand.continuationItems", data)
@@ -487,12 +814,12 @@ async def scrape_channel_videos(
 def parse_search_response(response: ScrapeApiResponse) -> List[Dict]:
     """parse search results from the YouTube API response"""
     results = []
-    data = json.loads(response.content)
+    data = json_loads(response.content)
     search_boxes = jp_all("$..videoRenderer", data)
     for i in search_boxes:
         if "videoId" not in i:
             continue
-        result = jmespath.search(
+        result = EXPRESSIONS.search(
             """{
             id: videoId,
             title: title.runs[0].text,
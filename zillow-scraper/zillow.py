@@ -9,7 +9,7 @@ import json
 import os
 import random
 import re
-from typing import List
+from typing import Any, AsyncIterator, List, Union
 from urllib.parse import quote, urlencode
 
 from loguru import logger as log
@@ -22,6 +22,33 @@ BASE_CONFIG = {
     "country": "US",
 }
 
+# orjson or msgspec decode large hidden web data several times faster than the json module when installed
+try:
+    import orjson
+
+    _fast_json_loads, _FAST_JSON_ERRORS = orjson.loads, (orjson.JSONDecodeError,)
+except ImportError:
+    try:
+        import msgspec
+
+        _fast_json_loads, _FAST_JSON_ERRORS = msgspec.json.decode, (msgspec.DecodeError,)
+    except ImportError:
+        _fast_json_loads, _FAST_JSON_ERRORS = None, ()
+
+
+def json_loads(data: Union[str, bytes]) -> Any:
+    """
+    decode JSON with the fastest available backend. Documents the fast decoders reject (e.g. NaN values)
+    are decoded again with json.loads so errors match it. Note that integers over 64 bits decode as floats with orjson.
+    """
+    if _fast_json_loads is not None:
+        try:
+            return _fast_json_loads(data)
+        except _FAST_JSON_ERRORS:
+            pass
+    return json.loads(data)
+
+
 def create_search_payload(query_data: dict, page_number: int = None):
     """create a search payload for Zillow's search API"""
     payload = {
@@ -34,13 +61,12 @@ def create_search_payload(query_data: dict, page_number: int = None):
     return json.dumps(payload)
 
 
-async def scrape_search(url: str, max_scrape_pages: int=None) -> List[dict]:
-    """base search function which is used by sale and rent search functions"""
-    search_data = []
+async def iter_search(url: str, max_scrape_pages: int = None) -> AsyncIterator[dict]:
+    """base search generator which yields properties as soon as each search page is scraped"""
     log.info(f"scraping search: {url}")
     # first scrape the search HTML page and find query variables for this search
     html_result = await SCRAPFLY.async_scrape(ScrapeConfig(url, **BASE_CONFIG))
-    script_data = json.loads(html_result.selector.xpath("//script[@id='__NEXT_DATA__']/text()").get())
+    script_data = json_loads(html_result.selector.xpath("//script[@id='__NEXT_DATA__']/text()").get())
     query_data = script_data["props"]["pageProps"]["searchPageState"]["queryState"]
 
     # then scrape Zillow's backend API for all query results:
@@ -49,15 +75,14 @@ async def scrape_search(url: str, max_scrape_pages: int=None) -> List[dict]:
         ScrapeConfig(_backend_url, **BASE_CONFIG, headers={"content-type": "application/json"},
                       body=create_search_payload(query_data), method="PUT")
     )
-    data = json.loads(api_result.content)
-    property_data = data["cat1"]["searchResults"]["listResults"]
-    search_data.extend(property_data)
+    data = json_loads(api_result.content)
+    for property_data in data["cat1"]["searchResults"]["listResults"]:
+        yield property_data
     _total_pages = data["cat1"]["searchList"]["totalPages"]
 
     # if no pagination data, return
     if _total_pages == 1:
-        log.success(f"scraped {len(search_data)} properties from search pages")
-        return search_data
+        return
 
     # else paginate remaining pages
     if max_scrape_pages and max_scrape_pages < _total_pages:
@@ -73,9 +98,13 @@ async def scrape_search(url: str, max_scrape_pages: int=None) -> List[dict]:
     ]
 
     async for result in SCRAPFLY.concurrent_scrape(to_scrape):
-        property_data = json.loads(result.content)["cat1"]["searchResults"]["listResults"]
-        search_data.extend(property_data)
+        for property_data in json_loads(result.content)["cat1"]["searchResults"]["listResults"]:
+            yield property_data
+
 
+async def scrape_search(url: str, max_scrape_pages: int=None) -> List[dict]:
+    """base search function which is used by sale and rent search functions"""
+    search_data = [item async for item in iter_search(url, max_scrape_pages=max_scrape_pages)]
     log.success(f"scraped {len(search_data)} properties from search pages")
     return search_data
 
@@ -88,13 +117,13 @@ async def scrape_properties(urls: List[str]):
         data = result.selector.css("script#__NEXT_DATA__::text").get()
         if data:
             # Option 1: some properties are located in NEXT DATA cache
-            data = json.loads(data)
-            property_data = json.loads(data["props"]["pageProps"]["componentProps"]["gdpClientCache"])
+            data = json_loads(data)
+            property_data = json_loads(data["props"]["pageProps"]["componentProps"]["gdpClientCache"])
             property_data = property_data[list(property_data)[0]]['property']
         else:
             # Option 2: other times it's in Apollo cache
             data = result.selector.css("script#hdpApolloPreloadedData::text").get()
-            data = json.loads(json.loads(data)["apiCache"])
+            data = json_loads(json_loads(data)["apiCache"])
             property_data = next(v["property"] for k, v in data.items() if "ForSale" in k)
         results.append(property_data)
     return results